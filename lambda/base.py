@@ -1,4 +1,5 @@
 import os, re, json, base64, decimal, datetime, traceback
+from functools import lru_cache
 
 str_to_float = lambda string: float(string)
 str_to_int = lambda string: int(string)
@@ -8,9 +9,11 @@ filter_targets = lambda filepaths, targets: [path for path in filepaths if is_ta
 STATUS_COMPLETE = 'Complete'
 STATUS_PROCESSING = 'Processing'
 STATUS_START = 'Start'
+STATUS_REPORTING = 'Reporting'
+STATUS_INITIALIZING = 'Initializing'
 
-get_s3_object = lambda s3, bucket, key: s3.Object(bucket, key).get()['Body'].read().decode('utf-8')
-put_s3_object = lambda s3, bucket, key, text, content_type: s3.Object(bucket, key).put(Body=text, ContentType=content_type)
+get_s3_object = lambda s3, bucket, key: s3.meta.client.get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8')
+put_s3_object = lambda s3, bucket, key, text, content_type: s3.meta.client.put_object(Bucket=bucket, Key=key, Body=text, ContentType=content_type)
 
 class CodelibException(Exception):
 	def __init__(self, message, code=None):
@@ -138,13 +141,17 @@ def response_failure(message, data=None, cors_method=None):
 	return ret
 
 
-def match_glob_pattern(string, pattern):
+@lru_cache(maxsize=1024)
+def compile_glob_pattern(pattern):
 	regex = re.escape(pattern[1:] if pattern.startswith('/') else pattern)
 	regex = regex.replace(r'\*\*', '.*')
 	regex = regex.replace(r'\*', '[^/]*')
 	regex = regex.replace(r'\?', '.')
 	regex = '^' + regex + '$'
-	match = re.match(regex, string)
+	return re.compile(regex)
+
+def match_glob_pattern(string, pattern):
+	match = compile_glob_pattern(pattern).match(string)
 	return bool(match)
 
 def extract_dict(dictionary, keys_string):
@@ -152,6 +159,15 @@ def extract_dict(dictionary, keys_string):
 	extracted_dict = [ dictionary.get(key) for key in keys ]
 	return extracted_dict
 
+def estimate_tokens(text):
+	"""
+	粗略估算文本的token数：ASCII字符按4个约1个token，其他字符（如中文）按每个1个token
+	"""
+	if not text:
+		return 0
+	non_ascii = sum(1 for char in text if ord(char) > 127)
+	return (len(text) - non_ascii + 3) // 4 + non_ascii
+
 def get_access_token(headers):
 	if not headers: 
 		return None
@@ -0,0 +1,335 @@
+import boto3
+import os, json, datetime, logging, uuid
+import base, datastore, json_recovery, model_config
+from botocore.exceptions import ClientError
+
+BATCH_INFERENCE 		= os.getenv('BATCH_INFERENCE', 'false').lower() == 'true'
+BATCH_INFERENCE_LOCAL 	= os.getenv('BATCH_INFERENCE_LOCAL', 'false').lower() == 'true'	# 使用本地替身处理JSONL，不提交Bedrock作业
+BATCH_ROLE_ARN 			= os.getenv('BATCH_ROLE_ARN')
+BATCH_MIN_RECORDS 		= base.str_to_int(os.getenv('BATCH_MIN_RECORDS', '100'))		# Bedrock批量推理作业的最少记录数
+BATCH_JOB_TIMEOUT_HOURS = base.str_to_int(os.getenv('BATCH_JOB_TIMEOUT_HOURS', '24'))
+MAX_TOKEN_TO_SAMPLE 	= base.str_to_int(os.getenv('MAX_TOKEN_TO_SAMPLE', '10000'))
+TEMPERATURE 			= base.str_to_float(os.getenv('TEMPERATURE', '0'))
+
+JOB_SUBMITTED 			= 'Submitted'
+JOB_INGESTED 			= 'Ingested'
+JOB_COMPLETED 			= ('Completed', 'PartiallyCompleted')
+JOB_FAILED 				= ('Failed', 'Stopped', 'Expired')
+LOCAL_JOB_PREFIX 		= 'local:'
+BATCH_PRICE_FACTOR 		= 0.5		# 批量推理按按需价格的一半计费
+
+s3						= boto3.resource('s3')
+sqs						= boto3.client('sqs')
+_bedrock 				= None
+
+log = logging.getLogger('crlog_{}'.format(__name__))
+
+def get_bedrock():
+	"""
+	Bedrock控制面客户端（批量推理作业），首次使用时创建
+	"""
+	global _bedrock
+	if _bedrock is None:
+		_bedrock = boto3.client('bedrock')
+	return _bedrock
+
+def is_batch_task(event, item):
+	"""
+	定时触发的全量评审（mode为all）使用批量推理；Webtool请求始终交互执行
+	"""
+	if not BATCH_INFERENCE or event.get('invoker') == 'webtool':
+		return False
+	return item.get('mode') == 'all'
+
+def build_record(item):
+	"""
+	把一个Task转换为InvokeModel格式的批量推理记录，recordId为任务编号
+
+	批量推理只执行单轮对话，带有confirm_prompt的Task不会提交到批量推理（见submit）。
+	"""
+	model_input = {
+		'anthropic_version': 'bedrock-2023-05-31',
+		'max_tokens': MAX_TOKEN_TO_SAMPLE,
+		'temperature': TEMPERATURE,
+		'messages': [ { 'role': 'user', 'content': [ { 'type': 'text', 'text': item.get('prompt_user') } ] } ],
+	}
+	if item.get('prompt_system'):
+		model_input['system'] = item.get('prompt_system')
+	return dict(recordId=str(item.get('number')), modelInput=model_input)
+
+def get_job_prefix(request_id, model):
+	return f'batch/{request_id}/{model}'
+
+def submit(commit_id, request_id, items):
+	"""
+	按模型把Task写成JSONL并提交批量推理作业，作业信息记录在Request记录的batch_jobs字段
+
+	批量推理只执行单轮对话，带有confirm_prompt的Task需要确认轮次，原样返回交互执行；
+	记录数少于BATCH_MIN_RECORDS或提交失败的模型，对应的Task同样原样返回，由调用方发送到SQS交互执行。
+
+	Returns:
+		list: 需要交互执行的Task
+	"""
+	groups, fallback = dict(), []
+	for item in items:
+		if item.get('confirm_prompt'):
+			fallback.append(item)
+			continue
+		groups.setdefault(item.get('model', '').lower(), []).append(item)
+	if fallback:
+		log.info(f'{len(fallback)} tasks need a confirm round, fall back to interactive execution.')
+
+	bucket_name = os.getenv('BUCKET_NAME')
+	jobs = []
+	for model, group in groups.items():
+		if len(group) < BATCH_MIN_RECORDS:
+			log.info(f'Only {len(group)} tasks for {model}, fall back to interactive execution.')
+			fallback.extend(group)
+			continue
+		prefix = get_job_prefix(request_id, model)
+		try:
+			input_key = f'{prefix}/input.jsonl'
+			manifest_key = f'{prefix}/tasks.json'
+			lines = '\n'.join(json.dumps(build_record(item), ensure_ascii=False) for item in group)
+			base.put_s3_object(s3, bucket_name, input_key, lines, 'application/jsonl')
+			base.put_s3_object(s3, bucket_name, manifest_key, base.dump_json(group), 'application/json')
+			create_tasks(request_id, group, model)
+			job_arn = start_job(request_id, model, input_key, f'{prefix}/output/')
+			jobs.append(dict(model=model, job_arn=job_arn, status=JOB_SUBMITTED, prefix=prefix, count=len(group)))
+			log.info(f'Submit batch inference job for {len(group)} tasks of {model}.', extra=dict(job_arn=job_arn))
+		except Exception as ex:
+			log.error(f'Fail to submit batch inference job for {model}.', extra=dict(exception=str(ex)))
+			fallback.extend(group)
+
+	if jobs:
+		# 切换为Processing，cron按TaskStatusIndex扫描到该Request后轮询作业
+		datastore.update_item(
+			os.getenv('REQUEST_TABLE'), dict(commit_id=commit_id, request_id=request_id),
+			'set batch_jobs = :j, task_status = :s, update_time = :t',
+			values={ ':j': jobs, ':s': base.STATUS_PROCESSING, ':t': str(datetime.datetime.now()) },
+		)
+	return fallback
+
+def create_tasks(request_id, group, model):
+	datetime_str = str(datetime.datetime.now())
+	datastore.batch_put(os.getenv('TASK_TABLE'), [
+		{
+			'request_id': request_id,
+			'number': number,
+			'mode': item.get('mode'),
+			'model': model,
+			'retry_times': 0,
+			'batch': True,
+			'create_time': datetime_str,
+			'update_time': datetime_str,
+		}
+		for item in group
+		for number in [ fused.get('number') for fused in item.get('fused_rules') or [] ] or [ item.get('number') ]
+	])
+
+def start_job(request_id, model, input_key, output_prefix):
+	bucket_name = os.getenv('BUCKET_NAME')
+	if BATCH_INFERENCE_LOCAL:
+		return run_local_job(bucket_name, input_key, output_prefix, model_config.get_model_id(model))
+	job_name = f'cr-{request_id}-{model}-{uuid.uuid4().hex[:8]}'.replace('.', '-')[:63]
+	response = get_bedrock().create_model_invocation_job(
+		jobName=job_name,
+		roleArn=BATCH_ROLE_ARN,
+		modelId=model_config.get_model_id(model),
+		inputDataConfig={ 's3InputDataConfig': { 's3Uri': f's3://{bucket_name}/{input_key}' } },
+		outputDataConfig={ 's3OutputDataConfig': { 's3Uri': f's3://{bucket_name}/{output_prefix}' } },
+		timeoutDurationInHours=BATCH_JOB_TIMEOUT_HOURS,
+	)
+	return response.get('jobArn')
+
+def run_local_job(bucket_name, input_key, output_prefix, model_id, invoke=None):
+	"""
+	本地替身：逐条处理JSONL并按Bedrock批量推理的输出格式写回S3
+
+	Args:
+		invoke: 处理单条modelInput的函数(model_id, model_input) -> modelOutput，默认调用InvokeModel
+
+	Returns:
+		str: 以local:开头的作业标识，状态始终为Completed
+	"""
+	if invoke is None:
+		import bedrock_client
+		client = bedrock_client.get_client()
+		invoke = lambda model_id, model_input: json.loads(client.invoke_model(modelId=model_id, body=json.dumps(model_input))['body'].read())
+
+	job_id = uuid.uuid4().hex
+	outputs = []
+	for line in base.get_s3_object(s3, bucket_name, input_key).splitlines():
+		if not line.strip():
+			continue
+		record = json.loads(line)
+		try:
+			record['modelOutput'] = invoke(model_id, record['modelInput'])
+		except Exception as ex:
+			record['error'] = dict(errorMessage=str(ex))
+		outputs.append(json.dumps(record, ensure_ascii=False))
+	output_key = f'{output_prefix}{job_id}/{os.path.basename(input_key)}.out'
+	base.put_s3_object(s3, bucket_name, output_key, '\n'.join(outputs), 'application/jsonl')
+	return f'{LOCAL_JOB_PREFIX}{job_id}'
+
+def get_job_status(job_arn):
+	if job_arn.startswith(LOCAL_JOB_PREFIX):
+		return 'Completed'
+	return get_bedrock().get_model_invocation_job(jobIdentifier=job_arn).get('status')
+
+def read_outputs(job):
+	"""
+	读取作业输出，Bedrock把结果写在输出目录下的{job_id}/input.jsonl.out
+
+	Returns:
+		dict: recordId -> 输出记录
+	"""
+	bucket_name = os.getenv('BUCKET_NAME')
+	job_id = job.get('job_arn').split('/')[-1].split(':')[-1]
+	prefix = f'{job.get("prefix")}/output/{job_id}/'
+	records = dict()
+	for summary in s3.Bucket(bucket_name).objects.filter(Prefix=prefix):
+		if not summary.key.endswith('.jsonl.out'):
+			continue
+		for line in base.get_s3_object(s3, bucket_name, summary.key).splitlines():
+			if line.strip():
+				record = json.loads(line)
+				records[record.get('recordId')] = record
+	return records
+
+def get_output_text(record):
+	output = (record or {}).get('modelOutput') or {}
+	return ''.join(block.get('text', '') for block in output.get('content', []) if block.get('type') == 'text')
+
+def ingest(commit_id, request_id, job):
+	"""
+	把作业输出写入Task表和S3结果，与Executor的update_complete_task一致
+
+	没有输出、输出报错或无法解析的Task发送到SQS交互执行。
+
+	可以重复执行（例如cron在写入过程中超时，下一次再次读取同一作业）：已完成的Task不再累加计数，
+	已重新发送的Task不再发送。
+
+	Returns:
+		tuple: (本次写入的Task数, 本次重新交互执行的Task数)
+	"""
+	import task_executor
+
+	bucket_name = os.getenv('BUCKET_NAME')
+	items = json.loads(base.get_s3_object(s3, bucket_name, f'{job.get("prefix")}/tasks.json'))
+	records = read_outputs(job) if job.get('status') in JOB_COMPLETED else dict()
+	completes, resends = 0, 0
+	for item in items:
+		record = records.get(str(item.get('number')))
+		try:
+			if not record or record.get('error'):
+				raise ValueError(f'No output for task {item.get("number")}: {(record or {}).get("error")}')
+			content, method = json_recovery.parse_findings(get_output_text(record))
+		except Exception as ex:
+			log.info('Batch output is not usable, fall back to interactive execution.', extra=dict(exception=str(ex)))
+			if claim_resend(request_id, item.get('number')):
+				resends += 1 if send_task(item) else 0
+			continue
+
+		timestamp = str(datetime.datetime.now())
+		usage = task_executor.get_token_usage(record.get('modelOutput', {}).get('usage'))
+		cost = model_config.estimate_cost(item.get('model'), usage) * BATCH_PRICE_FACTOR
+		result = dict(
+			commit_id = commit_id,
+			request_id = request_id,
+			rule = item.get('rule_name'),
+			model = item.get('model'),
+			content = content,
+			timestamp = timestamp,
+			start_time = '',
+			end_time = timestamp,
+			timecost = '',
+			payload = base.dump_json(record.get('modelInput')),
+			prompt_system = item.get('prompt_system', ''),
+			prompt_user = base.dump_json([ item.get('prompt_user') ]),
+			json_recovery = [ method ],
+			batch_job = job.get('job_arn'),
+			usage = usage,
+			cost = cost,
+		)
+		project_name = (item.get('context') or {}).get('project_name')
+		fused_rules = item.get('fused_rules') or []
+		if fused_rules:
+			findings = task_executor.split_fused_findings(content, fused_rules)
+			shares = task_executor.split_usage(usage, cost, len(fused_rules))
+			applied = False
+			for fused, (fused_usage, fused_cost) in zip(fused_rules, shares):
+				fused_result = dict(result, rule=fused.get('rule_name'), content=findings[fused.get('number')], fused=True, usage=fused_usage, cost=fused_cost)
+				if task_executor.update_complete_task(commit_id, request_id, fused.get('number'), item.get('mode'), fused_result) is not None:
+					task_executor.record_usage(project_name, fused_result)
+					applied = True
+		else:
+			applied = task_executor.update_complete_task(commit_id, request_id, item.get('number'), item.get('mode'), result) is not None
+			if applied:
+				task_executor.record_usage(project_name, result)
+		completes += 1 if applied else 0
+	datastore.flush_counters()
+	return completes, resends
+
+def claim_resend(request_id, number):
+	"""
+	在Task记录上标记已重新发送，同一Task只重新发送一次；已完成的Task不再发送
+	"""
+	try:
+		datastore.update_item(
+			os.getenv('TASK_TABLE'), dict(request_id=request_id, number=number),
+			'set resent = :r, update_time = :t',
+			values={ ':r': True, ':s': True, ':t': str(datetime.datetime.now()) },
+			condition='attribute_not_exists(resent) AND (attribute_not_exists(succ) OR succ <> :s)',
+		)
+		return True
+	except ClientError as ex:
+		if ex.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+			raise
+		log.info(f'Task(request_id={request_id}, number={number}) is already resent or complete.')
+		return False
+
+def send_task(item):
+	sqs_url = os.getenv('TASK_SQS_URL')
+	try:
+		sqs.send_message(QueueUrl=sqs_url, MessageBody=base.encode_base64(base.dump_json(item)))
+		return True
+	except Exception as ex:
+		log.error(f'Fail to send message to SQS({sqs_url}).', extra=dict(exception=str(ex)))
+		return False
+
+def poll_request(record):
+	"""
+	检查Request的批量推理作业，已结束的作业写入结果
+
+	每个作业写入后立即保存状态，cron超时中断时已写入的作业不再重复读取。
+
+	Returns:
+		bool: 是否有作业在本次被写入
+	"""
+	commit_id, request_id, jobs = base.extract_dict(record, 'commit_id, request_id, batch_jobs')
+	changed = False
+	for job in jobs or []:
+		if job.get('status') == JOB_INGESTED:
+			continue
+		try:
+			status = get_job_status(job.get('job_arn'))
+		except Exception as ex:
+			log.error('Fail to get batch inference job.', extra=dict(job=job, exception=str(ex)))
+			continue
+		if status not in JOB_COMPLETED and status not in JOB_FAILED:
+			continue
+		job['status'] = status
+		completes, resends = ingest(commit_id, request_id, job)
+		log.info(f'Batch inference job is {status}. {completes} tasks ingested, {resends} tasks resent.', extra=dict(job_arn=job.get('job_arn')))
+		job['status'] = JOB_INGESTED
+		changed = True
+		datastore.update_item(
+			os.getenv('REQUEST_TABLE'), dict(commit_id=commit_id, request_id=request_id),
+			'set batch_jobs = :j, update_time = :t',
+			values={ ':j': jobs, ':t': str(datetime.datetime.now()) },
+		)
+	return changed
+
+def has_pending_jobs(record):
+	return any(job.get('status') != JOB_INGESTED for job in (record or {}).get('batch_jobs') or [])
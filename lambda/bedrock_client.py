@@ -0,0 +1,84 @@
+"""
+Bedrock Runtime client pool
+
+Clients are created once per (region, credentials, timeout profile) and reused
+for the lifetime of the Lambda container, so warm invocations skip credential
+resolution and endpoint setup and keep their TLS connections alive.
+"""
+import os, threading
+import boto3
+import base
+from botocore.config import Config
+
+BEDROCK_ACCESS_KEY 				= os.getenv('BEDROCK_ACCESS_KEY')
+BEDROCK_SECRET_KEY 				= os.getenv('BEDROCK_SECRET_KEY')
+BEDROCK_REGION 					= os.getenv('BEDROCK_REGION')
+BEDROCK_MAX_POOL_CONNECTIONS 	= base.str_to_int(os.getenv('BEDROCK_MAX_POOL_CONNECTIONS', '50'))
+BEDROCK_CONNECT_TIMEOUT 		= base.str_to_int(os.getenv('BEDROCK_CONNECT_TIMEOUT', '10'))
+DEFAULT_TIMEOUT 				= 120
+
+_clients 						= dict()
+_sessions 						= dict()
+_lock 							= threading.Lock()
+
+
+def get_credentials(access_key=None, secret_key=None, region=None):
+	"""
+	Resolve explicit credentials, falling back to the BEDROCK_* environment variables.
+	The environment credentials are only used when all three of them are configured,
+	which matches the original module-level client behaviour.
+
+	Returns:
+		tuple: (region, access_key, secret_key), any of them may be None
+	"""
+	if access_key and secret_key:
+		return region or BEDROCK_REGION, access_key, secret_key
+	if BEDROCK_ACCESS_KEY and BEDROCK_SECRET_KEY and BEDROCK_REGION:
+		return region or BEDROCK_REGION, BEDROCK_ACCESS_KEY, BEDROCK_SECRET_KEY
+	return region, None, None
+
+
+def _get_session(access_key, secret_key):
+	session = _sessions.get(access_key)
+	if session is None:
+		if access_key:
+			session = boto3.session.Session(aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+		else:
+			session = boto3.session.Session()
+		_sessions[access_key] = session
+	return session
+
+
+def get_client(timeout=None, region=None, access_key=None, secret_key=None):
+	"""
+	Get a pooled bedrock-runtime client
+
+	Args:
+		timeout: Read timeout in seconds (the timeout profile, e.g. a model's 'timeout')
+		region: Bedrock region, defaults to BEDROCK_REGION or the Lambda region
+		access_key: Optional access key, defaults to BEDROCK_ACCESS_KEY
+		secret_key: Optional secret key, defaults to BEDROCK_SECRET_KEY
+
+	Returns:
+		botocore client, shared by all callers with the same key. Clients are thread-safe.
+	"""
+	timeout = timeout or DEFAULT_TIMEOUT
+	region, access_key, secret_key = get_credentials(access_key, secret_key, region)
+	key = (region, access_key, timeout)
+	client = _clients.get(key)
+	if client is not None:
+		return client
+
+	with _lock:
+		client = _clients.get(key)
+		if client is None:
+			config = Config(
+				read_timeout=timeout,
+				connect_timeout=BEDROCK_CONNECT_TIMEOUT,
+				max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS,
+				tcp_keepalive=True,
+			)
+			session = _get_session(access_key, secret_key)
+			client = session.client(service_name='bedrock-runtime', region_name=region, config=config)
+			_clients[key] = client
+	return client
@@ -0,0 +1,166 @@
+"""
+Streaming Bedrock response readers
+
+Both InvokeModelWithResponseStream and ConverseStream are read incrementally.
+When the prompt asks for <output> before any other block, reading stops as
+soon as the <output>...</output> block is complete, so the caller does not wait
+for the text the model generates after the findings. Prompts that put
+<output> last (e.g. "<thought>...</thought><output>...</output>") are read to
+the end, as stopping there would save nothing.
+"""
+import json, re, time
+
+OUTPUT_OPEN_TAG 		= '<output>'
+OUTPUT_CLOSE_TAG 		= '</output>'
+STOP_REASON_OUTPUT 		= 'output_complete'
+FORMAT_PATTERN 			= re.compile(r'<(output|thought)>[^<]*</\1>\s*<(output|thought)>')
+
+
+def is_output_first(*prompts):
+	"""
+	Whether the format instruction of the prompt puts <output> before other content
+
+	The last prompt that contains a format such as "<output>...</output><thought>"
+	decides, so a confirm or rectifier turn can override the system prompt.
+	"""
+	for prompt in reversed([ prompt for prompt in prompts if isinstance(prompt, str) ]):
+		formats = FORMAT_PATTERN.findall(prompt)
+		if formats:
+			return formats[-1][0] == 'output'
+	return False
+
+
+class OutputWatcher:
+	"""
+	Accumulate streamed text and detect when the <output> block is closed
+
+	Each chunk is scanned together with a short overlap from the previous one,
+	so tags split across chunks are still found and the total cost stays
+	linear in the length of the response.
+	"""
+
+	def __init__(self, start_time=None, stop_at_output=False):
+		self.start_time = start_time or time.time()
+		self.stop_at_output = stop_at_output
+		self.chunks = []
+		self.tail = ''
+		self.opened = False
+		self.first_token_time = None
+		self.output_time = None
+
+	@property
+	def text(self):
+		return ''.join(self.chunks)
+
+	@property
+	def complete(self):
+		return self.output_time is not None
+
+	@property
+	def reply_text(self):
+		"""
+		Text of the reply, ending with </output> when reading stopped there
+
+		Characters of the next block that arrived in the same chunk are dropped,
+		so the conversation never carries a half-written block.
+		"""
+		text = self.text
+		if not (self.stop_at_output and self.complete):
+			return text
+		index = text.find(OUTPUT_CLOSE_TAG, text.find(OUTPUT_OPEN_TAG))
+		return text[:index + len(OUTPUT_CLOSE_TAG)] if index >= 0 else text
+
+	def touch(self):
+		if self.first_token_time is None:
+			self.first_token_time = time.time()
+
+	def feed(self, text):
+		"""
+		Append a text delta
+
+		Returns:
+			bool: True once </output> has been seen after <output> and reading should stop
+		"""
+		if not text:
+			return self.stop_at_output and self.complete
+		self.touch()
+		self.chunks.append(text)
+		if self.complete:
+			return self.stop_at_output
+
+		window = self.tail + text
+		if not self.opened:
+			index = window.find(OUTPUT_OPEN_TAG)
+			if index >= 0:
+				self.opened = True
+				window = window[index + len(OUTPUT_OPEN_TAG):]
+		if self.opened and OUTPUT_CLOSE_TAG in window:
+			self.output_time = time.time()
+			return self.stop_at_output
+		self.tail = window[-(len(OUTPUT_CLOSE_TAG) - 1):]
+		return False
+
+	def elapsed_ms(self, moment):
+		return int((moment - self.start_time) * 1000) if moment else None
+
+
+def _close(stream):
+	try:
+		stream.close()
+	except Exception:
+		pass
+
+
+def read_invoke_model_stream(response, watcher):
+	"""
+	Read an InvokeModelWithResponseStream response (Anthropic messages events)
+
+	Returns:
+		dict: text, reasoning, stop_reason, usage
+	"""
+	stream = response.get('body')
+	stop_reason, usage = None, {}
+	for event in stream:
+		chunk = event.get('chunk')
+		if not chunk:
+			continue
+		data = json.loads(chunk.get('bytes'))
+		kind = data.get('type')
+		if kind == 'message_start':
+			usage.update(data.get('message', {}).get('usage', {}))
+		elif kind == 'content_block_delta':
+			delta = data.get('delta', {})
+			if delta.get('type') == 'text_delta' and watcher.feed(delta.get('text')):
+				stop_reason = STOP_REASON_OUTPUT
+				_close(stream)
+				break
+		elif kind == 'message_delta':
+			stop_reason = data.get('delta', {}).get('stop_reason')
+			usage.update(data.get('usage', {}))
+	return dict(text=watcher.reply_text, reasoning=None, stop_reason=stop_reason, usage=usage)
+
+
+def read_converse_stream(response, watcher):
+	"""
+	Read a ConverseStream response, collecting reasoning deltas separately
+
+	Returns:
+		dict: text, reasoning, stop_reason, usage
+	"""
+	stream = response.get('stream')
+	stop_reason, usage, reasoning = None, {}, []
+	for event in stream:
+		if 'contentBlockDelta' in event:
+			delta = event['contentBlockDelta'].get('delta', {})
+			if 'reasoningContent' in delta:
+				watcher.touch()
+				reasoning.append(delta['reasoningContent'].get('text', ''))
+			elif 'text' in delta and watcher.feed(delta['text']):
+				stop_reason = STOP_REASON_OUTPUT
+				_close(stream)
+				break
+		elif 'messageStop' in event:
+			stop_reason = event['messageStop'].get('stopReason')
+		elif 'metadata' in event:
+			usage = event['metadata'].get('usage', {})
+	return dict(text=watcher.reply_text, reasoning=''.join(reasoning) or None, stop_reason=stop_reason, usage=usage)
@@ -0,0 +1,94 @@
+"""
+Context-window guard
+
+A prompt that does not fit the model's context window can never succeed, so
+it must not be retried. Instead the code in it is cut into overlapping chunks
+at line boundaries and each chunk is reviewed as a task of its own.
+
+- The dispatcher checks every file before creating tasks, against the largest
+  model the rule may be routed to (its model and model_ladder).
+- The executor checks again before calling Bedrock, and splits the task when
+  Bedrock rejects the input as too long and the model ladder is exhausted.
+
+Token counts are estimated with base.estimate_tokens, so the usable input is
+the context window scaled by CONTEXT_SAFETY_RATIO minus the tokens reserved
+for the replies.
+"""
+import os
+import base, model_config
+
+MAX_TOKEN_TO_SAMPLE 		= base.str_to_int(os.getenv('MAX_TOKEN_TO_SAMPLE', '10000'))
+CONTEXT_SAFETY_RATIO 		= base.str_to_float(os.getenv('CONTEXT_SAFETY_RATIO', '0.8'))			# Share of the window trusted to the estimate
+CHUNK_OVERLAP_LINES 		= base.str_to_int(os.getenv('CHUNK_OVERLAP_LINES', '20'))				# Lines repeated at the start of the next chunk
+MIN_CHUNK_TOKENS 			= base.str_to_int(os.getenv('MIN_CHUNK_TOKENS', '1000'))
+
+
+def get_input_limit(models, confirm=False):
+	"""
+	Largest estimated input any of the models can take
+
+	The reply reserves MAX_TOKEN_TO_SAMPLE tokens; a confirm round sends the
+	first reply back as input and reserves another reply.
+	"""
+	reserve = MAX_TOKEN_TO_SAMPLE * (2 if confirm else 1)
+	windows = [ model_config.get_context_window(model) for model in models if model ] or [ model_config.DEFAULT_CONTEXT_WINDOW ]
+	return int(max(windows) * CONTEXT_SAFETY_RATIO) - reserve
+
+
+def get_models(model, ladder=None):
+	"""
+	Models a task may be routed to: the rule's model and every tier of its ladder
+	"""
+	models = [ (model or '').lower() ]
+	for tier in ladder or []:
+		name = tier.get('model') if isinstance(tier, dict) else tier
+		if name:
+			models.append(str(name).lower())
+	return models
+
+
+def split_lines(code, max_tokens):
+	"""
+	Lines of the code, with any line longer than max_tokens cut into pieces
+	"""
+	lines = []
+	for line in code.splitlines(keepends=True):
+		if base.estimate_tokens(line) <= max_tokens:
+			lines.append(line)
+			continue
+		# Every character counts as at most one token
+		lines.extend(line[start:start + max_tokens] for start in range(0, len(line), max_tokens))
+	return lines
+
+
+def split_code(code, max_tokens, overlap_lines=None):
+	"""
+	Cut code into chunks of at most max_tokens estimated tokens
+
+	Consecutive chunks share up to overlap_lines lines, at most half of the
+	previous chunk, so a finding on a chunk boundary is seen whole at least once.
+
+	Returns:
+		list: [ (first line number, text) ], a single chunk when the code fits
+	"""
+	overlap_lines = CHUNK_OVERLAP_LINES if overlap_lines is None else overlap_lines
+	max_tokens = max(1, int(max_tokens))
+	lines = split_lines(code or '', max_tokens)
+	chunks, start = [], 0
+	while start < len(lines):
+		end, tokens = start, 0
+		while end < len(lines) and (end == start or tokens + base.estimate_tokens(lines[end]) <= max_tokens):
+			tokens += base.estimate_tokens(lines[end])
+			end += 1
+		chunks.append((start + 1, ''.join(lines[start:end])))
+		if end >= len(lines):
+			break
+		start = end - min(overlap_lines, (end - start) // 2)
+	return chunks or [ (1, code or '') ]
+
+
+def split_in_two(code):
+	"""
+	Split code that the model rejected at runtime into about two halves
+	"""
+	return split_code(code, max(MIN_CHUNK_TOKENS, (base.estimate_tokens(code) + 1) // 2))
@@ -1,14 +1,14 @@
 import boto3
 import os, datetime, logging
-import base, task_base
+import base, datastore, metrics, task_base, batch_inference
 from logger import init_logger
 
 REQUEST_TABLE 			= os.getenv('REQUEST_TABLE')
 TASK_TABLE 				= os.getenv('TASK_TABLE')
 SNS_TOPIC_ARN 			= os.getenv('SNS_TOPIC_ARN')
 REPORT_TIMEOUT_SECONDS 	= base.str_to_int(os.getenv('REPORT_TIMEOUT_SECONDS', '900'))
+BATCH_TIMEOUT_SECONDS 	= base.str_to_int(os.getenv('BATCH_TIMEOUT_SECONDS', '90000'))
 
-dynamodb 				= boto3.resource("dynamodb")
 sns 					= boto3.resource('sns')
 s3 						= boto3.resource("s3")
 
@@ -20,29 +20,32 @@ def lambda_handler(event, context):
 	log.info(event, extra=dict(label='event'))
 
 	items = []
-	hours = 24
+	# 批量推理作业可能超过24小时，扫描范围覆盖其超时时限
+	hours = max(24, BATCH_TIMEOUT_SECONDS // 3600 + 1) if batch_inference.BATCH_INFERENCE else 24
 	start_time = datetime.datetime.now() - datetime.timedelta(hours=hours)
-	result = dynamodb.Table(REQUEST_TABLE).query(
-		IndexName='TaskStatusIndex',
-		KeyConditionExpression='task_status = :s AND create_time >= :t',
-		ExpressionAttributeValues={ ':s': base.STATUS_PROCESSING ,':t': str(start_time) },
-		ConsistentRead=True
-	)
-	items = items + result.get('Items')
-	result = dynamodb.Table(REQUEST_TABLE).query(
-		IndexName='TaskStatusIndex',
-		KeyConditionExpression='task_status = :s AND create_time >= :t',
-		ExpressionAttributeValues={ ':s': base.STATUS_START ,':t': str(start_time) },
-		ConsistentRead=True
-	)
-	items = items + result.get('Items')
+	# Reporting状态的Request在认领超时后重新生成报告
+	for status in [ base.STATUS_PROCESSING, base.STATUS_START, base.STATUS_REPORTING ]:
+		items.extend(datastore.query_all(
+			REQUEST_TABLE,
+			fields=task_base.PROGRESS_FIELDS,
+			IndexName='TaskStatusIndex',
+			KeyConditionExpression='task_status = :s AND create_time >= :t',
+			ExpressionAttributeValues={ ':s': status ,':t': str(start_time) },
+		))
 	log.info(f'Load incomplete request record for the last {hours} hours.', extra=dict(items=items))
 
 	for item in items:
 		try:
-			if item:
+			if not item:
+				continue
+			if batch_inference.has_pending_jobs(item) and batch_inference.poll_request(item):
+				# 写入批量结果后重新读取计数
+				task_base.check_request_progress_by_pksk(item.get('commit_id'), item.get('request_id'), log)
+			else:
 				task_base.check_request_progress(item, log)
 		except Exception as ex:
 			log.error('Fail to process request record.', extra=dict(exception=str(ex)))
-	
+
+	# 写入批量推理结果时缓存的指标统一输出
+	metrics.flush()
 	log.info('Complete cron function.')
@@ -0,0 +1,255 @@
+import threading
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+
+dynamodb 				= boto3.resource("dynamodb")
+_local 					= threading.local()
+_deserializer 			= TypeDeserializer()
+
+def get_table(table_name):
+	"""
+	获取DynamoDB Table对象，同一Lambda容器内按线程、表名复用
+
+	boto3的resource对象不保证线程安全，并发处理SQS记录时每个线程使用各自的Table对象，
+	底层client（线程安全）仍然共享。缓存保存在threading.local中，线程结束后随之释放，
+	不会随热启动的调用次数增长。
+	"""
+	tables = getattr(_local, 'tables', None)
+	if tables is None:
+		tables = _local.tables = dict()
+	cached = tables.get(table_name)
+	if cached is not None and cached[0] is dynamodb:
+		return cached[1]
+	table = dynamodb.Table(table_name)
+	tables[table_name] = (dynamodb, table)
+	return table
+
+def build_projection(fields, names=None):
+	"""
+	将字段列表转换为ProjectionExpression，字段名统一使用占位符，避免与保留字（如data、number）冲突
+
+	Returns:
+		tuple: (projection_expression, expression_attribute_names)
+	"""
+	names = dict(names or {})
+	placeholders = []
+	for i, field in enumerate(fields):
+		placeholder = f'#p{i}'
+		names[placeholder] = field
+		placeholders.append(placeholder)
+	return ', '.join(placeholders), names
+
+def get_item(table_name, key, fields=None, consistent=False):
+	"""
+	读取单条记录
+
+	Args:
+		table_name: 表名
+		key: 主键
+		fields: 需要返回的字段列表，为None时返回全部字段
+		consistent: 是否强一致读
+
+	Returns:
+		dict: 记录，不存在时返回None
+	"""
+	params = dict(Key=key, ConsistentRead=consistent)
+	if fields:
+		params['ProjectionExpression'], params['ExpressionAttributeNames'] = build_projection(fields)
+	return get_table(table_name).get_item(**params).get('Item')
+
+def put_item(table_name, item, condition=None, names=None, values=None):
+	params = dict(Item=item)
+	if condition:
+		params['ConditionExpression'] = condition
+	if names:
+		params['ExpressionAttributeNames'] = names
+	if values:
+		params['ExpressionAttributeValues'] = values
+	get_table(table_name).put_item(**params)
+
+def update_item(table_name, key, expression, values=None, names=None, condition=None, return_values='NONE', return_values_on_failure=None):
+	"""
+	更新单条记录，默认不返回数据（ReturnValues=NONE），只有调用方确实需要结果时才指定return_values
+
+	return_values_on_failure为ALL_OLD时，条件不满足的异常带有当前记录（见get_failed_item），不需要再读取一次。
+
+	Returns:
+		dict: 当return_values不为NONE时返回Attributes，否则返回None
+	"""
+	params = dict(Key=key, UpdateExpression=expression, ReturnValues=return_values)
+	if values:
+		params['ExpressionAttributeValues'] = values
+	if names:
+		params['ExpressionAttributeNames'] = names
+	if condition:
+		params['ConditionExpression'] = condition
+	if return_values_on_failure:
+		params['ReturnValuesOnConditionCheckFailure'] = return_values_on_failure
+	response = get_table(table_name).update_item(**params)
+	return response.get('Attributes') if return_values != 'NONE' else None
+
+def get_failed_item(ex):
+	"""
+	条件不满足的异常中带回的当前记录（ReturnValuesOnConditionCheckFailure=ALL_OLD），没有时返回None
+	"""
+	item = (getattr(ex, 'response', None) or {}).get('Item')
+	if not item:
+		return None
+	return { field: _deserializer.deserialize(value) for field, value in item.items() }
+
+def transact_update(updates):
+	"""
+	在一个事务中更新多条记录，任意一条的条件不满足时全部不生效
+
+	resource的client会自动转换DynamoDB类型，key与values直接使用Python值。
+
+	Args:
+		updates: 更新列表，每项为dict(table_name, key, expression, values, names, condition)，含义与update_item相同
+
+	Raises:
+		ClientError: 条件不满足时错误码为TransactionCanceledException，CancellationReasons按顺序给出各条更新的原因
+	"""
+	items = []
+	for update in updates:
+		params = dict(
+			TableName=update['table_name'],
+			Key=update['key'],
+			UpdateExpression=update['expression'],
+		)
+		if update.get('values'):
+			params['ExpressionAttributeValues'] = update['values']
+		if update.get('names'):
+			params['ExpressionAttributeNames'] = update['names']
+		if update.get('condition'):
+			params['ConditionExpression'] = update['condition']
+		items.append(dict(Update=params))
+	dynamodb.meta.client.transact_write_items(TransactItems=items)
+
+def is_condition_failed(ex, index=0):
+	"""
+	判断异常是否由条件不满足引起，事务按index判断对应的更新
+	"""
+	response = getattr(ex, 'response', None) or {}
+	code = response.get('Error', {}).get('Code')
+	if code == 'ConditionalCheckFailedException':
+		return True
+	if code == 'TransactionCanceledException':
+		reasons = response.get('CancellationReasons') or []
+		return len(reasons) > index and reasons[index].get('Code') == 'ConditionalCheckFailed'
+	return False
+
+def query_all(table_name, fields=None, **kwargs):
+	"""
+	分页查询的生成器，自动跟随LastEvaluatedKey，调用方无需关心1MB分页
+
+	Args:
+		table_name: 表名
+		fields: 需要返回的字段列表，为None时返回全部字段
+		kwargs: 透传给Table.query的参数，例如KeyConditionExpression、IndexName
+	"""
+	params = dict(kwargs)
+	if fields:
+		params['ProjectionExpression'], params['ExpressionAttributeNames'] = build_projection(fields, params.get('ExpressionAttributeNames'))
+	table = get_table(table_name)
+	while True:
+		response = table.query(**params)
+		for item in response.get('Items', []):
+			yield item
+		last_key = response.get('LastEvaluatedKey')
+		if not last_key:
+			break
+		params['ExclusiveStartKey'] = last_key
+
+def query_items(table_name, fields=None, **kwargs):
+	return list(query_all(table_name, fields=fields, **kwargs))
+
+def batch_put(table_name, items):
+	"""
+	批量写入，每25条一批，未处理的条目由batch_writer自动重试
+	"""
+	with get_table(table_name).batch_writer() as writer:
+		for item in items:
+			writer.put_item(Item=item)
+
+class CounterBuffer:
+	"""
+	合并同一次调用内对同一条记录的重复计数更新
+
+	- add: 累加计数字段（使用ADD，字段不存在时从0开始）
+	- set: 设置普通字段，同一字段多次设置以最后一次为准
+	- flush: 每条记录只产生一次update_item调用
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.pending = dict()
+
+	def _entry(self, table_name, key):
+		ident = (table_name, tuple(sorted(key.items())))
+		entry = self.pending.get(ident)
+		if entry is None:
+			entry = self.pending[ident] = dict(table_name=table_name, key=dict(key), counters=dict(), fields=dict())
+		return entry
+
+	def add(self, table_name, key, field, amount=1):
+		with self.lock:
+			counters = self._entry(table_name, key)['counters']
+			counters[field] = counters.get(field, 0) + amount
+
+	def set(self, table_name, key, field, value):
+		with self.lock:
+			self._entry(table_name, key)['fields'][field] = value
+
+	def restore(self, entry):
+		"""
+		写入失败的条目放回缓冲区，与期间新增的更新合并：计数累加，字段以新设置的值为准
+		"""
+		with self.lock:
+			pending = self._entry(entry['table_name'], entry['key'])
+			for field, amount in entry['counters'].items():
+				pending['counters'][field] = pending['counters'].get(field, 0) + amount
+			for field, value in entry['fields'].items():
+				pending['fields'].setdefault(field, value)
+
+	def flush(self):
+		"""
+		逐条写入缓冲的更新，写入成功的条目才从缓冲区移除
+
+		写入失败的条目保留在缓冲区，下一次flush时重试，异常在全部条目处理后抛出。
+		"""
+		with self.lock:
+			entries, self.pending = list(self.pending.values()), dict()
+		error = None
+		for entry in entries:
+			names, values, sets, adds = dict(), dict(), [], []
+			for i, (field, value) in enumerate(entry['fields'].items()):
+				names[f'#f{i}'], values[f':f{i}'] = field, value
+				sets.append(f'#f{i} = :f{i}')
+			for i, (field, amount) in enumerate(entry['counters'].items()):
+				names[f'#c{i}'], values[f':c{i}'] = field, amount
+				adds.append(f'#c{i} :c{i}')
+			expression = ' '.join(part for part in [
+				'SET ' + ', '.join(sets) if sets else '',
+				'ADD ' + ', '.join(adds) if adds else '',
+			] if part)
+			if not expression:
+				continue
+			try:
+				update_item(entry['table_name'], entry['key'], expression, values=values, names=names)
+			except Exception as ex:
+				self.restore(entry)
+				error = error or ex
+		if error is not None:
+			raise error
+		return len(entries)
+
+counters = CounterBuffer()
+
+def add_counter(table_name, key, field, amount=1):
+	counters.add(table_name, key, field, amount)
+
+def set_field(table_name, key, field, value):
+	counters.set(table_name, key, field, value)
+
+def flush_counters():
+	return counters.flush()
@@ -0,0 +1,219 @@
+"""
+Local recovery of malformed findings output
+
+Model output is parsed strictly first. When that fails, a sequence of local
+repairs is tried before the caller falls back to asking the model to
+re-output its answer:
+
+	- unclosed <output> tag or findings without any tag
+	- markdown code fences around the JSON
+	- JSON literals (true/false/null) vs Python literals (True/False/None)
+	- raw newlines and unescaped quotes inside string values
+	- trailing commas
+	- a truncated final element
+
+Each successful parse reports the method that recovered it, so callers can
+count how often each path is taken.
+"""
+import re, ast, json
+
+METHOD_STRICT 			= 'strict'
+METHOD_REPAIRED 		= 'repaired'
+METHOD_TRUNCATED 		= 'truncated'
+
+OUTPUT_PATTERN 			= re.compile(r'<output>(.*?)</output>', re.DOTALL)
+FENCE_PATTERN 			= re.compile(r'^\s*```[a-zA-Z]*\s*\n?(.*?)\n?\s*```\s*$', re.DOTALL)
+LITERALS 				= { 'True': 'true', 'False': 'false', 'None': 'null' }
+CLOSERS 				= { '[': ']', '{': '}' }
+
+
+class RecoveryError(ValueError):
+	pass
+
+
+def extract_output(text):
+	"""
+	Text inside <output>, tolerating a missing closing tag or a missing tag
+
+	Returns:
+		tuple: (content, tagged) where tagged is False when the content was not
+		taken from a complete <output>...</output> block
+	"""
+	text = text or ''
+	match = OUTPUT_PATTERN.search(text)
+	if match:
+		return match.group(1), True
+	index = text.find('<output>')
+	if index >= 0:
+		return text[index + len('<output>'):], False
+	start = min([ i for i in (text.find('['), text.find('{')) if i >= 0 ], default=-1)
+	return (text[start:] if start >= 0 else ''), False
+
+
+def strip_fences(content):
+	match = FENCE_PATTERN.match(content)
+	return match.group(1) if match else content
+
+
+def _load(content):
+	"""
+	Parse with json first and Python literal syntax second
+	"""
+	try:
+		return json.loads(content)
+	except ValueError:
+		return ast.literal_eval(content)
+
+
+def _next_significant(content, index):
+	while index < len(content) and content[index] in ' \t\r\n':
+		index += 1
+	return content[index] if index < len(content) else ''
+
+
+def repair(content):
+	"""
+	Rewrite content into valid JSON in a single pass
+
+	A double quote inside a string only closes the string when it is followed
+	by a structural character; otherwise it is escaped. The scan also tracks
+	the open brackets and the end of the last complete top-level element.
+
+	Returns:
+		tuple: (repaired text, open bracket stack, repaired text up to the end
+		of the last complete element of the outermost container or None)
+	"""
+	out, stack = [], []
+	in_string, escaped = False, False
+	last_complete = None
+	index, length = 0, len(content)
+	while index < length:
+		char = content[index]
+		if in_string:
+			if escaped:
+				escaped = False
+				out.append(char)
+			elif char == '\\':
+				escaped = True
+				out.append(char)
+			elif char == '"':
+				if _next_significant(content, index + 1) in (',', ':', '}', ']', ''):
+					in_string = False
+					out.append(char)
+				else:
+					out.append('\\"')
+			elif char == '\n':
+				out.append('\\n')
+			elif char == '\r':
+				out.append('\\r')
+			elif char == '\t':
+				out.append('\\t')
+			else:
+				out.append(char)
+			index += 1
+			continue
+
+		if char == '"':
+			in_string = True
+			out.append(char)
+		elif char in CLOSERS:
+			stack.append(char)
+			out.append(char)
+		elif char in (']', '}'):
+			# Drop a trailing comma before the closing bracket
+			while out and out[-1] in ' \t\r\n':
+				out.pop()
+			if out and out[-1] == ',':
+				out.pop()
+			if stack:
+				stack.pop()
+			out.append(char)
+			if len(stack) == 1:
+				last_complete = len(out)
+		elif char.isalpha():
+			end = index
+			while end < length and (content[end].isalnum() or content[end] == '_'):
+				end += 1
+			word = content[index:end]
+			out.append(LITERALS.get(word, word))
+			index = end
+			continue
+		else:
+			out.append(char)
+		index += 1
+
+	text = ''.join(out)
+	if in_string:
+		text += '"'
+	return text, stack, ''.join(out[:last_complete]) if last_complete is not None else None
+
+
+def close_truncated(text, stack, complete_prefix):
+	"""
+	Cut a truncated document after its last complete element and close it
+	"""
+	if not stack:
+		return None
+	if complete_prefix is not None:
+		return complete_prefix + CLOSERS[stack[0]]
+	return text + ''.join(CLOSERS[bracket] for bracket in reversed(stack))
+
+
+def normalize(value):
+	"""
+	Wrap a single finding into a list; every finding must be a dict
+
+	Bracketed text that is not findings (for example "See [\"a.py\"]" in a
+	reply without <output>) is rejected, so it goes to the rectifier instead
+	of being reported as findings.
+	"""
+	if isinstance(value, dict):
+		return [ value ]
+	if isinstance(value, list) and all(isinstance(item, dict) for item in value):
+		return value
+	raise RecoveryError('Content is not a list of findings')
+
+
+def parse_findings(text):
+	"""
+	Parse the findings list from a model reply
+
+	Returns:
+		tuple: (findings list, method) where method is METHOD_STRICT,
+		METHOD_REPAIRED or METHOD_TRUNCATED
+
+	Raises:
+		RecoveryError: when no local repair yields a finding or a list of findings
+	"""
+	content, tagged = extract_output(text)
+	if tagged:
+		try:
+			return normalize(ast.literal_eval(content)), METHOD_STRICT
+		except (ValueError, SyntaxError, RecoveryError, MemoryError, RecursionError):
+			pass
+		try:
+			return normalize(json.loads(content)), METHOD_STRICT
+		except (ValueError, RecoveryError, RecursionError):
+			pass
+
+	content = strip_fences(content.strip())
+	if not content:
+		raise RecoveryError('No findings content to recover')
+	try:
+		return normalize(_load(content)), METHOD_REPAIRED
+	except (ValueError, SyntaxError, RecoveryError, MemoryError, RecursionError):
+		pass
+
+	repaired, stack, complete_prefix = repair(content)
+	try:
+		return normalize(_load(repaired)), METHOD_REPAIRED
+	except (ValueError, SyntaxError, RecoveryError, MemoryError, RecursionError):
+		pass
+
+	closed = close_truncated(repaired, stack, complete_prefix)
+	if closed:
+		try:
+			return normalize(_load(closed)), METHOD_TRUNCATED
+		except (ValueError, SyntaxError, RecoveryError, MemoryError, RecursionError):
+			pass
+	raise RecoveryError('Fail to recover findings content')
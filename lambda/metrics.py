@@ -0,0 +1,102 @@
+import os, json, time, threading
+from contextlib import contextmanager
+
+METRICS_NAMESPACE 		= os.getenv('METRICS_NAMESPACE', 'CodeReviewer')
+EMF_MAX_VALUES 			= 100		# EMF每个指标最多100个值
+
+def build_document(name, value, unit='None', dimensions=None, namespace=None):
+	"""
+	构造CloudWatch Embedded Metric Format（EMF）文档
+
+	Lambda输出到stdout的EMF文档会被CloudWatch Logs自动提取为指标，不需要调用PutMetricData。
+	value可以是数值列表，CloudWatch按列表中的每个值统计分位数（直方图）。
+	"""
+	return build_group_document(dimensions, { name: (unit, value) }, namespace)
+
+def build_group_document(dimensions, values, namespace=None):
+	"""
+	构造包含多个指标的EMF文档，同一组维度下的指标合并输出
+
+	Args:
+		dimensions: 维度
+		values: 指标名 -> (单位, 数值或数值列表)
+	"""
+	dimensions = { key: str(value) for key, value in (dimensions or {}).items() }
+	document = {
+		'_aws': {
+			'Timestamp': int(time.time() * 1000),
+			'CloudWatchMetrics': [{
+				'Namespace': namespace or METRICS_NAMESPACE,
+				'Dimensions': [ list(dimensions.keys()) ],
+				'Metrics': [ { 'Name': name, 'Unit': unit } for name, (unit, _) in values.items() ],
+			}],
+		},
+	}
+	for name, (_, value) in values.items():
+		document[name] = value
+	document.update(dimensions)
+	return document
+
+class MetricBuffer:
+	"""
+	缓存一次Lambda调用内的指标，flush时按维度合并输出
+
+	- 同一维度下的不同指标合并为一个EMF文档
+	- 同一指标的多个值合并为数值列表，单个指标超过EMF_MAX_VALUES个值时拆分为多个文档
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.groups = dict()
+
+	def add(self, name, value, unit='None', dimensions=None):
+		key = tuple(sorted((str(k), str(v)) for k, v in (dimensions or {}).items()))
+		with self.lock:
+			metrics = self.groups.setdefault(key, dict())
+			metric = metrics.get(name)
+			if metric is None:
+				metric = metrics[name] = (unit, [])
+			metric[1].append(value)
+
+	def flush(self):
+		with self.lock:
+			groups, self.groups = self.groups, dict()
+		documents = []
+		for key, metrics in groups.items():
+			dimensions = dict(key)
+			start = 0
+			while True:
+				values = { name: (unit, items[start:start + EMF_MAX_VALUES]) for name, (unit, items) in metrics.items() if len(items) > start }
+				if not values:
+					break
+				values = { name: (unit, items[0] if len(items) == 1 else items) for name, (unit, items) in values.items() }
+				documents.append(build_group_document(dimensions, values))
+				start += EMF_MAX_VALUES
+		for document in documents:
+			print(json.dumps(document))
+		return len(documents)
+
+buffer = MetricBuffer()
+
+def emit(name, value, unit='None', dimensions=None):
+	"""
+	记录单个指标，缓存到本次调用结束时由flush统一输出
+	"""
+	buffer.add(name, value, unit, dimensions)
+
+def flush():
+	"""
+	输出本次调用缓存的指标，在每个Lambda入口处理结束时调用
+	"""
+	return buffer.flush()
+
+@contextmanager
+def timer(name, dimensions=None):
+	"""
+	记录代码块的耗时(毫秒)，代码块抛出异常时同样记录
+	"""
+	start = time.time()
+	try:
+		yield
+	finally:
+		emit(name, int((time.time() - start) * 1000), 'Milliseconds', dimensions)
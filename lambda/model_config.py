@@ -3,13 +3,17 @@ Model Configuration Module
 Centralized management for all Claude model configurations
 """
 
+DEFAULT_CONTEXT_WINDOW = 200000
+
 MODEL_CONFIGS = {
     # Claude 3.7 Series (uses cross-region inference)
     'claude3.7-sonnet': {
         'model_id': 'us.anthropic.claude-3-7-sonnet-20250219-v1:0',  # Cross-region inference model ID
         'supports_reasoning': True,
         'version': '3.7',
+        'supports_prompt_cache': True,
         'timeout': 900,  # 15 minutes (Lambda max)
+        'context_window': 200000,  # Input plus output tokens
         'param_restriction': None,
     },
 
@@ -18,21 +22,27 @@ MODEL_CONFIGS = {
         'model_id': 'us.anthropic.claude-opus-4-20250514-v1:0',  # Cross-region inference model ID
         'supports_reasoning': True,  # Supports interleaved-thinking and dev-full-thinking via anthropic_beta
         'version': '4',
+        'supports_prompt_cache': True,
         'timeout': 900,  # 15 minutes (Lambda max)
+        'context_window': 200000,  # Input plus output tokens
         'param_restriction': None,
     },
     'claude4-opus-4.1': {
         'model_id': 'us.anthropic.claude-opus-4-1-20250805-v1:0',  # Cross-region inference model ID
         'supports_reasoning': True,  # Supports interleaved-thinking and dev-full-thinking via anthropic_beta
         'version': '4.1',
+        'supports_prompt_cache': True,
         'timeout': 900,  # 15 minutes (Lambda max)
+        'context_window': 200000,  # Input plus output tokens
         'param_restriction': None,
     },
     'claude4-sonnet': {
         'model_id': 'us.anthropic.claude-sonnet-4-20250514-v1:0',  # Cross-region inference model ID
         'supports_reasoning': True,  # Supports interleaved-thinking and dev-full-thinking via anthropic_beta
         'version': '4',
+        'supports_prompt_cache': True,
         'timeout': 900,  # 15 minutes (Lambda max)
+        'context_window': 200000,  # Input plus output tokens
         'param_restriction': None,
     },
 
@@ -41,14 +51,18 @@ MODEL_CONFIGS = {
         'model_id': 'us.anthropic.claude-sonnet-4-5-20250929-v1:0',  # Cross-region inference model ID
         'supports_reasoning': True,  # Supports interleaved-thinking and dev-full-thinking via anthropic_beta
         'version': '4.5',
+        'supports_prompt_cache': True,
         'timeout': 900,  # 15 minutes (Lambda max)
+        'context_window': 200000,  # Input plus output tokens
         'param_restriction': 'temperature_only',  # Can only use temperature
     },
     'claude4.5-haiku': {
         'model_id': 'us.anthropic.claude-haiku-4-5-20251001-v1:0',  # Cross-region inference model ID
         'supports_reasoning': True,  # Supports interleaved-thinking and dev-full-thinking via anthropic_beta
         'version': '4.5',
+        'supports_prompt_cache': True,
         'timeout': 900,  # 15 minutes (Lambda max)
+        'context_window': 200000,  # Input plus output tokens
         'param_restriction': 'temperature_only',  # Can only use temperature
     },
 
@@ -57,39 +71,65 @@ MODEL_CONFIGS = {
         'model_id': 'anthropic.claude-3-5-sonnet-20240620-v1:0',
         'supports_reasoning': False,
         'version': '3.5',
+        'supports_prompt_cache': False,
         'timeout': 120,
+        'context_window': 200000,  # Input plus output tokens
         'param_restriction': None,
     },
     'claude3-opus': {
         'model_id': 'anthropic.claude-3-opus-20240229-v1:0',
         'supports_reasoning': False,
         'version': '3',
+        'supports_prompt_cache': False,
         'timeout': 120,
+        'context_window': 200000,  # Input plus output tokens
         'param_restriction': None,
     },
     'claude3-sonnet': {
         'model_id': 'anthropic.claude-3-sonnet-20240229-v1:0',
         'supports_reasoning': False,
         'version': '3',
+        'supports_prompt_cache': False,
         'timeout': 120,
+        'context_window': 200000,  # Input plus output tokens
         'param_restriction': None,
     },
     'claude3-haiku': {
         'model_id': 'anthropic.claude-3-haiku-20240307-v1:0',
         'supports_reasoning': False,
         'version': '3',
+        'supports_prompt_cache': False,
         'timeout': 120,
+        'context_window': 200000,  # Input plus output tokens
         'param_restriction': None,
     },
     'claude3': {  # Default mapping
         'model_id': 'anthropic.claude-3-sonnet-20240229-v1:0',
         'supports_reasoning': False,
         'version': '3',
+        'supports_prompt_cache': False,
         'timeout': 120,
+        'context_window': 200000,  # Input plus output tokens
         'param_restriction': None,
     },
 }
 
+# On-demand prices in USD per million tokens, keyed by model name
+# cache_read / cache_write are the prompt caching rates
+MODEL_PRICES = {
+    'claude3.7-sonnet': {'input': 3.0, 'output': 15.0, 'cache_read': 0.3, 'cache_write': 3.75},
+    'claude4-opus': {'input': 15.0, 'output': 75.0, 'cache_read': 1.5, 'cache_write': 18.75},
+    'claude4-opus-4.1': {'input': 15.0, 'output': 75.0, 'cache_read': 1.5, 'cache_write': 18.75},
+    'claude4-sonnet': {'input': 3.0, 'output': 15.0, 'cache_read': 0.3, 'cache_write': 3.75},
+    'claude4.5-sonnet': {'input': 3.0, 'output': 15.0, 'cache_read': 0.3, 'cache_write': 3.75},
+    'claude4.5-haiku': {'input': 1.0, 'output': 5.0, 'cache_read': 0.1, 'cache_write': 1.25},
+    'claude3.5-sonnet': {'input': 3.0, 'output': 15.0, 'cache_read': 0.3, 'cache_write': 3.75},
+    'claude3-opus': {'input': 15.0, 'output': 75.0, 'cache_read': 1.5, 'cache_write': 18.75},
+    'claude3-sonnet': {'input': 3.0, 'output': 15.0, 'cache_read': 0.3, 'cache_write': 3.75},
+    'claude3-haiku': {'input': 0.25, 'output': 1.25, 'cache_read': 0.03, 'cache_write': 0.3},
+    'claude3': {'input': 3.0, 'output': 15.0, 'cache_read': 0.3, 'cache_write': 3.75},
+}
+
 
 def get_model_config(model_name):
     """
@@ -110,6 +150,20 @@ def get_model_config(model_name):
     return config.copy()
 
 
+def get_context_window(model_name):
+    """
+    Get the context window (input plus output tokens) of a model
+
+    Args:
+        model_name: Model name
+
+    Returns:
+        int: Context window in tokens, DEFAULT_CONTEXT_WINDOW for unknown models
+    """
+    config = MODEL_CONFIGS.get(model_name) or {}
+    return config.get('context_window', DEFAULT_CONTEXT_WINDOW)
+
+
 def is_claude37_or_later(model_name):
     """
     Check if the model is Claude 3.7 or later version
@@ -163,6 +217,20 @@ def supports_reasoning(model_name):
     return config.get('supports_reasoning', False)
 
 
+def supports_prompt_cache(model_name):
+    """
+    Check if the model supports prompt caching (cache_control / Converse cachePoint)
+
+    Args:
+        model_name: Model name
+
+    Returns:
+        bool: True if model supports prompt caching
+    """
+    config = get_model_config(model_name)
+    return config.get('supports_prompt_cache', False)
+
+
 def get_model_id(model_name):
     """
     Get Bedrock model ID by model name
@@ -179,3 +247,40 @@ def get_model_id(model_name):
     except (ValueError, KeyError):
         # Fallback: return original model name
         return model_name
+
+
+def get_model_price(model_name):
+    """
+    Get the price table entry of a model
+
+    Args:
+        model_name: Model name (e.g., 'claude4-sonnet')
+
+    Returns:
+        dict: USD per million tokens for input, output, cache_read and cache_write, or None if unknown
+    """
+    return MODEL_PRICES.get(model_name)
+
+
+def estimate_cost(model_name, usage):
+    """
+    Estimate the cost of one invocation
+
+    Reasoning tokens are billed as output tokens and are already included in output_tokens.
+
+    Args:
+        model_name: Model name (e.g., 'claude4-sonnet')
+        usage: dict with input_tokens, output_tokens, cache_read_tokens and cache_write_tokens
+
+    Returns:
+        float: Cost in USD, 0 if the model has no price
+    """
+    price = get_model_price(model_name)
+    if not price or not usage:
+        return 0.0
+    return (
+        usage.get('input_tokens', 0) * price['input']
+        + usage.get('output_tokens', 0) * price['output']
+        + usage.get('cache_read_tokens', 0) * price['cache_read']
+        + usage.get('cache_write_tokens', 0) * price['cache_write']
+    ) / 1000000
@@ -0,0 +1,104 @@
+"""
+Size-aware model routing
+
+A rule may declare a model ladder, ordered from the cheapest tier to the
+most capable one:
+
+	model_ladder:
+	  - model: claude4.5-haiku
+	    max_input_tokens: 8000
+	  - model: claude4-sonnet
+
+Each task starts on the first tier whose max_input_tokens covers the
+estimated input size, and moves up the ladder when the model rejects the
+input as too long. A tier without max_input_tokens accepts any size.
+"""
+import re, logging
+import model_config, rate_control
+from botocore.exceptions import ClientError
+
+# Input-length wording of Bedrock's ValidationException; throttling messages such
+# as "Too many tokens, please wait before trying again." must not match
+CONTEXT_OVERFLOW_PATTERN = re.compile(r'(input|prompt) is too long|too many input tokens|input (length|tokens?) .*exceeds?|context (length|window)|maximum context', re.IGNORECASE)
+VALIDATION_ERROR = 'ValidationException'
+
+log = logging.getLogger('crlog_{}'.format(__name__))
+
+
+def normalize_ladder(ladder, default_model=None):
+	"""
+	Validate a ladder declared in a rule
+
+	Tiers may be given as model names or as dicts with model and
+	max_input_tokens. Unknown models are dropped. The rule's own model is
+	appended as the top tier when the ladder does not already contain it.
+
+	Returns:
+		list: [ { 'model': str, 'max_input_tokens': int or None } ], may be empty
+	"""
+	tiers = []
+	for tier in ladder or []:
+		if isinstance(tier, str):
+			tier = dict(model=tier)
+		if not isinstance(tier, dict) or not tier.get('model'):
+			continue
+		model = str(tier.get('model')).lower()
+		if model not in model_config.MODEL_CONFIGS:
+			log.info(f'Model({model}) in ladder is not supported.')
+			continue
+		limit = tier.get('max_input_tokens')
+		tiers.append(dict(model=model, max_input_tokens=int(limit) if limit else None))
+
+	default_model = (default_model or '').lower()
+	if tiers and default_model in model_config.MODEL_CONFIGS and default_model not in [ tier['model'] for tier in tiers ]:
+		tiers.append(dict(model=default_model, max_input_tokens=None))
+	return tiers
+
+
+def select_tier(ladder, input_tokens, start=0):
+	"""
+	Index of the first tier from start that fits input_tokens, or the top tier
+	"""
+	for index in range(start, len(ladder)):
+		limit = ladder[index].get('max_input_tokens')
+		if limit is None or input_tokens <= limit:
+			return index
+	return len(ladder) - 1
+
+
+def is_validation_error(ex):
+	if isinstance(ex, ClientError):
+		return ex.response.get('Error', {}).get('Code') == VALIDATION_ERROR
+	return VALIDATION_ERROR in str(ex)
+
+
+def is_context_overflow(ex):
+	"""
+	Whether an invocation failed because the input does not fit the model
+
+	Throttling is ruled out first. Otherwise the exception chain must contain
+	a ValidationException whose message talks about the input length.
+	"""
+	if rate_control.is_throttling(ex):
+		return False
+	while ex is not None:
+		if is_validation_error(ex) and CONTEXT_OVERFLOW_PATTERN.search(str(ex)):
+			return True
+		ex = ex.__cause__
+	return False
+
+
+def escalate(prompt_data):
+	"""
+	Move prompt_data to the next tier of its ladder
+
+	Returns:
+		bool: False when there is no ladder or the top tier is already in use
+	"""
+	ladder = prompt_data.get('model_ladder') or []
+	index = prompt_data.get('model_tier', 0) + 1
+	if index >= len(ladder):
+		return False
+	prompt_data['model_tier'] = index
+	prompt_data['model'] = ladder[index]['model']
+	return True
@@ -0,0 +1,230 @@
+import os, time, random, logging, threading
+from decimal import Decimal
+import base, datastore, metrics
+from botocore.exceptions import ClientError
+
+RATE_CONTROL_ENABLED 	= os.getenv('RATE_CONTROL', 'true').lower() == 'true'
+RATE_INITIAL 			= base.str_to_float(os.getenv('RATE_INITIAL', '60'))			# 初始速率(次/分钟)
+RATE_MIN 				= base.str_to_float(os.getenv('RATE_MIN', '4'))				# 最低速率(次/分钟)
+RATE_MAX 				= base.str_to_float(os.getenv('RATE_MAX', '600'))				# 最高速率(次/分钟)
+RATE_INCREASE 			= base.str_to_float(os.getenv('RATE_INCREASE', '1'))			# 每次成功调用的加性增长(次/分钟)
+RATE_DECREASE_FACTOR 	= base.str_to_float(os.getenv('RATE_DECREASE_FACTOR', '0.5'))	# 限流时的乘性回退系数
+RATE_DECREASE_COOLDOWN 	= base.str_to_float(os.getenv('RATE_DECREASE_COOLDOWN', '5'))	# 两次回退的最小间隔(秒)
+RATE_BURST_SECONDS 		= base.str_to_float(os.getenv('RATE_BURST_SECONDS', '5'))		# 令牌桶容量对应的秒数
+RATE_MAX_WAIT 			= base.str_to_float(os.getenv('RATE_MAX_WAIT', '1'))			# 在Lambda内等待令牌的最长时间(秒)，更长的等待交给SQS延迟消息
+RATE_RETRY_JITTER 		= base.str_to_float(os.getenv('RATE_RETRY_JITTER', '0.2'))		# 未取得令牌时重试前的随机等待上限(秒)
+RATE_CONFLICT_RETRIES 	= 4																# 缓存的状态过期导致条件写入失败时的最多尝试次数
+RATE_KEY_PREFIX 		= 'rate#'
+RATE_SORT_KEY 			= 'bucket'
+THROTTLING_CODES 		= ('ThrottlingException', 'TooManyRequestsException', 'ServiceQuotaExceededException')
+
+log = logging.getLogger('crlog_{}'.format(__name__))
+
+_lock 					= threading.Lock()
+_states 				= dict()		# 容器内缓存的令牌桶状态，按模型ID
+_increases 				= dict()		# 尚未写入的加性增长，按模型ID
+
+class RateLimitedException(Exception):
+	"""
+	在RATE_MAX_WAIT内没有取得调用配额，delay为建议的延迟秒数
+	"""
+	def __init__(self, model_id, delay):
+		super().__init__(f'Rate limit of {model_id} is reached, retry in {delay:.1f} seconds.')
+		self.model_id = model_id
+		self.delay = delay
+
+def is_enabled():
+	return RATE_CONTROL_ENABLED and bool(os.getenv('REQUEST_TABLE'))
+
+def get_key(model_id):
+	"""
+	令牌桶记录的主键，与Request记录存放在同一张表中
+
+	令牌桶记录没有task_status字段，因此不会进入TaskStatusIndex，也不会被cron扫描到。
+	"""
+	return dict(commit_id=f'{RATE_KEY_PREFIX}{model_id}', request_id=RATE_SORT_KEY)
+
+def is_throttling(ex):
+	"""
+	沿异常链判断是否为Bedrock限流
+	"""
+	while ex is not None:
+		if isinstance(ex, ClientError) and ex.response.get('Error', {}).get('Code') in THROTTLING_CODES:
+			return True
+		if any(code in str(ex) for code in THROTTLING_CODES):
+			return True
+		ex = ex.__cause__
+	return False
+
+def is_condition_failed(ex):
+	return isinstance(ex, ClientError) and ex.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+def load_state(model_id):
+	"""
+	读取令牌桶状态，记录不存在时返回初始状态（updated_at为None）
+	"""
+	item = datastore.get_item(os.getenv('REQUEST_TABLE'), get_key(model_id), fields=['rate', 'tokens', 'updated_at'], consistent=True)
+	return to_state(item)
+
+def to_state(item):
+	if not item:
+		return dict(rate=RATE_INITIAL, tokens=None, updated_at=None)
+	return dict(rate=float(item.get('rate', RATE_INITIAL)), tokens=float(item.get('tokens', 0)), updated_at=item.get('updated_at'))
+
+def get_state(model_id):
+	"""
+	容器内缓存的令牌桶状态，没有缓存时读取一次
+
+	缓存可能落后于其他执行器的写入，扣减以updated_at作为版本号条件，过期的缓存只会导致条件写入失败并刷新。
+	"""
+	with _lock:
+		state = _states.get(model_id)
+	if state is None:
+		state = load_state(model_id)
+		set_state(model_id, state)
+	return state
+
+def set_state(model_id, state):
+	with _lock:
+		_states[model_id] = state
+
+def refill(state, now):
+	"""
+	按经过的时间补充令牌
+
+	Returns:
+		tuple: (当前令牌数, 每秒速率)
+	"""
+	per_second = max(state['rate'], RATE_MIN) / 60
+	capacity = max(1.0, per_second * RATE_BURST_SECONDS)
+	if state['updated_at'] is None:
+		return capacity, per_second
+	elapsed = max(0.0, now - float(state['updated_at']))
+	return min(capacity, state['tokens'] + elapsed * per_second), per_second
+
+def take_token(model_id, state, tokens, now):
+	"""
+	在一次条件写入中补充令牌、扣减一个令牌，并带上本容器累计的加性增长
+
+	以updated_at作为版本号条件，令牌桶不存在时创建。条件不满足说明缓存的状态已过期，
+	异常中带回的当前记录（ALL_OLD）用于刷新缓存，不需要再读取。
+
+	Returns:
+		tuple: (是否取得令牌, 最新的状态；条件不满足且没有带回记录时为None)
+	"""
+	with _lock:
+		increase = _increases.get(model_id, 0.0)
+	rate = min(RATE_MAX, state['rate'] + increase)
+	values = {
+		':t': Decimal(str(round(tokens - 1, 6))), ':n': Decimal(str(now)),
+		':r': Decimal(str(rate)), ':m': model_id,
+	}
+	if state['updated_at'] is None:
+		condition = 'attribute_not_exists(updated_at)'
+	else:
+		condition = 'updated_at = :o'
+		values[':o'] = state['updated_at']
+	try:
+		datastore.update_item(
+			os.getenv('REQUEST_TABLE'), get_key(model_id),
+			'SET tokens = :t, updated_at = :n, rate = :r, model_id = :m',
+			values=values, condition=condition, return_values_on_failure='ALL_OLD',
+		)
+	except ClientError as ex:
+		if not is_condition_failed(ex):
+			raise
+		item = datastore.get_failed_item(ex)
+		latest = to_state(item) if item else None
+		if latest is not None:
+			set_state(model_id, latest)
+		return False, latest
+	with _lock:
+		_increases[model_id] = _increases.get(model_id, 0.0) - increase
+	set_state(model_id, dict(rate=rate, tokens=tokens - 1, updated_at=values[':n']))
+	if rate != state['rate']:
+		emit_limit(model_id, rate)
+	return True, None
+
+def acquire(model_id, max_wait=None):
+	"""
+	在调用模型前取得一个令牌，令牌不足时在max_wait内等待
+
+	按缓存的状态补充令牌，令牌足够时以一次条件写入扣减，缓存过期时用带回的记录重试，
+	最多RATE_CONFLICT_RETRIES次；令牌不足时不访问DynamoDB。max_wait默认很短，
+	等待交给SQS的延迟消息，不占用Lambda的运行时间。
+
+	Returns:
+		float: 0表示已取得令牌；否则为建议的延迟秒数，由调用方延迟后重试
+	"""
+	if not is_enabled() or not model_id:
+		return 0
+	max_wait = RATE_MAX_WAIT if max_wait is None else max_wait
+	deadline = time.time() + max_wait
+	try:
+		state, conflicts = get_state(model_id), 0
+		while True:
+			now = time.time()
+			tokens, per_second = refill(state, now)
+			if tokens >= 1 and conflicts < RATE_CONFLICT_RETRIES:
+				taken, latest = take_token(model_id, state, tokens, now)
+				if taken:
+					return 0
+				conflicts += 1
+				state = latest or load_state(model_id)
+				continue
+			wait = (1 - tokens) / per_second if tokens < 1 else 1 / per_second
+			if now + wait > deadline:
+				return wait
+			time.sleep(wait + random.uniform(0, RATE_RETRY_JITTER))
+			conflicts = 0
+	except Exception as ex:
+		# 令牌桶不可用时不阻塞评审
+		log.warning(f'Fail to acquire rate token for {model_id}.', extra=dict(exception=str(ex)))
+		return 0
+
+def record_success(model_id):
+	"""
+	调用成功，速率加性增长（不超过RATE_MAX）
+
+	增长量在容器内累计，随下一次取令牌的条件写入一起写入，不单独访问DynamoDB。
+	"""
+	if not is_enabled() or not model_id:
+		return
+	with _lock:
+		_increases[model_id] = _increases.get(model_id, 0.0) + RATE_INCREASE
+
+def record_throttle(model_id):
+	"""
+	遇到限流，速率乘性回退（不低于RATE_MIN）
+
+	RATE_DECREASE_COOLDOWN内只回退一次，避免同一波限流被多个执行器重复回退。
+	本容器尚未写入的加性增长一并丢弃。
+	"""
+	if not is_enabled() or not model_id:
+		return None
+	now = time.time()
+	with _lock:
+		_increases.pop(model_id, None)
+	try:
+		state = load_state(model_id)
+		rate = max(RATE_MIN, state['rate'] * RATE_DECREASE_FACTOR)
+		datastore.update_item(
+			os.getenv('REQUEST_TABLE'), get_key(model_id),
+			'SET rate = :r, tokens = :z, updated_at = :n, decreased_at = :n, model_id = :m',
+			values={
+				':r': Decimal(str(rate)), ':z': Decimal('0'), ':n': Decimal(str(now)),
+				':c': Decimal(str(now - RATE_DECREASE_COOLDOWN)), ':m': model_id,
+			},
+			condition='attribute_not_exists(decreased_at) OR decreased_at < :c',
+		)
+		set_state(model_id, dict(rate=rate, tokens=0.0, updated_at=Decimal(str(now))))
+		log.info(f'Rate of {model_id} is decreased to {rate} per minute.')
+		emit_limit(model_id, rate)
+		return rate
+	except Exception as ex:
+		if not is_condition_failed(ex):
+			log.warning(f'Fail to decrease rate for {model_id}.', extra=dict(exception=str(ex)))
+		return None
+
+def emit_limit(model_id, rate):
+	metrics.emit('BedrockRateLimit', rate, dimensions=dict(ModelId=model_id))
@@ -0,0 +1,115 @@
+"""
+Adaptive reasoning budget
+
+Rules that set enable_reasoning get a thinking budget chosen per task instead
+of a fixed 2000 tokens:
+
+	budget = (REASONING_BUDGET_BASE + input_tokens * REASONING_BUDGET_RATIO) * complexity * history
+
+- input_tokens is the estimated size of the prompt, so a one-line diff stays
+  near the minimum and a large file gets more room to think.
+- complexity comes from the rule's reasoning_complexity (low, medium, high).
+- history is learned from earlier calls of the same model and rule: a reply
+  cut off by max_tokens, or reasoning that used most of its budget, raises
+  it; reasoning that used little of its budget lowers it.
+
+A rule's reasoning_budget overrides the computed value. The result is always
+clamped to [REASONING_BUDGET_MIN, REASONING_BUDGET_MAX] and kept below
+max_tokens, as Bedrock requires.
+
+History is kept per Lambda container, like region health in region_pool.
+"""
+import os, threading, logging
+import base
+
+REASONING_BUDGET_MIN 		= base.str_to_int(os.getenv('REASONING_BUDGET_MIN', '1024'))		# Bedrock minimum budget_tokens
+REASONING_BUDGET_MAX 		= base.str_to_int(os.getenv('REASONING_BUDGET_MAX', '8000'))
+REASONING_BUDGET_BASE 		= base.str_to_int(os.getenv('REASONING_BUDGET_BASE', '1024'))
+REASONING_BUDGET_RATIO 		= base.str_to_float(os.getenv('REASONING_BUDGET_RATIO', '0.2'))		# Budget tokens per input token
+REASONING_EWMA_ALPHA 		= base.str_to_float(os.getenv('REASONING_EWMA_ALPHA', '0.3'))
+REASONING_OUTPUT_RESERVE 	= 1024		# Tokens kept for the answer itself when max_tokens is small
+
+COMPLEXITY_FACTORS 			= { 'low': 0.5, 'medium': 1.0, 'high': 2.0 }
+HIGH_UTILIZATION 			= 0.9
+LOW_UTILIZATION 			= 0.3
+HISTORY_FACTOR_MIN 			= 0.5
+HISTORY_FACTOR_MAX 			= 2.0
+HISTORY_STEP 				= 1.25
+
+SOURCE_RULE 				= 'rule'
+SOURCE_ADAPTIVE 			= 'adaptive'
+
+_history 					= dict()
+_lock 						= threading.Lock()
+
+log = logging.getLogger('crlog_{}'.format(__name__))
+
+
+class BudgetHistory:
+	"""
+	Outcomes of earlier reasoning calls for one model and rule
+	"""
+
+	def __init__(self):
+		self.utilization = None
+		self.factor = 1.0
+
+	def update(self, utilization, truncated):
+		self.utilization = utilization if self.utilization is None else self.utilization + REASONING_EWMA_ALPHA * (utilization - self.utilization)
+		if truncated or self.utilization >= HIGH_UTILIZATION:
+			self.factor = min(HISTORY_FACTOR_MAX, self.factor * HISTORY_STEP)
+		elif self.utilization <= LOW_UTILIZATION:
+			self.factor = max(HISTORY_FACTOR_MIN, self.factor / HISTORY_STEP)
+
+
+def get_history(model, rule_name):
+	key = (model, rule_name)
+	history = _history.get(key)
+	if history is None:
+		history = _history[key] = BudgetHistory()
+	return history
+
+
+def clamp(budget, max_tokens=None):
+	upper = REASONING_BUDGET_MAX
+	if max_tokens:
+		upper = min(upper, max_tokens - REASONING_OUTPUT_RESERVE)
+	return int(max(REASONING_BUDGET_MIN, min(upper, budget)))
+
+
+def get_complexity_factor(complexity):
+	return COMPLEXITY_FACTORS.get(str(complexity or 'medium').lower(), 1.0)
+
+
+def choose(model, rule_name, input_tokens, complexity=None, override=None, max_tokens=None):
+	"""
+	Pick the reasoning budget of one call
+
+	Returns:
+		tuple: (budget tokens, source) where source is SOURCE_RULE for a rule override
+	"""
+	if override:
+		return clamp(base.str_to_int(str(override)) or REASONING_BUDGET_MIN, max_tokens), SOURCE_RULE
+	with _lock:
+		factor = get_history(model, rule_name).factor
+	budget = (REASONING_BUDGET_BASE + (input_tokens or 0) * REASONING_BUDGET_RATIO) * get_complexity_factor(complexity) * factor
+	return clamp(budget, max_tokens), SOURCE_ADAPTIVE
+
+
+def record_outcome(model, rule_name, budget, reasoning_tokens, stop_reason):
+	"""
+	Learn from a finished call: how much of the budget was used and whether the reply was cut off
+	"""
+	if not budget:
+		return
+	utilization = min(1.0, (reasoning_tokens or 0) / budget)
+	truncated = stop_reason in ('max_tokens', 'length')
+	with _lock:
+		get_history(model, rule_name).update(utilization, truncated)
+	if truncated:
+		log.info(f'Reply of {model} for rule({rule_name}) is cut off with a reasoning budget of {budget}.')
+
+
+def reset():
+	with _lock:
+		_history.clear()
@@ -0,0 +1,210 @@
+"""
+Bedrock region pool with health scoring and circuit breaking
+
+BEDROCK_REGION_POOL configures the regions a model may be served from, either
+as a comma separated list used for every model or as JSON keyed by model
+name, with "default" for the remaining models:
+
+	{"default": ["us-east-1", "us-west-2"], "claude4-sonnet": ["us-east-1", "us-east-2"]}
+
+Without a pool every call goes to BEDROCK_REGION, as before.
+
+Each (model, region) keeps an exponentially weighted latency and error rate.
+Regions are picked at random weighted by their health score. A circuit opens
+after consecutive regional failures and rejects traffic for
+REGION_CIRCUIT_OPEN_SECONDS, then lets a single probe through (half-open); the
+probe closes the circuit on success and reopens it on failure.
+
+Health is kept per Lambda container. Containers are reused across
+invocations, so each one learns about a brown-out after a few failures
+instead of sharing state through a table on every call.
+"""
+import os, json, time, random, threading, logging
+import base, metrics
+
+BEDROCK_REGION 					= os.getenv('BEDROCK_REGION')
+BEDROCK_REGION_POOL 			= os.getenv('BEDROCK_REGION_POOL', '')
+REGION_FAILURE_THRESHOLD 		= base.str_to_int(os.getenv('REGION_FAILURE_THRESHOLD', '3'))			# Consecutive failures that open a circuit
+REGION_CIRCUIT_OPEN_SECONDS 	= base.str_to_float(os.getenv('REGION_CIRCUIT_OPEN_SECONDS', '60'))	# Time before a half-open probe
+REGION_EWMA_ALPHA 				= base.str_to_float(os.getenv('REGION_EWMA_ALPHA', '0.2'))			# Weight of the latest sample
+REGION_LATENCY_REFERENCE 		= base.str_to_float(os.getenv('REGION_LATENCY_REFERENCE', '30000'))	# Latency (ms) that halves the score
+REGION_MIN_SCORE 				= 0.01
+
+STATE_CLOSED 					= 'closed'
+STATE_OPEN 						= 'open'
+STATE_HALF_OPEN 				= 'half_open'
+
+# Errors that say nothing about the region: the same request fails everywhere
+NON_REGIONAL_ERRORS 			= ('ValidationException', 'AccessDeniedException', 'ResourceNotFoundException')
+
+_health 						= dict()
+_lock 							= threading.Lock()
+
+log = logging.getLogger('crlog_{}'.format(__name__))
+
+
+class RegionHealth:
+	"""
+	Health of one model in one region
+	"""
+
+	def __init__(self):
+		self.latency = None
+		self.error_rate = 0.0
+		self.failures = 0
+		self.state = STATE_CLOSED
+		self.opened_at = 0.0
+		self.probing = False
+
+	def score(self):
+		latency = self.latency if self.latency is not None else 0
+		return max(REGION_MIN_SCORE, (1 - self.error_rate) / (1 + latency / REGION_LATENCY_REFERENCE))
+
+	def available(self, now):
+		"""
+		Whether the circuit lets a call through; moves an expired open circuit to half-open
+		"""
+		if self.state == STATE_OPEN and now - self.opened_at >= REGION_CIRCUIT_OPEN_SECONDS:
+			self.state = STATE_HALF_OPEN
+			self.probing = False
+		if self.state == STATE_HALF_OPEN:
+			return not self.probing
+		return self.state == STATE_CLOSED
+
+
+def parse_pool(text=None):
+	"""
+	Parse BEDROCK_REGION_POOL
+
+	Returns:
+		dict: model name (or 'default') -> list of regions
+	"""
+	text = (BEDROCK_REGION_POOL if text is None else text).strip()
+	if not text:
+		return dict()
+	if text.startswith('{'):
+		try:
+			pool = json.loads(text)
+		except ValueError as ex:
+			log.warning('BEDROCK_REGION_POOL is not valid JSON.', extra=dict(exception=str(ex)))
+			return dict()
+		return { str(model).lower(): [ region.strip() for region in regions if region.strip() ] for model, regions in pool.items() if isinstance(regions, list) }
+	return dict(default=[ region.strip() for region in text.split(',') if region.strip() ])
+
+
+_pool = parse_pool()
+
+
+def get_regions(model):
+	"""
+	Regions configured for a model, [ BEDROCK_REGION ] when there is no pool
+	"""
+	regions = _pool.get((model or '').lower()) or _pool.get('default')
+	return regions or [ BEDROCK_REGION ]
+
+
+def get_health(model, region):
+	key = (model, region)
+	health = _health.get(key)
+	if health is None:
+		health = _health[key] = RegionHealth()
+	return health
+
+
+def choose(model, now=None, rand=None):
+	"""
+	Pick a region for the next call
+
+	Closed circuits and half-open circuits without a probe in flight are
+	candidates, weighted by score. When every circuit is open the one that
+	opened first is used, so a full outage degrades to the previous behaviour
+	instead of failing without a call.
+
+	Returns:
+		str: region name, None when neither a pool nor BEDROCK_REGION is configured
+	"""
+	regions = get_regions(model)
+	if len(regions) == 1:
+		return regions[0]
+	now = time.time() if now is None else now
+	rand = rand or random.random
+	with _lock:
+		candidates = [ (region, get_health(model, region)) for region in regions ]
+		available = [ (region, health) for region, health in candidates if health.available(now) ]
+		if not available:
+			region, health = min(candidates, key=lambda candidate: candidate[1].opened_at)
+			return region
+		# A half-open region gets exactly one probe
+		for region, health in available:
+			if health.state == STATE_HALF_OPEN:
+				health.probing = True
+				return region
+		total = sum(health.score() for _, health in available)
+		point = rand() * total
+		for region, health in available:
+			point -= health.score()
+			if point <= 0:
+				return region
+		return available[-1][0]
+
+
+def record_success(model, region, latency_ms):
+	if len(get_regions(model)) == 1:
+		return
+	with _lock:
+		health = get_health(model, region)
+		health.latency = latency_ms if health.latency is None else health.latency + REGION_EWMA_ALPHA * (latency_ms - health.latency)
+		health.error_rate *= 1 - REGION_EWMA_ALPHA
+		health.failures = 0
+		changed = health.state != STATE_CLOSED
+		health.state = STATE_CLOSED
+		health.probing = False
+	if changed:
+		log.info(f'Circuit of {model} in {region} is closed.')
+		emit_state(model, region, STATE_CLOSED)
+
+
+def record_failure(model, region, ex=None, now=None):
+	"""
+	Count a failed call against the region
+
+	Errors that would fail in every region (see NON_REGIONAL_ERRORS) are not
+	counted, but a half-open probe is still released so the next call can
+	probe the region again.
+	"""
+	if len(get_regions(model)) == 1:
+		return
+	if ex is not None and not is_regional_failure(ex):
+		with _lock:
+			get_health(model, region).probing = False
+		return
+	now = time.time() if now is None else now
+	with _lock:
+		health = get_health(model, region)
+		health.error_rate += REGION_EWMA_ALPHA * (1 - health.error_rate)
+		health.failures += 1
+		opened = health.state == STATE_HALF_OPEN or (health.state == STATE_CLOSED and health.failures >= REGION_FAILURE_THRESHOLD)
+		if opened:
+			health.state = STATE_OPEN
+			health.opened_at = now
+			health.probing = False
+	if opened:
+		log.info(f'Circuit of {model} in {region} is open after {health.failures} failures.')
+		emit_state(model, region, STATE_OPEN)
+
+
+def is_regional_failure(ex):
+	while ex is not None:
+		if any(code in str(ex) for code in NON_REGIONAL_ERRORS):
+			return False
+		ex = ex.__cause__
+	return True
+
+
+def emit_state(model, region, state):
+	metrics.emit('BedrockRegionCircuitOpen', 1 if state == STATE_OPEN else 0, dimensions=dict(Model=model, Region=region))
+
+
+def reset():
+	with _lock:
+		_health.clear()
@@ -1,18 +1,35 @@
 import datetime
+import functools
+import hashlib
 import html
 import json
 import logging
 import os
 import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import base
 import boto3
+import datastore
+import s3_codec
+from botocore.exceptions import ClientError
 from logger import init_logger
 import github_code
 
-dynamodb				= boto3.resource("dynamodb")
-sns						= boto3.resource('sns')
-s3						= boto3.resource("s3")
+sns						= boto3.client('sns')
+s3						= boto3.resource("s3")									# 资源对象不是线程安全的，并发调用使用s3.meta.client
+REPORT_FETCH_CONCURRENCY 	= base.str_to_int(os.getenv('REPORT_FETCH_CONCURRENCY', '16'))		# 并发读取任务结果的线程数
+FINDINGS_KEY_PREFIX 		= 'findings#'
+FINDINGS_SHARDS 			= base.str_to_int(os.getenv('FINDINGS_SHARDS', '4'))					# 每个Request的发现汇总分区数
+FINDINGS_ITEM_LIMIT 		= 350 * 1024															# 超过该大小的发现只记录S3位置（DynamoDB单条记录上限400KB）
+REPORT_TEMPLATE 			= 'report_template'														# 报告外壳页面与共用的CSS/JS：report_template.html/.css/.js
+REPORT_STATIC_PREFIX 		= 'report/static'														# 共用CSS/JS在S3中的目录，文件名带内容摘要
+PRESIGNED_URL_MAX_EXPIRES 	= 3600 * 24 * 7															# SigV4预签名URL的最长有效期（7天）
+REPORT_URL_EXPIRES 			= PRESIGNED_URL_MAX_EXPIRES
+PARTIAL_REPORT_URL_EXPIRES 	= 3600 * 24
+
+uploaded_static_keys 		= set()		# 本容器已确认存在的共用CSS/JS
 
 init_logger()
 log = logging.getLogger('crlog_{}'.format(__name__))
@@ -22,35 +39,234 @@ def get_json_directory(project_name, commit_id):
 	name = re.sub(r'^_+|_+$', '', name)
 	return 'report/{}/{}'.format(name, commit_id)
 	
-def generate_report_content(project_name, data):
+def summarize_usage(results):
+	"""
+	按规则汇总Token用量与费用，用于报告页脚
+
+	@return dict(total, rules)，rules按费用从高到低排序；结果中没有用量时返回None
+	"""
+	rules = dict()
+	for result in results:
+		usage = result.get('usage') if isinstance(result, dict) else None
+		if not usage:
+			continue
+		name = result.get('rule') or 'none'
+		summary = rules.setdefault(name, dict(rule=name, tasks=0, findings=0, input_tokens=0, output_tokens=0, cache_read_tokens=0, cost=0.0, estimated=False))
+		summary['tasks'] += 1
+		summary['estimated'] = summary['estimated'] or bool(usage.get('estimated'))
+		summary['findings'] += len(result.get('content') or [])
+		for field in ('input_tokens', 'output_tokens', 'cache_read_tokens'):
+			summary[field] += int(usage.get(field) or 0)
+		summary['cost'] += float(result.get('cost') or 0)
+	if not rules:
+		return None
+
+	total = dict(rule='Total', tasks=0, findings=0, input_tokens=0, output_tokens=0, cache_read_tokens=0, cost=0.0, estimated=False)
+	for summary in rules.values():
+		for field in total:
+			if field == 'estimated':
+				total[field] = total[field] or summary[field]
+			elif field != 'rule':
+				total[field] += summary[field]
+	for summary in [ total, *rules.values() ]:
+		summary['cost'] = round(summary['cost'], 6)
+		summary['cost_per_finding'] = round(summary['cost'] / summary['findings'], 6) if summary['findings'] else None
+	return dict(total=total, rules=sorted(rules.values(), key=lambda summary: summary['cost'], reverse=True))
+
+def to_report_entry(result, number=None):
+	"""
+	报告需要的结果字段：规则、发现、用量与费用，不包含提示词与模型回复
+	"""
+	entry = dict(rule=result.get('rule'), content=result.get('content'), usage=result.get('usage'), cost=result.get('cost'))
+	if number is not None:
+		entry['number'] = int(number)
+	return entry
+
+def get_findings_key(request_id, number):
+	"""
+	发现汇总记录与Request记录在同一张表中：commit_id为findings#request_id#分区号，request_id为补零的任务编号
+
+	按任务编号分散到FINDINGS_SHARDS个分区，避免大Request的并发写入集中在一个分区。
+	"""
+	number = int(number)
+	return dict(commit_id=f'{FINDINGS_KEY_PREFIX}{request_id}#{number % max(1, FINDINGS_SHARDS)}', request_id=f'{number:08d}')
+
+def append_findings(request_id, number, result, s3_key=None):
+	"""
+	任务完成时把报告需要的字段追加到Request的发现汇总，最终报告与进行中的报告直接读取汇总
+
+	同一任务重复写入时覆盖为同样的内容。发现过大时只记录S3位置，生成报告时再读取。
+	写入失败只记录日志，生成报告时发现汇总不完整会退回到逐个读取S3结果。
+	"""
+	try:
+		item = get_findings_key(request_id, number)
+		entry = base.dump_json(to_report_entry(result, number))
+		if len(entry.encode('utf-8')) > FINDINGS_ITEM_LIMIT and s3_key:
+			item['data'] = s3_key
+		else:
+			item['entry'] = entry
+		item['create_time'] = str(datetime.datetime.now())
+		datastore.put_item(os.getenv('REQUEST_TABLE'), item)
+		return True
+	except Exception as ex:
+		log.error(f'Fail to append findings of task(request_id={request_id}, number={number}).', extra=dict(exception=str(ex)))
+		return False
+
+def load_findings(bucket_name, request_id):
+	"""
+	并发读取各分区的发现汇总，按任务编号排序
+
+	@return 报告条目列表，每条带有number
+	"""
+	def query_shard(shard):
+		return datastore.query_items(
+			os.getenv('REQUEST_TABLE'),
+			KeyConditionExpression='commit_id=:pk',
+			ExpressionAttributeValues={ ':pk': f'{FINDINGS_KEY_PREFIX}{request_id}#{shard}' },
+			ConsistentRead=True,
+		)
+	shards = max(1, FINDINGS_SHARDS)
+	with ThreadPoolExecutor(max_workers=shards) as pool:
+		items = [ item for shard_items in pool.map(query_shard, range(shards)) for item in shard_items ]
+	items.sort(key=lambda item: item.get('request_id'))
+
+	entries = []
+	for item in items:
+		number = int(item.get('request_id'))
+		if item.get('entry'):
+			entries.append(json.loads(item.get('entry')))
+			continue
+		result = load_task_result(bucket_name, dict(request_id=request_id, number=number, data=item.get('data')))
+		for data in result if type(result) is list else [ result ] if result else []:
+			entries.append(to_report_entry(data, number))
+	return entries
 
-	# 读取Report Template
+@functools.lru_cache(maxsize=None)
+def load_template(name):
+	"""
+	读取lambda目录下的报告模板文件，每个Lambda容器只读取一次
+	"""
 	path = os.path.dirname(os.path.abspath(__file__))
-	json_file = os.path.join(path, 'report_template.html')
-	with open(json_file, 'r') as f:
-		content = f.read()
+	with open(os.path.join(path, name), 'r', encoding='utf-8') as f:
+		return f.read()
+
+def get_finding_file(item):
+	"""
+	发现所在的文件，filepath中的行号（@line）不参与分页
+	"""
+	filepath = item.get('filepath') if isinstance(item, dict) else None
+	return re.sub(r'\s*@line.*$', '', str(filepath)) if filepath else ''
+
+def paginate_findings(data):
+	"""
+	把报告数据按规则与文件分页，分页顺序为规则与文件首次出现的顺序
+
+	@return [ dict(rule, file, data) ]，data与报告数据格式相同：[ dict(rule, content) ]
+	"""
+	pages = dict()
+	for entry in data:
+		for item in entry.get('content') or []:
+			rule, file = entry.get('rule'), get_finding_file(item)
+			page = pages.setdefault((rule, file), dict(rule=rule, file=file, data=[ dict(rule=rule, content=[]) ]))
+			page['data'][0]['content'].append(item)
+	return list(pages.values())
+
+def get_presigned_url(bucket_name, key, expires=REPORT_URL_EXPIRES):
+	"""
+	生成预签名URL，有效期不超过PRESIGNED_URL_MAX_EXPIRES，超过时S3会拒绝该URL
+	"""
+	return s3.meta.client.generate_presigned_url('get_object', Params={'Bucket': bucket_name, 'Key': key}, ExpiresIn=min(expires, PRESIGNED_URL_MAX_EXPIRES))
+
+def get_page_key(report_key, index):
+	"""
+	报告分页数据的S3 key：与外壳页面同目录的{name}.data/序号.json，report_receiver按同样的规则读取
+	"""
+	return f'{os.path.splitext(report_key)[0]}.data/{index}.json'
+
+def upload_static_assets(bucket_name):
+	"""
+	把报告共用的CSS/JS上传到REPORT_STATIC_PREFIX，文件名带内容摘要，同样的内容所有报告只上传一次
+
+	@return dict(style=S3 key, script=S3 key)
+	"""
+	keys = dict()
+	for field, ext, content_type in [ ('style', 'css', 'text/css'), ('script', 'js', 'application/javascript') ]:
+		text = load_template(f'{REPORT_TEMPLATE}.{ext}')
+		digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]
+		key = keys[field] = f'{REPORT_STATIC_PREFIX}/{REPORT_TEMPLATE}.{digest}.{ext}'
+		if key in uploaded_static_keys:
+			continue
+		try:
+			s3.meta.client.head_object(Bucket=bucket_name, Key=key)
+		except ClientError as ex:
+			if ex.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+				raise
+			s3_codec.put_object(s3, bucket_name, key, text, content_type, s3_codec.ENCODING_GZIP, CacheControl='public, max-age=31536000, immutable')
+			log.info(f'Static asset is uploaded to s3://{bucket_name}/{key}')
+		uploaded_static_keys.add(key)
+	return keys
+
+def generate_report_content(project_name, pages, usage=None, progress=None, assets=None):
+	"""
+	生成报告外壳页面，页面只包含标题、分页清单与用量，分页数据由页面按需请求
+
+	@params pages 分页清单 [ dict(rule, file, findings, url) ]，也可以用data代替url内联分页数据
+	@params assets 共用CSS/JS的URL dict(style, script)，为空时引用与模板同目录的文件
+	"""
+	content = load_template(f'{REPORT_TEMPLATE}.html')
 
 	# 准备变量
 	datetime_str = datetime.datetime.now().strftime("%Y年%m月%d日 %H时%M分%S秒")
 	title = f'{project_name}代码审核报告'
 	subtitle = f'检测时间: {datetime_str}'
+	if progress:
+		subtitle = f'{subtitle}（评审进行中: {progress}）'
 
-	# 替换数据
-	filtered_data = [item for item in data if item.get('content') and len(item['content']) > 0]
-	all_data_text = repr(base.dump_json(filtered_data, indent=4))[1:-1]
+	# 替换数据，JSON中的</转义，避免提前结束script标签
+	pages_text = base.dump_json(pages or []).replace('</', '<\\/')
+	usage_text = base.dump_json(usage).replace('</', '<\\/')
 	replacement = f"""<script id="diy">
 	const expand_all = false;
 	const title = '{title}';
 	const subtitle = '{subtitle}';
-	const data = {all_data_text};
-	</script>
-	"""
-	# print('Replacement:', dict(placement=replacement))
-	content = re.sub(r'<script id="diy">.*?</script>', replacement, content, flags=re.DOTALL)
-	# print('New Content:', dict(content=content))
+	const pages = {pages_text};
+	const usage = {usage_text};
+	</script>"""
+	content = re.sub(r'<script id="diy">.*?</script>', lambda match: replacement, content, flags=re.DOTALL)
+	if assets:
+		content = content.replace(f'href="{REPORT_TEMPLATE}.css"', f'href="{html.escape(assets.get("style"))}"')
+		content = content.replace(f'src="{REPORT_TEMPLATE}.js"', f'src="{html.escape(assets.get("script"))}"')
 
 	return title, subtitle, content
 
+def write_report(project_name, commit_id, name, data, usage=None, progress=None, expires=REPORT_URL_EXPIRES):
+	"""
+	写入报告：共用CSS/JS、按规则与文件分页的gzip数据（{name}.data/序号.json）与外壳页面（{name}.html）
+
+	分页数据由最多REPORT_FETCH_CONCURRENCY个线程并发写入。
+	@return title, subtitle, 外壳页面的S3 key, 预签名URL, 分页数
+	"""
+	bucket_name = os.getenv('BUCKET_NAME')
+	key = f'{get_json_directory(project_name or "none", commit_id)}/{name}.html'
+	pages = paginate_findings(data)
+
+	def put_page(index):
+		page_key = get_page_key(key, index)
+		s3_codec.put_object(s3, bucket_name, page_key, base.dump_json(pages[index]['data']), 'application/json', s3_codec.ENCODING_GZIP)
+		return page_key
+	with ThreadPoolExecutor(max_workers=max(1, REPORT_FETCH_CONCURRENCY)) as pool:
+		page_keys = list(pool.map(put_page, range(len(pages))))
+	manifest = [
+		dict(rule=page['rule'], file=page['file'], findings=len(page['data'][0]['content']), url=get_presigned_url(bucket_name, page_key, expires))
+		for page, page_key in zip(pages, page_keys)
+	]
+	assets = { field: get_presigned_url(bucket_name, asset_key, expires) for field, asset_key in upload_static_assets(bucket_name).items() }
+
+	title, subtitle, content = generate_report_content(project_name, manifest, usage, progress, assets)
+	s3_codec.put_object(s3, bucket_name, key, content, 'text/html; charset=utf-8', s3_codec.ENCODING_GZIP)
+	log.info(f'Report is created to s3://{bucket_name}/{key} with {len(pages)} pages.')
+	return title, subtitle, key, get_presigned_url(bucket_name, key, expires), len(pages)
+
 def generate_report_and_notify(record, event, context):
 
 	commit_id = event.get('commit_id')
@@ -69,16 +285,15 @@ def generate_report_and_notify(record, event, context):
 	# 更新数据库Task状态
 	try:
 		request_table = os.getenv('REQUEST_TABLE')
-		dynamodb.Table(request_table).update_item(
-			Key = {'commit_id': commit_id, 'request_id': request_id},
-			UpdateExpression = 'set task_status = :s, report_s3key = :rs, report_url = :ru, update_time = :t',
-			ExpressionAttributeValues = { 
+		datastore.update_item(
+			request_table, {'commit_id': commit_id, 'request_id': request_id},
+			'set task_status = :s, report_s3key = :rs, report_url = :ru, update_time = :t',
+			values = { 
 				':s': base.STATUS_COMPLETE, 
 				':rs': result.get('s3key'),
 				':ru': result.get('url'),
 				':t': str(datetime.datetime.now()) 
 			},
-			ReturnValues = 'ALL_NEW'
 		)
 	except Exception as ex:
 		log.error('Fail to update request record report.', extra=dict(exception=str(ex)))
@@ -87,8 +302,12 @@ def generate_report_and_notify(record, event, context):
 	# 发送SNS消息
 	try:
 		sns_topic_arn = os.getenv('SNS_TOPIC_ARN')
-		message = dict(title=result.get('title'), subtitle=result.get('subtitle'), report_url=result.get('url'), data=result.get('data'), context=context)
-		response = sns.Topic(sns_topic_arn).publish(Message=base.dump_json(message), Subject=result.get('title', 'none'))
+		# 消息只包含报告位置与汇总计数，SNS消息上限256KB；report_receiver按需从S3读取分页数据
+		message = dict(
+			title=result.get('title'), subtitle=result.get('subtitle'), report_url=result.get('url'),
+			report_key=result.get('s3key'), pages=result.get('pages'), summary=result.get('summary'), context=context,
+		)
+		response = sns.publish(TopicArn=sns_topic_arn, Message=base.dump_json(message), Subject=result.get('title', 'none'))
 		log.info('SNS message is sent: {}'.format(response['MessageId']))
 	except Exception as ex:
 		log.error('Fail to send SNS message.', extra=dict(exception=str(ex)))
@@ -100,6 +319,46 @@ def generate_report_and_notify(record, event, context):
 	except Exception as ex:
 		log.error('Fail to post review to GitHub PR.', extra=dict(exception=str(ex)))
 	
+def load_task_result(bucket_name, item):
+	"""
+	读取一个成功任务的S3结果，读取或解析失败时返回None
+
+	使用线程安全的S3 client，可以在线程池中并发调用。
+	"""
+	request_id, number, s3_key = map(item.get, ('request_id', 'number', 'data'))
+	try:
+		return json.loads(s3_codec.get_object(s3, bucket_name, s3_key))
+	except Exception as ex:
+		log.error(f'Fail to get result for task(request_id={request_id}, number={number}).', extra=dict(exception=str(ex)))
+		return None
+
+def iter_task_results(bucket_name, request_id):
+	"""
+	按任务编号顺序逐个产出成功任务的S3结果
+
+	Task表通过query_all分页读取全部任务；S3结果由最多REPORT_FETCH_CONCURRENCY个线程并发读取，
+	最多预读2倍并发数的结果，内存占用与任务数无关。
+	"""
+	items = datastore.query_all(
+		os.getenv('TASK_TABLE'),
+		fields=[ 'request_id', 'number', 'succ', 'data' ],
+		KeyConditionExpression='request_id=:rid',
+		ExpressionAttributeValues={ ':rid': request_id },
+		ConsistentRead=True
+	)
+	window = max(1, REPORT_FETCH_CONCURRENCY) * 2
+	with ThreadPoolExecutor(max_workers=max(1, REPORT_FETCH_CONCURRENCY)) as pool:
+		pending = deque()
+		for item in items:
+			if item.get('succ') != True:
+				log.info('Found failed result for task(request_id={request_id}, number={number}).'.format(**item), extra=dict(item=base.dump_json(item)))
+				continue
+			pending.append(pool.submit(load_task_result, bucket_name, item))
+			if len(pending) >= window:
+				yield pending.popleft().result()
+		while pending:
+			yield pending.popleft().result()
+
 def generate_report(record, event, context):
 
 	commit_id = event.get('commit_id')
@@ -109,54 +368,43 @@ def generate_report(record, event, context):
 	log.info(f'Generating report for {label}.')
 
 	project_name = context.get('project_name')
-	directory = get_json_directory(project_name, commit_id)
 	
-	# 写入data.js文件
+	# 发现汇总覆盖全部完成的任务时直接使用，否则（例如汇总写入失败或旧的Request）并发读取全部成功任务的结果
 	bucket_name = os.getenv('BUCKET_NAME')
-	TASK_TABLE = os.getenv('TASK_TABLE')
-	items = dynamodb.Table(TASK_TABLE).query(
-		KeyConditionExpression='request_id=:rid',
-		ExpressionAttributeValues={ ':rid': request_id },
-		ConsistentRead=True
-	)
-	ret = [ item for item in items.get('Items') ]
-	all_data = []
-	for item in items.get('Items'):
-		try:
-			if item.get('succ') == True:
-				request_id, number, s3_key = map(item.get, ('request_id', 'number', 'data'))
-				s3_content = base.get_s3_object(s3, bucket_name, s3_key)
-				json_data = json.loads(s3_content)
-				log.info(f'Found successful result for task(request_id={request_id}, number={number}).', extra=dict(task={ key: str(item[key]) for key in item }, result=json_data))
-				log.info(f'Parsed JSON data: {json_data}')
-				if json_data:
-					if type(json_data) is list:
-						all_data = all_data + json_data
-					else:
-						all_data.append(json_data)
-			else:
-				log.info('Found failed result for task(request_id={request_id}, number={number}).'.format(**item), extra=dict(item=base.dump_json(item)))
-		except Exception as ex:
-			log.error('Fail to get result for task.', extra=dict(exception=str(ex)))
-	log.info('Got all data.', extra=dict(all_data=all_data))
+	all_data = load_findings(bucket_name, request_id)
+	counters = datastore.get_item(os.getenv('REQUEST_TABLE'), dict(commit_id=commit_id, request_id=request_id), fields=[ 'task_complete' ], consistent=True) or {}
+	if len(all_data) < int(counters.get('task_complete') or 0):
+		log.info(f'Findings of {label} are incomplete ({len(all_data)} < {counters.get("task_complete")}), read all results.')
+		all_data = []
+		for json_data in iter_task_results(bucket_name, request_id):
+			if not json_data:
+				continue
+			for result in json_data if type(json_data) is list else [ json_data ]:
+				all_data.append(to_report_entry(result))
+	log.info(f'Got {len(all_data)} results for {label}.')
 	
-	report_data = []
-	for data in all_data:
-		report_data.append(dict(rule=data.get('rule'), content=data.get('content')))
-	log.info('Simplify all data to report data.', extra=dict(report_data=report_data))
-
-	# 写入HTML文件
-	title, subtitle, content = generate_report_content(project_name, report_data)
-	bucket_name = os.getenv('BUCKET_NAME')
-	key = f'{directory}/index.html'
-	base.put_s3_object(s3, bucket_name, key, content, 'Content-Type: text/html')
-	log.info(f'Report is created to s3://{bucket_name}/{key}')
-	
-	# 为index.html产生Presign URL
-	presigned_url = s3.Object(bucket_name, key).meta.client.generate_presigned_url('get_object', Params={'Bucket': bucket_name, 'Key': key}, ExpiresIn=3600 * 24 * 30)
+	# 写入index.html与分页数据，页脚显示按规则汇总的用量与费用
+	usage = summarize_usage(all_data)
+	title, subtitle, key, presigned_url, pages = write_report(project_name, commit_id, 'index', all_data, usage)
 	log.info(f'Report URL: {presigned_url}')
 
-	return dict(title=title, subtitle=subtitle, url=presigned_url, s3key=key, data=all_data)
+	summary = dict(results=len(all_data), findings=sum(len(entry.get('content') or []) for entry in all_data))
+	return dict(title=title, subtitle=subtitle, url=presigned_url, s3key=key, pages=pages, summary=summary, data=all_data, usage=usage)
+
+def generate_partial_report(record):
+	"""
+	评审进行中时，用已完成任务的发现汇总生成报告，写入partial.html并把URL记录到Request的partial_report_url
+	"""
+	commit_id, request_id, project_name, total, completes = base.extract_dict(record, 'commit_id, request_id, project_name, task_total, task_complete')
+	entries = load_findings(os.getenv('BUCKET_NAME'), request_id)
+	_, _, _, url, _ = write_report(project_name, commit_id, 'partial', entries, summarize_usage(entries), f'{completes}/{total}', PARTIAL_REPORT_URL_EXPIRES)
+	datastore.update_item(
+		os.getenv('REQUEST_TABLE'), dict(commit_id=commit_id, request_id=request_id),
+		'set partial_report_url = :u, partial_report_time = :t',
+		values = { ':u': url, ':t': str(datetime.datetime.now()) },
+	)
+	log.info(f'Partial report of request(commit_id={commit_id}, request_id={request_id}) is created with {len(entries)} results.')
+	return url
 
 def post_review_to_github_pr(event, result):
 	commit_id = event.get('commit_id')
@@ -168,10 +416,11 @@ def post_review_to_github_pr(event, result):
 	if not request_table:
 		return
 
-	item = dynamodb.Table(request_table).get_item(
-		Key={'commit_id': commit_id, 'request_id': request_id},
-		ConsistentRead=True
-	).get('Item')
+	item = datastore.get_item(
+		request_table, {'commit_id': commit_id, 'request_id': request_id},
+		fields=[ 'source', 'pr_number', 'project_id', 'repo_url' ],
+		consistent=True
+	)
 
 	if not item or item.get('source') != 'github':
 		return
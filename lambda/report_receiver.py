@@ -1,10 +1,14 @@
-import os, re, json, logging
+import os, re, json, logging, functools
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import html
+import boto3
+import base, s3_codec
 from logger import init_logger
 
+s3 = boto3.resource('s3')
+
 init_logger()
 log = logging.getLogger('crlog_{}'.format(__name__))
 
@@ -28,26 +32,99 @@ insert report_template.html code here.
 已经import了os, re, json, logging,html你不用提供这部分的import
 """
 
-def generate_report(title, subtitle, data, template='report_template.html'):
-    # 读取模板文件
-    with open(template, 'r', encoding='utf-8') as file:
-        template = file.read()
+STYLE_PATTERN 				= re.compile(r'<style>(.*?)</style>', re.DOTALL)
+CODE_FENCE_PATTERN 			= re.compile(r'(```[\s\S]*?```)')
+CODE_BLOCK_PATTERN 			= re.compile(r'```(.*?)\n([\s\S]*?)\n```')
+REPORT_MAIL_MAX_FINDINGS 	= base.str_to_int(os.getenv('REPORT_MAIL_MAX_FINDINGS', '200'))		# 邮件中最多显示的问题数，其余通过报告链接查看
+REPORT_MAIL_MAX_BYTES 		= base.str_to_int(os.getenv('REPORT_MAIL_MAX_BYTES', '1048576'))		# 邮件正文的大小上限(字节)
+
+@functools.lru_cache(maxsize=None)
+def load_css(template='report_template.html'):
+    """
+    读取报告样式，每个Lambda容器只读取一次
+
+    模板按本文件所在目录解析；模板不内联样式时读取同名的CSS文件。
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), template)
+    with open(path, 'r', encoding='utf-8') as file:
+        css_match = STYLE_PATTERN.search(file.read())
+    if css_match:
+        return css_match.group(1)
+    css_path = os.path.splitext(path)[0] + '.css'
+    if not os.path.exists(css_path):
+        return ''
+    with open(css_path, 'r', encoding='utf-8') as file:
+        return file.read()
+
+def render_content(content):
+    """
+    逐段产出问题内容的HTML，代码块渲染为<pre>，其余文本转义后换行转为<br>
+    """
+    for part in CODE_FENCE_PATTERN.split(content):
+        block = CODE_BLOCK_PATTERN.match(part) if part.startswith('```') and part.endswith('```') else None
+        if block:
+            lang, code = block.groups()
+            yield f'<pre class="code-block"><code class="code-block-content {html.escape(lang)}">{html.escape(code)}</code></pre>'
+        else:
+            yield html.escape(part).replace('\n', '<br>')
+
+def render_item(rule, item):
+    """
+    逐段产出一个问题的HTML
+    """
+    title = html.escape(item.get('title') or 'Untitled Issue')
+    filepath = html.escape(item['filepath']) if item.get('filepath') else ''
+    yield f"""
+    <li class="issue-item">
+        <div class="issue-header">
+            <span class="issue-header-text">{title}{f" ({filepath})" if filepath else ''}</span>
+        </div>
+        <div class="issue-content">
+            <div class="metadata-container">"""
+    if item.get('title'):
+        yield f'<p><strong>Title:</strong> {title}</p>'
+    if rule.get('rule'):
+        yield f'<p><strong>Rule:</strong> {html.escape(rule["rule"])}</p>'
+    if filepath:
+        yield f'<p><strong>File:</strong> {filepath}</p>'
+    yield '</div><div class="content-container">'
+    if item.get('content'):
+        yield from render_content(str(item['content']))
+    yield '</div></div></li>'
+
+def iter_report_data(report_key, pages):
+    """
+    按顺序逐页读取报告的分页数据（与report.get_page_key相同的{name}.data/序号.json），只在需要时读取下一页
+    """
+    bucket_name = os.getenv('BUCKET_NAME')
+    prefix = os.path.splitext(report_key)[0]
+    for index in range(pages or 0):
+        yield from json.loads(s3_codec.get_object(s3, bucket_name, f'{prefix}.data/{index}.json'))
 
-    # 提取 CSS 样式
-    css_match = re.search(r'<style>(.*?)</style>', template, re.DOTALL)
-    css = css_match.group(1) if css_match else ''
+def iter_report(title, subtitle, data, template='report_template.html', report_url=None, max_findings=None, max_bytes=None, total=None):
+    """
+    逐段产出邮件报告的HTML，不使用JavaScript，所有section默认展开
 
-    # 创建 HTML 结构
-    html_content = f"""
+    问题按报告顺序输出，超过max_findings个或正文超过max_bytes时停止，只显示前面的问题，并提示通过报告链接查看全部。
+    data可以是逐页读取的生成器，停止后不再读取；total为问题总数，为空时数出剩余的问题。
+    """
+    max_findings = REPORT_MAIL_MAX_FINDINGS if max_findings is None else max_findings
+    max_bytes = REPORT_MAIL_MAX_BYTES if max_bytes is None else max_bytes
+    items = ( (rule, item) for rule in data or [] if isinstance(rule.get('content'), list) for item in rule['content'] )
+
+    link = ''
+    if report_url:
+        link = f'<div style="border: 1px dashed gray; padding: 5px;">报告原始地址：<a href="{html.escape(report_url)}" target="_blank">点击打开</a></div>'
+    yield f"""
     <!DOCTYPE html>
     <html lang="en">
     <head>
         <meta charset="UTF-8">
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
         <title>{html.escape(title)}</title>
-        <style>{css}</style>
+        <style>{load_css(template)}</style>
     </head>
-    <body>
+    <body>{link}
         <div class="container">
             <header>
                 <div class="header-content">
@@ -60,60 +137,50 @@ def generate_report(title, subtitle, data, template='report_template.html'):
             <ul id="report-container" class="issue-list">
     """
 
-    # 生成报告内容
-    if not data:
-        html_content += '<div class="no-issues">没有发现问题</div>'
-    else:
-        for rule in data:
-            if rule.get('content') and isinstance(rule['content'], list):
-                for item in rule['content']:
-                    html_content += f"""
-                    <li class="issue-item">
-                        <div class="issue-header">
-                            <span class="issue-header-text">{html.escape(item.get('title', 'Untitled Issue'))}
-                            {f" ({html.escape(item['filepath'])})" if item.get('filepath') else ''}</span>
-                        </div>
-                        <div class="issue-content">
-                            <div class="metadata-container">
-                    """
-                    
-                    if item.get('title'):
-                        html_content += f'<p><strong>Title:</strong> {html.escape(item["title"])}</p>'
-                    if rule.get('rule'):
-                        html_content += f'<p><strong>Rule:</strong> {html.escape(rule["rule"])}</p>'
-                    if item.get('filepath'):
-                        html_content += f'<p><strong>File:</strong> {html.escape(item["filepath"])}</p>'
-                    
-                    html_content += '</div><div class="content-container">'
-                    
-                    if item.get('content'):
-                        content_parts = re.split(r'(```[\s\S]*?```)', item['content'])
-                        for part in content_parts:
-                            if part.startswith('```') and part.endswith('```'):
-                                lang, code = re.match(r'```(.*?)\n([\s\S]*?)\n```', part).groups()
-                                html_content += f'<pre class="code-block"><code class="code-block-content {lang}">{html.escape(code)}</code></pre>'
-                            else:
-                                html_content += html.escape(part).replace('\n', '<br>')
-                    
-                    html_content += '</div></div></li>'
+    size, shown, truncated = 0, 0, False
+    for rule, item in items:
+        if max_findings and shown >= max_findings:
+            truncated = True
+            break
+        chunks = list(render_item(rule, item))
+        chunk_size = sum(len(chunk.encode('utf-8')) for chunk in chunks)
+        if max_bytes and shown and size + chunk_size > max_bytes:
+            truncated = True
+            break
+        size += chunk_size
+        shown += 1
+        yield from chunks
+    if not shown:
+        yield '<div class="no-issues">没有发现问题</div>'
+    if truncated:
+        total = total if total is not None else shown + 1 + sum(1 for _ in items)
+        yield f'<div class="no-issues">仅显示前{shown}个问题，共{total}个问题，完整内容请打开报告原始地址查看。</div>'
 
     # 关闭 HTML 结构
-    html_content += """
+    yield """
             </ul>
         </div>
     </body>
     </html>
     """
 
-    return html_content
+def generate_report(title, subtitle, data, template='report_template.html', report_url=None, max_findings=None, max_bytes=None, total=None):
+    """
+    生成邮件报告的完整HTML，各段写入列表后一次拼接
+    """
+    return ''.join(iter_report(title, subtitle, data, template, report_url, max_findings, max_bytes, total))
 
 def send_mail(message):
 
     message_data = json.loads(message)
     title = message_data.get('title') 
     subtitle = message_data.get('subtitle') 
-    data = message_data.get('data')
     report_url = message_data.get('report_url')
+    # SNS消息只包含报告位置与汇总计数，问题从S3的分页数据逐页读取；兼容带有data的旧消息
+    data = message_data.get('data')
+    if data is None:
+        data = iter_report_data(message_data.get('report_key'), message_data.get('pages'))
+    total = (message_data.get('summary') or {}).get('findings')
     
     smtp_server = os.getenv('SMTP_SERVER')
     smtp_port = os.getenv('SMTP_PORT')
@@ -122,13 +189,11 @@ def send_mail(message):
     report_sender = os.getenv('REPORT_SENDER')
     report_receiver = os.getenv('REPORT_RECEIVER')
 
-    filtered_data = [item for item in data if item.get('content') and len(item['content']) > 0]
-    html = generate_report(title, subtitle, filtered_data)
-    replacement = f'<body><div style="border: 1px dashed gray; padding: 5px;">报告原始地址：<a href="{report_url}" target="_blank">点击打开</a></div>'
-    html = re.sub(r'<body>', replacement, html)
+    filtered_data = (item for item in data if item.get('content') and len(item['content']) > 0)
+    content = generate_report(title, subtitle, filtered_data, report_url=report_url, total=total)
       
     msg = MIMEMultipart('alternative')
-    msg.attach(MIMEText(html, 'html', 'utf-8'))
+    msg.attach(MIMEText(content, 'html', 'utf-8'))
     msg['Subject'] = title if title else 'No Title'
     msg['From'] = report_sender
     msg['To'] = report_receiver
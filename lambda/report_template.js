@@ -0,0 +1,203 @@
+function escapeHtml(unsafe) {
+  return unsafe
+    .replace(/&/g, "&amp;")
+    .replace(/</g, "&lt;")
+    .replace(/>/g, "&gt;")
+    .replace(/"/g, "&quot;")
+    .replace(/'/g, "&#039;");
+}
+
+function renderCodeBlock(lang, code) {
+  return `<pre class="code-block"><code class="code-block-content ${lang}">${escapeHtml(code)}</code></pre>`;
+}
+
+function renderContent(content) {
+  const contentContainer = document.createElement('div');
+  contentContainer.classList.add('content-container');
+
+  const parts = content.split(/(```[\s\S]*?```)/);
+  parts.forEach(part => {
+    if (part.startsWith('```') && part.endsWith('```')) {
+      const [, lang, code] = part.match(/```(.*?)\n([\s\S]*?)\n```/);
+      contentContainer.innerHTML += renderCodeBlock(lang, code);
+    } else {
+      const span = document.createElement('span');
+      span.innerHTML = escapeHtml(part).replace(/\n/g, '<br>');
+      contentContainer.appendChild(span);
+    }
+  });
+
+  return contentContainer;
+}
+
+const renderItem = (rule, item, isExpanded) => {
+  const issueItem = document.createElement('li');
+  issueItem.classList.add('issue-item');
+
+  const issueHeader = document.createElement('div');
+  issueHeader.classList.add('issue-header');
+
+  const issueHeaderText = document.createElement('span');
+  issueHeaderText.classList.add('issue-header-text');
+  issueHeaderText.textContent = item.title || 'Untitled Issue';
+  if (item.filepath) {
+    issueHeaderText.textContent += ` (${item.filepath})`;
+  }
+  issueHeader.appendChild(issueHeaderText);
+
+  const issueToggleIcon = document.createElement('span');
+  issueToggleIcon.classList.add('issue-toggle-icon');
+  issueToggleIcon.textContent = isExpanded ? '-' : '+';
+  issueHeader.appendChild(issueToggleIcon);
+
+  issueItem.appendChild(issueHeader);
+
+  const issueContent = document.createElement('div');
+  issueContent.classList.add('issue-content');
+  if (!isExpanded) {
+    issueContent.classList.add('collapsed');
+  }
+
+  const metadataContainer = document.createElement('div');
+  metadataContainer.classList.add('metadata-container');
+
+  if (item.title) {
+    const titleLine = document.createElement('p');
+    titleLine.innerHTML = `<strong>Title:</strong> ${escapeHtml(item.title)}`;
+    metadataContainer.appendChild(titleLine);
+  }
+
+  if (rule.rule) {
+    const ruleLine = document.createElement('p');
+    ruleLine.innerHTML = `<strong>Rule:</strong> ${escapeHtml(rule.rule)}`;
+    metadataContainer.appendChild(ruleLine);
+  }
+
+  if (item.filepath) {
+    const filepathLine = document.createElement('p');
+    filepathLine.innerHTML = `<strong>File:</strong> ${escapeHtml(item.filepath)}`;
+    metadataContainer.appendChild(filepathLine);
+  }
+
+  issueContent.appendChild(metadataContainer);
+
+  if (item.content) {
+    issueContent.appendChild(renderContent(item.content));
+  }
+
+  issueItem.appendChild(issueContent);
+
+  issueHeader.addEventListener('click', () => {
+    issueContent.classList.toggle('collapsed');
+    issueToggleIcon.textContent = issueContent.classList.contains('collapsed') ? '+' : '-';
+  });
+
+  return issueItem;
+};
+
+// 分页数据：内联的data直接使用，否则请求url（gzip压缩，浏览器自动解压）
+const loadPage = (page) => {
+  if (page.data) {
+    return Promise.resolve(page.data);
+  }
+  return fetch(page.url).then((response) => {
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}`);
+    }
+    return response.json();
+  });
+};
+
+const renderPage = (page, list, isExpanded) => {
+  loadPage(page).then((rules) => {
+    list.innerHTML = '';
+    rules.forEach((rule) => {
+      (rule.content || []).forEach((item) => list.appendChild(renderItem(rule, item, isExpanded)));
+    });
+  }).catch((error) => {
+    list.innerHTML = `<li class="page-error">加载失败: ${escapeHtml(error.message)}</li>`;
+  });
+};
+
+// 每个分页对应一个规则下的一个文件，分组进入可视区域时才请求数据
+const renderReport = (pages, isExpanded) => {
+  const reportContainer = document.getElementById('report-container');
+  reportContainer.innerHTML = ''; // 清空现有内容
+
+  if (pages.length === 0) {
+    // 没有分页时，显示"没有发现问题"的消息
+    const noIssuesMessage = document.createElement('div');
+    noIssuesMessage.classList.add('no-issues');
+    noIssuesMessage.textContent = '没有发现问题';
+    reportContainer.appendChild(noIssuesMessage);
+    return;
+  }
+
+  const observer = 'IntersectionObserver' in window ? new IntersectionObserver((entries) => {
+    entries.filter((entry) => entry.isIntersecting).forEach((entry) => {
+      observer.unobserve(entry.target);
+      entry.target.load();
+    });
+  }, { rootMargin: '400px' }) : null;
+
+  pages.forEach((page) => {
+    const group = document.createElement('li');
+    group.classList.add('page-group');
+
+    const header = document.createElement('div');
+    header.classList.add('page-header');
+    header.textContent = `${page.rule || 'none'} · ${page.file || '-'} (${page.findings})`;
+    group.appendChild(header);
+
+    const list = document.createElement('ul');
+    list.classList.add('issue-list');
+    list.innerHTML = '<li class="page-loading">加载中...</li>';
+    group.appendChild(list);
+
+    group.load = () => renderPage(page, list, isExpanded);
+    reportContainer.appendChild(group);
+    if (observer) {
+      observer.observe(group);
+    } else {
+      group.load();
+    }
+  });
+};
+
+const renderUsage = (usage) => {
+  const footer = document.getElementById('usage-footer');
+  if (!usage || !usage.rules) {
+    return;
+  }
+  const number = (value) => (value || 0).toLocaleString();
+  const dollar = (value) => value === null || value === undefined ? '-' : `$${value.toFixed(4)}`;
+  const rows = [...usage.rules, usage.total].map((item) => `
+    <tr>
+      <td>${escapeHtml(item.rule)}</td>
+      <td>${number(item.tasks)}</td>
+      <td>${number(item.findings)}</td>
+      <td>${number(item.input_tokens)}</td>
+      <td>${number(item.output_tokens)}</td>
+      <td>${number(item.cache_read_tokens)}</td>
+      <td>${item.estimated ? '≈' : ''}${dollar(item.cost)}</td>
+      <td>${dollar(item.cost_per_finding)}</td>
+    </tr>`).join('');
+  footer.innerHTML = `
+    <table>
+      <tr><th>Rule</th><th>Tasks</th><th>Findings</th><th>Input Tokens</th><th>Output Tokens</th><th>Cache Read</th><th>Cost (USD)</th><th>Cost / Finding</th></tr>
+      ${rows}
+    </table>`;
+};
+
+document.addEventListener('DOMContentLoaded', () => {
+  const pageTitle = document.getElementById('page-title');
+  const mainTitle = document.getElementById('main-title');
+  const detectionDate = document.getElementById('detection-date');
+
+  pageTitle.textContent = title;
+  mainTitle.textContent = title;
+  detectionDate.textContent = subtitle;
+
+  renderReport(pages, true);
+  renderUsage(usage);
+});
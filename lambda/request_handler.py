@@ -1,13 +1,14 @@
 import traceback
 import json, os, re, datetime, logging
 import boto3, base
-import codelib
+import codelib, datastore, review_rules, rule_index, supersession
 from logger import init_logger
 
 REQUEST_TABLE 				= os.getenv('REQUEST_TABLE')
 TASK_DISPATCHER_FUN_NAME 	= os.getenv('TASK_DISPATCHER_FUN_NAME')
+RULE_PRECHECK 				= os.getenv('RULE_PRECHECK', 'true').lower() == 'true'
+RULES_PAYLOAD_LIMIT 		= base.str_to_int(os.getenv('RULES_PAYLOAD_LIMIT', '131072'))	# 随调用传递给Task Dispatcher的规则集大小上限（字节）
 	
-dynamodb = boto3.resource('dynamodb')
 lambda_client = boto3.client('lambda')
 sqs_client = boto3.client('sqs')
 
@@ -44,6 +45,39 @@ def get_invoker(event):
 		log.info('Fail to parse invoker in body.', extra=dict(exception=str(ex)))
 		return None
 
+def has_applicable_rules(params, repo_context):
+	"""
+	预检查是否存在适用于本次事件和分支的规则，用于在调用Task Dispatcher前提前结束请求
+	检查过程出错时返回True，交由Task Dispatcher按原流程处理
+
+	已加载的规则集随调用参数传递给Task Dispatcher（见attach_rules），避免重复从代码仓库获取
+	"""
+	if not RULE_PRECHECK or params.get('invoker') == 'webtool':
+		return True
+	try:
+		event_type, target_branch = params.get('event_type'), params.get('target_branch')
+		rules = review_rules.load_rules(params, repo_context, commit_id=params.get('commit_id'), branch=target_branch)
+		rules_hash = attach_rules(params, rules)
+		return rule_index.has_applicable_rules(rules, event_type, target_branch, rules_hash)
+	except Exception as ex:
+		log.warning('Fail to precheck rules, fall back to task dispatcher.', extra=dict(exception=str(ex)))
+		return True
+
+def attach_rules(params, rules):
+	"""
+	将预检查加载的规则集及其哈希写入调用参数，超过RULES_PAYLOAD_LIMIT时不传递，由Task Dispatcher重新加载
+
+	Returns:
+		str: 规则集哈希
+	"""
+	rules_hash = rule_index.compute_rules_hash(rules)
+	if len(base.dump_json(rules)) <= RULES_PAYLOAD_LIMIT:
+		params['rules'] = rules
+		params['rules_hash'] = rules_hash
+	else:
+		log.info(f'Rules exceed {RULES_PAYLOAD_LIMIT} bytes and will be reloaded by task dispatcher.')
+	return rules_hash
+
 def process(event, context):
 
 	log.info(event, extra=dict(label='event'))
@@ -107,7 +141,20 @@ def process(event, context):
 			except Exception as ex:
 				log.warning('Fail to capture PR metadata.', extra=dict(exception=str(ex)))
 
-		dynamodb.Table(REQUEST_TABLE).put_item(Item=record)
+		# 记录该分支上最新的提交，之前提交的评审任务将被取消；没有适用规则的提交同样取代之前的提交
+		try:
+			supersession.record_head(params, record['create_time'])
+		except Exception as ex:
+			log.warning('Fail to record latest head.', extra=dict(exception=str(ex)))
+
+		# 没有任何规则适用于该事件和分支时，直接完成请求
+		if not has_applicable_rules(params, repo_context):
+			record['task_status'] = base.STATUS_COMPLETE
+			datastore.put_item(REQUEST_TABLE, record)
+			log.info(f'No rule applies to branch({params.get("target_branch")}) and event({params.get("event_type")}). Complete request({params["request_id"]}) directly.')
+			return base.response_success_post(dict(request_id=params['request_id'], commit_id=params['commit_id']))
+
+		datastore.put_item(REQUEST_TABLE, record)
 		log.info('Complete inserting record to ddb.')
 		
 		# 调用第二个Lambda函数，使用'Event'进行异步调用
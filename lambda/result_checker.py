@@ -1,10 +1,9 @@
-import os, boto3, base, json, logging
+import os, boto3, base, datastore, json, logging, s3_codec
 from logger import init_logger
 
 REQUEST_TABLE 				= os.getenv('REQUEST_TABLE')
 TASK_TABLE 					= os.getenv('TASK_TABLE')
 
-dynamodb = boto3.resource('dynamodb')
 s3 = boto3.resource("s3")
 
 init_logger()
@@ -25,24 +24,28 @@ def lambda_handler(event, context):
 	
 	try:
 		
-		item = dynamodb.Table(REQUEST_TABLE).get_item(Key=dict(commit_id=commit_id, request_id=request_id), ConsistentRead=True)
-		result = item.get('Item')
+		result = datastore.get_item(REQUEST_TABLE, dict(commit_id=commit_id, request_id=request_id), fields=[ 'task_total', 'task_complete', 'task_failure', 'task_cancel', 'task_status', 'report_url', 'partial_report_url' ], consistent=True)
 
-		ready, url = False, None
+		ready, url, partial_url = False, None, None
 		summary, tasks = None, []
 		if result:
 			summary = '{} tasks total: {} successful, {} failed。'.format(result.get('task_total'), result.get('task_complete'), result.get('task_failure'))
+			if result.get('task_cancel'):
+				summary = '{} tasks total: {} successful, {} failed, {} cancelled。'.format(result.get('task_total'), result.get('task_complete'), result.get('task_failure'), result.get('task_cancel'))
 			if result.get('task_status') == 'Complete':
 				ready = True
 				url = result.get('report_url')
+			else:
+				# 评审进行中时返回已完成任务的报告
+				partial_url = result.get('partial_report_url')
 		log.info(f'Load ready: {ready}, report URL: {url}')
 
 		# 获取所有Task
-		items = dynamodb.Table(TASK_TABLE).query(
+		tasks = datastore.query_items(
+			TASK_TABLE,
 			KeyConditionExpression='request_id=:rid',
 			ExpressionAttributeValues={ ':rid': request_id }
 		)
-		tasks = items.get('Items')
 		log.info(f'Found {len(tasks)} tasks for request_id={request_id}')
 
 		bucket_name = os.getenv('BUCKET_NAME')
@@ -51,7 +54,7 @@ def lambda_handler(event, context):
 			
 			if s3_key:
 				try:
-					s3_content = base.get_s3_object(s3, bucket_name, s3_key)
+					s3_content = s3_codec.get_object(s3, bucket_name, s3_key)
 					s3_data = json.loads(s3_content)
 					task['bedrock_system'] = s3_data.get('prompt_system', '')
 					task['bedrock_prompt'] = s3_data.get('prompt_user', '')
@@ -61,7 +64,7 @@ def lambda_handler(event, context):
 					log.info(f'Fail to parse data in s3({s3_key}) for task(request_id={request_id}, number={number})', extra=dict(exception=str(ex)))
 					task['prompt_system'] = task['prompt_user'] = task['payload'] = task['result'] = ''
 
-		ret = dict(succ=True, ready=ready, url=url, summary=summary, tasks=tasks)
+		ret = dict(succ=True, ready=ready, url=url, partial_url=partial_url, summary=summary, tasks=tasks)
 		
 		return { 'statusCode': 200, 'headers': headers, 'body': base.dump_json(ret) }
 
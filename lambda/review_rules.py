@@ -0,0 +1,140 @@
+"""
+评审规则的加载，由Request Handler（预检查）与Task Dispatcher共用
+
+- 基础规则：lambda/baseCodeReviewRule/*.yaml，每个Lambda容器只读取一次
+- 仓库规则：代码仓库中.codereview/*.yaml
+- Webtool：由调用参数中的提示词构造单条规则
+"""
+import copy, os, logging
+import codelib, yaml
+from glob import glob
+from logger import init_logger
+
+BASE_RULES_DIRNAME 		= 'baseCodeReviewRule'
+_base_rules_cache		= None
+
+init_logger()
+log = logging.getLogger('crlog_{}'.format(__name__))
+
+def load_base_rules():
+	"""
+	加载基础评审规则
+	
+	从本地目录加载规则文件，支持两个查找位置：
+	1. lambda/baseCodeReviewRule/*.yaml（Lambda函数目录）
+	2. baseCodeReviewRule/*.yaml（项目根目录）
+	
+	支持格式：
+	- YAML 多文档格式（--- 分隔）
+	- 单个规则对象
+	- 规则数组
+	
+	文件扩展名：
+	- 支持 .yaml 和 .yml
+	
+	返回:
+		list: 基础规则列表，已缓存，后续调用直接返回缓存结果
+	"""
+	global _base_rules_cache
+	if _base_rules_cache is not None:
+		return _base_rules_cache
+
+	rules = []
+
+	def _append_from_text(text, source):
+		"""从文本内容解析并追加规则"""
+		if not text:
+			return
+		try:
+			for doc in yaml.safe_load_all(text):
+				if not doc:
+					continue
+				if isinstance(doc, list):
+					rules.extend(doc)
+				elif isinstance(doc, dict):
+					rules.append(doc)
+				else:
+					log.warning('Unsupported base rule format ignored.', extra=dict(source=source, type=str(type(doc))))
+		except Exception as ex:
+			log.error('Fail to parse base rule.', extra=dict(source=source, exception=str(ex)))
+
+	# 从本地目录读取规则文件
+	current_dir = os.path.dirname(os.path.abspath(__file__))
+	candidates = [
+		os.path.join(current_dir, BASE_RULES_DIRNAME),  # lambda/baseCodeReviewRule
+		os.path.join(os.path.dirname(current_dir), BASE_RULES_DIRNAME),  # baseCodeReviewRule
+	]
+	
+	log.debug(f'Searching for base rules in directories: {candidates}')
+	log.debug(f'Current directory: {current_dir}')
+	
+	seen_paths = set()
+	for directory in candidates:
+		# 避免重复处理相同路径（虽然当前逻辑不会出现，但保留以增强健壮性）
+		normalized_path = os.path.normpath(directory)
+		if normalized_path in seen_paths:
+			continue
+		seen_paths.add(normalized_path)
+		
+		if not os.path.isdir(directory):
+			log.debug(f'Base rules directory not found: {directory}')
+			continue
+		
+		log.info(f'Found base rules directory: {directory}')
+		
+		# 支持 .yaml 和 .yml 两种扩展名
+		yaml_files = []
+		for pattern in ['*.yaml', '*.yml']:
+			yaml_files.extend(glob(os.path.join(directory, pattern)))
+		
+		for path in sorted(yaml_files):
+			try:
+				with open(path, 'r', encoding='utf-8') as f:
+					_append_from_text(f.read(), f'file:{path}')
+				log.info(f'Successfully loaded base rule file: {path}')
+			except Exception as ex:
+				log.error('Fail to load base rule file.', extra=dict(file=path, exception=str(ex)))
+
+	_base_rules_cache = rules
+	log.info(f'Loaded {len(rules)} base rules from local files.')
+	return _base_rules_cache
+
+def load_rules(event, repo_context, commit_id=None, branch=None):
+	"""
+	加载评审规则，支持两种不同的触发模式
+	
+	设计原则：
+	- Webtool模式：用户通过Web界面直接输入完整的系统提示词和用户提示词
+	- Webhook模式：从仓库内.codereview/*.yaml文件中加载结构化规则配置
+	
+	Args:
+		event: 触发事件，包含invoker字段区分触发模式
+		repo_context: 仓库上下文
+		commit_id: 提交ID
+		branch: 分支名
+	
+	Returns:
+		list: 规则列表
+	"""
+	# 基础规则在容器内缓存，使用副本，调用方修改规则不会影响缓存
+	base_rules = copy.deepcopy(load_base_rules())
+	if event.get('invoker') == 'webtool':
+		webtool_rule = {
+			"name": event.get("rule_name"),
+			"mode": event.get('mode'),
+			"number": 1,
+			"model": event.get('model'),
+			"event": event.get('event_type'),
+			"branch": event.get('target_branch'),
+			"target": event.get('target'),
+			"confirm": event.get('confirm', False),
+			"prompt_system": event.get('webtool_prompt_system'),
+			"prompt_user": event.get('webtool_prompt_user')
+		}
+		rules = base_rules + [webtool_rule]
+		log.info('Loaded rules for webtool invoker.', extra=dict(rule_count=len(rules)))
+	else:
+		repo_rules = codelib.get_rules(repo_context, commit_id, branch)
+		rules = base_rules + repo_rules
+		log.info('Loaded rules for webhook invoker.', extra=dict(base_rules=len(base_rules), repo_rules=len(repo_rules)))
+	return rules
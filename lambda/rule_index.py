@@ -0,0 +1,112 @@
+import copy, json, hashlib
+import base
+from functools import lru_cache
+
+GLOB_CHARS 				= ('*', '?', '|')
+INDEX_CACHE_SIZE 		= 32
+
+_index_cache 			= dict()
+_identity_cache 		= dict()		# id(rules) -> (rules, index)，持有规则列表引用，避免id被复用
+
+def compute_rules_hash(rules):
+	"""
+	计算规则集的哈希值，作为规则索引的缓存键
+
+	同一组规则（内容相同，与对象身份无关）总是得到相同的哈希值。
+	"""
+	text = json.dumps(rules, cls=base.CustomJsonEncoder, ensure_ascii=False, sort_keys=True)
+	return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def is_branch_glob(pattern):
+	return isinstance(pattern, str) and any(char in pattern for char in GLOB_CHARS)
+
+@lru_cache(maxsize=256)
+def compile_branch_pattern(pattern):
+	"""
+	将分支模式预编译为正则列表，多个模式以 | 分隔，任意一个匹配即可
+	"""
+	return tuple(base.compile_glob_pattern(item.strip()) for item in pattern.split('|') if item.strip())
+
+def match_compiled_branch(regexes, branch):
+	return branch is not None and any(regex.match(branch) for regex in regexes)
+
+def match_branch(pattern, branch):
+	"""
+	判断规则中的branch是否匹配目标分支
+
+	- 不含通配符时按字符串精确匹配（兼容原有行为）
+	- 含通配符时按glob匹配，例如 release/* 匹配 release/1.0，release/** 可跨越多级目录
+	- 支持以 | 分隔多个模式，例如 main|dev|feature/*
+	"""
+	if is_branch_glob(pattern):
+		return match_compiled_branch(compile_branch_pattern(pattern), branch)
+	return pattern == branch
+
+class RuleIndex:
+	"""
+	按事件类型编译的规则索引
+
+	结构：
+	- exact: { event: { branch: [(position, rule), ...] } }，精确分支名直接字典查找
+	- globs: { event: [(position, regexes, rule), ...] }，通配符分支使用预编译的正则
+
+	匹配结果按规则在原始规则集中的顺序返回，与线性扫描的结果一致。
+	"""
+
+	def __init__(self, rules):
+		self.rules = rules
+		self.exact = dict()
+		self.globs = dict()
+		for position, rule in enumerate(rules):
+			if not isinstance(rule, dict):
+				continue
+			event, pattern = rule.get('event'), rule.get('branch')
+			if pattern is not None and not isinstance(pattern, str):
+				continue
+			if is_branch_glob(pattern):
+				regexes = compile_branch_pattern(pattern)
+				self.globs.setdefault(event, []).append((position, regexes, rule))
+			else:
+				self.exact.setdefault(event, dict()).setdefault(pattern, []).append((position, rule))
+
+	def match(self, event_type, branch):
+		matched = list(self.exact.get(event_type, {}).get(branch, []))
+		for position, regexes, rule in self.globs.get(event_type, []):
+			if match_compiled_branch(regexes, branch):
+				matched.append((position, rule))
+		matched.sort(key=lambda pair: pair[0])
+		# 索引在容器内缓存，返回副本，调用方修改规则不会影响之后的匹配结果
+		return [ copy.deepcopy(rule) for _, rule in matched ]
+
+	def has_match(self, event_type, branch):
+		if self.exact.get(event_type, {}).get(branch):
+			return True
+		return any(match_compiled_branch(regexes, branch) for _, regexes, _ in self.globs.get(event_type, []))
+
+def get_rule_index(rules, rules_hash=None):
+	"""
+	获取规则集对应的索引，同一规则集（按哈希）在Lambda容器生命周期内只编译一次
+
+	同一个规则列表对象再次查询时按对象身份直接命中，不再序列化和计算哈希；
+	调用方已知规则集哈希时（例如随请求传递）可通过rules_hash传入。
+	"""
+	cached = _identity_cache.get(id(rules))
+	if cached is not None and cached[0] is rules:
+		return cached[1]
+	key = rules_hash or compute_rules_hash(rules)
+	index = _index_cache.get(key)
+	if index is None:
+		if len(_index_cache) >= INDEX_CACHE_SIZE:
+			_index_cache.pop(next(iter(_index_cache)))
+		index = RuleIndex(rules)
+		_index_cache[key] = index
+	if len(_identity_cache) >= INDEX_CACHE_SIZE:
+		_identity_cache.pop(next(iter(_identity_cache)))
+	_identity_cache[id(rules)] = (rules, index)
+	return index
+
+def find_rules(rules, event_type, branch, rules_hash=None):
+	return get_rule_index(rules, rules_hash).match(event_type, branch)
+
+def has_applicable_rules(rules, event_type, branch, rules_hash=None):
+	return get_rule_index(rules, rules_hash).has_match(event_type, branch)
@@ -0,0 +1,77 @@
+import os, gzip, logging
+import base
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+S3_COMPRESSION 			= os.getenv('S3_COMPRESSION', 'gzip').lower()						# 写入S3时的压缩方式：gzip、zstd或none
+S3_COMPRESS_MIN_BYTES 	= base.str_to_int(os.getenv('S3_COMPRESS_MIN_BYTES', '1024'))		# 小于该大小的对象不压缩
+
+ENCODING_GZIP 			= 'gzip'
+ENCODING_ZSTD 			= 'zstd'
+GZIP_MAGIC 				= b'\x1f\x8b'
+ZSTD_MAGIC 				= b'\x28\xb5\x2f\xfd'
+
+log = logging.getLogger('crlog_{}'.format(__name__))
+
+def get_encoding(encoding=None):
+	"""
+	实际使用的压缩方式，没有安装zstandard时zstd退回到gzip
+
+	@return gzip、zstd，不压缩时返回None
+	"""
+	encoding = (encoding or S3_COMPRESSION or '').lower()
+	if encoding == ENCODING_ZSTD and zstandard is None:
+		log.warning('Package zstandard is not installed, use gzip instead.')
+		return ENCODING_GZIP
+	return encoding if encoding in (ENCODING_GZIP, ENCODING_ZSTD) else None
+
+def encode(text, encoding=None):
+	"""
+	按压缩方式编码文本
+
+	@params encoding 为空时使用S3_COMPRESSION；面向浏览器的对象应指定gzip
+	@return (body, Content-Encoding)，不压缩时Content-Encoding为None
+	"""
+	body = text.encode('utf-8') if isinstance(text, str) else text
+	encoding = get_encoding(encoding)
+	if not encoding or len(body) < S3_COMPRESS_MIN_BYTES:
+		return body, None
+	if encoding == ENCODING_ZSTD:
+		return zstandard.ZstdCompressor().compress(body), ENCODING_ZSTD
+	return gzip.compress(body), ENCODING_GZIP
+
+def decode(body, content_encoding=None):
+	"""
+	解码S3对象，按Content-Encoding或内容的魔数判断压缩方式，未压缩的历史对象原样返回
+	"""
+	content_encoding = (content_encoding or '').lower()
+	if content_encoding == ENCODING_GZIP or body[:2] == GZIP_MAGIC:
+		body = gzip.decompress(body)
+	elif content_encoding == ENCODING_ZSTD or body[:4] == ZSTD_MAGIC:
+		if zstandard is None:
+			raise Exception('Package zstandard is required to read zstd objects.')
+		body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+	return body.decode('utf-8')
+
+def put_object(s3, bucket, key, text, content_type, encoding=None, **kwargs):
+	"""
+	压缩后写入S3，并设置对应的Content-Encoding
+
+	使用线程安全的S3 client，可以在线程池中并发调用。
+	@params kwargs 透传给put_object的参数，例如CacheControl
+	"""
+	body, content_encoding = encode(text, encoding)
+	params = dict(Bucket=bucket, Key=key, Body=body, ContentType=content_type, **kwargs)
+	if content_encoding:
+		params['ContentEncoding'] = content_encoding
+	s3.meta.client.put_object(**params)
+
+def get_object(s3, bucket, key):
+	"""
+	读取S3对象并解码为文本，兼容压缩与未压缩的对象
+	"""
+	response = s3.meta.client.get_object(Bucket=bucket, Key=key)
+	return decode(response['Body'].read(), response.get('ContentEncoding'))
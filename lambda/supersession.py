@@ -0,0 +1,93 @@
+import os, time, logging
+import base, datastore
+from botocore.exceptions import ClientError
+
+SUPERSEDE_ENABLED 		= os.getenv('SUPERSEDE_OUTDATED_COMMITS', 'true').lower() == 'true'
+HEAD_CACHE_SECONDS 		= base.str_to_int(os.getenv('HEAD_CACHE_SECONDS', '5'))
+SUPERSEDE_EVENTS 		= [ event.strip() for event in os.getenv('SUPERSEDE_EVENTS', 'merge').split(',') if event.strip() ]
+HEAD_KEY_PREFIX 		= 'head#'
+HEAD_SORT_KEY 			= 'latest'
+
+_head_cache 			= dict()
+
+log = logging.getLogger('crlog_{}'.format(__name__))
+
+def get_head_key(params):
+	"""
+	最新提交标记的主键，与Request记录存放在同一张表中
+
+	标记记录没有task_status字段，因此不会进入TaskStatusIndex，也不会被cron扫描到。
+	"""
+	project_id, event_type, ref = base.extract_dict(params, 'project_id, event_type, ref')
+	return dict(commit_id=f'{HEAD_KEY_PREFIX}{project_id}#{event_type}#{ref}', request_id=HEAD_SORT_KEY)
+
+def is_trackable(params):
+	"""
+	只跟踪Webhook触发的请求；Webtool是人工发起的评审，即使针对旧提交也不应被取消
+
+	只跟踪SUPERSEDE_EVENTS中的事件（默认merge）：MR/PR的最新提交覆盖了整个变更，
+	而每次push只评审本次推送的差异，新的push不能代替旧的push评审。
+	"""
+	if not SUPERSEDE_ENABLED or not params:
+		return False
+	if params.get('invoker') == 'webtool' or params.get('event_type') not in SUPERSEDE_EVENTS:
+		return False
+	return bool(params.get('project_id') and params.get('ref') and params.get('commit_id'))
+
+def record_head(params, create_time):
+	"""
+	记录(project, event, ref)上最新的提交
+
+	使用条件写入保证乱序到达的旧Webhook不会覆盖较新的记录。
+	"""
+	if not is_trackable(params):
+		return False
+	key = get_head_key(params)
+	item = dict(key, head_commit_id=params.get('commit_id'), head_request_id=params.get('request_id'), create_time=create_time)
+	try:
+		datastore.put_item(
+			os.getenv('REQUEST_TABLE'), item,
+			condition='attribute_not_exists(create_time) OR create_time <= :t',
+			values={ ':t': create_time },
+		)
+	except ClientError as ex:
+		if ex.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+			raise
+		log.info(f'A newer head is already recorded for {key["commit_id"]}.')
+		return False
+	_head_cache[key['commit_id']] = (time.time() + HEAD_CACHE_SECONDS, params.get('commit_id'))
+	return True
+
+def get_head_commit_id(params):
+	"""
+	读取最新提交，在HEAD_CACHE_SECONDS内复用，同一容器处理同一请求的多个任务时只读一次
+	"""
+	key = get_head_key(params)
+	cached = _head_cache.get(key['commit_id'])
+	if cached and cached[0] > time.time():
+		return cached[1]
+	item = datastore.get_item(os.getenv('REQUEST_TABLE'), key, fields=[ 'head_commit_id' ])
+	head_commit_id = item.get('head_commit_id') if item else None
+	_head_cache[key['commit_id']] = (time.time() + HEAD_CACHE_SECONDS, head_commit_id)
+	return head_commit_id
+
+def is_superseded(params, commit_id=None):
+	"""
+	判断请求对应的提交是否已被同一分支上更新的提交取代
+
+	Args:
+		params: 请求参数（Task Dispatcher的event，或Task Executor消息中的context）
+		commit_id: 格式化后的提交ID，为None时使用params中的commit_id
+
+	Returns:
+		bool: 已被取代时返回True；检查失败时返回False，按原流程继续评审
+	"""
+	if not is_trackable(params):
+		return False
+	try:
+		head_commit_id = get_head_commit_id(params)
+	except Exception as ex:
+		log.warning('Fail to check supersession marker.', extra=dict(exception=str(ex)))
+		return False
+	commit_id = commit_id or params.get('commit_id')
+	return bool(head_commit_id) and head_commit_id != commit_id
@@ -1,7 +1,11 @@
 import os, datetime
-import base, boto3, report
+import base, datastore, report
+from botocore.exceptions import ClientError
 
-dynamodb				= boto3.resource("dynamodb")
+PROGRESS_FIELDS 		= [ 'commit_id', 'request_id', 'mode', 'project_name', 'create_time', 'task_total', 'task_complete', 'task_failure', 'task_cancel', 'batch_jobs', 'task_status', 'report_claim_time' ]
+REPORT_CLAIM_TIMEOUT 	= base.str_to_int(os.getenv('REPORT_CLAIM_TIMEOUT', '900'))	# 认领报告后超过该时间仍未完成，允许重新认领(秒)
+PARTIAL_REPORT_EVERY 	= base.str_to_int(os.getenv('PARTIAL_REPORT_EVERY', '10'))		# 每完成多少个任务更新一次进行中的报告，0表示不生成
+PARTIAL_REPORT_MAX 		= base.str_to_int(os.getenv('PARTIAL_REPORT_MAX', '10'))		# 每个Request最多更新进行中的报告的次数
 
 def is_datetime_expired(datetime_text, duration):
 	now_datetime = datetime.datetime.now()
@@ -16,8 +20,8 @@ def check_request_progress_by_pksk(commit_id, request_id, log):
 	@params request_id request表的SK
 	"""
 	table_name = os.getenv('REQUEST_TABLE')
-	item = dynamodb.Table(table_name).get_item(Key=dict(commit_id=commit_id, request_id=request_id), ConsistentRead=True)
-	check_request_progress(item.get('Item'), log)
+	item = datastore.get_item(table_name, dict(commit_id=commit_id, request_id=request_id), fields=PROGRESS_FIELDS, consistent=True)
+	check_request_progress(item, log)
 
 
 def check_request_progress(record, log):
@@ -26,7 +30,8 @@ def check_request_progress(record, log):
 	@params record request表记录
 	"""
 
-	commit_id, request_id, mode, project_name, create_time, total, completes, failures = base.extract_dict(record, 'commit_id, request_id, mode, project_name, create_time, task_total, task_complete, task_failure')
+	commit_id, request_id, mode, project_name, create_time, total, completes, failures, cancels = base.extract_dict(record, 'commit_id, request_id, mode, project_name, create_time, task_total, task_complete, task_failure, task_cancel')
+	cancels = cancels or 0
 	label = f'request record(commit_id={commit_id}, request_id={request_id})'
 	log.info(f'Checking incomplete request record(commit_id={commit_id}, request_id={request_id})...')
 
@@ -34,14 +39,17 @@ def check_request_progress(record, log):
 	
 	# 检查整个Code Review是否完成
 	try:
-		if completes + failures >= total:
+		if completes + failures + cancels >= total:
 			is_completed = True
 			log.info(f'Mark code review complete. For all sub-task are complete for {label}.')
 		else:
-			log.info(f'Code review is uncomplete. Completes({completes}) + Failures({failures}) < Total({total}) for {label}.')
+			log.info(f'Code review is uncomplete. Completes({completes}) + Failures({failures}) + Cancels({cancels}) < Total({total}) for {label}.')
 		
-		# 检查整个Code Review是否超时
-		timeout = base.str_to_int(os.getenv('REPORT_TIMEOUT_SECONDS', '900'))
+		# 检查整个Code Review是否超时，包含批量推理作业的Request按批量推理的时限计算
+		if record.get('batch_jobs'):
+			timeout = base.str_to_int(os.getenv('BATCH_TIMEOUT_SECONDS', '90000'))
+		else:
+			timeout = base.str_to_int(os.getenv('REPORT_TIMEOUT_SECONDS', '900'))
 		if type(timeout) == int:
 			if is_datetime_expired(create_time, timeout):
 				is_completed = True
@@ -54,13 +62,117 @@ def check_request_progress(record, log):
 		
 	# Code Review完成，则产生报告
 	if is_completed:
-		try:
-			event = dict(commit_id = commit_id, request_id = request_id, mode = mode)
-			context = dict(project_name=project_name)
-			report.generate_report_and_notify(None, event, context)
-		except Exception as ex:
-			log.error('Fail to generate report and notify.', extra=dict(exception=str(ex)))
-			return
+		generate_report(record, log)
+
+def check_request_counters(record, log):
+	"""
+	根据计数器更新后的记录（失败计数的ReturnValues=ALL_NEW，或完成计数事务后的强一致读取）判断Request是否完成
+
+	超时由cron检查，这里只判断子任务是否全部结束。
+	@params record 计数器更新后的request表记录，为空时不处理
+	@return 是否由本次调用生成报告
+	"""
+	if not record:
+		return False
+	record = mark_processing(record, log)
+	total, completes, failures, cancels = base.extract_dict(record, 'task_total, task_complete, task_failure, task_cancel')
+	if total is None or (completes or 0) + (failures or 0) + (cancels or 0) < total:
+		if is_partial_report_due(record):
+			try:
+				report.generate_partial_report(record)
+			except Exception as ex:
+				log.error('Fail to generate partial report.', extra=dict(exception=str(ex)))
+		return False
+	log.info(f'Mark code review complete. For all sub-task are complete for request record(commit_id={record.get("commit_id")}, request_id={record.get("request_id")}).')
+	return generate_report(record, log)
+
+def is_partial_report_due(record):
+	"""
+	评审进行中时，完成数每到一个间隔更新一次进行中的报告
+
+	间隔取PARTIAL_REPORT_EVERY与task_total / PARTIAL_REPORT_MAX中较大的值，大Request的更新次数不超过PARTIAL_REPORT_MAX。
+	完成计数在事务中更新后强一致读取，并发完成时同一间隔偶尔会重复生成或跳过一次，不影响最终报告。
+	"""
+	total, completes = base.extract_dict(record, 'task_total, task_complete')
+	if not PARTIAL_REPORT_EVERY or not total or not completes:
+		return False
+	interval = max(PARTIAL_REPORT_EVERY, -(-int(total) // max(1, PARTIAL_REPORT_MAX or 1)))
+	return int(completes) % interval == 0
+
+def mark_processing(record, log):
+	"""
+	子任务有了结果后，把仍处于Start/Initializing的Request切换为Processing，cron才能扫描到
+
+	计数器更新不再设置task_status，以条件更新单独切换，不会把Reporting/Complete改回Processing。
+	@return 切换后的记录；无需切换或条件不满足时返回原记录
+	"""
+	if record.get('task_status') not in (base.STATUS_START, base.STATUS_INITIALIZING):
+		return record
+	commit_id, request_id = base.extract_dict(record, 'commit_id, request_id')
+	try:
+		return datastore.update_item(
+			os.getenv('REQUEST_TABLE'), dict(commit_id=commit_id, request_id=request_id),
+			'set task_status = :p',
+			values = { ':p': base.STATUS_PROCESSING, ':s': base.STATUS_START, ':i': base.STATUS_INITIALIZING },
+			condition = 'task_status IN (:s, :i)',
+			return_values = 'ALL_NEW',
+		)
+	except ClientError as ex:
+		if ex.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+			log.error('Fail to mark request as processing.', extra=dict(exception=str(ex)))
+		return record
+
+def claim_report(record, log):
+	"""
+	以条件更新把Request切换为Reporting，并发的执行器和cron中只有一个能认领成功
+
+	- 处理中（Start/Initializing/Processing）且未被认领过的Request可以认领
+	- 认领后超过REPORT_CLAIM_TIMEOUT仍处于Reporting（报告生成中断），允许重新认领
+	@return 是否认领成功
+	"""
+	commit_id, request_id = base.extract_dict(record, 'commit_id, request_id')
+	now = datetime.datetime.now()
+	try:
+		datastore.update_item(
+			os.getenv('REQUEST_TABLE'), dict(commit_id=commit_id, request_id=request_id),
+			'set task_status = :r, report_claim_time = :t',
+			values = {
+				':r': base.STATUS_REPORTING,
+				':p': base.STATUS_PROCESSING,
+				':s': base.STATUS_START,
+				':i': base.STATUS_INITIALIZING,
+				':t': str(now),
+				':e': str(now - datetime.timedelta(seconds=REPORT_CLAIM_TIMEOUT)),
+			},
+			condition = '(task_status IN (:p, :s, :i) AND attribute_not_exists(report_claim_time)) OR (task_status = :r AND report_claim_time < :e)',
+		)
+		return True
+	except ClientError as ex:
+		if ex.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+			raise
+		log.info(f'Report of request record(commit_id={commit_id}, request_id={request_id}) is already claimed.')
+		return False
+
+def generate_report(record, log):
+	"""
+	认领成功后生成报告并发送通知
+	@return 是否由本次调用生成报告
+	"""
+	commit_id, request_id, mode, project_name = base.extract_dict(record, 'commit_id, request_id, mode, project_name')
+	try:
+		if not claim_report(record, log):
+			return False
+	except Exception as ex:
+		log.error('Fail to claim report.', extra=dict(exception=str(ex)))
+		return False
+
+	try:
+		event = dict(commit_id = commit_id, request_id = request_id, mode = mode)
+		context = dict(project_name=project_name)
+		report.generate_report_and_notify(None, event, context)
+	except Exception as ex:
+		log.error('Fail to generate report and notify.', extra=dict(exception=str(ex)))
+	return True
 		
 
 
@@ -1,103 +1,22 @@
 import boto3
 import os, re, datetime, logging
-import base, codelib, report, yaml
-from glob import glob
+import base, batch_inference, codelib, context_guard, datastore, metrics, report, rule_index, supersession, task_base
+from review_rules import load_base_rules, load_rules
 from logger import init_logger
 
 # Initialize AWS services clients
-dynamodb 				= boto3.resource("dynamodb")
 sqs_client 				= boto3.client("sqs")
-BASE_RULES_DIRNAME 		= 'baseCodeReviewRule'
-_base_rules_cache		= None
+PROMPT_CACHE 			= os.getenv('PROMPT_CACHE', 'false').lower() == 'true'
+CODE_PLACEHOLDER 		= '{{code}}'
+DIY_FIELD_EXCLUDES 		= ['name', 'event', 'mode', 'model', 'branch', 'target', 'system', 'order', 'confirm', 'fusion', 'model_ladder', 'enable_reasoning', 'reasoning_budget', 'reasoning_complexity']
+FUSION_MAX_TOKENS 		= base.str_to_int(os.getenv('FUSION_MAX_TOKENS', '50000'))
+FUSION_OUTPUT_PROMPT 	= '请依次按照下面{count}条评审规则评审我的代码，每条规则的评审任务只适用于该规则。\n输出要求：只输出<output>和<thought>两个标签；<output>中是一个JSON数组，汇总所有规则的发现，每条发现的字段按照所属规则的要求输出，并增加"rule_name"字段，值为该发现所属规则的名称（与"## 规则:"后的名称完全一致）。'
 
 init_logger()
 log = logging.getLogger('crlog_{}'.format(__name__))
 
 def match_branch(pattern, branch):
-	return pattern == branch
-
-def load_base_rules():
-	"""
-	加载基础评审规则
-	
-	从本地目录加载规则文件，支持两个查找位置：
-	1. lambda/baseCodeReviewRule/*.yaml（Lambda函数目录）
-	2. baseCodeReviewRule/*.yaml（项目根目录）
-	
-	支持格式：
-	- YAML 多文档格式（--- 分隔）
-	- 单个规则对象
-	- 规则数组
-	
-	文件扩展名：
-	- 支持 .yaml 和 .yml
-	
-	返回:
-		list: 基础规则列表，已缓存，后续调用直接返回缓存结果
-	"""
-	global _base_rules_cache
-	if _base_rules_cache is not None:
-		return _base_rules_cache
-
-	rules = []
-
-	def _append_from_text(text, source):
-		"""从文本内容解析并追加规则"""
-		if not text:
-			return
-		try:
-			for doc in yaml.safe_load_all(text):
-				if not doc:
-					continue
-				if isinstance(doc, list):
-					rules.extend(doc)
-				elif isinstance(doc, dict):
-					rules.append(doc)
-				else:
-					log.warning('Unsupported base rule format ignored.', extra=dict(source=source, type=str(type(doc))))
-		except Exception as ex:
-			log.error('Fail to parse base rule.', extra=dict(source=source, exception=str(ex)))
-
-	# 从本地目录读取规则文件
-	current_dir = os.path.dirname(os.path.abspath(__file__))
-	candidates = [
-		os.path.join(current_dir, BASE_RULES_DIRNAME),  # lambda/baseCodeReviewRule
-		os.path.join(os.path.dirname(current_dir), BASE_RULES_DIRNAME),  # baseCodeReviewRule
-	]
-	
-	log.debug(f'Searching for base rules in directories: {candidates}')
-	log.debug(f'Current directory: {current_dir}')
-	
-	seen_paths = set()
-	for directory in candidates:
-		# 避免重复处理相同路径（虽然当前逻辑不会出现，但保留以增强健壮性）
-		normalized_path = os.path.normpath(directory)
-		if normalized_path in seen_paths:
-			continue
-		seen_paths.add(normalized_path)
-		
-		if not os.path.isdir(directory):
-			log.debug(f'Base rules directory not found: {directory}')
-			continue
-		
-		log.info(f'Found base rules directory: {directory}')
-		
-		# 支持 .yaml 和 .yml 两种扩展名
-		yaml_files = []
-		for pattern in ['*.yaml', '*.yml']:
-			yaml_files.extend(glob(os.path.join(directory, pattern)))
-		
-		for path in sorted(yaml_files):
-			try:
-				with open(path, 'r', encoding='utf-8') as f:
-					_append_from_text(f.read(), f'file:{path}')
-				log.info(f'Successfully loaded base rule file: {path}')
-			except Exception as ex:
-				log.error('Fail to load base rule file.', extra=dict(file=path, exception=str(ex)))
-
-	_base_rules_cache = rules
-	log.info(f'Loaded {len(rules)} base rules from local files.')
-	return _base_rules_cache
+	return rule_index.match_branch(pattern, branch)
 
 def send_message(data):
 	sqs_url = os.getenv('TASK_SQS_URL')
@@ -191,24 +110,7 @@ def get_prompt_data(mode, rule, code, variables=None):
 			# 策略2：Webhook模式 - 从多个DIY字段动态构建提示词
 			# prompt_user字段不存在，需要从.codereview/*.yaml的多个字段构建
 			prompt_system = rule.get('system', '')
-			
-			# 排除Built-in字段和特殊字段，只保留DIY字段用于构建prompt_user
-			field_excludes = ['name', 'event', 'mode', 'model', 'branch', 'target', 'system', 'order', 'confirm']
-			
-			# 获取order字段，用于指定DIY字段的排序顺序
-			order = rule.get('order', [])
-			
-			# 提取所有DIY字段（非排除字段）
-			all_fields = [key for key in rule.keys() if key.lower() not in field_excludes]
-			
-			# 按照order中的顺序排序DIY字段，未在order中的字段保持原顺序
-			sorted_fields = sorted(all_fields, key=lambda x: order.index(x) if x in order else len(order))
-			
-			# 将排序后的DIY字段组合成prompt_user
-			prompt_user = ''
-			for key in sorted_fields:
-				value = rule.get(key)
-				prompt_user = f'{prompt_user}\n\n{value}' if prompt_user else value
+			prompt_user = join_diy_fields(rule)
 			
 			# 在DIY字段前添加代码内容
 			prompt_user = f'以下是我的代码:\n{code}\n{prompt_user}'
@@ -220,47 +122,195 @@ def get_prompt_data(mode, rule, code, variables=None):
 	else:
 		# 非Claude模型不支持
 		return None, None
+
+def join_diy_fields(rule):
+	"""
+	将DIY字段按order排序后组合成一段文本
+
+	Built-in字段和特殊字段被排除；未在order中的字段保持原顺序，排在order中的字段之后。
+	"""
+	order = rule.get('order', [])
+	all_fields = [key for key in rule.keys() if key.lower() not in DIY_FIELD_EXCLUDES]
+	sorted_fields = sorted(all_fields, key=lambda x: order.index(x) if x in order else len(order))
+
+	text = ''
+	for key in sorted_fields:
+		value = rule.get(key)
+		text = f'{text}\n\n{value}' if text else value
+	return text
+
+def get_cacheable_prompt_data(mode, rule, code, variables=None):
+	"""
+	缓存友好的提示词布局：系统提示词与规则说明在前，代码在最后
+
+	同一条规则应用到多个文件时，prompt_user中代码之前的部分完全相同，
+	Executor在该位置设置缓存点，后续任务可以直接复用Bedrock缓存的前缀。
+
+	- Webhook模式：DIY字段在前，代码在后
+	- Webtool模式：以提示词中第一个{{code}}占位符为界，没有占位符时退回到get_prompt_data
+
+	Returns:
+		tuple: (prompt_system, prompt_user, prompt_cache_point)，
+		prompt_cache_point为prompt_user中可缓存前缀的长度，无法缓存时为None
+	"""
+	if rule.get('mode') != mode: return None, None, None
+
+	model = rule.get('model') or ''
+	if not model.startswith('claude'):
+		return None, None, None
+
+	if rule.get('prompt_user'):
+		prompt_system = rule.get('prompt_system')
+		pattern = rule.get('prompt_user')
+	else:
+		prompt_system = rule.get('system', '')
+		pattern = f'{join_diy_fields(rule)}\n\n以下是我的代码:\n{CODE_PLACEHOLDER}'
+
+	prefix, placeholder, suffix = pattern.partition(CODE_PLACEHOLDER)
+	if not placeholder:
+		prompt_system, prompt_user = get_prompt_data(mode, rule, code, variables)
+		return prompt_system, prompt_user, None
+
+	# 代码内容不参与变量替换，保证前缀与文件无关
+	head = format_prompt(prefix, variables)
+	prompt_user = head + (code or '') + format_prompt(suffix, variables, code=code)
+	prompt_system = format_prompt(prompt_system, variables, code=code)
+	return prompt_system, prompt_user, len(head) if head.strip() else None
 	
+def get_fusion_key(content, variables=None):
+	"""
+	可合并规则的分组键：同一文件、同一代码、同一模式、同一模型（及模型阶梯）、同一系统提示词
+
+	未开启fusion的规则、Webtool规则、开启推理的规则和非Claude模型返回None，始终单独执行。
+	"""
+	rule = content.get('rule') or {}
+	model = (rule.get('model') or '').lower()
+	if not rule.get('fusion') or rule.get('prompt_user') or rule.get('enable_reasoning') or not model.startswith('claude'):
+		return None
+	if rule.get('mode') != content.get('mode'):
+		return None
+	system = format_prompt(rule.get('system', '') or '', variables)
+	return (content.get('mode'), model, str(rule.get('model_ladder') or ''), system, content.get('filepath'), content.get('content'))
+
+def get_fusion_section(rule, variables=None):
+	return f'## 规则: {rule.get("name", "none")}\n{format_prompt(join_diy_fields(rule), variables)}'
+
+def group_fusion_contents(contents, variables=None):
+	"""
+	将contents分组，每组生成一个Bedrock Task
+
+	可合并的规则按出现顺序贪心装入同一组，代码与各规则说明的估算token数之和不超过FUSION_MAX_TOKENS；
+	其余content各自单独成组。
+
+	Returns:
+		list: 分组列表，每组是content列表
+	"""
+	groups, open_groups = [], dict()
+	for content in contents:
+		key = get_fusion_key(content, variables)
+		if key is None:
+			groups.append([ content ])
+			continue
+		tokens = base.estimate_tokens(get_fusion_section(content.get('rule'), variables))
+		current = open_groups.get(key)
+		if current and current['tokens'] + tokens <= FUSION_MAX_TOKENS:
+			current['group'].append(content)
+			current['tokens'] += tokens
+		else:
+			group = [ content ]
+			groups.append(group)
+			open_groups[key] = dict(group=group, tokens=base.estimate_tokens(content.get('content')) + tokens)
+	return groups
+
+def get_fusion_prompt_data(group, variables=None):
+	"""
+	生成合并多条规则的提示词，每条规则一个章节，并要求每条发现标注rule_name
+
+	PROMPT_CACHE开启时规则说明在前、代码在后，与get_cacheable_prompt_data的布局一致。
+
+	Returns:
+		tuple: (prompt_system, prompt_user, prompt_cache_point)
+	"""
+	first = group[0]
+	rule, code = first.get('rule'), first.get('content') or ''
+	prompt_system = format_prompt(rule.get('system', '') or '', variables)
+	sections = '\n\n'.join(get_fusion_section(content.get('rule'), variables) for content in group)
+	instructions = f'{FUSION_OUTPUT_PROMPT.format(count=len(group))}\n\n{sections}'
+	if PROMPT_CACHE:
+		head = f'{instructions}\n\n以下是我的代码:\n'
+		return prompt_system, head + code, len(head)
+	return prompt_system, f'以下是我的代码:\n{code}\n\n{instructions}', None
+
+def split_oversize_contents(event, contents, variables=None):
+	"""
+	超出模型上下文窗口的代码按行切分为有重叠的多段，每段作为单独的任务，不再交给Bedrock后反复重试
+
+	上限按规则可能使用的最大模型（model与model_ladder）计算，扣除代码以外的提示词与回复预留的token。
+	切分后的content带有chunk字段：段序号index、段数total与首行行号line。
+	"""
+	confirm_prompt = event.get('confirm_prompt') if event.get('confirm', False) else None
+	result = []
+	for content in contents:
+		rule = content.get('rule') or {}
+		code = content.get('content') or ''
+		limit = context_guard.get_input_limit(context_guard.get_models(rule.get('model'), rule.get('model_ladder')), bool(confirm_prompt))
+		prompt_system, prompt_user = get_prompt_data(content.get('mode'), rule, '', variables) or (None, None)
+		overhead = base.estimate_tokens(prompt_system) + base.estimate_tokens(prompt_user) + base.estimate_tokens(confirm_prompt)
+		if not prompt_user or base.estimate_tokens(code) + overhead <= limit:
+			result.append(content)
+			continue
+		chunks = context_guard.split_code(code, max(context_guard.MIN_CHUNK_TOKENS, limit - overhead))
+		log.info(f'Split {content.get("filepath")} into {len(chunks)} chunks for rule({rule.get("name")}).', extra=dict(limit=limit, overhead=overhead))
+		for index, (line, text) in enumerate(chunks):
+			result.append(dict(content, content=text, chunk=dict(index=index + 1, total=len(chunks), line=line)))
+	return result
+
 def send_task_to_sqs(event, rules, request_id, commit_id, contents, variables=None):
 
 	# 更新记录的任务总数
 	count = len(contents)
 	log.info('Final count: {}'.format(count))
 	log.info('Commit Id, Request Id: {}, {}'.format(commit_id, request_id))
+	table_name = os.getenv('REQUEST_TABLE')
+	request_key = dict(commit_id=commit_id, request_id=request_id)
 	try:
-		table_name = os.getenv('REQUEST_TABLE')
-		table = dynamodb.Table(table_name)
-		table.update_item(
-			Key = dict(commit_id=commit_id, request_id=request_id),
-			UpdateExpression = "set #s = :s, update_time = :t, task_complete = :tc, task_failure = :tf, task_total = :tt, report_s3key = :rs, report_url = :ru",
-			ExpressionAttributeNames = { '#s': 'task_status' },
-			ExpressionAttributeValues = {
-				':s': 'Initializing',
+		datastore.update_item(
+			table_name, request_key,
+			"set #s = :s, update_time = :t, task_complete = :tc, task_failure = :tf, task_cancel = :tca, task_total = :tt, report_s3key = :rs, report_url = :ru remove report_claim_time",
+			names = { '#s': 'task_status' },
+			values = {
+				':s': base.STATUS_INITIALIZING,
 				':t': str(datetime.datetime.now()),
 				':tc': 0,
 				':tf': 0,
+				':tca': 0,
 				':tt': count,
 				':rs': '',
 				':ru': '',
 			},
-			ReturnValues = "ALL_NEW",
 		)
-		item = dynamodb.Table(table_name).get_item(Key=dict(commit_id=commit_id, request_id=request_id), ConsistentRead=True).get('Item')
-		log.info('Test Item.', extra=dict(item={ k: str(item[k]) for k in item }))
 	except Exception as ex:
 		log.error(f'Fail to update status for request record(commit_id={commit_id}), request_id={request_id}).', extra=dict(exception=str(ex)))
 		return False
 		
-	# 每一个content与每一个rule组合成一个Bedrock Task
+	# 每一个content与每一个rule组合成一个Bedrock Task，开启fusion的兼容规则合并为一个Task
 	# 刚写完，准备deploy一次，然后看看效果吧。应该每次request，只管branch，不管mode，所有mode都会执行一次。
 	number = 0
-	for content in contents:
+	batch_items = []
+	for group in group_fusion_contents(contents, variables):
+		content = group[0]
 		mode = content.get('mode')
 		rule = content.get('rule')
 		result = True
 		try:
 			model = rule.get('model')
-			prompt_system, prompt_user = get_prompt_data(mode, rule, content.get('content'), variables)
+			prompt_cache_point = None
+			if len(group) > 1:
+				prompt_system, prompt_user, prompt_cache_point = get_fusion_prompt_data(group, variables)
+			elif PROMPT_CACHE:
+				prompt_system, prompt_user, prompt_cache_point = get_cacheable_prompt_data(mode, rule, content.get('content'), variables)
+			else:
+				prompt_system, prompt_user = get_prompt_data(mode, rule, content.get('content'), variables)
 			log.info(f'Make up new prompt.', extra=dict(prompt_system=prompt_system, prompt_user=prompt_user))
 			if not prompt_user: continue
 		
@@ -280,8 +330,31 @@ def send_task_to_sqs(event, rules, request_id, commit_id, contents, variables=No
 				prompt_system = prompt_system,
 				prompt_user = prompt_user,
 			)
+			if prompt_cache_point:
+				item['prompt_cache_point'] = prompt_cache_point
+			if rule.get('model_ladder'):
+				item['model_ladder'] = rule.get('model_ladder')
+			if content.get('chunk'):
+				item['chunk'] = content.get('chunk')
+			# 代码在prompt_user中的位置，Executor据此在输入超出上下文窗口时继续拆分任务
+			code_start = prompt_user.find(content.get('content')) if content.get('content') and len(group) == 1 else -1
+			if code_start >= 0:
+				item['code_span'] = [ code_start, code_start + len(content.get('content')) ]
+			if rule.get('enable_reasoning'):
+				# 推理预算由Executor按输入大小与历史结果选择，规则的reasoning_budget作为覆盖值
+				item.update({ key: rule.get(key) for key in ('enable_reasoning', 'reasoning_budget', 'reasoning_complexity') if rule.get(key) is not None })
+			if len(group) > 1:
+				# 合并的每条规则占用一个任务编号，Executor按rule_name拆分结果后分别写入
+				item['fused_rules'] = [ dict(rule_name=rule_name, number=number) ]
+				for fused in group[1:]:
+					number += 1
+					item['fused_rules'].append(dict(rule_name=fused.get('rule').get('name', 'none'), number=number))
 			if event.get('confirm', False) and event.get('confirm_prompt'):
 				item['confirm_prompt'] = event.get('confirm_prompt')
+			if batch_inference.is_batch_task(event, item):
+				# 全量评审先收集起来，循环结束后按模型提交批量推理作业
+				batch_items.append(item)
+				continue
 			result = send_message(item)
 			if not result:
 				log.info('Fail to send bedrock task to SQS')
@@ -290,42 +363,70 @@ def send_task_to_sqs(event, rules, request_id, commit_id, contents, variables=No
 			result = False
 		
 		if not result:
-			try:
-				table.update_item(
-					Key=dict(commit_id=commit_id, request_id=request_id),
-					UpdateExpression="set task_failure = task_failure + :tf",
-					ExpressionAttributeValues={ ':tf': 1 },
-					ReturnValues="ALL_NEW",
-				)
-			except Exception as ex:
-				log.error(f'Fail to update FAILURE COUNT for commit_id({commit_id}) and mode({mode}).', extra=dict(exception=str(ex)))
+			count_failure(request_key, len(group))
+
+	# 批量推理作业提交失败或记录数不足的任务，按原方式发送到SQS
+	if batch_items:
+		for item in batch_inference.submit(commit_id, request_id, batch_items):
+			if not send_message(item):
+				log.info('Fail to send bedrock task to SQS')
+				count_failure(request_key, len(item.get('fused_rules') or [ item ]))
 
 	return True
 
+def count_failure(request_key, count):
+	"""
+	立即累加发送失败的任务数，并根据更新后的计数器判断Request是否已全部结束
+
+	执行器可能在发送循环结束前就完成了其余任务，此时只有这次更新能看到全部结束并生成报告。
+	"""
+	try:
+		record = datastore.update_item(
+			os.getenv('REQUEST_TABLE'), request_key,
+			'ADD task_failure :tf',
+			values = { ':tf': count },
+			return_values = 'ALL_NEW',
+		)
+	except Exception as ex:
+		log.error(f'Fail to update FAILURE COUNT for request record({request_key}).', extra=dict(exception=str(ex)))
+		return
+	task_base.check_request_counters(record, log)
+
 def update_dynamodb_status(commit_id, scan_scope, status, file_num):
 	
 	key = { 'commit_id': commit_id, 'scan_scope': scan_scope }
 	
 	# 检查数据存在性
 	table_name = os.getenv('REQUEST_TABLE')
-	table = dynamodb.Table(table_name)
-	item = table.get_item(Key=key)
-	if item.get('Item') is None:
+	item = datastore.get_item(table_name, key, fields=['commit_id'])
+	if item is None:
 		raise Exception(f'Cannot find record for COMMIT ID({commit_id}) and SCAN SCOPE({scan_scope}).')
 	
 	# 更新数据
-	table.update_item(
-		Key=key,
-		UpdateExpression="set task_status = :s, update_at = :t, file_num = file_num + :m",
-		ExpressionAttributeValues={
+	datastore.update_item(
+		table_name, key,
+		"set task_status = :s, update_at = :t, file_num = file_num + :m",
+		values={
 			":s": status,
 			":t": str(datetime.datetime.now()),
 			":m": file_num,
 		},
-		ReturnValues="ALL_NEW",
 	)
 
 
+def complete_superseded_request(event, commit_id, request_id):
+	"""
+	请求对应的提交已被同一分支上更新的提交取代，不再获取代码和分派任务，直接完成请求
+	"""
+	datetime_str = str(datetime.datetime.now())
+	table_name = os.getenv('REQUEST_TABLE')
+	datastore.update_item(
+		table_name, { 'commit_id': commit_id, 'request_id': request_id },
+		'set task_status = :s, task_complete = :tc, task_failure = :tf, task_cancel = :tca, task_total = :tt, superseded = :ss, update_time = :t',
+		values = { ':s': base.STATUS_COMPLETE, ':tc': 0, ':tf': 0, ':tca': 0, ':tt': 0, ':ss': True, ':t': datetime_str },
+	)
+	log.info(f'Request({request_id}) for commit({commit_id}) is superseded by a newer commit on {event.get("ref")}. Skip dispatching.')
+
 def validate_sqs_event(event):
 	"""
 	mode = all
@@ -341,53 +442,12 @@ def validate_sqs_event(event):
 def update_project_name(commit_id, request_id, project_name):
 	datetime_str = str(datetime.datetime.now())
 	table_name = os.getenv('REQUEST_TABLE')
-	dynamodb.Table(table_name).update_item(
-		Key = { 'commit_id': commit_id, 'request_id': request_id },
-		UpdateExpression = 'set project_name = :pn, update_time = :t',
-		ExpressionAttributeValues = { ':pn': project_name, ':t': datetime_str },
-		ReturnValues = 'ALL_NEW'
+	datastore.update_item(
+		table_name, { 'commit_id': commit_id, 'request_id': request_id },
+		'set project_name = :pn, update_time = :t',
+		values = { ':pn': project_name, ':t': datetime_str },
 	)
 
-def load_rules(event, repo_context, commit_id=None, branch=None):
-	"""
-	加载评审规则，支持两种不同的触发模式
-	
-	设计原则：
-	- Webtool模式：用户通过Web界面直接输入完整的系统提示词和用户提示词
-	- Webhook模式：从仓库内.codereview/*.yaml文件中加载结构化规则配置
-	
-	Args:
-		event: 触发事件，包含invoker字段区分触发模式
-		repo_context: 仓库上下文
-		commit_id: 提交ID
-		branch: 分支名
-	
-	Returns:
-		list: 规则列表
-	"""
-	base_rules = list(load_base_rules())
-	if event.get('invoker') == 'webtool':
-		webtool_rule = {
-			"name": event.get("rule_name"),
-			"mode": event.get('mode'),
-			"number": 1,
-			"model": event.get('model'),
-			"event": event.get('event_type'),
-			"branch": event.get('target_branch'),
-			"target": event.get('target'),
-			"confirm": event.get('confirm', False),
-			"prompt_system": event.get('webtool_prompt_system'),
-			"prompt_user": event.get('webtool_prompt_user')
-		}
-		rules = base_rules + [webtool_rule]
-		log.info('Loaded rules for webtool invoker.', extra=dict(rule_count=len(rules)))
-	else:
-		repo_rules = codelib.get_rules(repo_context, commit_id, branch)
-		rules = base_rules + repo_rules
-		log.info('Loaded rules for webhook invoker.', extra=dict(base_rules=len(base_rules), repo_rules=len(repo_rules)))
-	return rules
-
-
 def get_targets(rule):
 	targets = [t.strip() for t in rule.get('target', '').strip().rstrip('.').split(',')]
 	return targets
@@ -435,6 +495,13 @@ def get_code_contents_for_diff(repo_context, commit_id, previous_commit_id, rule
 	return contents
 
 def lambda_handler(event, context):
+	try:
+		return dispatch(event, context)
+	finally:
+		# 本次调用缓存的指标统一输出
+		metrics.flush()
+
+def dispatch(event, context):
 	
 	log.info(event, extra=dict(label='event'))
 	
@@ -455,6 +522,9 @@ def lambda_handler(event, context):
 	target			= event.get('target')
 	project_name	= event.get('project_name')
 	previous_commit_id 	= event.get('previous_commit_id')
+	# Request Handler预检查时已加载的规则集，取出后不再随event写入SQS消息
+	preloaded_rules 	= event.pop('rules', None)
+	rules_hash 			= event.pop('rules_hash', None)
 	
 	# 获取Code Lib Context
 	repo_context = codelib.init_repo_context(event)
@@ -477,12 +547,19 @@ def lambda_handler(event, context):
 	except Exception as ex:
 		log.error(f'Fail to update project name.', extra=dict(exception=str(ex)))
 
+	# 已有更新的提交时，不再获取代码
+	if supersession.is_superseded(event, commit_id):
+		complete_superseded_request(event, commit_id, request_id)
+		return base.response_success(None)
+
 	# 解析.codereview规则
-	all_rules = load_rules(event, repo_context, commit_id=commit_id, branch=target_branch)
-	rules = []
-	for rule in all_rules:
-		if match_branch(rule.get('branch'), target_branch) and rule.get('event') == event_type:
-			rules.append(rule)
+	if preloaded_rules is not None:
+		all_rules = preloaded_rules
+		log.info('Use rules loaded by request handler.', extra=dict(rule_count=len(all_rules)))
+	else:
+		with metrics.timer('DispatchRuleFetchTime', dict(Project=project_name or 'none')):
+			all_rules, rules_hash = load_rules(event, repo_context, commit_id=commit_id, branch=target_branch), None
+	rules = rule_index.find_rules(all_rules, event_type, target_branch, rules_hash)
 	log.info(f'Found {len(rules)} rules for branch({target_branch})', extra=dict(rule_names=[rule.get('name') for rule in rules]))
 	modes = list({rule.get('mode') for rule in rules})
 	log.info('Found {} modes for branch({}): {}'.format(len(modes), target_branch, modes))
@@ -493,29 +570,33 @@ def lambda_handler(event, context):
 		mode = rule.get('mode')
 		
 		rule_contents = []
-		if mode == 'all':
-			rule_contents = get_code_contents_for_all(repo_context, commit_id, rule)
-		elif mode == 'single':
-			rule_contents = get_code_contents_for_single(repo_context, commit_id, previous_commit_id, rule)
-		elif mode == 'diff':
-			rule_contents = get_code_contents_for_diff(repo_context, commit_id, previous_commit_id, rule)
+		dimensions = dict(Model=rule.get('model') or 'none', Mode=mode or 'none', Project=project_name or 'none')
+		with metrics.timer('DispatchFetchTime', dimensions):
+			if mode == 'all':
+				rule_contents = get_code_contents_for_all(repo_context, commit_id, rule)
+			elif mode == 'single':
+				rule_contents = get_code_contents_for_single(repo_context, commit_id, previous_commit_id, rule)
+			elif mode == 'diff':
+				rule_contents = get_code_contents_for_diff(repo_context, commit_id, previous_commit_id, rule)
 		
 		log.info(f'Get {len(rule_contents)} contents for rule({rule.get("name")}).', extra=dict(contents=rule_contents))
 		contents = contents + rule_contents
 
+	contents = split_oversize_contents(event, contents)
 	log.info(f'Get {len(contents)} prompt segments for involved files', extra=dict(contents=contents))
 	# contents = None # to del
-	if contents:
+	if contents and supersession.is_superseded(event, commit_id):
+		complete_superseded_request(event, commit_id, request_id)
+	elif contents:
 		result = send_task_to_sqs(event, rules, request_id, commit_id, contents)
 	else:
 		try:
 			datetime_str = str(datetime.datetime.now())
 			table_name = os.getenv('REQUEST_TABLE')
-			dynamodb.Table(table_name).update_item(
-				Key = { 'commit_id': commit_id, 'request_id': request_id },
-				UpdateExpression = 'set task_status = :s, task_complete = :tc, task_failure = :tf, task_total = :tt, update_time = :t',
-				ExpressionAttributeValues = { ':s': base.STATUS_COMPLETE, ':tf': 0, ':tc': 0, ':tt': 0, ':t': datetime_str },
-				ReturnValues = 'ALL_NEW'
+			datastore.update_item(
+				table_name, { 'commit_id': commit_id, 'request_id': request_id },
+				'set task_status = :s, task_complete = :tc, task_failure = :tf, task_total = :tt, update_time = :t',
+				values = { ':s': base.STATUS_COMPLETE, ':tf': 0, ':tc': 0, ':tt': 0, ':t': datetime_str },
 			)
 			event = dict(commit_id = commit_id, request_id = request_id)
 			context = dict(project_name=project_name)
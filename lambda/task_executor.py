@@ -1,9 +1,11 @@
 import boto3
 import traceback
-import os, re, ast, json, time, datetime, logging, random
-import base, task_base
-import model_config
-from botocore.config import Config
+import os, json, math, time, datetime, logging, random, threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from botocore.exceptions import ClientError
+import base, datastore, report, s3_codec, supersession, task_base
+import bedrock_client, bedrock_stream, context_guard, json_recovery, metrics, model_config, model_router, rate_control, reasoning_budget, region_pool
 from logger import init_logger
 
 REQUEST_TABLE 			= os.getenv('REQUEST_TABLE')
@@ -12,28 +14,62 @@ SNS_TOPIC_ARN 			= os.getenv('SNS_TOPIC_ARN')
 SQS_MAX_DELAY 			= base.str_to_int(os.getenv('SQS_MAX_DELAY', '300'))   		# 最大延迟时间(秒)
 SQS_BASE_DELAY 			= base.str_to_int(os.getenv('SQS_BASE_DELAY', '60'))   		# 初始延迟时间(秒)
 SQS_MAX_RETRIES 		= base.str_to_int(os.getenv('SQS_MAX_RETRIES', '5'))		# 最大重试次数
+SQS_DELAY_LIMIT 		= 900															# SQS DelaySeconds上限(秒)
 MAX_FAILED_TIMES 		= base.str_to_int(os.getenv('MAX_FAILED_TIMES', '6'))
 MAX_TOKEN_TO_SAMPLE 	= base.str_to_int(os.getenv('MAX_TOKEN_TO_SAMPLE', '10000'))
 REPORT_TIMEOUT_SECONDS 	= base.str_to_int(os.getenv('REPORT_TIMEOUT_SECONDS', '900'))
 TOP_P 					= base.str_to_float(os.getenv('TOP_P', '1'))
 TEMPERATURE 			= base.str_to_float(os.getenv('TEMPERATURE', '0'))
-
-BEDROCK_ACCESS_KEY 		= os.getenv('BEDROCK_ACCESS_KEY')
-BEDROCK_SECRET_KEY 		= os.getenv('BEDROCK_SECRET_KEY')
-BEDROCK_REGION 			= os.getenv('BEDROCK_REGION')
+BEDROCK_STREAMING 		= os.getenv('BEDROCK_STREAMING', 'false').lower() == 'true'
+RECORD_CONCURRENCY 		= base.str_to_int(os.getenv('RECORD_CONCURRENCY', '4'))		# 同一批次内并发处理的SQS记录数
+BEDROCK_CONCURRENCY 	= base.str_to_int(os.getenv('BEDROCK_CONCURRENCY', '4'))		# 单个容器内并发的Bedrock调用数
+USAGE_KEY_PREFIX 		= 'usage#'
+CHECKPOINT_RESERVE_MS 	= base.str_to_int(os.getenv('CHECKPOINT_RESERVE_MS', '60000'))	# 剩余时间少于该值（或上一轮耗时）时保存检查点
+CHECKPOINT_PREFIX 		= 'checkpoint'
+STAGE_REVIEW 			= 'review'
+STAGE_CONFIRM 			= 'confirm'
 
 sqs						= boto3.client("sqs")
-dynamodb				= boto3.resource("dynamodb")
-sns						= boto3.resource('sns')
-s3						= boto3.resource("s3")
-if BEDROCK_ACCESS_KEY and BEDROCK_SECRET_KEY and BEDROCK_REGION:
-	bedrock	= boto3.client(service_name="bedrock-runtime", aws_access_key_id=BEDROCK_ACCESS_KEY, aws_secret_access_key=BEDROCK_SECRET_KEY, region_name=BEDROCK_REGION)
-else:
-	bedrock	= boto3.client(service_name="bedrock-runtime")
+s3						= boto3.resource("s3")									# 资源对象不是线程安全的，并发调用使用s3.meta.client
+bedrock_slots			= threading.BoundedSemaphore(max(1, BEDROCK_CONCURRENCY))
 
 init_logger()
 log = logging.getLogger('crlog_{}'.format(__name__))
 
+class RetryLaterException(Exception):
+	"""
+	Raised when a Bedrock invocation failed but still has retries left.
+	The task is rescheduled through SQS instead of sleeping inside the Lambda.
+	model_tier keeps the ladder tier the task escalated to, so the retry does
+	not start again from the bottom of the ladder. checkpoint is the S3 key of
+	the turns completed before the failed one, so the retry only redoes that turn.
+	"""
+	def __init__(self, message, delay, current_retry, error_messages, model_tier=0, checkpoint=None):
+		super().__init__(message)
+		self.delay = delay
+		self.current_retry = current_retry
+		self.error_messages = error_messages
+		self.model_tier = model_tier
+		self.checkpoint = checkpoint
+
+class CheckpointException(Exception):
+	"""
+	Raised before a turn when the Lambda has too little time left for it.
+	The conversation so far is saved to S3 under key and the task continues
+	from there in a new invocation.
+	"""
+	def __init__(self, message, key, current_retry):
+		super().__init__(message)
+		self.key = key
+		self.current_retry = current_retry
+
+class ContextOverflowException(Exception):
+	"""
+	Raised when the input does not fit the context window of any model the
+	task may use. Retrying cannot help, so the task is split or failed at once.
+	"""
+	pass
+
 def invoke_claude3(model, prompt_data, task_name):
 
 	params = dict(
@@ -80,7 +116,7 @@ def invoke_claude3(model, prompt_data, task_name):
 		log.info(f'Bedrock - Invoking claude3 for {task_name}.', extra=dict(params=params))
 		start_time = time.time()
 		log.info(f'invoke model', extra=dict(payload=params, modelId=llm_id))
-		response = bedrock.invoke_model(body=base.dump_json(params), modelId=llm_id)
+		response = bedrock_client.get_client().invoke_model(body=base.dump_json(params), modelId=llm_id)
 		end_time = time.time()
 		timecost = int(end_time * 1000 - start_time * 1000)
 		start_time = datetime.datetime.fromtimestamp(start_time).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
@@ -103,39 +139,143 @@ def invoke_claude3(model, prompt_data, task_name):
 		raise Exception(f'Fail to invoke Claude3: {ex}') from ex
 
 
-def build_messages(messages, for_converse_api=False):
+def build_content(text, for_converse_api=False, cache=False):
+	"""
+	Build a content list for one text, optionally followed by a cache checkpoint
+
+	InvokeModel marks the text block itself with cache_control, while Converse
+	takes a separate cachePoint block after it.
+	"""
+	if for_converse_api:
+		content = [{'text': text}]
+		if cache:
+			content.append({'cachePoint': {'type': 'default'}})
+	else:
+		block = {'type': 'text', 'text': text}
+		if cache:
+			block['cache_control'] = {'type': 'ephemeral'}
+		content = [block]
+	return content
+
+
+def build_messages(messages, for_converse_api=False, cache_point=None):
 	"""
 	Build messages array for Bedrock API
 
 	Args:
 		messages: List of message strings or message objects
 		for_converse_api: If True, format for Converse API (no 'type' field)
+		cache_point: Length of the cacheable prefix of the first user message.
+			When set, a cache checkpoint is placed after that prefix and, for
+			confirm rounds, after the latest assistant reply as well.
 
 	Returns:
 		list: Formatted messages array
 	"""
 	formatted_messages = []
 	if isinstance(messages, list):
+		last_reply = len(messages) - 2 if len(messages) >= 3 else None
 		for i, message in enumerate(messages):
 			role = 'user' if i % 2 == 0 else 'assistant'
 			if isinstance(message, str):
-				if for_converse_api:
-					# Converse API format: no 'type' field
-					formatted_messages.append({
-						'role': role,
-						'content': [{'text': message}]
-					})
+				if i == 0 and cache_point and 0 < cache_point < len(message):
+					content = build_content(message[:cache_point], for_converse_api, cache=True)
+					content += build_content(message[cache_point:], for_converse_api)
 				else:
-					# InvokeModel API format: with 'type' field
-					formatted_messages.append({
-						'role': role,
-						'content': [{'type': 'text', 'text': message}]
-					})
+					content = build_content(message, for_converse_api, cache=bool(cache_point) and i == last_reply)
+				formatted_messages.append({
+					'role': role,
+					'content': content
+				})
 			elif isinstance(message, dict):
 				formatted_messages.append(message)
 	return formatted_messages
 
 
+def get_cache_point(model_cfg, prompt_data):
+	"""
+	Cacheable prefix length of the first user message, or None when the model
+	does not support prompt caching or the task has no cacheable prefix
+	"""
+	if not model_cfg.get('supports_prompt_cache'):
+		return None
+	return prompt_data.get('cache_point') or None
+
+
+def get_cache_usage(usage):
+	"""
+	Read cache token counts from InvokeModel or Converse usage
+
+	Returns:
+		tuple: (cache_read_tokens, cache_write_tokens)
+	"""
+	usage = usage or {}
+	read = usage.get('cache_read_input_tokens', usage.get('cacheReadInputTokens')) or 0
+	write = usage.get('cache_creation_input_tokens', usage.get('cacheWriteInputTokens')) or 0
+	return read, write
+
+
+USAGE_FIELDS = ('input_tokens', 'output_tokens', 'reasoning_tokens', 'cache_read_tokens', 'cache_write_tokens')
+
+
+def get_token_usage(usage, reasoning=None, text=None, payload=None):
+	"""
+	Normalize InvokeModel or Converse usage into token counts
+
+	Bedrock bills reasoning as output tokens and does not report it separately,
+	so reasoning_tokens is estimated from the reasoning text and is already
+	part of output_tokens.
+
+	A stream that is cut off once <output> is complete never receives the final
+	usage event, so missing input or output counts are estimated from the
+	request payload and the streamed text, and the usage is marked estimated.
+
+	Returns:
+		dict: input_tokens, output_tokens, reasoning_tokens, cache_read_tokens,
+		cache_write_tokens and estimated
+	"""
+	usage = usage or {}
+	cache_read, cache_write = get_cache_usage(usage)
+	result = dict(
+		input_tokens = int(usage.get('input_tokens', usage.get('inputTokens')) or 0),
+		output_tokens = int(usage.get('output_tokens', usage.get('outputTokens')) or 0),
+		reasoning_tokens = base.estimate_tokens(reasoning),
+		cache_read_tokens = int(cache_read),
+		cache_write_tokens = int(cache_write),
+		estimated = False,
+	)
+	if not result['input_tokens'] and not result['cache_read_tokens'] and payload:
+		result['input_tokens'] = base.estimate_tokens(payload)
+		result['estimated'] = True
+	if not result['output_tokens'] and (text or reasoning):
+		result['output_tokens'] = base.estimate_tokens(text) + result['reasoning_tokens']
+		result['estimated'] = True
+	return result
+
+
+def add_usage(total, usage):
+	total = dict(total or {})
+	for field in USAGE_FIELDS:
+		total[field] = total.get(field, 0) + (usage or {}).get(field, 0)
+	total['estimated'] = bool(total.get('estimated') or (usage or {}).get('estimated'))
+	return total
+
+
+def split_usage(usage, cost, count):
+	"""
+	Share the usage of a fused invocation evenly between its rules
+
+	Returns:
+		list: count (usage, cost) tuples; integer remainders go to the first rule
+	"""
+	parts = []
+	for index in range(count):
+		part = { field: usage.get(field, 0) // count + (usage.get(field, 0) % count if index == 0 else 0) for field in USAGE_FIELDS }
+		part['estimated'] = bool(usage.get('estimated'))
+		parts.append((part, cost / count))
+	return parts
+
+
 def build_request_params(model_cfg, prompt_data, enable_reasoning, reasoning_budget):
 	"""
 	Build request parameters for Bedrock API
@@ -152,7 +292,7 @@ def build_request_params(model_cfg, prompt_data, enable_reasoning, reasoning_bud
 	params = {
 		'anthropic_version': 'bedrock-2023-05-31',
 		'max_tokens': MAX_TOKEN_TO_SAMPLE,
-		'messages': build_messages(prompt_data.get('messages', [])),
+		'messages': build_messages(prompt_data.get('messages', []), cache_point=get_cache_point(model_cfg, prompt_data)),
 	}
 
 	# Add system prompt if provided
@@ -262,45 +402,38 @@ def invoke_claude(model, prompt_data, task_name, enable_reasoning=False):
 	# 1. Get model configuration
 	config = model_config.get_model_config(model)
 
-	# 2. Build request parameters
-	reasoning_budget = prompt_data.get('reasoning_budget', 2000)
-	params = build_request_params(config, prompt_data, enable_reasoning, reasoning_budget)
-
-	# 3. Build reasoning config if enabled and supported
-	additional_fields = None
+	# 2. Choose the reasoning budget from the input size, the rule and earlier outcomes
+	budget, budget_source = None, None
 	if enable_reasoning and config.get('supports_reasoning'):
-		additional_fields = build_reasoning_config(reasoning_budget)
-
-	# 4. Create Bedrock client with timeout configuration
-	timeout = config.get('timeout', 120)
-	boto_config = Config(read_timeout=timeout)
-
-	if BEDROCK_ACCESS_KEY and BEDROCK_SECRET_KEY and BEDROCK_REGION:
-		bedrock_client = boto3.client(
-			service_name="bedrock-runtime",
-			aws_access_key_id=BEDROCK_ACCESS_KEY,
-			aws_secret_access_key=BEDROCK_SECRET_KEY,
-			region_name=BEDROCK_REGION,
-			config=boto_config
-		)
-	else:
-		bedrock_client = boto3.client(
-			service_name="bedrock-runtime",
-			config=boto_config
-		)
+		context = prompt_data.get('context') or {}
+		input_tokens = base.estimate_tokens(prompt_data.get('system')) + sum(base.estimate_tokens(message) for message in prompt_data.get('messages', []))
+		budget, budget_source = reasoning_budget.choose(model, context.get('rule_name'), input_tokens, prompt_data.get('reasoning_complexity'), prompt_data.get('reasoning_budget_override'), MAX_TOKEN_TO_SAMPLE)
+
+	# 3. Build request parameters and reasoning config if enabled and supported
+	params = build_request_params(config, prompt_data, enable_reasoning, budget)
+	additional_fields = build_reasoning_config(budget) if budget else None
+
+	# 4. Pick the healthiest region; a half-open region is released by record_success/record_failure below
+	region = region_pool.choose(model)
 
-	# 5. Invoke Bedrock
+	# 5. Get pooled Bedrock client for the model's timeout profile and invoke Bedrock
 	try:
-		log.info(f'Invoking {config["model_id"]} for {task_name}',
+		client = bedrock_client.get_client(timeout=config.get('timeout', 120), region=region)
+		log.info(f'Invoking {config["model_id"]} in {region} for {task_name}',
 				 extra={'params': params, 'additional_fields': additional_fields})
 
 		start_time = time.time()
 
+		# Streaming stops reading as soon as the <output> block is complete, if the prompt asks for <output> first
+		streaming = prompt_data.get('streaming', BEDROCK_STREAMING)
+		stop_at_output = bedrock_stream.is_output_first(prompt_data.get('system'), *prompt_data.get('messages', [])[-1:])
+		watcher = bedrock_stream.OutputWatcher(start_time, stop_at_output) if streaming else None
+
 		# Choose API based on whether additional_fields are needed
 		if additional_fields:
 			# Use Converse API (supports additionalModelRequestFields)
 			# Need to rebuild messages in Converse format (no 'type' field)
-			converse_messages = build_messages(prompt_data.get('messages', []), for_converse_api=True)
+			converse_messages = build_messages(prompt_data.get('messages', []), for_converse_api=True, cache_point=get_cache_point(config, prompt_data))
 
 			converse_params = {
 				'modelId': config['model_id'],
@@ -318,37 +451,58 @@ def invoke_claude(model, prompt_data, task_name, enable_reasoning=False):
 
 			# Note: topP is not used when thinking is enabled (temperature must be 1.0)
 
-			response = bedrock_client.converse(**converse_params)
-			response_body = response
+			if watcher:
+				response = client.converse_stream(**converse_params)
+				result = bedrock_stream.read_converse_stream(response, watcher)
+			else:
+				response = client.converse(**converse_params)
+				result = parse_response(response, config, True)
 		else:
 			# Use InvokeModel API (existing approach)
-			response = bedrock_client.invoke_model(
-				body=json.dumps(params),
-				modelId=config['model_id']
-			)
-			response_body = json.loads(response['body'].read())
+			if watcher:
+				response = client.invoke_model_with_response_stream(
+					body=json.dumps(params),
+					modelId=config['model_id']
+				)
+				result = bedrock_stream.read_invoke_model_stream(response, watcher)
+			else:
+				response = client.invoke_model(
+					body=json.dumps(params),
+					modelId=config['model_id']
+				)
+				result = parse_response(json.loads(response['body'].read()), config, False)
 
 		end_time = time.time()
 
-		# 6. Parse response
-		result = parse_response(response_body, config, additional_fields is not None)
+		# 6. Streaming timings
+		time_to_first_token = watcher.elapsed_ms(watcher.first_token_time) if watcher else None
+		time_to_output = watcher.elapsed_ms(watcher.output_time) if watcher else None
+		if watcher:
+			log.info(f'Streamed {config["model_id"]} for {task_name}.', extra=dict(time_to_first_token=time_to_first_token, time_to_output=time_to_output, stop_reason=result.get('stop_reason')))
 
 		# 7. Return result
 		timecost = int((end_time - start_time) * 1000)
+		region_pool.record_success(model, region, timecost)
 		return {
 			'model': config['model_id'],
+			'region': region,
 			'text': result['text'],
 			'reasoning': result.get('reasoning'),  # New: reasoning content
 			'stop_reason': result.get('stop_reason'),
 			'usage': result.get('usage', {}),
+			'reasoning_budget': budget,
+			'reasoning_budget_source': budget_source,
 			'payload': json.dumps(params),
 			'timecost': timecost,
+			'time_to_first_token': time_to_first_token,
+			'time_to_output': time_to_output,
 			'start_time': datetime.datetime.fromtimestamp(start_time).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
 			'end_time': datetime.datetime.fromtimestamp(end_time).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
 		}
 
 	except Exception as ex:
-		log.error(f'Failed to invoke {config["model_id"]}: {ex}')
+		region_pool.record_failure(model, region, ex)
+		log.error(f'Failed to invoke {config["model_id"]} in {region}: {ex}')
 		raise Exception(f'Fail to invoke Claude: {ex}') from ex
 
 
@@ -360,7 +514,7 @@ def invoke_bedrock(task_name, prompt_data):
 	model = prompt_data.get('model')
 	enable_reasoning = prompt_data.get('enable_reasoning', False)
 
-	while prompt_data['current_retry'] < prompt_data['max_retry']:
+	if prompt_data['current_retry'] < prompt_data['max_retry']:
 
 		try:
 
@@ -370,19 +524,51 @@ def invoke_bedrock(task_name, prompt_data):
 						 'claude4-opus', 'claude4-opus-4.1', 'claude4-sonnet',
 						 'claude4.5-sonnet', 'claude4.5-haiku']:
 
-				reply = invoke_claude(model, prompt_data, task_name, enable_reasoning)
+				# 取得集群共享的调用配额，限流时乘性回退、成功时加性增长
+				model_id = model_config.get_model_id(model)
+				wait = rate_control.acquire(model_id)
+				if wait:
+					raise rate_control.RateLimitedException(model_id, wait)
+				try:
+					with bedrock_slots:
+						reply = invoke_claude(model, prompt_data, task_name, enable_reasoning)
+				except Exception as ex:
+					if rate_control.is_throttling(ex):
+						rate_control.record_throttle(model_id)
+					raise
+				rate_control.record_success(model_id)
 
 				prompt_data['messages'].append(reply['text'])
 				prompt_data['latest_reply'] = reply['text']
 				prompt_data['reasoning'] = reply.get('reasoning')  # New: store reasoning
+				prompt_data['region'] = reply.get('region')
+				usage = get_token_usage(reply.get('usage'), reply.get('reasoning'), reply.get('text'), reply.get('payload'))
+				prompt_data['usage'] = add_usage(prompt_data.get('usage'), usage)
+				prompt_data['cost'] = prompt_data.get('cost', 0.0) + model_config.estimate_cost(model, usage)
+				if reply.get('reasoning_budget'):
+					prompt_data['reasoning_budget'] = reply['reasoning_budget']
+					prompt_data['reasoning_budget_source'] = reply.get('reasoning_budget_source')
+					reasoning_budget.record_outcome(model, prompt_data.get('context', {}).get('rule_name'), reply['reasoning_budget'], usage.get('reasoning_tokens'), reply.get('stop_reason'))
 				prompt_data['payload'] = reply['payload']
 				prompt_data['end_time'] = reply['end_time']
 				if 'start_time' not in prompt_data:
 					prompt_data['start_time'] = reply['start_time']
+				prompt_data['turn_timecost'] = reply['timecost']
 				if 'timecost' not in prompt_data:
 					prompt_data['timecost'] = reply['timecost']
 				else:
 					prompt_data['timecost'] += reply['timecost']
+				if reply.get('time_to_first_token') is not None:
+					prompt_data['time_to_first_token'] = reply['time_to_first_token']
+					prompt_data['time_to_output'] = reply.get('time_to_output')
+				dimensions = get_metric_dimensions(model, prompt_data.get('context'))
+				metrics.emit('BedrockInvocationTime', reply['timecost'], 'Milliseconds', dimensions)
+				if reply.get('time_to_first_token') is not None:
+					metrics.emit('BedrockTimeToFirstByte', reply['time_to_first_token'], 'Milliseconds', dimensions)
+				if prompt_data.get('cache_point'):
+					cache_read, cache_write = get_cache_usage(reply.get('usage'))
+					prompt_data['cache_read_tokens'] = prompt_data.get('cache_read_tokens', 0) + cache_read
+					prompt_data['cache_write_tokens'] = prompt_data.get('cache_write_tokens', 0) + cache_write
 
 			else:
 				log.info(f'Model({model}) is not supported.')
@@ -390,66 +576,280 @@ def invoke_bedrock(task_name, prompt_data):
 
 			return prompt_data
 
+		except rate_control.RateLimitedException as ex:
+			# 未取得配额不算作失败，不消耗重试次数；按令牌桶给出的延迟加上不超过该延迟的抖动，分散重试的执行器
+			delay = max(1, min(math.ceil(ex.delay * (1 + random.random())), SQS_DELAY_LIMIT))
+			error_messages = [ dict(err=message.get('err')) for message in prompt_data.get('error_messages', []) ]
+			raise RetryLaterException(str(ex), delay, prompt_data['current_retry'], error_messages, prompt_data.get('model_tier', 0)) from ex
+
 		except Exception as ex:
 
+			# 输入超出当前模型的上下文时沿阶梯升级模型，不消耗重试次数；没有更大的模型时重试也无法成功
+			if model_router.is_context_overflow(ex):
+				if model_router.escalate(prompt_data):
+					log.info(f'Input is too long for {model}, escalate {task_name} to {prompt_data["model"]}.')
+					return invoke_bedrock(task_name, prompt_data)
+				raise ContextOverflowException(f'Input of {task_name} is too long for {model}: {ex}') from ex
+
 			prompt_data['current_retry'] += 1
-			expo = 2 ** (prompt_data['current_retry'] - 1)
-			seed = random.randint(-SQS_BASE_DELAY, SQS_BASE_DELAY)
-			delay = min(SQS_BASE_DELAY * expo + seed, SQS_MAX_DELAY)
 			log.info(f'Fail to process SQS record for the {prompt_data["current_retry"]} times.', extra=dict(exception=str(ex)))
 			
 			if not isinstance(prompt_data.get('error_messages'), list):
 				prompt_data['error_messages'] = list()
 			prompt_data['error_messages'].append(dict(err=str(ex), traceback=traceback.format_exc()))
 
-			commit_id, request_id, number, mode = base.extract_dict(prompt_data.get('context', {}), 'commit_id, request_id, number, mode')
-			update_failure_task(
-				commit_id, request_id, number, mode, 
-				base.dump_json(prompt_data['error_messages']), 
-				prompt_data.get('system'), 
-				base.dump_json(prompt_data.get('messages')), 
-				True
-			)
-			
-			log.info(f"Retrying in {delay} seconds...")
-			time.sleep(delay)  # 延迟一段时间后重试
+			if prompt_data['current_retry'] < prompt_data['max_retry']:
+				commit_id, request_id, mode = base.extract_dict(prompt_data.get('context', {}), 'commit_id, request_id, mode')
+				for number in get_task_numbers(prompt_data.get('context', {})):
+					update_failure_task(
+						commit_id, request_id, number, mode, 
+						base.dump_json(prompt_data['error_messages']), 
+						prompt_data.get('system'), 
+						base.dump_json(prompt_data.get('messages')), 
+						True
+					)
+				delay = get_retry_delay(prompt_data['current_retry'])
+				error_messages = [ dict(err=message.get('err')) for message in prompt_data['error_messages'] ]
+				raise RetryLaterException(f'Retry {task_name} in {delay} seconds', delay, prompt_data['current_retry'], error_messages, prompt_data.get('model_tier', 0)) from ex
 	
-	# 跳出循环即表示重试多次失败
-	commit_id, request_id, number, mode = base.extract_dict(prompt_data.get('context', {}), 'commit_id, request_id, number, mode')
-	update_failure_task(
-		commit_id, request_id, number, mode, 
-		base.dump_json(prompt_data['error_messages']), 
-		prompt_data.get('system'), 
-		base.dump_json(prompt_data.get('messages')), 
-		False
-	)
-	log.info(f'Review failure is saved in {task_name}.')
+	# 重试次数用尽即表示重试多次失败
+	fail_task(task_name, prompt_data)
 	raise Exception(f'Fail to process {task_name} for {prompt_data["max_retry"]} times')
 
 
-def extract_bedrock_response(text):
-	
-	match = re.search(r'<output>(.*?)</output>', text, re.DOTALL)
-	if not match:
-		log.info('No <output> tag found in response.', extra=dict(text=text))
-		content = ''
-	else:
-		content = match.group(1)
+def fail_task(task_name, prompt_data):
+	"""
+	Record the final failure of every task number of the invocation and check whether the request is finished
+	"""
+	commit_id, request_id, mode = base.extract_dict(prompt_data.get('context', {}), 'commit_id, request_id, mode')
+	record = None
+	for number in get_task_numbers(prompt_data.get('context', {})):
+		record = update_failure_task(
+			commit_id, request_id, number, mode, 
+			base.dump_json(prompt_data.get('error_messages', [])), 
+			prompt_data.get('system'), 
+			base.dump_json(prompt_data.get('messages')), 
+			False
+		) or record
+	task_base.check_request_counters(record, log)
+	log.info(f'Review failure is saved in {task_name}.')
 
+
+def get_metric_dimensions(model, context=None):
+	"""
+	Dimensions of the per-stage latency metrics: model, mode and project
+	"""
+	context = context or {}
+	return dict(Model=model or 'none', Mode=context.get('mode') or 'none', Project=context.get('project_name') or 'none')
+
+def get_task_numbers(context):
+	"""
+	Task numbers covered by one invocation; a fused task covers one number per rule
+	"""
+	return context.get('numbers') or [ context.get('number') ]
+
+def split_fused_findings(content, fused_rules):
+	"""
+	Split the findings of a fused invocation back out per rule_name
+
+	Findings whose rule_name does not match any fused rule are kept with the
+	first rule, so nothing the model reported is dropped.
+
+	Returns:
+		dict: number -> list of findings
+	"""
+	normalize = lambda name: str(name or '').strip().lower()
+	numbers = { normalize(rule.get('rule_name')): rule.get('number') for rule in fused_rules }
+	findings = { rule.get('number'): [] for rule in fused_rules }
+	first = fused_rules[0].get('number')
+	for finding in content if isinstance(content, list) else []:
+		number = numbers.get(normalize(finding.get('rule_name'))) if isinstance(finding, dict) else None
+		if number is None:
+			log.info('Finding does not match any fused rule.', extra=dict(finding=finding))
+			number = first
+		findings[number].append(finding)
+	return findings
+
+def get_retry_delay(current_retry):
+	"""
+	Exponential backoff with jitter, capped by SQS_MAX_DELAY and the SQS DelaySeconds limit
+	"""
+	expo = 2 ** (current_retry - 1)
+	seed = random.randint(-SQS_BASE_DELAY, SQS_BASE_DELAY)
+	return max(0, min(SQS_BASE_DELAY * expo + seed, SQS_MAX_DELAY, SQS_DELAY_LIMIT))
+
+def schedule_retry(event, ex):
+	"""
+	Re-enqueue the task with DelaySeconds and the attempt counter in the envelope,
+	so the current invocation is released immediately.
+
+	Returns:
+		bool: True if the delayed message was sent
+	"""
+	retry_event = dict(event, current_retry=ex.current_retry, error_messages=ex.error_messages)
+	if ex.model_tier:
+		retry_event['model_tier'] = ex.model_tier
+	if ex.checkpoint:
+		retry_event['checkpoint'] = ex.checkpoint
 	try:
-		log.info('Try to parse json result.', extra=dict(content=content))
-		python_object = ast.literal_eval(content)
-		
-		if isinstance(python_object, dict):
-			python_object = [python_object]
-		elif not isinstance(python_object, list):
-			raise ValueError("Content is not a list or dict")
-	except Exception as ex:
-		log.info('Fail to parse JSON content.', extra=dict(content=content, exception=str(ex)))
-		raise base.CRError(1, f'Fail to parse JSON content from: {content}') from ex
+		message = base.encode_base64(base.dump_json(retry_event))
+		sqs.send_message(QueueUrl=TASK_SQS_URL, MessageBody=message, DelaySeconds=ex.delay)
+		log.info(f'Task is rescheduled in {ex.delay} seconds for retry {ex.current_retry}.', extra=dict(request_id=event.get('request_id'), number=event.get('number')))
+		return True
+	except Exception as send_ex:
+		log.error('Fail to reschedule task to SQS.', extra=dict(exception=str(send_ex)))
+		return False
+
+def split_task(event):
+	"""
+	Replace a task whose input does not fit the context window with tasks
+	reviewing overlapping halves of its code
+
+	code_span marks the code inside prompt_user. The first half keeps the
+	task number; the others get numbers past the request's task_total, which
+	grows by the number of added tasks so the request only completes once
+	every half is done.
+
+	Returns:
+		bool: True if the halves were enqueued, False if the task cannot be split
+	"""
+	span, prompt_user = event.get('code_span'), event.get('prompt_user') or ''
+	if not span or event.get('fused_rules'):
+		return False
+	start, end = span
+	chunks = context_guard.split_in_two(prompt_user[start:end])
+	if len(chunks) < 2:
+		return False
+
+	request_key = dict(commit_id=event.get('commit_id'), request_id=event.get('request_id'))
+	datetime_str = str(datetime.datetime.now())
+	record = datastore.update_item(
+		REQUEST_TABLE, request_key,
+		'set update_time = :t ADD task_total :n',
+		values = { ':n': len(chunks) - 1, ':t': datetime_str },
+		return_values = 'ALL_NEW',
+	)
+	total = int(record.get('task_total'))
+	numbers = [ event.get('number') ] + list(range(total - len(chunks) + 2, total + 1))
+	first_line = (event.get('chunk') or {}).get('line', 1)
+	failures = 0
+	for index, ((line, text), number) in enumerate(zip(chunks, numbers)):
+		child = { key: value for key, value in event.items() if key not in ('current_retry', 'error_messages', 'model_tier', 'checkpoint') }
+		child.update(
+			number = number,
+			prompt_user = prompt_user[:start] + text + prompt_user[end:],
+			code_span = [ start, start + len(text) ],
+			chunk = dict(index=index + 1, total=len(chunks), line=first_line + line - 1),
+		)
+		if event.get('identity'):
+			child['identity'] = f'{event.get("identity")}-{number}'
+		try:
+			sqs.send_message(QueueUrl=TASK_SQS_URL, MessageBody=base.encode_base64(base.dump_json(child)))
+		except Exception as ex:
+			log.error(f'Fail to send split task({number}) to SQS.', extra=dict(exception=str(ex)))
+			failures += 1
+	log.info(f'Split task(request_id={request_key["request_id"]}, number={event.get("number")}) into {numbers}.')
+	if failures:
+		record = datastore.update_item(
+			REQUEST_TABLE, request_key,
+			'set update_time = :t ADD task_failure :tf',
+			values = { ':tf': failures, ':t': datetime_str },
+			return_values = 'ALL_NEW',
+		)
+		task_base.check_request_counters(record, log)
+	return True
+
+def extract_bedrock_response(text, recovery=None):
+	"""
+	Parse the findings in <output>, repairing common formatting mistakes locally
+
+	Args:
+		text: Model reply
+		recovery: Optional list, the parse method is appended to it
 
+	Raises:
+		base.CRError: when local recovery fails and the model has to re-output
+	"""
+	try:
+		python_object, method = json_recovery.parse_findings(text)
+	except Exception as ex:
+		log.info('Fail to parse JSON content.', extra=dict(text=text, exception=str(ex)))
+		raise base.CRError(1, f'Fail to parse JSON content from: {text}') from ex
+
+	if method != json_recovery.METHOD_STRICT:
+		log.info(f'Findings are recovered locally ({method}).', extra=dict(text=text))
+		metrics.emit('JsonRecovery', 1, unit='Count', dimensions=dict(Method=method))
+	if recovery is not None:
+		recovery.append(method)
 	return python_object
 
+def get_checkpoint_key(context):
+	return f'{CHECKPOINT_PREFIX}/{context.get("request_id")}/{context.get("number")}.json'
+
+def check_remaining_time(task_name, prompt_data, message):
+	"""
+	Save a checkpoint and stop before a turn that may not finish in the remaining time
+
+	The turn needs at least CHECKPOINT_RESERVE_MS, or as long as the last
+	turn took. The checkpoint holds prompt_data before the turn and the
+	message of the turn, so the continuation resumes with that turn.
+
+	Raises:
+		CheckpointException: when the checkpoint is saved
+	"""
+	deadline = prompt_data.get('deadline')
+	if not deadline:
+		return
+	remaining = int((deadline - time.time()) * 1000)
+	needed = max(CHECKPOINT_RESERVE_MS, prompt_data.get('turn_timecost') or 0)
+	if remaining >= needed:
+		return
+	key = save_checkpoint(prompt_data, message)
+	log.info(f'Save checkpoint of {task_name} with {remaining}ms left.', extra=dict(key=key, needed=needed, turns=len(prompt_data.get('messages', [])) // 2))
+	raise CheckpointException(f'Continue {task_name} from {key}', key, prompt_data.get('current_retry', 0))
+
+def save_checkpoint(prompt_data, message):
+	"""
+	Save prompt_data before a turn and the message of that turn
+
+	Returns:
+		str: S3 key of the checkpoint
+	"""
+	key = get_checkpoint_key(prompt_data.get('context', {}))
+	state = { field: value for field, value in prompt_data.items() if field != 'deadline' }
+	s3_codec.put_object(s3, os.getenv('BUCKET_NAME'), key, base.dump_json(dict(prompt_data=state, message=message)), 'application/json')
+	return key
+
+def load_checkpoint(key):
+	"""
+	Returns:
+		tuple: (prompt_data, message of the next turn)
+	"""
+	state = json.loads(s3_codec.get_object(s3, os.getenv('BUCKET_NAME'), key))
+	return state.get('prompt_data'), state.get('message')
+
+def delete_checkpoint(key):
+	try:
+		s3.meta.client.delete_object(Bucket=os.getenv('BUCKET_NAME'), Key=key)
+	except Exception as ex:
+		log.info(f'Fail to delete checkpoint {key}.', extra=dict(exception=str(ex)))
+
+def schedule_continuation(event, ex):
+	"""
+	Enqueue the task again without delay, resuming from the checkpoint in a fresh invocation
+
+	Returns:
+		bool: True if the continuation was sent
+	"""
+	continuation = dict(event, checkpoint=ex.key, current_retry=ex.current_retry)
+	try:
+		sqs.send_message(QueueUrl=TASK_SQS_URL, MessageBody=base.encode_base64(base.dump_json(continuation)))
+		log.info(f'Task continues from checkpoint {ex.key}.', extra=dict(request_id=event.get('request_id'), number=event.get('number')))
+		return True
+	except Exception as send_ex:
+		log.error('Fail to send continuation to SQS.', extra=dict(exception=str(send_ex)))
+		return False
+
 def invoke_and_extract_bedrock(task_name, prompt_data, message):
 
 	if not isinstance(prompt_data.get('current_retry'), int):
@@ -457,15 +857,27 @@ def invoke_and_extract_bedrock(task_name, prompt_data, message):
 	if not isinstance(prompt_data.get('max_retry'), int):
 		raise Exception(f'max_retry({prompt_data.get("max_retry")}) in prompt_data is not int.')
 	
+	check_remaining_time(task_name, prompt_data, message)
+	completed = list(prompt_data['messages'])
 	prompt_data['messages'].append(message)
-	prompt_data = invoke_bedrock(task_name, prompt_data)
+	try:
+		prompt_data = invoke_bedrock(task_name, prompt_data)
+	except RetryLaterException as ex:
+		# 之前的轮次已完成并已计费时保存检查点，重试只重做失败的这一轮
+		if completed:
+			prompt_data['messages'] = completed
+			ex.checkpoint = save_checkpoint(prompt_data, message)
+			log.info(f'Save checkpoint of {task_name} for retry.', extra=dict(key=ex.checkpoint, turns=len(completed) // 2))
+		raise
 	reply = prompt_data.get('latest_reply')
 	log.info(f'Get bedrock result.', extra=dict(reply=reply))
 	try:
-		content = extract_bedrock_response(reply)
+		content = extract_bedrock_response(reply, prompt_data.setdefault('json_recovery', []))
 		prompt_data['content'] = content
 	except Exception as ex:
 		log.info('Fail to parse JSON in output tag. Try to rectify the JSON output.', extra=dict(text=reply))
+		metrics.emit('JsonRecovery', 1, unit='Count', dimensions=dict(Method='rectifier'))
+		prompt_data.setdefault('json_recovery', []).append('rectifier')
 		prompt_data['current_retry'] += 1
 		if prompt_data['current_retry'] < prompt_data['max_retry']:
 			JSON_RECTIFIER_PROMPT = 'The JSON in <output> tag seems invalid, it can not be convert into JSON object in Python. Please check and re-output again. Output all your message in this format \"<output>your finding</output><thought>your thought</thought>\".\nIMPORTANT:\n  - nothing should be output outside <output> and <thought> tag.'
@@ -473,7 +885,13 @@ def invoke_and_extract_bedrock(task_name, prompt_data, message):
 	
 	return prompt_data
 
-def handle_code_review(record, event, context):
+def handle_code_review(record, event, context, deadline=None):
+	"""
+	执行一个评审任务
+
+	deadline为Lambda超时的时间戳，每一轮调用前检查剩余时间，不足时保存检查点并由新的调用继续。
+	事件带有checkpoint时从检查点恢复对话，跳过已完成的轮次。
+	"""
 
 	log.info(event, extra=dict(label='task event'))
 	log.info(context, extra=dict(label='task context'))
@@ -488,32 +906,104 @@ def handle_code_review(record, event, context):
 	commit_id, request_id, number, mode, model, prompt_system, prompt_user, confirm_prompt, rule_name = base.extract_dict(event, 'commit_id, request_id, number, mode, model, prompt_system, prompt_user, confirm_prompt, rule_name')
 	current_timestamp = datetime.datetime.now()
 	model = model.lower()
+	current_retry = event.get('current_retry') or 0
+	fused_rules = event.get('fused_rules') or []
+	numbers = [ fused.get('number') for fused in fused_rules ] or [ number ]
+	checkpoint = load_checkpoint(event.get('checkpoint')) if event.get('checkpoint') else None
+
+	# 规则声明了模型阶梯时，按估算的输入大小选择模型；重试消息从已升级到的级别开始
+	model_ladder = model_router.normalize_ladder(event.get('model_ladder'), model)
+	model_tier = 0
+	input_tokens = base.estimate_tokens(prompt_system) + base.estimate_tokens(prompt_user) + base.estimate_tokens(confirm_prompt)
+	if model_ladder and not checkpoint:
+		model_tier = model_router.select_tier(model_ladder, input_tokens, start=min(event.get('model_tier') or 0, len(model_ladder) - 1))
+		model = model_ladder[model_tier]['model']
+		log.info(f'Route {label} to {model}.', extra=dict(input_tokens=input_tokens, model_tier=model_tier))
 	
-	try:
-		create_task(commit_id, request_id, number, mode, model)
-	except Exception as ex:
-		raise Exception(f'Fail to create task: {ex}') from ex
+	# 重试消息与检查点的继续消息复用已创建的Task记录，保留retry_times
+	if not current_retry and not checkpoint:
+		try:
+			for task_number in numbers:
+				create_task(commit_id, request_id, task_number, mode, model)
+		except Exception as ex:
+			raise Exception(f'Fail to create task: {ex}') from ex
+
+	# 提交已被更新的提交取代时，不再调用Bedrock
+	if supersession.is_superseded(context, commit_id):
+		for task_number in numbers:
+			record = cancel_task(commit_id, request_id, task_number, mode)
+		task_base.check_request_counters(record, log)
+		log.info(f'Commit({commit_id}) is superseded. Cancel {label}.')
+		return
+
+	if checkpoint:
+		prompt_data, message = checkpoint
+		# 从检查点继续后又失败重试时，重试次数与模型级别以重试消息为准
+		prompt_data['current_retry'] = max(prompt_data.get('current_retry') or 0, current_retry)
+		if prompt_data.get('model_ladder') and (event.get('model_tier') or 0) > (prompt_data.get('model_tier') or 0):
+			prompt_data['model_tier'] = min(event.get('model_tier'), len(prompt_data['model_ladder']) - 1)
+			prompt_data['model'] = prompt_data['model_ladder'][prompt_data['model_tier']]['model']
+		log.info(f'Resume {label} from checkpoint at stage {prompt_data.get("stage")}.', extra=dict(turns=len(prompt_data.get('messages', [])) // 2))
+	else:
+		prompt_data, message = None, prompt_user
+
+	# 估算的输入超出可用的最大模型的上下文窗口时不调用Bedrock，直接拆分任务
+	input_limit = context_guard.get_input_limit(context_guard.get_models(model, model_ladder), bool(confirm_prompt))
+	if not prompt_data and input_tokens > input_limit and split_task(event):
+		log.info(f'Input of {label} is too long ({input_tokens} > {input_limit}) and is split.')
+		return
 
-	prompt_data = dict(
-		context = dict(commit_id = commit_id, request_id = request_id, number = number, mode = mode),
+	prompt_data = prompt_data or dict(
+		stage = STAGE_REVIEW,
+		context = dict(commit_id = commit_id, request_id = request_id, number = number, numbers = numbers, mode = mode, project_name = (context or {}).get('project_name'), rule_name = rule_name),
 		model=model, 
 		system=prompt_system, 
 		messages=[], 
-		current_retry=0, 
-		max_retry=SQS_MAX_RETRIES
+		current_retry=current_retry, 
+		max_retry=SQS_MAX_RETRIES,
+		model_ladder=model_ladder,
+		model_tier=model_tier,
 	)
-
-	prompt_data = invoke_and_extract_bedrock(label, prompt_data, prompt_user)
-	
-	if confirm_prompt:
-		log.info('Try to confirm last output.')
-		prompt_data = invoke_and_extract_bedrock(label, prompt_data, confirm_prompt)
+	if event.get('prompt_cache_point') and not checkpoint:
+		prompt_data['cache_point'] = event.get('prompt_cache_point')
+	if event.get('error_messages'):
+		prompt_data['error_messages'] = list(event.get('error_messages'))
+	# 规则开启推理时由reasoning_budget按输入大小、规则复杂度与历史结果选择预算，规则的reasoning_budget优先
+	if event.get('enable_reasoning') and not checkpoint:
+		prompt_data['enable_reasoning'] = True
+		prompt_data['reasoning_budget_override'] = event.get('reasoning_budget')
+		prompt_data['reasoning_complexity'] = event.get('reasoning_complexity')
+
+	prompt_data['deadline'] = deadline
+	try:
+		if prompt_data.get('stage') != STAGE_CONFIRM:
+			prompt_data = invoke_and_extract_bedrock(label, prompt_data, message)
+			message = confirm_prompt
+		
+		if confirm_prompt and supersession.is_superseded(context, commit_id):
+			for task_number in numbers:
+				record = cancel_task(commit_id, request_id, task_number, mode)
+			task_base.check_request_counters(record, log)
+			log.info(f'Commit({commit_id}) is superseded. Cancel confirm round of {label}.')
+			return
+		elif confirm_prompt:
+			log.info('Try to confirm last output.')
+			prompt_data['stage'] = STAGE_CONFIRM
+			prompt_data = invoke_and_extract_bedrock(label, prompt_data, message)
+	except ContextOverflowException as ex:
+		# 模型拒绝了过长的输入：能拆分时拆分为子任务，否则直接记录失败，不再重试
+		if split_task(event):
+			log.info(f'Input of {label} is rejected as too long and is split.')
+			return
+		prompt_data.setdefault('error_messages', []).append(dict(err=str(ex), traceback=traceback.format_exc()))
+		fail_task(label, prompt_data)
+		return
 	
 	result = dict(
 		commit_id = commit_id,
 		request_id = request_id,
 		rule = rule_name,
-		model = model,
+		model = prompt_data.get('model', model),
 		content = prompt_data.get('content', ''),
 		timestamp = str(current_timestamp),
 		start_time = prompt_data.get('start_time', ''),
@@ -523,11 +1013,41 @@ def handle_code_review(record, event, context):
 		prompt_system = prompt_data.get('system', ''),
 		prompt_user = base.dump_json(prompt_data.get('messages')[::2]),
 		reasoning = prompt_data.get('reasoning', ''),  # New: reasoning content
-		enable_reasoning = prompt_data.get('enable_reasoning', False)  # New: reasoning flag
+		enable_reasoning = prompt_data.get('enable_reasoning', False),  # New: reasoning flag
+		reasoning_budget = prompt_data.get('reasoning_budget'),
+		reasoning_budget_source = prompt_data.get('reasoning_budget_source'),
+		time_to_first_token = prompt_data.get('time_to_first_token'),
+		time_to_output = prompt_data.get('time_to_output'),
+		cache_read_tokens = prompt_data.get('cache_read_tokens'),
+		json_recovery = prompt_data.get('json_recovery'),
+		cache_write_tokens = prompt_data.get('cache_write_tokens'),
+		region = prompt_data.get('region'),
+		chunk = event.get('chunk'),
+		usage = prompt_data.get('usage'),
+		cost = prompt_data.get('cost'),
 	)
-
-	update_complete_task(commit_id, request_id, number, mode, result)
-	task_base.check_request_progress_by_pksk(commit_id, request_id, log)
+	project_name = (context or {}).get('project_name')
+	dimensions = get_metric_dimensions(result['model'], prompt_data.get('context'))
+	metrics.emit('RetryCount', prompt_data.get('current_retry', 0), 'Count', dimensions)
+
+	if fused_rules:
+		# 合并调用的结果按rule_name拆分，每条规则仍写入各自的Task记录与S3结果
+		findings = split_fused_findings(result['content'], fused_rules)
+		shares = split_usage(result.get('usage') or {}, result.get('cost') or 0.0, len(fused_rules))
+		for fused, (usage, cost) in zip(fused_rules, shares):
+			fused_result = dict(result, rule=fused.get('rule_name'), content=findings[fused.get('number')], fused=True, usage=usage, cost=cost)
+			completed = update_complete_task(commit_id, request_id, fused.get('number'), mode, fused_result, dimensions)
+			if completed is not None:
+				record = completed
+				record_usage(project_name, fused_result)
+	else:
+		record = update_complete_task(commit_id, request_id, number, mode, result, dimensions)
+		if record is not None:
+			record_usage(project_name, result)
+	# 计数器更新返回的记录即可判断是否完成，只有完成最后一个子任务的执行器能认领报告
+	task_base.check_request_counters(record, log)
+	if event.get('checkpoint'):
+		delete_checkpoint(event.get('checkpoint'))
 	log.info(f'Review result is saved in {label}', extra=dict(label=label, result=result))
 	return 
 		
@@ -536,7 +1056,7 @@ def create_task(commit_id, request_id, number, mode, model):
 	try:
 		datetime_str = str(datetime.datetime.now())
 		table_name = os.getenv('TASK_TABLE')
-		dynamodb.Table(table_name).put_item(Item={
+		datastore.put_item(table_name, {
 			'request_id': request_id,
 			'number': number,
 			'mode': mode,
@@ -548,41 +1068,117 @@ def create_task(commit_id, request_id, number, mode, model):
 	except Exception as e:
 		raise Exception (f'Fail to create TASK for commit_id({commit_id}) and mode({mode}).') from e
 	
-def update_complete_task(commit_id, request_id, number, mode, result):
+def to_decimal(value):
+	return Decimal(str(round(value or 0, 8)))
+
+def record_usage(project_name, result):
+	"""
+	累计项目的每日用量（总计与每条规则各一条记录），并输出用量指标
+
+	用量记录与Request记录在同一张表中（commit_id为usage#项目名，request_id为日期或日期#规则），
+	没有task_status字段，不会进入TaskStatusIndex。计数在本次Lambda调用结束时合并写入。
+	"""
+	usage = result.get('usage')
+	if not usage:
+		return
+	project_name = project_name or 'unknown'
+	rule_name = result.get('rule') or 'none'
+	cost = to_decimal(result.get('cost'))
+	date = datetime.date.today().isoformat()
+	for sort_key in (date, f'{date}#{rule_name}'):
+		key = dict(commit_id=f'{USAGE_KEY_PREFIX}{project_name}', request_id=sort_key)
+		for field in USAGE_FIELDS:
+			datastore.add_counter(REQUEST_TABLE, key, field, usage.get(field, 0))
+		datastore.add_counter(REQUEST_TABLE, key, 'cost', cost)
+		datastore.add_counter(REQUEST_TABLE, key, 'tasks', 1)
+		datastore.add_counter(REQUEST_TABLE, key, 'findings', len(result.get('content') or []))
+
+	dimensions = dict(Project=project_name, Rule=rule_name)
+	metrics.emit('BedrockInputTokens', usage.get('input_tokens', 0), 'Count', dimensions)
+	metrics.emit('BedrockOutputTokens', usage.get('output_tokens', 0), 'Count', dimensions)
+	metrics.emit('BedrockCost', float(cost), 'None', dimensions)
+
+def update_complete_task(commit_id, request_id, number, mode, result, dimensions=None):
+	"""
+	写入结果并累加Request的完成计数
+
+	Task记录以succ不为true作为条件，与Request的完成计数、用量在同一事务中写入：同一任务的重复消息或重复写入
+	（例如批量推理结果被再次读取）不会重复累加，计数写入失败时也不会留下已完成却未计数的Task。
+	S3与DynamoDB的写入耗时按dimensions输出指标。
+
+	Returns:
+		dict: 更新后的Request记录；任务此前已完成时返回None
+	"""
 	try:
 
-		# 保存数据到S3
+		# 压缩后保存数据到S3
 		s3_data = result
 		bucket_name = os.getenv('BUCKET_NAME')
 		s3_key = f"result/{request_id}/{number}.json"
-		base.put_s3_object(s3, bucket_name, s3_key, base.dump_json(s3_data), 'Content-Type: application/json')
+		with metrics.timer('S3WriteTime', dimensions):
+			s3_codec.put_object(s3, bucket_name, s3_key, base.dump_json(s3_data), 'application/json')
 		
 		datetime_str = str(datetime.datetime.now())
 		table_name = os.getenv('TASK_TABLE')
-		dynamodb.Table(table_name).update_item(
-			Key={'request_id': request_id, 'number': number},
-			UpdateExpression='set succ = :s, update_time = :t, bedrock_model = :bm, bedrock_start_time = :bst, bedrock_end_time = :bet, bedrock_timecost = :btc, #d = :d',
-			ExpressionAttributeNames={
-				'#d': 'data'
-			},
-			ExpressionAttributeValues={
-				':s': True,
-				':t': datetime_str,
-				':bm': result.get('model'),
-				':bst': result.get('start_time'),
-				':bet': result.get('end_time'),
-				':btc': result.get('timecost'),
-				':d': s3_key
-			},
-			ReturnValues='ALL_NEW'
-		)
-		# 更新Request表
-		dynamodb.Table(REQUEST_TABLE).update_item(
-			Key = { 'commit_id': commit_id, 'request_id': request_id },
-			UpdateExpression = 'set task_status = :s, task_complete = task_complete + :tc, update_time = :t',
-			ExpressionAttributeValues = { ':s': base.STATUS_PROCESSING, ':tc': 1, ':t': datetime_str },
-			ReturnValues = 'ALL_NEW'
-		)
+		expression = 'set succ = :s, update_time = :t, #m = :bm, bedrock_model = :bm, bedrock_start_time = :bst, bedrock_end_time = :bet, bedrock_timecost = :btc, #d = :d'
+		values = {
+			':s': True,
+			':t': datetime_str,
+			':bm': result.get('model'),
+			':bst': result.get('start_time'),
+			':bet': result.get('end_time'),
+			':btc': result.get('timecost'),
+			':d': s3_key
+		}
+		if result.get('time_to_first_token') is not None:
+			expression += ', bedrock_ttft = :ttft, bedrock_tto = :tto'
+			values.update({ ':ttft': result.get('time_to_first_token'), ':tto': result.get('time_to_output') })
+		if result.get('cache_read_tokens') is not None:
+			expression += ', bedrock_cache_read = :bcr, bedrock_cache_write = :bcw'
+			values.update({ ':bcr': result.get('cache_read_tokens'), ':bcw': result.get('cache_write_tokens') })
+		if any(method != json_recovery.METHOD_STRICT for method in result.get('json_recovery') or []):
+			expression += ', json_recovery = :jr'
+			values[':jr'] = result.get('json_recovery')
+		if result.get('reasoning_budget'):
+			expression += ', bedrock_reasoning_budget = :brb'
+			values[':brb'] = result.get('reasoning_budget')
+		usage = result.get('usage')
+		if usage:
+			expression += ', bedrock_input_tokens = :bit, bedrock_output_tokens = :bot, bedrock_reasoning_tokens = :brt, bedrock_cost = :bc, bedrock_usage_estimated = :bue'
+			values.update({
+				':bit': usage.get('input_tokens', 0), ':bot': usage.get('output_tokens', 0),
+				':brt': usage.get('reasoning_tokens', 0), ':bc': to_decimal(result.get('cost')),
+				':bue': bool(usage.get('estimated')),
+			})
+		# 追加到Request的发现汇总，报告直接读取汇总，不再逐个读取S3结果；重复写入覆盖为同样的内容
+		report.append_findings(request_id, number, result, s3_key)
+		# Task记录与Request的完成计数、用量在同一事务中更新
+		request_key = { 'commit_id': commit_id, 'request_id': request_id }
+		counter_expression = 'set task_complete = task_complete + :tc, update_time = :t'
+		counter_values = { ':tc': 1, ':t': datetime_str }
+		if usage:
+			counter_expression += ' ADD ' + ', '.join(f'usage_{field} :u{i}' for i, field in enumerate(USAGE_FIELDS)) + ', usage_cost :uc'
+			counter_values.update({ f':u{i}': usage.get(field, 0) for i, field in enumerate(USAGE_FIELDS) })
+			counter_values[':uc'] = to_decimal(result.get('cost'))
+		write_start = time.time()
+		try:
+			datastore.transact_update([
+				dict(
+					table_name=table_name, key={'request_id': request_id, 'number': number},
+					expression=expression, names={ '#d': 'data', '#m': 'model' }, values=values,
+					condition='attribute_not_exists(succ) OR succ <> :s',
+				),
+				dict(table_name=REQUEST_TABLE, key=request_key, expression=counter_expression, values=counter_values),
+			])
+		except ClientError as ex:
+			if not datastore.is_condition_failed(ex):
+				raise
+			log.info(f'Task(request_id={request_id}, number={number}) is already complete.')
+			return None
+		# 事务不返回更新后的记录，强一致读取用于判断是否完成
+		record = datastore.get_item(REQUEST_TABLE, request_key, consistent=True)
+		metrics.emit('DynamoDBWriteTime', int((time.time() - write_start) * 1000), 'Milliseconds', dimensions)
+		return record
 	except Exception as e:
 		raise Exception (f'Fail to update TASK COMPLETE for commit_id({commit_id}) and mode({mode}).') from e
 	
@@ -590,10 +1186,10 @@ def update_failure_task(commit_id, request_id, number, mode, error_message, prom
 	try:
 		datetime_str = str(datetime.datetime.now())
 		table_name = os.getenv('TASK_TABLE')
-		dynamodb.Table(table_name).update_item(
-			Key = { 'request_id': request_id, 'number': number },
-			UpdateExpression = 'set retry_times = retry_times + :rt, succ = :s, message = :m, update_time = :t, bedrock_system = :bsp, bedrock_prompt = :bup',
-			ExpressionAttributeValues = { 
+		datastore.update_item(
+			table_name, { 'request_id': request_id, 'number': number },
+			'set retry_times = retry_times + :rt, succ = :s, message = :m, update_time = :t, bedrock_system = :bsp, bedrock_prompt = :bup',
+			values = { 
 				':rt': 1,
 				':s': False, 
 				':m': error_message,
@@ -601,17 +1197,35 @@ def update_failure_task(commit_id, request_id, number, mode, error_message, prom
 				':bsp': prompt_system,
 				':bup': prompt_user
 			},
-			ReturnValues = 'ALL_NEW'
 		)
 		if not need_retry:
-			dynamodb.Table(REQUEST_TABLE).update_item(
-				Key = { 'commit_id': commit_id, 'request_id': request_id },
-				UpdateExpression = 'set task_status = :s, task_failure = task_failure + :tf, update_time = :t',
-				ExpressionAttributeValues = { ':s': base.STATUS_PROCESSING, ':tf': 1, ':t': datetime_str },
-				ReturnValues = 'ALL_NEW'
+			return datastore.update_item(
+				REQUEST_TABLE, { 'commit_id': commit_id, 'request_id': request_id },
+				'set task_failure = task_failure + :tf, update_time = :t',
+				values = { ':tf': 1, ':t': datetime_str },
+				return_values = 'ALL_NEW',
 			)
 	except Exception as ex:
 		log.info(f'Fail to update TASK FAILURE for commit_id({commit_id}) and mode({mode}).', extra=dict(exception=str(ex)))
+	return None
+
+def cancel_task(commit_id, request_id, number, mode):
+	try:
+		datetime_str = str(datetime.datetime.now())
+		table_name = os.getenv('TASK_TABLE')
+		datastore.update_item(
+			table_name, { 'request_id': request_id, 'number': number },
+			'set succ = :s, cancelled = :c, message = :m, update_time = :t',
+			values = { ':s': False, ':c': True, ':m': 'Superseded by a newer commit.', ':t': datetime_str },
+		)
+		return datastore.update_item(
+			REQUEST_TABLE, { 'commit_id': commit_id, 'request_id': request_id },
+			'set update_time = :t ADD task_cancel :tca',
+			values = { ':tca': 1, ':t': datetime_str },
+			return_values = 'ALL_NEW',
+		)
+	except Exception as e:
+		raise Exception (f'Fail to update TASK CANCELLED for commit_id({commit_id}) and mode({mode}).') from e
 
 def validate_sqs_event(event):
 	required = [ 'context', 'commit_id', 'mode', 'model', 'rule_name', 'prompt_user', 'prompt_system' ]
@@ -620,28 +1234,89 @@ def validate_sqs_event(event):
 			raise Exception(f'SQS event does not have field {field} - {event}')
 	return True
 
-def lambda_handler(event, context):
-
-	log.info(event, extra=dict(label='event'))
-	log.info('Receiving {} SQS records'.format(len(event["Records"])))
+def process_record(record, deadline=None):
+	"""
+	处理单条SQS记录，deadline为Lambda超时的时间戳
 
-	batch_item_failures, batch_item_successes = [], []
-	for record in event["Records"]:
-		
-		log.info('Processing SQS record.', extra=dict(record=record))
+	Returns:
+		bool: True表示记录处理成功（包括已重新投递延迟重试消息）
+	"""
+	log.info('Processing SQS record.', extra=dict(record=record))
 
+	try:
 		base64_text = record["body"]
 		body_text = base.decode_base64(base64_text)
 		log.info(body_text, extra=dict(label='plain body'))
 		
 		sqs_event = json.loads(body_text)
 		sqs_context = sqs_event.get('context', {})
-	
-		try:
-			handle_code_review(record, sqs_event, sqs_context)
+	except Exception as ex:
+		log.info(f'Fail to parse SQS record.', extra=dict(exception=str(ex)))
+		return False
+
+	emit_queue_wait(record, sqs_event)
+
+	try:
+		handle_code_review(record, sqs_event, sqs_context, deadline)
+		return True
+	except RetryLaterException as ex:
+		# 已重新投递延迟消息时，当前消息视为处理成功
+		return schedule_retry(sqs_event, ex)
+	except CheckpointException as ex:
+		# 剩余时间不足，已完成的轮次保存在检查点中，由新的调用继续
+		return schedule_continuation(sqs_event, ex)
+	except Exception as ex:
+		log.info(f'Fail to check code review result.', extra=dict(exception=str(ex)))
+		return False
+
+def emit_queue_wait(record, sqs_event):
+	"""
+	SQS排队时间：从消息的SentTimestamp到开始处理，延迟重试消息包含其DelaySeconds
+	"""
+	sent = (record.get('attributes') or {}).get('SentTimestamp')
+	if not sent:
+		return
+	context = dict(sqs_event.get('context') or {}, mode=sqs_event.get('mode'))
+	wait = max(0, int(time.time() * 1000) - int(sent))
+	metrics.emit('SqsQueueWait', wait, 'Milliseconds', get_metric_dimensions(sqs_event.get('model'), context))
+
+def process_records(records, deadline=None):
+	"""
+	并发处理一批SQS记录，并发数由RECORD_CONCURRENCY控制，Bedrock调用数另由bedrock_slots限制
+
+	Returns:
+		list: 与records顺序一致的处理结果
+	"""
+	workers = min(max(1, RECORD_CONCURRENCY), len(records))
+	if workers <= 1:
+		return [ process_record(record, deadline) for record in records ]
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		return list(pool.map(lambda record: process_record(record, deadline), records))
+
+def lambda_handler(event, context):
+
+	log.info(event, extra=dict(label='event'))
+	records = event["Records"]
+	log.info('Receiving {} SQS records'.format(len(records)))
+
+	batch_item_failures, batch_item_successes = [], []
+	deadline = time.time() + context.get_remaining_time_in_millis() / 1000 if hasattr(context, 'get_remaining_time_in_millis') else None
+	try:
+		results = process_records(records, deadline)
+	finally:
+		# 本次调用缓存的指标统一输出
+		metrics.flush()
+
+	# 本次调用累计的用量合并写入
+	try:
+		datastore.flush_counters()
+	except Exception as ex:
+		log.error('Fail to update usage counters.', extra=dict(exception=str(ex)))
+
+	for record, succeeded in zip(records, results):
+		if succeeded:
 			batch_item_successes.append({"itemIdentifier": record['messageId']})
-		except Exception as ex:
-			log.info(f'Fail to check code review result.', extra=dict(exception=str(ex)))
+		else:
 			batch_item_failures.append({"itemIdentifier": record['messageId']})
 
 	batch_response = dict(batchItemSeccesses = batch_item_successes, batchItemFailures = batch_item_failures)
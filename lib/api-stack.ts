@@ -103,7 +103,7 @@ export class CRApi extends Construct {
 			logGroup: logGroup
 		})
 		const bedrock_policy = new iam.PolicyStatement({
-            actions: ["bedrock:InvokeModel"],
+            actions: ["bedrock:InvokeModel", "bedrock:InvokeModelWithResponseStream"],
             resources: ["*"],
         })
 		this.task_executor.role?.addToPrincipalPolicy(bedrock_policy)
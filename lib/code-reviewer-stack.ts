@@ -1,4 +1,5 @@
 import * as cdk from 'aws-cdk-lib';
+import * as iam from 'aws-cdk-lib/aws-iam';
 import { SnsEventSource, SqsEventSource } from 'aws-cdk-lib/aws-lambda-event-sources';
 import { Construct } from 'constructs';
 import { CRBucket  } from './bucket-stack';
@@ -148,6 +149,16 @@ export class CodeReviewerStack extends cdk.Stack {
 		/* 数据库 */
 		const database = new CRDatabase(this, 'Database', { prefix: prefix })
 
+		/* Bedrock批量推理作业使用的服务角色，读取输入JSONL并写回输出 */
+		const batch_role = new iam.Role(this, 'BatchInferenceRole', {
+			assumedBy: new iam.ServicePrincipal('bedrock.amazonaws.com'),
+		})
+		buckets.report_bucket.grantReadWrite(batch_role)
+		batch_role.addToPrincipalPolicy(new iam.PolicyStatement({
+			actions: ["bedrock:InvokeModel"],
+			resources: ["*"],
+		}))
+
 		/* 配置环境变量 */
 		api.request_handler.addEnvironment('REQUEST_TABLE', database.request_table.tableName)
 		api.request_handler.addEnvironment('TASK_DISPATCHER_FUN_NAME', api.task_dispatcher.functionName)
@@ -164,6 +175,10 @@ export class CodeReviewerStack extends cdk.Stack {
 		api.task_dispatcher.addEnvironment('SNS_TOPIC_ARN', sns.report_topic.topicArn)
 		api.task_dispatcher.addEnvironment('ACCESS_TOKEN', access_token.valueAsString)
 		api.task_dispatcher.addEnvironment('BASE_RULES', base_rules.valueAsString)
+		api.task_dispatcher.addEnvironment('PROMPT_CACHE', 'false')
+		api.task_dispatcher.addEnvironment('BATCH_INFERENCE', 'false')
+		api.task_dispatcher.addEnvironment('BATCH_ROLE_ARN', batch_role.roleArn)
+		api.task_dispatcher.addEnvironment('BATCH_MIN_RECORDS', '100')
 
 		api.task_executor.addEnvironment('BUCKET_NAME', buckets.report_bucket.bucketName)
 		api.task_executor.addEnvironment('REQUEST_TABLE', database.request_table.tableName)
@@ -176,11 +191,17 @@ export class CodeReviewerStack extends cdk.Stack {
 		api.task_executor.addEnvironment('TEMPERATURE', '0')
 		api.task_executor.addEnvironment('TOP_P', '1')
 		api.task_executor.addEnvironment('MAX_TOKEN_TO_SAMPLE', '10000')
+		api.task_executor.addEnvironment('BEDROCK_STREAMING', 'false')
+		api.task_executor.addEnvironment('RECORD_CONCURRENCY', '4')
+		api.task_executor.addEnvironment('BEDROCK_CONCURRENCY', '4')
+		api.task_executor.addEnvironment('RATE_CONTROL', 'true')
+		api.task_executor.addEnvironment('RATE_INITIAL', '60')
 		api.task_executor.addEnvironment('MAX_FAILED_TIMES', '6')
 		api.task_executor.addEnvironment('REPORT_TIMEOUT_SECONDS', '900')
 		api.task_executor.addEnvironment('BEDROCK_ACCESS_KEY', bedrock_access_key.valueAsString)
 		api.task_executor.addEnvironment('BEDROCK_SECRET_KEY', bedrock_secret_key.valueAsString)
 		api.task_executor.addEnvironment('BEDROCK_REGION', bedrock_region.valueAsString)
+		api.task_executor.addEnvironment('BEDROCK_REGION_POOL', '')
 		api.task_executor.addEnvironment('ACCESS_TOKEN', access_token.valueAsString)
 
 		api.report_receiver.addEnvironment('SMTP_SERVER', smtp_server.valueAsString)
@@ -189,6 +210,7 @@ export class CodeReviewerStack extends cdk.Stack {
 		api.report_receiver.addEnvironment('SMTP_PASSWORD', smtp_password.valueAsString)
 		api.report_receiver.addEnvironment('REPORT_SENDER', report_sender.valueAsString)
 		api.report_receiver.addEnvironment('REPORT_RECEIVER', report_receiver.valueAsString)
+		api.report_receiver.addEnvironment('BUCKET_NAME', buckets.report_bucket.bucketName)
 
 		/* 触发Lambda */
 		api.task_executor.addEventSource(new SqsEventSource(sqs.task_queue))
@@ -200,12 +222,18 @@ export class CodeReviewerStack extends cdk.Stack {
 		cron.cron_func.addEnvironment('TASK_TABLE', database.task_table.tableName)
 		cron.cron_func.addEnvironment('SNS_TOPIC_ARN', sns.report_topic.topicArn)
 		cron.cron_func.addEnvironment('REPORT_TIMEOUT_SECONDS', `900`)
+		cron.cron_func.addEnvironment('TASK_SQS_URL', sqs.task_queue.queueUrl)
+		cron.cron_func.addEnvironment('BATCH_INFERENCE', 'false')
+		cron.cron_func.addEnvironment('BATCH_TIMEOUT_SECONDS', '90000')
+		cron.cron_func.addEnvironment('MAX_FAILED_TIMES', '6')
 		cron.cron_func.addEnvironment('ACCESS_TOKEN', access_token.valueAsString)
 
 		/* 权限配置 */
 		buckets.report_bucket.grantReadWrite(api.task_dispatcher)
 		buckets.report_bucket.grantReadWrite(api.task_executor)
 		buckets.report_bucket.grantRead(api.result_checker)
+		buckets.report_bucket.grantRead(api.report_receiver)
+		buckets.report_bucket.grantReadWrite(cron.cron_func)
 		
 		database.request_table.grantReadWriteData(api.request_handler)
 		database.request_table.grantReadData(api.result_checker)
@@ -214,13 +242,24 @@ export class CodeReviewerStack extends cdk.Stack {
 		database.request_table.grantReadWriteData(cron.cron_func)
 
 		database.task_table.grantReadWriteData(api.task_executor)
-		database.task_table.grantReadData(api.task_dispatcher)
 		database.task_table.grantReadData(api.result_checker)
-		database.task_table.grantReadData(cron.cron_func)
+		database.task_table.grantReadWriteData(api.task_dispatcher)
+		database.task_table.grantReadWriteData(cron.cron_func)
 		
 		sqs.task_queue.grantSendMessages(api.task_dispatcher)
 		sqs.task_queue.grantSendMessages(api.task_executor)
 		sqs.task_queue.grantConsumeMessages(api.task_executor)
+		sqs.task_queue.grantSendMessages(cron.cron_func)
+
+		api.task_dispatcher.role?.addToPrincipalPolicy(new iam.PolicyStatement({
+			actions: ["bedrock:CreateModelInvocationJob"],
+			resources: ["*"],
+		}))
+		batch_role.grantPassRole(api.task_dispatcher.role!)
+		cron.cron_func.role?.addToPrincipalPolicy(new iam.PolicyStatement({
+			actions: ["bedrock:GetModelInvocationJob", "bedrock:InvokeModel"],
+			resources: ["*"],
+		}))
 		
 		sns.report_topic.grantPublish(api.task_dispatcher)
 		sns.report_topic.grantPublish(api.task_executor)
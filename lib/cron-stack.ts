@@ -18,7 +18,8 @@ export class CRCron extends Construct {
 			runtime: lambda.Runtime.PYTHON_3_12,
 			code: lambda.Code.fromAsset('lambda'),
 			handler: 'cron_function.lambda_handler',
-			timeout: cdk.Duration.seconds(30),
+			/* 批量推理作业结束后在cron中写入结果，写入可重复执行，超时中断后由下一次调度继续 */
+			timeout: cdk.Duration.minutes(5),
 			layers: props.layers ?? []
 		})
 
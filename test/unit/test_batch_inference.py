@@ -0,0 +1,254 @@
+"""
+batch_inference.py 单元测试
+
+测试目标：验证全量评审的Bedrock批量推理流程
+- 只有定时触发的全量评审走批量推理
+- 记录数不足时退回SQS交互执行
+- 提交作业后写入JSONL、任务清单与Request的batch_jobs
+- 作业完成后结果按Executor的格式写入，无法使用的记录重新发送到SQS
+
+测试方法：使用moto模拟S3与DynamoDB，作业使用本地替身执行
+"""
+
+import sys
+import os
+import json
+import types
+import datetime
+import pytest
+import boto3
+from unittest.mock import patch
+from moto import mock_aws
+
+# 在导入被测模块前，注入 awslambdaric 替身，避免本地缺少该依赖导致导入失败
+if 'awslambdaric.lambda_runtime_log_utils' not in sys.modules:
+    _parent = types.ModuleType('awslambdaric')
+    _sub = types.ModuleType('awslambdaric.lambda_runtime_log_utils')
+    class _JsonFormatter:
+        def __init__(self, *a, **k):
+            pass
+        def format(self, record):
+            return '{}'
+    _sub.JsonFormatter = _JsonFormatter
+    sys.modules['awslambdaric'] = _parent
+    sys.modules['awslambdaric.lambda_runtime_log_utils'] = _sub
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import base
+import datastore
+import s3_codec
+import batch_inference
+import task_executor
+import task_dispatcher
+import cron_function
+
+BUCKET_NAME = 'batch-test-bucket'
+REQUEST_TABLE = 'batch-test-request'
+TASK_TABLE = 'batch-test-task'
+COMMIT_ID = 'c1'
+REQUEST_ID = 'r1'
+
+
+def make_item(number, rule_name='rule-a', fused_rules=None):
+    item = dict(
+        context=dict(invoker='webhook'), commit_id=COMMIT_ID, request_id=REQUEST_ID, number=number,
+        mode='all', model='claude3.7-sonnet', rule_name=rule_name, prompt_system='system', prompt_user=f'code {number}',
+    )
+    if fused_rules:
+        item['fused_rules'] = fused_rules
+    return item
+
+
+def fake_invoke(model_id, model_input):
+    """第2条记录返回无法解析的文本，其余返回一条发现"""
+    text = model_input['messages'][0]['content'][0]['text']
+    if text == 'code 2':
+        return dict(content=[ dict(type='text', text='I cannot review this.') ])
+    return dict(content=[ dict(type='text', text='<output>[{"title": "%s", "rule_name": "rule-b"}]</output>' % text) ])
+
+
+@pytest.fixture
+def aws():
+    """创建S3桶与两张表，作业由本地替身执行"""
+    with mock_aws():
+        s3 = boto3.resource('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BUCKET_NAME)
+        dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+        dynamodb.create_table(
+            TableName=REQUEST_TABLE,
+            KeySchema=[{'AttributeName': 'commit_id', 'KeyType': 'HASH'}, {'AttributeName': 'request_id', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[
+                {'AttributeName': 'commit_id', 'AttributeType': 'S'}, {'AttributeName': 'request_id', 'AttributeType': 'S'},
+                {'AttributeName': 'task_status', 'AttributeType': 'S'}, {'AttributeName': 'create_time', 'AttributeType': 'S'},
+            ],
+            GlobalSecondaryIndexes=[{
+                'IndexName': 'TaskStatusIndex',
+                'KeySchema': [{'AttributeName': 'task_status', 'KeyType': 'HASH'}, {'AttributeName': 'create_time', 'KeyType': 'RANGE'}],
+                'Projection': {'ProjectionType': 'ALL'},
+            }],
+            BillingMode='PAY_PER_REQUEST',
+        )
+        dynamodb.create_table(
+            TableName=TASK_TABLE,
+            KeySchema=[{'AttributeName': 'request_id', 'KeyType': 'HASH'}, {'AttributeName': 'number', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[{'AttributeName': 'request_id', 'AttributeType': 'S'}, {'AttributeName': 'number', 'AttributeType': 'N'}],
+            BillingMode='PAY_PER_REQUEST',
+        )
+        dynamodb.Table(REQUEST_TABLE).put_item(Item=dict(
+            commit_id=COMMIT_ID, request_id=REQUEST_ID, task_status=base.STATUS_START, create_time=str(datetime.datetime.now()),
+            task_complete=0, task_failure=0, task_cancel=0, task_total=4,
+        ))
+        env = { 'BUCKET_NAME': BUCKET_NAME, 'REQUEST_TABLE': REQUEST_TABLE, 'TASK_TABLE': TASK_TABLE }
+        run_local_job = batch_inference.run_local_job
+        local_job = lambda bucket, input_key, output_prefix, model_id: run_local_job(bucket, input_key, output_prefix, model_id, invoke=fake_invoke)
+        with patch.dict(os.environ, env), patch.object(datastore, 'dynamodb', dynamodb), \
+                patch.object(batch_inference, 's3', s3), patch.object(task_executor, 's3', s3), \
+                patch.object(task_executor, 'REQUEST_TABLE', REQUEST_TABLE), patch.object(cron_function, 'REQUEST_TABLE', REQUEST_TABLE), \
+                patch.multiple(batch_inference, BATCH_INFERENCE=True, BATCH_INFERENCE_LOCAL=True, BATCH_MIN_RECORDS=3), \
+                patch.object(batch_inference, 'run_local_job', side_effect=local_job), \
+                patch.object(batch_inference, 'send_task', return_value=True) as send_task:
+            yield dynamodb, s3, send_task
+
+
+class TestBatchInference:
+    """batch_inference.py 测试类"""
+
+    def test_only_scheduled_whole_project_reviews_use_batch(self):
+        """
+        测试目的：验证只有非Webtool的全量评审走批量推理
+        """
+        with patch.object(batch_inference, 'BATCH_INFERENCE', True):
+            assert batch_inference.is_batch_task(dict(invoker='webhook'), dict(mode='all'))
+            assert not batch_inference.is_batch_task(dict(invoker='webtool'), dict(mode='all'))
+            assert not batch_inference.is_batch_task(dict(invoker='webhook'), dict(mode='diff'))
+        with patch.object(batch_inference, 'BATCH_INFERENCE', False):
+            assert not batch_inference.is_batch_task(dict(invoker='webhook'), dict(mode='all'))
+
+    def test_small_group_falls_back_to_sqs(self, aws):
+        """
+        测试目的：验证记录数少于BATCH_MIN_RECORDS时不提交作业
+
+        期望结果：所有任务原样返回，Request记录没有batch_jobs
+        """
+        dynamodb, _, _ = aws
+        items = [ make_item(1), make_item(2) ]
+        assert batch_inference.submit(COMMIT_ID, REQUEST_ID, items) == items
+        record = dynamodb.Table(REQUEST_TABLE).get_item(Key=dict(commit_id=COMMIT_ID, request_id=REQUEST_ID))['Item']
+        assert 'batch_jobs' not in record
+
+    def test_confirm_tasks_fall_back_to_sqs(self, aws):
+        """
+        测试目的：验证需要确认轮次的任务不提交批量作业，避免confirm_prompt被静默忽略
+
+        期望结果：带confirm_prompt的任务原样返回交互执行，其余任务提交作业
+        """
+        dynamodb, s3, _ = aws
+        confirm = dict(make_item(2), confirm_prompt='confirm')
+        items = [ make_item(1), confirm, make_item(3), make_item(4) ]
+        assert batch_inference.submit(COMMIT_ID, REQUEST_ID, items) == [ confirm ]
+
+        record = dynamodb.Table(REQUEST_TABLE).get_item(Key=dict(commit_id=COMMIT_ID, request_id=REQUEST_ID))['Item']
+        job = record['batch_jobs'][0]
+        assert job['count'] == 3
+        lines = base.get_s3_object(s3, BUCKET_NAME, f'{job["prefix"]}/input.jsonl').splitlines()
+        assert [ json.loads(line)['recordId'] for line in lines ] == [ '1', '3', '4' ]
+
+    def test_submit_and_ingest(self, aws):
+        """
+        测试目的：验证提交作业与写入结果的完整流程
+
+        测试过程：
+        1. 提交4个任务，其中第3个任务合并了两条规则（编号3、4）
+        2. 本地替身执行作业，第2条记录的输出无法解析
+        3. poll_request读取输出并写入结果
+
+        期望结果：
+        - 输入JSONL每个任务一行，recordId为任务编号
+        - Task表为每个编号创建了记录
+        - 可解析的任务写入S3结果，合并任务按rule_name拆分
+        - 第2个任务重新发送到SQS，作业标记为已写入，不会重复写入
+        """
+        dynamodb, s3, send_task = aws
+        items = [ make_item(1), make_item(2), make_item(3, fused_rules=[ dict(rule_name='rule-a', number=3), dict(rule_name='rule-b', number=4) ]) ]
+        assert batch_inference.submit(COMMIT_ID, REQUEST_ID, items) == []
+
+        record = dynamodb.Table(REQUEST_TABLE).get_item(Key=dict(commit_id=COMMIT_ID, request_id=REQUEST_ID))['Item']
+        job = record['batch_jobs'][0]
+        assert job['status'] == batch_inference.JOB_SUBMITTED and job['count'] == 3
+        assert record['task_status'] == base.STATUS_PROCESSING
+        lines = base.get_s3_object(s3, BUCKET_NAME, f'{job["prefix"]}/input.jsonl').splitlines()
+        assert [ json.loads(line)['recordId'] for line in lines ] == [ '1', '2', '3' ]
+        tasks = dynamodb.Table(TASK_TABLE).scan()['Items']
+        assert sorted(int(task['number']) for task in tasks) == [ 1, 2, 3, 4 ]
+
+        assert batch_inference.has_pending_jobs(record)
+        assert batch_inference.poll_request(record)
+
+        result = json.loads(s3_codec.get_object(s3, BUCKET_NAME, f'result/{REQUEST_ID}/1.json'))
+        assert result['content'] == [ { 'title': 'code 1', 'rule_name': 'rule-b' } ]
+        fused_a = json.loads(s3_codec.get_object(s3, BUCKET_NAME, f'result/{REQUEST_ID}/3.json'))
+        fused_b = json.loads(s3_codec.get_object(s3, BUCKET_NAME, f'result/{REQUEST_ID}/4.json'))
+        assert fused_a['content'] == [] and len(fused_b['content']) == 1
+        assert send_task.call_args[0][0]['number'] == 2
+
+        record = dynamodb.Table(REQUEST_TABLE).get_item(Key=dict(commit_id=COMMIT_ID, request_id=REQUEST_ID))['Item']
+        assert record['task_complete'] == 3
+        assert not batch_inference.has_pending_jobs(record)
+        assert not batch_inference.poll_request(record)
+
+    def test_ingest_is_idempotent(self, aws):
+        """
+        测试目的：验证同一作业被重复写入（例如cron写入过程中超时后再次执行）时不会重复计数或重复发送
+
+        期望结果：第二次写入没有任务被计入，task_complete仍为2，无法使用的任务只发送一次
+        """
+        dynamodb, _, send_task = aws
+        items = [ make_item(1), make_item(2), make_item(3) ]
+        batch_inference.submit(COMMIT_ID, REQUEST_ID, items)
+        record = dynamodb.Table(REQUEST_TABLE).get_item(Key=dict(commit_id=COMMIT_ID, request_id=REQUEST_ID))['Item']
+        job = dict(record['batch_jobs'][0], status='Completed')
+
+        assert batch_inference.ingest(COMMIT_ID, REQUEST_ID, job) == (2, 1)
+        assert batch_inference.ingest(COMMIT_ID, REQUEST_ID, job) == (0, 0)
+
+        record = dynamodb.Table(REQUEST_TABLE).get_item(Key=dict(commit_id=COMMIT_ID, request_id=REQUEST_ID))['Item']
+        assert record['task_complete'] == 2
+        assert send_task.call_count == 1
+
+    def test_dispatcher_to_cron(self, aws):
+        """
+        测试目的：验证从Task Dispatcher提交批量作业到cron写入结果并生成报告的完整流程
+
+        测试过程：
+        1. Task Dispatcher分发3个全量评审任务，全部提交为批量作业，没有SQS消息
+        2. cron按TaskStatusIndex扫描到处理中的Request，读取作业输出并写入结果
+
+        期望结果：Request在提交作业后为Processing，cron写入3个结果后认领并生成一次报告
+        """
+        dynamodb, _, send_task = aws
+        dynamodb.Table(REQUEST_TABLE).update_item(
+            Key=dict(commit_id=COMMIT_ID, request_id=REQUEST_ID),
+            UpdateExpression='set task_total = :t', ExpressionAttributeValues={ ':t': 3 },
+        )
+        rules = [ dict(name=f'rule-{i}', mode='all', model='claude3.7-sonnet', prompt_system='system', prompt_user='{{content}}') for i in range(3) ]
+        contents = [ dict(mode='all', filepath='<The Whole Project>', content=f'project {i}', rule=rule) for i, rule in enumerate(rules) ]
+        event = dict(commit_id=COMMIT_ID, request_id=REQUEST_ID, invoker='webhook', project_name='demo')
+
+        with patch.object(task_dispatcher, 'PROMPT_CACHE', False), \
+                patch.object(task_dispatcher, 'send_message') as send_message, \
+                patch.object(task_executor, 'record_usage'), \
+                patch.object(cron_function.task_base.report, 'generate_report_and_notify') as generate:
+            assert task_dispatcher.send_task_to_sqs(event, rules, REQUEST_ID, COMMIT_ID, contents)
+            record = dynamodb.Table(REQUEST_TABLE).get_item(Key=dict(commit_id=COMMIT_ID, request_id=REQUEST_ID))['Item']
+            assert record['task_status'] == base.STATUS_PROCESSING
+            assert not send_message.called
+
+            cron_function.lambda_handler(dict(), None)
+
+        record = dynamodb.Table(REQUEST_TABLE).get_item(Key=dict(commit_id=COMMIT_ID, request_id=REQUEST_ID))['Item']
+        assert record['task_complete'] == 3
+        assert record['task_status'] == base.STATUS_REPORTING
+        assert not batch_inference.has_pending_jobs(record)
+        assert generate.call_count == 1 and not send_task.called
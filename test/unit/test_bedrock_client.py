@@ -0,0 +1,55 @@
+"""
+bedrock_client.py 单元测试
+
+测试目标：验证Bedrock Runtime客户端按(region, 凭证, 超时配置)复用
+- 相同配置返回同一个客户端对象（复用连接池）
+- 不同超时配置或区域返回不同客户端
+- 客户端配置了连接池大小与超时
+
+注意：创建客户端不会发起网络请求，不需要AWS凭证
+"""
+
+import sys
+import os
+from unittest.mock import patch
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import bedrock_client
+
+
+class TestBedrockClient:
+    """bedrock_client.py 测试类"""
+
+    def test_client_reused_per_key(self):
+        """
+        测试目的：验证相同(region, 凭证, 超时)得到同一个客户端，不同则新建
+
+        期望结果：
+        - 两次相同参数的调用返回同一对象
+        - 超时或区域不同时返回不同对象
+        - 客户端的read_timeout与max_pool_connections符合配置
+        """
+        with patch.dict(bedrock_client._clients, clear=True):
+            first = bedrock_client.get_client(timeout=900, region='us-east-1')
+            second = bedrock_client.get_client(timeout=900, region='us-east-1')
+            other_timeout = bedrock_client.get_client(timeout=120, region='us-east-1')
+            other_region = bedrock_client.get_client(timeout=900, region='us-west-2')
+
+            assert first is second
+            assert other_timeout is not first
+            assert other_region is not first
+            assert first.meta.config.read_timeout == 900
+            assert first.meta.config.max_pool_connections == bedrock_client.BEDROCK_MAX_POOL_CONNECTIONS
+            assert other_region.meta.region_name == 'us-west-2'
+
+    def test_explicit_credentials_use_separate_client(self):
+        """
+        测试目的：验证显式凭证与默认凭证链使用不同的客户端
+        """
+        with patch.dict(bedrock_client._clients, clear=True):
+            default = bedrock_client.get_client(timeout=120, region='us-east-1')
+            explicit = bedrock_client.get_client(timeout=120, region='us-east-1', access_key='AKIA_TEST', secret_key='secret')
+            assert default is not explicit
+            assert explicit is bedrock_client.get_client(timeout=120, region='us-east-1', access_key='AKIA_TEST', secret_key='secret')
@@ -0,0 +1,127 @@
+"""
+bedrock_stream.py 单元测试
+
+测试目标：验证流式响应的增量解析
+- 标签跨chunk拆分时仍能识别</output>
+- 读到</output>后立即停止读取并关闭流，不再等待后续文本
+- 记录首token时间和输出完成时间
+- ConverseStream中reasoning与正文分开收集
+
+测试方法：使用本地构造的事件序列模拟Bedrock流，不调用真实服务
+"""
+
+import sys
+import os
+import json
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import bedrock_stream
+
+
+class FakeStream:
+    """可迭代的事件流，记录被消费的事件数以及是否被关闭"""
+
+    def __init__(self, events):
+        self.events = events
+        self.consumed = 0
+        self.closed = False
+
+    def __iter__(self):
+        for event in self.events:
+            self.consumed += 1
+            yield event
+
+    def close(self):
+        self.closed = True
+
+
+def anthropic_chunk(data):
+    return { 'chunk': { 'bytes': json.dumps(data).encode('utf-8') } }
+
+
+class TestBedrockStream:
+    """bedrock_stream.py 测试类"""
+
+    def test_watcher_detects_split_tags(self):
+        """
+        测试目的：验证<output>与</output>被拆分到多个chunk时仍能正确识别
+
+        期望结果：只有在</output>完整出现后feed才返回True
+        """
+        watcher = bedrock_stream.OutputWatcher(stop_at_output=True)
+        parts = [ '<thought>about </output', '</thought><out', 'put>[{"title": "x"}]</', 'output>' ]
+        results = [ watcher.feed(part) for part in parts ]
+
+        assert results == [ False, False, False, True ], "<output>之前的</output>不应触发完成"
+        assert watcher.text == ''.join(parts)
+        assert watcher.first_token_time is not None and watcher.output_time is not None
+
+    def test_invoke_model_stream_stops_after_output(self):
+        """
+        测试目的：验证InvokeModelWithResponseStream在</output>之后立即停止读取
+
+        测试过程：构造包含输出块以及大量尾随文本的事件序列
+
+        期望结果：
+        - 尾随事件未被消费，流被关闭
+        - stop_reason为output_complete，usage保留message_start中的输入token
+        """
+        events = [
+            anthropic_chunk({ 'type': 'message_start', 'message': { 'usage': { 'input_tokens': 120 } } }),
+            anthropic_chunk({ 'type': 'content_block_delta', 'delta': { 'type': 'text_delta', 'text': '<output>[]' } }),
+            anthropic_chunk({ 'type': 'content_block_delta', 'delta': { 'type': 'text_delta', 'text': '</output>' } }),
+        ] + [ anthropic_chunk({ 'type': 'content_block_delta', 'delta': { 'type': 'text_delta', 'text': 'trailing ' } }) for _ in range(50) ]
+        stream = FakeStream(events)
+
+        result = bedrock_stream.read_invoke_model_stream({ 'body': stream }, bedrock_stream.OutputWatcher(stop_at_output=True))
+
+        assert result['text'] == '<output>[]</output>'
+        assert result['stop_reason'] == bedrock_stream.STOP_REASON_OUTPUT
+        assert result['usage'] == { 'input_tokens': 120 }
+        assert stream.consumed == 3 and stream.closed
+
+    def test_converse_stream_collects_reasoning(self):
+        """
+        测试目的：验证ConverseStream中reasoning增量单独收集，输出不完整时读到流结束
+
+        期望结果：text与reasoning分离，stop_reason与usage来自流末尾事件
+        """
+        events = [
+            { 'contentBlockDelta': { 'delta': { 'reasoningContent': { 'text': 'let me ' } } } },
+            { 'contentBlockDelta': { 'delta': { 'reasoningContent': { 'text': 'think' } } } },
+            { 'contentBlockDelta': { 'delta': { 'text': '<output>[' } } },
+            { 'messageStop': { 'stopReason': 'max_tokens' } },
+            { 'metadata': { 'usage': { 'inputTokens': 10, 'outputTokens': 20 } } },
+        ]
+        stream = FakeStream(events)
+
+        result = bedrock_stream.read_converse_stream({ 'stream': stream }, bedrock_stream.OutputWatcher())
+
+        assert result['text'] == '<output>['
+        assert result['reasoning'] == 'let me think'
+        assert result['stop_reason'] == 'max_tokens'
+        assert result['usage'] == { 'inputTokens': 10, 'outputTokens': 20 }
+        assert not stream.closed
+
+    def test_output_last_is_read_to_the_end(self):
+        """
+        测试目的：验证提示词要求<output>在最后时不提前停止，要求<output>在前时回复以</output>结束
+
+        期望结果：
+        - is_output_first按最后一个包含格式说明的提示词判断
+        - 不提前停止时读完全部事件；提前停止时同一chunk中</output>之后的文本不进入回复
+        """
+        assert not bedrock_stream.is_output_first('Output all your message in this format "<thought>your thought</thought><output>your\nfinding</output>"')
+        assert bedrock_stream.is_output_first('format "<thought>t</thought><output>o</output>"', 'in this format "<output>your finding</output><thought>your thought</thought>".')
+        assert not bedrock_stream.is_output_first('no format here', None)
+
+        events = [ anthropic_chunk({ 'type': 'content_block_delta', 'delta': { 'type': 'text_delta', 'text': text } }) for text in [ '<output>[]</output><tho', 'ught>done</thought>' ] ]
+        stream = FakeStream(events)
+        result = bedrock_stream.read_invoke_model_stream({ 'body': stream }, bedrock_stream.OutputWatcher())
+        assert result['text'] == '<output>[]</output><thought>done</thought>' and stream.consumed == 2
+
+        stream = FakeStream(list(events))
+        result = bedrock_stream.read_invoke_model_stream({ 'body': stream }, bedrock_stream.OutputWatcher(stop_at_output=True))
+        assert result['text'] == '<output>[]</output>' and stream.consumed == 1
@@ -0,0 +1,65 @@
+"""
+context_guard.py 单元测试
+
+测试目标：验证上下文窗口检查与代码切分
+- 输入上限按可用的最大模型计算，并为回复预留token
+- 代码按行切分为有重叠的多段，过长的单行被截断
+- 运行时拆分得到约两半
+
+测试方法：直接调用切分函数，不访问AWS
+"""
+
+import sys
+import os
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import base
+import context_guard
+
+
+class TestContextGuard:
+    """context_guard.py 测试类"""
+
+    def test_input_limit(self):
+        """
+        测试目的：验证输入上限取模型中最大的上下文窗口，confirm轮次多预留一次回复
+        """
+        limit = context_guard.get_input_limit([ 'claude4.5-haiku', 'claude4-sonnet' ])
+        assert limit == int(200000 * context_guard.CONTEXT_SAFETY_RATIO) - context_guard.MAX_TOKEN_TO_SAMPLE
+        assert context_guard.get_input_limit([ 'claude4-sonnet' ], confirm=True) == limit - context_guard.MAX_TOKEN_TO_SAMPLE
+        assert context_guard.get_models('Claude4-Sonnet', [ dict(model='claude4.5-haiku'), 'claude3-haiku' ]) == [ 'claude4-sonnet', 'claude4.5-haiku', 'claude3-haiku' ]
+
+    def test_split_code_with_overlap(self):
+        """
+        测试目的：验证代码切分为不超过上限的多段，相邻两段重叠，且覆盖全部行
+
+        期望结果：
+        - 每段不超过max_tokens
+        - 下一段的首行号不大于上一段的末行号，重叠不超过overlap_lines
+        - 拼接去掉重叠后的各段等于原代码
+        """
+        lines = [ f'{i:03d}' + 'y' * 36 + '\n' for i in range(100) ]
+        chunks = context_guard.split_code(''.join(lines), 100, overlap_lines=3)
+        assert len(chunks) > 1
+        assert all(base.estimate_tokens(text) <= 100 for _, text in chunks)
+        rebuilt = []
+        for line, text in chunks:
+            parts = text.splitlines(keepends=True)
+            overlap = len(rebuilt) - (line - 1)
+            assert 0 <= overlap <= 3
+            rebuilt.extend(parts[overlap:])
+        assert rebuilt == lines
+
+    def test_long_line_and_small_code(self):
+        """
+        测试目的：验证超过上限的单行被截断为多段，较小的代码保持为一段
+        """
+        chunks = context_guard.split_code('z' * 1000, 100, overlap_lines=0)
+        assert all(base.estimate_tokens(text) <= 100 for _, text in chunks)
+        assert len(chunks) == 3 and ''.join(text for _, text in chunks) == 'z' * 1000
+        assert context_guard.split_code('a\nb\n', 100) == [ (1, 'a\nb\n') ]
+        assert context_guard.split_code('', 100) == [ (1, '') ]
+        halves = context_guard.split_in_two(''.join(f'{i:05d}' + 'w' * 95 + '\n' for i in range(200)))
+        assert len(halves) in (2, 3)
@@ -0,0 +1,167 @@
+"""
+datastore.py 单元测试
+
+测试目标：验证统一的DynamoDB访问层
+- 查询自动分页，不丢失超过一页的数据
+- 投影表达式对保留字（data、number）使用占位符
+- 同一次调用内对同一记录的计数更新被合并为一次写入
+- 批量写入
+
+测试方法：使用moto模拟DynamoDB，不依赖真实AWS资源
+"""
+
+import sys
+import os
+import threading
+import pytest
+import boto3
+from unittest.mock import patch
+from moto import mock_aws
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import datastore
+
+TASK_TABLE = 'datastore-test-task'
+REQUEST_TABLE = 'datastore-test-request'
+
+
+@pytest.fixture
+def tables():
+    """在moto环境中创建Task表和Request表，并让datastore使用模拟的资源"""
+    with mock_aws():
+        dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+        dynamodb.create_table(
+            TableName=TASK_TABLE,
+            KeySchema=[{'AttributeName': 'request_id', 'KeyType': 'HASH'}, {'AttributeName': 'number', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[{'AttributeName': 'request_id', 'AttributeType': 'S'}, {'AttributeName': 'number', 'AttributeType': 'N'}],
+            BillingMode='PAY_PER_REQUEST',
+        )
+        dynamodb.create_table(
+            TableName=REQUEST_TABLE,
+            KeySchema=[{'AttributeName': 'commit_id', 'KeyType': 'HASH'}, {'AttributeName': 'request_id', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[{'AttributeName': 'commit_id', 'AttributeType': 'S'}, {'AttributeName': 'request_id', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST',
+        )
+        with patch.object(datastore, 'dynamodb', dynamodb):
+            yield dynamodb
+
+
+class TestDatastore:
+    """datastore.py 测试类"""
+
+    def test_query_all_paginates(self, tables):
+        """
+        测试目的：验证query_all跟随LastEvaluatedKey读取全部分页
+
+        测试过程：
+        1. 批量写入30条任务
+        2. 使用Limit=7强制分多页查询
+
+        期望结果：返回全部30条，且只包含投影字段
+        """
+        datastore.batch_put(TASK_TABLE, [ dict(request_id='r1', number=i, data=f'result/r1/{i}.json', prompt='x' * 10) for i in range(30) ])
+
+        items = datastore.query_items(
+            TASK_TABLE,
+            fields=[ 'number', 'data' ],
+            KeyConditionExpression='request_id=:rid',
+            ExpressionAttributeValues={ ':rid': 'r1' },
+            Limit=7,
+        )
+
+        assert len(items) == 30
+        assert sorted(int(item['number']) for item in items) == list(range(30))
+        assert all(set(item.keys()) == { 'number', 'data' } for item in items), "只应返回投影字段"
+
+    def test_get_item_projection(self, tables):
+        """
+        测试目的：验证get_item的投影读取，以及记录不存在时返回None
+        """
+        datastore.put_item(REQUEST_TABLE, dict(commit_id='c1', request_id='r1', task_total=3, project_name='demo'))
+
+        item = datastore.get_item(REQUEST_TABLE, dict(commit_id='c1', request_id='r1'), fields=[ 'task_total' ], consistent=True)
+        assert item == { 'task_total': 3 }
+        assert datastore.get_item(REQUEST_TABLE, dict(commit_id='c1', request_id='none')) is None
+
+    def test_update_item_return_values(self, tables):
+        """
+        测试目的：验证update_item默认不返回数据，指定return_values时返回更新后的属性
+        """
+        key = dict(commit_id='c1', request_id='r1')
+        datastore.put_item(REQUEST_TABLE, dict(key, task_complete=0))
+
+        assert datastore.update_item(REQUEST_TABLE, key, 'set task_complete = task_complete + :n', values={ ':n': 1 }) is None
+        attributes = datastore.update_item(REQUEST_TABLE, key, 'set task_complete = task_complete + :n', values={ ':n': 1 }, return_values='UPDATED_NEW')
+        assert attributes == { 'task_complete': 2 }
+
+    def test_counter_coalescing(self, tables):
+        """
+        测试目的：验证同一记录的多次计数更新被合并为一次update_item
+
+        测试过程：
+        1. 对同一条记录累加task_failure三次，并设置一个普通字段
+        2. 对另一条记录累加一次
+        3. flush
+
+        期望结果：只产生2次update_item调用，计数值正确
+        """
+        key1, key2 = dict(commit_id='c1', request_id='r1'), dict(commit_id='c1', request_id='r2')
+        datastore.put_item(REQUEST_TABLE, dict(key1, task_failure=0))
+        datastore.put_item(REQUEST_TABLE, dict(key2, task_failure=0))
+
+        for _ in range(3):
+            datastore.add_counter(REQUEST_TABLE, key1, 'task_failure')
+        datastore.set_field(REQUEST_TABLE, key1, 'task_status', 'Processing')
+        datastore.add_counter(REQUEST_TABLE, key2, 'task_failure', 2)
+
+        with patch.object(datastore, 'update_item', wraps=datastore.update_item) as spy:
+            assert datastore.flush_counters() == 2
+            assert spy.call_count == 2
+
+        item1 = datastore.get_item(REQUEST_TABLE, key1)
+        assert item1['task_failure'] == 3
+        assert item1['task_status'] == 'Processing'
+        assert datastore.get_item(REQUEST_TABLE, key2)['task_failure'] == 2
+        assert datastore.flush_counters() == 0, "flush后缓冲区应为空"
+
+    def test_failed_flush_keeps_counters(self, tables):
+        """
+        测试目的：验证写入失败的计数保留在缓冲区，不会丢失
+
+        测试过程：
+        1. 累加task_failure后flush，update_item抛出异常
+        2. 失败期间又累加一次
+        3. 再次flush
+
+        期望结果：第一次flush抛出异常，第二次flush写入两次累加的总和
+        """
+        key = dict(commit_id='c1', request_id='r3')
+        datastore.put_item(REQUEST_TABLE, dict(key, task_failure=0))
+        datastore.add_counter(REQUEST_TABLE, key, 'task_failure', 2)
+
+        with patch.object(datastore, 'update_item', side_effect=Exception('throttled')):
+            with pytest.raises(Exception):
+                datastore.flush_counters()
+        datastore.add_counter(REQUEST_TABLE, key, 'task_failure')
+
+        assert datastore.flush_counters() == 1
+        assert datastore.get_item(REQUEST_TABLE, key)['task_failure'] == 3
+
+    def test_table_cache_per_thread(self, tables):
+        """
+        测试目的：验证Table对象按线程缓存，线程结束后缓存随之释放
+
+        期望结果：同一线程复用同一Table对象；其他线程使用各自的Table对象，且不进入当前线程的缓存
+        """
+        table = datastore.get_table(REQUEST_TABLE)
+        assert datastore.get_table(REQUEST_TABLE) is table
+
+        others = []
+        for _ in range(3):
+            thread = threading.Thread(target=lambda: others.append(datastore.get_table(REQUEST_TABLE)))
+            thread.start()
+            thread.join()
+        assert all(other is not table for other in others)
+        assert datastore._local.tables[REQUEST_TABLE][1] is table
@@ -0,0 +1,62 @@
+"""
+json_recovery.py 单元测试
+
+测试目标：验证模型输出的发现在本地修复常见格式错误
+- 合法输出走strict路径
+- 代码块包裹、JSON字面量、未转义的引号与换行、尾随逗号在本地修复
+- 截断的最后一个元素被丢弃，保留完整的发现
+- 没有可解析内容时抛出RecoveryError，由调用方回退到模型纠正
+"""
+
+import sys
+import os
+import pytest
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import json_recovery
+
+
+class TestJsonRecovery:
+    """json_recovery.py 测试类"""
+
+    @pytest.mark.parametrize('text, expected, method', [
+        ('<output>[{"title": "a"}]</output>', [{'title': 'a'}], 'strict'),
+        ("<output>{'title': 'py', 'fixed': None}</output>", [{'title': 'py', 'fixed': None}], 'strict'),
+        ('<output>[{"title": "a", "fixed": false}]</output>', [{'title': 'a', 'fixed': False}], 'strict'),
+        ('<output>```json\n[{"title": "a"}]\n```</output>', [{'title': 'a'}], 'repaired'),
+        ('<output>[{"title": "Use "foo" here", "content": "line1\nline2",},]</output>',
+            [{'title': 'Use "foo" here', 'content': 'line1\nline2'}], 'repaired'),
+        ('<output>[{"title": "a", "fixed": true, "ref": None}]</output>', [{'title': 'a', 'fixed': True, 'ref': None}], 'repaired'),
+        ('<output>[{"title": "a"}, {"title": "b", "content": "cut off', [{'title': 'a'}], 'truncated'),
+        ('Findings: [{"title": "untagged"}]', [{'title': 'untagged'}], 'repaired'),
+    ])
+    def test_parse_findings(self, text, expected, method):
+        """
+        测试目的：验证各类常见格式错误的本地修复结果与修复路径
+        """
+        assert json_recovery.parse_findings(text) == (expected, method)
+
+    def test_unrecoverable_output_raises(self):
+        """
+        测试目的：验证无法本地修复时抛出异常，由调用方回退到模型纠正
+        """
+        with pytest.raises(json_recovery.RecoveryError):
+            json_recovery.parse_findings('I could not find any issue.')
+        with pytest.raises(json_recovery.RecoveryError):
+            json_recovery.parse_findings('<output>"just a string"</output>')
+
+    @pytest.mark.parametrize('text', [
+        'No issues. See ["a.py"]',
+        'Checked files [1, 2, 3] and found nothing.',
+        '<output>["a.py", "b.py",]</output>',
+    ])
+    def test_non_finding_content_is_unrecoverable(self, text):
+        """
+        测试目的：验证修复得到的内容中有非dict元素时不当作发现，交由模型纠正
+
+        期望结果：抛出RecoveryError
+        """
+        with pytest.raises(json_recovery.RecoveryError):
+            json_recovery.parse_findings(text)
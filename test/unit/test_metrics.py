@@ -0,0 +1,83 @@
+"""
+metrics.py 单元测试
+
+测试目标：验证EMF指标在一次调用内缓存、flush时合并输出
+- 同一维度下的指标合并为一个文档，同一指标的多个值合并为数值列表
+- 单个指标超过EMF_MAX_VALUES个值时拆分为多个文档
+- timer记录代码块耗时
+
+测试方法：捕获stdout中的EMF文档
+"""
+
+import sys
+import os
+import json
+import pytest
+from unittest.mock import patch
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import metrics
+
+DIMENSIONS = dict(Model='claude4-sonnet', Mode='diff', Project='demo')
+
+
+@pytest.fixture(autouse=True)
+def buffer():
+    """每个用例使用空的缓存"""
+    with patch.object(metrics, 'buffer', metrics.MetricBuffer()):
+        yield
+
+
+def flush_documents(capsys):
+    capsys.readouterr()
+    metrics.flush()
+    return [ json.loads(line) for line in capsys.readouterr().out.splitlines() ]
+
+
+class TestMetrics:
+    """metrics.py 测试类"""
+
+    def test_emit_is_buffered_until_flush(self, capsys):
+        """
+        测试目的：验证emit不立即输出，flush时按维度合并
+
+        测试过程：同一维度记录3次调用耗时与1次首字节时间，另一维度记录1次
+
+        期望结果：emit时没有输出；flush输出2个文档，调用耗时合并为数值列表
+        """
+        for value in (100, 250, 900):
+            metrics.emit('BedrockInvocationTime', value, 'Milliseconds', DIMENSIONS)
+        metrics.emit('BedrockTimeToFirstByte', 40, 'Milliseconds', DIMENSIONS)
+        metrics.emit('BedrockInvocationTime', 70, 'Milliseconds', dict(DIMENSIONS, Mode='all'))
+        assert capsys.readouterr().out == ''
+
+        documents = flush_documents(capsys)
+        assert len(documents) == 2
+        document = next(document for document in documents if document['Mode'] == 'diff')
+        assert document['BedrockInvocationTime'] == [ 100, 250, 900 ]
+        assert document['BedrockTimeToFirstByte'] == 40
+        assert document['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [ [ 'Mode', 'Model', 'Project' ] ]
+        assert { metric['Name'] for metric in document['_aws']['CloudWatchMetrics'][0]['Metrics'] } == { 'BedrockInvocationTime', 'BedrockTimeToFirstByte' }
+        assert flush_documents(capsys) == []
+
+    def test_values_split_at_emf_limit(self, capsys):
+        """
+        测试目的：验证单个指标的值超过EMF_MAX_VALUES时拆分为多个文档
+        """
+        for value in range(metrics.EMF_MAX_VALUES + 5):
+            metrics.emit('SqsQueueWait', value, 'Milliseconds', DIMENSIONS)
+        documents = flush_documents(capsys)
+        assert [ len(document['SqsQueueWait']) for document in documents ] == [ metrics.EMF_MAX_VALUES, 5 ]
+
+    def test_timer_records_on_exception(self, capsys):
+        """
+        测试目的：验证timer在代码块抛出异常时同样记录耗时
+        """
+        with pytest.raises(ValueError):
+            with metrics.timer('S3WriteTime', DIMENSIONS):
+                raise ValueError('boom')
+        documents = flush_documents(capsys)
+        assert documents[0]['S3WriteTime'] >= 0
+        assert documents[0]['_aws']['CloudWatchMetrics'][0]['Metrics'] == [ dict(Name='S3WriteTime', Unit='Milliseconds') ]
@@ -20,7 +20,10 @@ from model_config import (
     get_model_id,
     supports_reasoning,
     is_claude37_or_later,
-    get_all_model_names
+    get_all_model_names,
+    estimate_cost,
+    MODEL_PRICES,
+    MODEL_CONFIGS,
 )
 
 
@@ -130,6 +133,14 @@ class TestModelConfig:
             assert 'version' in config
             print(f"✅ {model}: model_id={config['model_id']}, reasoning={config['supports_reasoning']}")
 
+    def test_estimate_cost(self):
+        """测试按价格表计算费用，所有模型都有价格，未知模型费用为0"""
+        assert set(MODEL_PRICES) == set(MODEL_CONFIGS)
+        usage = dict(input_tokens=1000000, output_tokens=100000, cache_read_tokens=1000000, cache_write_tokens=0)
+        assert estimate_cost('claude4-sonnet', usage) == pytest.approx(3.0 + 1.5 + 0.3)
+        assert estimate_cost('unknown-model', usage) == 0.0
+        assert estimate_cost('claude4-sonnet', None) == 0.0
+
 
 if __name__ == '__main__':
     # 直接运行此文件时执行测试
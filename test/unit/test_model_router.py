@@ -0,0 +1,71 @@
+"""
+model_router.py 单元测试
+
+测试目标：验证按输入大小选择模型阶梯
+- 阶梯校验：未知模型被忽略，规则的model作为最高一级
+- 按估算token数选择第一个能容纳的级别
+- 识别输入过长的错误并升级到下一级
+"""
+
+import sys
+import os
+from botocore.exceptions import ClientError
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import model_router
+
+
+class TestModelRouter:
+    """model_router.py 测试类"""
+
+    def test_normalize_and_select(self):
+        """
+        测试目的：验证阶梯校验与按输入大小选择级别
+
+        期望结果：
+        - 未知模型被丢弃，规则的model追加为不限大小的最高一级
+        - 小输入选择第一级，超过阈值选择下一级，超过所有阈值选择最高一级
+        """
+        ladder = model_router.normalize_ladder([
+            { 'model': 'Claude4.5-Haiku', 'max_input_tokens': 1000 },
+            { 'model': 'gpt-4', 'max_input_tokens': 5000 },
+            { 'model': 'claude4-sonnet', 'max_input_tokens': 20000 },
+        ], 'claude4-opus')
+
+        assert [ tier['model'] for tier in ladder ] == [ 'claude4.5-haiku', 'claude4-sonnet', 'claude4-opus' ]
+        assert ladder[-1]['max_input_tokens'] is None
+        assert model_router.select_tier(ladder, 200) == 0
+        assert model_router.select_tier(ladder, 1500) == 1
+        assert model_router.select_tier(ladder, 50000) == 2
+        assert model_router.normalize_ladder(None, 'claude4-opus') == []
+
+    def test_escalate_on_context_overflow(self):
+        """
+        测试目的：验证输入过长的错误沿阶梯升级，到达最高一级后不再升级
+        """
+        overflow = Exception('ValidationException: prompt is too long: 210000 tokens > 200000 maximum')
+        wrapped = Exception('Fail to invoke Claude')
+        wrapped.__cause__ = overflow
+        assert model_router.is_context_overflow(wrapped)
+        assert not model_router.is_context_overflow(Exception('ThrottlingException'))
+        assert model_router.is_context_overflow(ClientError({ 'Error': { 'Code': 'ValidationException', 'Message': 'Input is too long for requested model.' } }, 'Converse'))
+
+    def test_throttling_is_not_overflow(self):
+        """
+        测试目的：验证限流错误即使提到token数量，也不会被当作输入过长而升级模型
+
+        期望结果：限流、非校验错误均不判定为输入过长
+        """
+        throttled = ClientError({ 'Error': { 'Code': 'ThrottlingException', 'Message': 'Too many tokens, please wait before trying again.' } }, 'Converse')
+        wrapped = Exception('Fail to invoke Claude')
+        wrapped.__cause__ = throttled
+        assert not model_router.is_context_overflow(wrapped)
+        assert not model_router.is_context_overflow(Exception('ThrottlingException: Too many tokens, please wait before trying again.'))
+        assert not model_router.is_context_overflow(Exception('Response is too long to parse'))
+
+        prompt_data = dict(model='claude4.5-haiku', model_tier=0, model_ladder=model_router.normalize_ladder([ 'claude4.5-haiku' ], 'claude4-sonnet'))
+        assert model_router.escalate(prompt_data) is True
+        assert prompt_data['model'] == 'claude4-sonnet' and prompt_data['model_tier'] == 1
+        assert model_router.escalate(prompt_data) is False
@@ -0,0 +1,173 @@
+"""
+rate_control.py 单元测试
+
+测试目标：验证按模型ID共享的AIMD令牌桶
+- 令牌用完后acquire返回建议的延迟，而不是无限等待
+- 取令牌只有一次条件写入，缓存过期时用条件失败带回的记录重试
+- 成功调用加性增长（随下一次取令牌写入），限流乘性回退且冷却期内只回退一次
+- 从异常链中识别限流错误
+
+测试方法：使用moto模拟DynamoDB
+"""
+
+import sys
+import os
+import time
+import threading
+import pytest
+import boto3
+from unittest.mock import patch
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import datastore
+import rate_control
+
+REQUEST_TABLE = 'rate-control-test-request'
+MODEL_ID = 'anthropic.test-model'
+
+
+@pytest.fixture
+def request_table():
+    """创建Request表，并把速率参数固定为便于计算的值"""
+    with mock_aws():
+        dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+        dynamodb.create_table(
+            TableName=REQUEST_TABLE,
+            KeySchema=[{'AttributeName': 'commit_id', 'KeyType': 'HASH'}, {'AttributeName': 'request_id', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[{'AttributeName': 'commit_id', 'AttributeType': 'S'}, {'AttributeName': 'request_id', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST',
+        )
+        with patch.object(datastore, 'dynamodb', dynamodb), \
+                patch.dict(os.environ, { 'REQUEST_TABLE': REQUEST_TABLE }), \
+                patch.multiple(rate_control, RATE_CONTROL_ENABLED=True, RATE_INITIAL=60.0, RATE_BURST_SECONDS=2.0, RATE_MIN=4.0), \
+                patch.dict(rate_control._states, clear=True), patch.dict(rate_control._increases, clear=True), \
+                patch.object(rate_control.metrics, 'emit') as emit:
+            yield emit
+
+
+class TestRateControl:
+    """rate_control.py 测试类"""
+
+    def test_bucket_exhaustion_returns_delay(self, request_table):
+        """
+        测试目的：验证令牌桶容量用完后，acquire不等待而是返回建议的延迟
+
+        测试过程：初始速率60次/分钟、容量2秒，即2个令牌；max_wait为0时连续取3次
+
+        期望结果：前两次取得令牌，第三次返回大于0的延迟
+        """
+        assert rate_control.acquire(MODEL_ID, max_wait=0) == 0
+        assert rate_control.acquire(MODEL_ID, max_wait=0) == 0
+        assert rate_control.acquire(MODEL_ID, max_wait=0) > 0
+
+    def test_concurrent_acquire_takes_each_token_once(self, request_table):
+        """
+        测试目的：验证多个执行器同时取令牌时，每个令牌只被取走一次，取不到的不会忙等
+
+        测试过程：桶内2个令牌（容器内缓存的状态已过期），6个线程同时以max_wait=0调用acquire
+
+        期望结果：恰好2个线程取得令牌，其余返回延迟，桶内令牌为0，期间没有sleep
+        """
+        rate_control.acquire(MODEL_ID, max_wait=0)
+        rate_control.datastore.update_item(REQUEST_TABLE, rate_control.get_key(MODEL_ID), 'SET tokens = :t, updated_at = :n', values={ ':t': 2, ':n': rate_control.Decimal(str(time.time())) })
+        barrier = threading.Barrier(6)
+        results = []
+
+        def take():
+            barrier.wait()
+            results.append(rate_control.acquire(MODEL_ID, max_wait=0))
+
+        with patch.object(rate_control.time, 'sleep') as sleep:
+            threads = [ threading.Thread(target=take) for _ in range(6) ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        assert sum(1 for result in results if result == 0) == 2
+        assert rate_control.load_state(MODEL_ID)['tokens'] < 1
+        assert not sleep.called
+
+    def test_acquire_is_one_conditional_write(self, request_table):
+        """
+        测试目的：验证令牌足够时取令牌只有一次DynamoDB写入，令牌不足时不访问DynamoDB
+
+        期望结果：
+        - 第一次读取并创建令牌桶，之后每次取令牌只调用一次update_item，不再读取
+        - 令牌用完后返回延迟，没有任何DynamoDB调用
+        """
+        assert rate_control.acquire(MODEL_ID, max_wait=0) == 0
+        with patch.object(rate_control.datastore, 'get_item', wraps=rate_control.datastore.get_item) as get_item, \
+                patch.object(rate_control.datastore, 'update_item', wraps=rate_control.datastore.update_item) as update_item:
+            assert rate_control.acquire(MODEL_ID, max_wait=0) == 0
+            assert not get_item.called and update_item.call_count == 1
+            update_item.reset_mock()
+            assert rate_control.acquire(MODEL_ID, max_wait=0) > 0
+            assert not get_item.called and not update_item.called
+
+    def test_stale_state_is_refreshed_from_failed_write(self, request_table):
+        """
+        测试目的：验证其他执行器取走令牌后，缓存过期的执行器用条件失败带回的记录重试，而不是重复取同一个令牌
+
+        期望结果：其他执行器取走最后一个令牌后，本执行器返回延迟，缓存刷新为最新的令牌数
+        """
+        assert rate_control.acquire(MODEL_ID, max_wait=0) == 0
+        cached = dict(rate_control._states[MODEL_ID])
+        assert rate_control.acquire(MODEL_ID, max_wait=0) == 0
+        rate_control._states[MODEL_ID] = cached
+
+        with patch.object(rate_control.time, 'sleep') as sleep:
+            assert rate_control.acquire(MODEL_ID, max_wait=0) > 0
+        assert rate_control._states[MODEL_ID]['tokens'] < 1
+        assert not sleep.called
+
+    def test_short_wait_sleeps_with_jitter(self, request_table):
+        """
+        测试目的：验证缺少的令牌能在max_wait内补充时，等待后再取，而不是立即重试
+
+        期望结果：令牌用完后sleep一次，等待时间不小于补充一个令牌所需的时间
+        """
+        rate_control.acquire(MODEL_ID, max_wait=0)
+        rate_control.acquire(MODEL_ID, max_wait=0)
+        with patch.object(rate_control.time, 'sleep') as sleep, \
+                patch.object(rate_control, 'refill', side_effect=[ (0.0, 1.0), (1.0, 1.0) ]):
+            assert rate_control.acquire(MODEL_ID, max_wait=5) == 0
+        assert sleep.call_count == 1
+        assert 1.0 <= sleep.call_args.args[0] <= 1.0 + rate_control.RATE_RETRY_JITTER
+
+    def test_additive_increase_and_multiplicative_decrease(self, request_table):
+        """
+        测试目的：验证成功时加性增长、限流时乘性回退，冷却期内重复的限流不会再次回退
+
+        期望结果：
+        - 成功后的增长随下一次取令牌写入，速率为61
+        - 第一次限流后速率减半，第二次限流被冷却期忽略
+        - 每次速率变化都输出指标
+        """
+        rate_control.acquire(MODEL_ID, max_wait=0)
+        rate_control.record_success(MODEL_ID)
+        assert rate_control.acquire(MODEL_ID, max_wait=0) == 0
+        assert rate_control.load_state(MODEL_ID)['rate'] == 61
+
+        assert rate_control.record_throttle(MODEL_ID) == 30.5
+        assert rate_control.record_throttle(MODEL_ID) is None
+        assert rate_control.load_state(MODEL_ID)['rate'] == 30.5
+        assert [ call.args[1] for call in request_table.call_args_list ] == [ 61, 30.5 ]
+
+    def test_is_throttling_follows_exception_chain(self):
+        """
+        测试目的：验证invoke_claude包装后的异常仍能识别为限流
+        """
+        throttled = ClientError({ 'Error': { 'Code': 'ThrottlingException', 'Message': 'Rate exceeded' } }, 'Converse')
+        try:
+            try:
+                raise throttled
+            except Exception as ex:
+                raise Exception('Fail to invoke Claude') from ex
+        except Exception as wrapped:
+            assert rate_control.is_throttling(wrapped)
+
+        assert not rate_control.is_throttling(Exception('ValidationException'))
@@ -0,0 +1,80 @@
+"""
+reasoning_budget.py 单元测试
+
+测试目标：验证推理预算按任务自适应选择
+- 预算随估算输入大小与规则复杂度增长，并限制在上下限之间
+- 规则的reasoning_budget覆盖自适应预算
+- 回复被截断或推理用满预算时增加预算，推理远低于预算时减少预算
+
+测试方法：直接调用选择与记录函数，不访问AWS
+"""
+
+import sys
+import os
+import pytest
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import reasoning_budget
+
+MODEL = 'claude3.7-sonnet'
+RULE = 'security'
+
+
+@pytest.fixture(autouse=True)
+def history():
+    """每个用例从空的历史开始"""
+    reasoning_budget.reset()
+    yield
+    reasoning_budget.reset()
+
+
+class TestReasoningBudget:
+    """reasoning_budget.py 测试类"""
+
+    def test_budget_grows_with_input_and_complexity(self):
+        """
+        测试目的：验证预算随输入大小与复杂度增长，且限制在上下限之间并小于max_tokens
+
+        期望结果：
+        - 小输入的low复杂度规则得到最小预算
+        - 大输入的预算更大，high复杂度的预算高于low
+        - 极大输入被限制在REASONING_BUDGET_MAX，并为输出保留token
+        """
+        small, source = reasoning_budget.choose(MODEL, RULE, 10, 'low')
+        assert small == reasoning_budget.REASONING_BUDGET_MIN and source == reasoning_budget.SOURCE_ADAPTIVE
+        assert reasoning_budget.choose(MODEL, RULE, 10000)[0] > small
+        assert reasoning_budget.choose(MODEL, RULE, 10000, 'high')[0] > reasoning_budget.choose(MODEL, RULE, 10000, 'low')[0]
+        assert reasoning_budget.choose(MODEL, RULE, 10 ** 6)[0] == reasoning_budget.REASONING_BUDGET_MAX
+        assert reasoning_budget.choose(MODEL, RULE, 10 ** 6, max_tokens=4000)[0] == 4000 - reasoning_budget.REASONING_OUTPUT_RESERVE
+
+    def test_rule_override(self):
+        """
+        测试目的：验证规则的reasoning_budget优先于自适应预算，且同样受上下限约束
+        """
+        assert reasoning_budget.choose(MODEL, RULE, 10, override=3000) == (3000, reasoning_budget.SOURCE_RULE)
+        assert reasoning_budget.choose(MODEL, RULE, 10, override='500')[0] == reasoning_budget.REASONING_BUDGET_MIN
+
+    def test_history_adjusts_budget(self):
+        """
+        测试目的：验证历史结果调整同一模型与规则的预算，不影响其他规则
+
+        测试过程：
+        1. 记录多次因max_tokens截断的调用，预算增加
+        2. 另一条规则记录多次推理只用了少量预算的调用，预算减少
+
+        期望结果：截断的规则预算增大，且不超过历史系数上限；低利用率的规则预算减小
+        """
+        start, _ = reasoning_budget.choose(MODEL, RULE, 20000)
+        for _ in range(3):
+            reasoning_budget.record_outcome(MODEL, RULE, start, start, 'max_tokens')
+        raised, _ = reasoning_budget.choose(MODEL, RULE, 20000)
+        assert raised > start
+        for _ in range(20):
+            reasoning_budget.record_outcome(MODEL, RULE, start, start, 'max_tokens')
+        assert reasoning_budget.get_history(MODEL, RULE).factor == reasoning_budget.HISTORY_FACTOR_MAX
+
+        for _ in range(3):
+            reasoning_budget.record_outcome(MODEL, 'style', start, start // 10, 'end_turn')
+        assert reasoning_budget.choose(MODEL, 'style', 20000)[0] < start
@@ -0,0 +1,145 @@
+"""
+region_pool.py 单元测试
+
+测试目标：验证多区域路由的健康评分与熔断
+- 区域池配置的解析
+- 连续失败后熔断，超时后半开只放行一个探测请求
+- 按健康评分加权选择区域
+- 与具体请求相关的错误不计入区域健康
+
+测试方法：用按区域返回结果的替身端点模拟区域故障，不访问AWS
+"""
+
+import sys
+import os
+import pytest
+from unittest.mock import patch
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import region_pool
+
+MODEL = 'claude4-sonnet'
+POOL = { 'default': [ 'us-east-1', 'us-west-2' ] }
+
+
+@pytest.fixture(autouse=True)
+def pool():
+    """配置两个区域，每个用例从空的健康状态开始"""
+    region_pool.reset()
+    with patch.object(region_pool, '_pool', POOL), patch.object(region_pool.metrics, 'emit') as emit:
+        yield emit
+    region_pool.reset()
+
+
+def call(endpoints, now):
+    """通过区域池调用替身端点，返回使用的区域"""
+    region = region_pool.choose(MODEL, now=now)
+    try:
+        latency = endpoints[region]()
+        region_pool.record_success(MODEL, region, latency)
+    except Exception as ex:
+        region_pool.record_failure(MODEL, region, ex, now=now)
+    return region
+
+
+def brown_out():
+    raise Exception('ServiceUnavailableException: Bedrock is unavailable')
+
+
+class TestRegionPool:
+    """region_pool.py 测试类"""
+
+    def test_parse_pool(self):
+        """
+        测试目的：验证区域池支持逗号分隔与按模型的JSON两种配置
+        """
+        assert region_pool.parse_pool('us-east-1, us-west-2') == dict(default=[ 'us-east-1', 'us-west-2' ])
+        assert region_pool.parse_pool('{"Claude4-Sonnet": ["us-east-2"], "default": ["us-east-1"]}') == { 'claude4-sonnet': [ 'us-east-2' ], 'default': [ 'us-east-1' ] }
+        assert region_pool.parse_pool('') == dict()
+        with patch.object(region_pool, '_pool', dict()), patch.object(region_pool, 'BEDROCK_REGION', 'eu-west-1'):
+            assert region_pool.choose(MODEL) == 'eu-west-1'
+
+    def test_brown_out_opens_circuit_and_probe_closes_it(self, pool):
+        """
+        测试目的：验证区域故障时熔断，并在恢复后通过半开探测关闭熔断
+
+        测试过程：
+        1. us-east-1持续失败，调用直到其熔断
+        2. 熔断期间的调用全部发往us-west-2
+        3. 熔断时间过后，只有一个探测请求发往us-east-1
+        4. us-east-1恢复后探测成功，熔断关闭
+
+        期望结果：如上，熔断与关闭时各输出一次指标
+        """
+        endpoints = { 'us-east-1': brown_out, 'us-west-2': lambda: 1000 }
+        now = 1000.0
+        for _ in range(50):
+            call(endpoints, now)
+        assert region_pool.get_health(MODEL, 'us-east-1').state == region_pool.STATE_OPEN
+        assert region_pool.get_health(MODEL, 'us-east-1').failures == region_pool.REGION_FAILURE_THRESHOLD
+        assert { call(endpoints, now) for _ in range(20) } == { 'us-west-2' }
+
+        now += region_pool.REGION_CIRCUIT_OPEN_SECONDS
+        assert region_pool.choose(MODEL, now=now) == 'us-east-1'
+        assert { region_pool.choose(MODEL, now=now) for _ in range(10) } == { 'us-west-2' }
+
+        region_pool.record_success(MODEL, 'us-east-1', 1000)
+        assert region_pool.get_health(MODEL, 'us-east-1').state == region_pool.STATE_CLOSED
+        assert [ call.args[1] for call in pool.call_args_list ] == [ 1, 0 ]
+
+    def test_failed_probe_reopens_circuit(self):
+        """
+        测试目的：验证半开探测失败时重新熔断
+        """
+        now = 1000.0
+        for _ in range(region_pool.REGION_FAILURE_THRESHOLD):
+            region_pool.record_failure(MODEL, 'us-east-1', now=now)
+        now += region_pool.REGION_CIRCUIT_OPEN_SECONDS
+        assert region_pool.choose(MODEL, now=now) == 'us-east-1'
+        region_pool.record_failure(MODEL, 'us-east-1', now=now)
+        health = region_pool.get_health(MODEL, 'us-east-1')
+        assert health.state == region_pool.STATE_OPEN and health.opened_at == now
+
+    def test_weighted_routing_prefers_healthy_region(self):
+        """
+        测试目的：验证未熔断时按健康评分加权，慢且出错的区域分到更少流量
+        """
+        for _ in range(5):
+            region_pool.record_success(MODEL, 'us-east-1', 90000)
+            region_pool.record_success(MODEL, 'us-west-2', 1000)
+        region_pool.record_failure(MODEL, 'us-east-1')
+
+        slow, fast = region_pool.get_health(MODEL, 'us-east-1').score(), region_pool.get_health(MODEL, 'us-west-2').score()
+        assert slow < fast
+        share = slow / (slow + fast)
+        assert region_pool.choose(MODEL, rand=lambda: share - 0.001) == 'us-east-1'
+        assert region_pool.choose(MODEL, rand=lambda: share + 0.001) == 'us-west-2'
+
+    def test_request_errors_do_not_count(self):
+        """
+        测试目的：验证输入校验等与区域无关的错误不影响区域健康
+        """
+        for _ in range(10):
+            try:
+                try:
+                    raise Exception('ValidationException: Input is too long for requested model.')
+                except Exception as ex:
+                    raise Exception('Fail to invoke Claude') from ex
+            except Exception as wrapped:
+                region_pool.record_failure(MODEL, 'us-east-1', wrapped)
+        health = region_pool.get_health(MODEL, 'us-east-1')
+        assert health.state == region_pool.STATE_CLOSED and health.failures == 0
+
+    def test_probe_is_released_on_request_error(self):
+        """
+        测试目的：验证半开探测遇到与区域无关的错误时释放探测，区域不会一直无法被选中
+        """
+        now = 1000.0
+        for _ in range(region_pool.REGION_FAILURE_THRESHOLD):
+            region_pool.record_failure(MODEL, 'us-east-1', now=now)
+        now += region_pool.REGION_CIRCUIT_OPEN_SECONDS
+        assert region_pool.choose(MODEL, now=now) == 'us-east-1'
+        region_pool.record_failure(MODEL, 'us-east-1', Exception('ValidationException: bad request'), now=now)
+        assert region_pool.choose(MODEL, now=now) == 'us-east-1'
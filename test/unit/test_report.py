@@ -0,0 +1,328 @@
+"""
+report.py 单元测试
+
+测试目标：验证报告页脚的用量与费用汇总
+- 按规则汇总Token用量、费用与单条发现的费用
+- 汇总数据写入报告模板
+"""
+
+import sys
+import os
+import types
+
+# 在导入被测模块前，注入 awslambdaric 替身，避免本地缺少该依赖导致导入失败
+if 'awslambdaric.lambda_runtime_log_utils' not in sys.modules:
+    _parent = types.ModuleType('awslambdaric')
+    _sub = types.ModuleType('awslambdaric.lambda_runtime_log_utils')
+    class _JsonFormatter:
+        def __init__(self, *a, **k):
+            pass
+        def format(self, record):
+            return '{}'
+    _sub.JsonFormatter = _JsonFormatter
+    sys.modules['awslambdaric'] = _parent
+    sys.modules['awslambdaric.lambda_runtime_log_utils'] = _sub
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import report
+import s3_codec
+
+
+class TestReportUsage:
+    """report.py 用量汇总测试类"""
+
+    def test_summarize_usage_by_rule(self):
+        """
+        测试目的：验证按规则汇总用量，按费用从高到低排序，没有发现的规则单条费用为空
+
+        期望结果：
+        - 规则sql两个任务合计，单条发现费用为费用/发现数
+        - 没有用量的旧结果被忽略
+        - 任一结果为估算值时汇总标记为估算
+        """
+        results = [
+            dict(rule='sql', usage=dict(input_tokens=100, output_tokens=10), cost=0.2, content=[ dict(title='a') ]),
+            dict(rule='sql', usage=dict(input_tokens=50, output_tokens=5, estimated=True), cost=0.1, content=[ dict(title='b') ]),
+            dict(rule='style', usage=dict(input_tokens=10, output_tokens=1), cost=0.5, content=[]),
+            dict(rule='legacy', content=[ dict(title='c') ]),
+        ]
+        usage = report.summarize_usage(results)
+        assert [ rule['rule'] for rule in usage['rules'] ] == [ 'style', 'sql' ]
+        sql = usage['rules'][1]
+        assert (sql['tasks'], sql['findings'], sql['input_tokens'], sql['cost_per_finding']) == (2, 2, 150, 0.15)
+        assert sql['estimated'] and not usage['rules'][0]['estimated']
+        assert usage['rules'][0]['cost_per_finding'] is None
+        assert usage['total']['cost'] == 0.8 and usage['total']['estimated']
+        assert report.summarize_usage([ dict(rule='legacy', content=[]) ]) is None
+
+    def test_usage_is_written_to_report(self):
+        """
+        测试目的：验证汇总数据写入报告，没有用量时为null
+        """
+        usage = report.summarize_usage([ dict(rule='sql', usage=dict(input_tokens=1), cost=0.1, content=[]) ])
+        _, _, content = report.generate_report_content('demo', [], usage)
+        assert 'const usage = {' in content and '"rule": "sql"' in content
+        _, _, content = report.generate_report_content('demo', [])
+        assert 'const usage = null;' in content
+
+
+def create_request_table(dynamodb):
+    dynamodb.create_table(
+        TableName='report-request',
+        KeySchema=[{'AttributeName': 'commit_id', 'KeyType': 'HASH'}, {'AttributeName': 'request_id', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[{'AttributeName': 'commit_id', 'AttributeType': 'S'}, {'AttributeName': 'request_id', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST',
+    )
+
+
+class TestReportAssembly:
+    """report.py 报告数据读取测试类"""
+
+    def test_results_are_fetched_concurrently_in_order(self):
+        """
+        测试目的：验证报告读取全部成功任务的结果，按任务编号顺序合并，失败任务与读取失败的结果被跳过
+
+        测试过程：
+        1. 在moto中创建Task表与S3结果：40个成功任务（其中一个结果为列表、一个S3对象缺失）和一个失败任务
+        2. 把并发数调小后生成报告
+
+        期望结果：
+        - 报告数据按任务编号排序，列表结果被展开
+        - 缺失的结果与失败任务不影响其他结果
+        - 读取在多个线程中进行
+        """
+        import json
+        import threading
+        import boto3
+        import datastore
+        from unittest.mock import patch
+        from moto import mock_aws
+
+        with mock_aws():
+            dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+            dynamodb.create_table(
+                TableName='report-task',
+                KeySchema=[{'AttributeName': 'request_id', 'KeyType': 'HASH'}, {'AttributeName': 'number', 'KeyType': 'RANGE'}],
+                AttributeDefinitions=[{'AttributeName': 'request_id', 'AttributeType': 'S'}, {'AttributeName': 'number', 'AttributeType': 'N'}],
+                BillingMode='PAY_PER_REQUEST',
+            )
+            create_request_table(dynamodb)
+            dynamodb.Table('report-request').put_item(Item=dict(commit_id='c1', request_id='r1', task_total=41, task_complete=40, task_failure=1))
+            s3 = boto3.resource('s3', region_name='us-east-1')
+            s3.create_bucket(Bucket='report-bucket')
+            table = dynamodb.Table('report-task')
+            for number in range(1, 42):
+                key = f'result/r1/{number}.json'
+                table.put_item(Item=dict(request_id='r1', number=number, succ=number != 41, data=key))
+                result = dict(rule=f'rule{number}', content=[ dict(title=str(number)) ])
+                if number == 7:
+                    continue
+                body = [ result, dict(rule='extra', content=[]) ] if number == 3 else result
+                s3.Object('report-bucket', key).put(Body=json.dumps(body))
+
+            threads = set()
+            load = report.load_task_result
+            def tracked_load(bucket_name, item):
+                threads.add(threading.get_ident())
+                return load(bucket_name, item)
+
+            with patch.object(datastore, 'dynamodb', dynamodb), patch.object(report, 's3', s3), \
+                    patch.object(report, 'REPORT_FETCH_CONCURRENCY', 4), \
+                    patch.object(report, 'load_task_result', side_effect=tracked_load), \
+                    patch.dict(os.environ, { 'TASK_TABLE': 'report-task', 'REQUEST_TABLE': 'report-request', 'BUCKET_NAME': 'report-bucket' }):
+                result = report.generate_report(None, dict(commit_id='c1', request_id='r1'), dict(project_name='demo'))
+
+            rules = [ data['rule'] for data in result['data'] ]
+            expected = [ f'rule{number}' for number in range(1, 41) if number != 7 ]
+            expected.insert(3, 'extra')
+            assert rules == expected
+            assert len(threads) > 1
+            assert s3.Object('report-bucket', result['s3key']).get()['ContentLength'] > 0
+
+
+class TestReportFindings:
+    """report.py 发现汇总测试类"""
+
+    def run_with_aws(self, callback):
+        import boto3
+        import datastore
+        from unittest.mock import patch
+        from moto import mock_aws
+
+        with mock_aws():
+            dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+            create_request_table(dynamodb)
+            s3 = boto3.resource('s3', region_name='us-east-1')
+            s3.create_bucket(Bucket='report-bucket')
+            with patch.object(datastore, 'dynamodb', dynamodb), patch.object(report, 's3', s3), \
+                    patch.dict(os.environ, { 'REQUEST_TABLE': 'report-request', 'TASK_TABLE': 'report-task', 'BUCKET_NAME': 'report-bucket' }):
+                return callback(dynamodb, s3)
+
+    def test_report_is_built_from_findings(self):
+        """
+        测试目的：验证任务完成时追加的发现汇总覆盖全部完成任务时，报告直接使用汇总，不读取Task表与S3结果
+
+        测试过程：
+        1. 12个任务乱序追加发现，其中一个发现超过FINDINGS_ITEM_LIMIT，只记录S3位置
+        2. Request的task_complete为12，生成报告
+
+        期望结果：
+        - 发现按任务编号排序，超限的发现从S3读取
+        - 汇总中不包含提示词等报告不需要的字段
+        - 没有调用iter_task_results
+        """
+        import json
+        from unittest.mock import patch
+
+        def callback(dynamodb, s3):
+            dynamodb.Table('report-request').put_item(Item=dict(commit_id='c1', request_id='r1', task_total=12, task_complete=12))
+            for number in [ 5, 1, 12, 3, 2, 4, 6, 7, 8, 9, 10, 11 ]:
+                result = dict(rule=f'rule{number}', content=[ dict(title=str(number)) ], prompt_user='x' * 100, usage=dict(input_tokens=number), cost=0.01)
+                key = f'result/r1/{number}.json'
+                s3.Object('report-bucket', key).put(Body=json.dumps(result))
+                with patch.object(report, 'FINDINGS_ITEM_LIMIT', 10 if number == 3 else report.FINDINGS_ITEM_LIMIT):
+                    assert report.append_findings('r1', number, result, key)
+            item = dynamodb.Table('report-request').get_item(Key=report.get_findings_key('r1', 3))['Item']
+            assert item.get('data') == 'result/r1/3.json' and 'entry' not in item
+
+            with patch.object(report, 'iter_task_results') as iter_task_results:
+                result = report.generate_report(None, dict(commit_id='c1', request_id='r1'), dict(project_name='demo'))
+            iter_task_results.assert_not_called()
+            return result
+
+        result = self.run_with_aws(callback)
+        assert [ data['rule'] for data in result['data'] ] == [ f'rule{number}' for number in range(1, 13) ]
+        assert all('prompt_user' not in data for data in result['data'])
+        assert result['usage']['total']['input_tokens'] == sum(range(1, 13))
+
+    def test_incomplete_findings_fall_back_to_results(self):
+        """
+        测试目的：验证发现汇总少于完成任务数（例如汇总写入失败）时，退回到读取全部S3结果
+
+        期望结果：报告包含全部完成任务的结果
+        """
+        from unittest.mock import patch
+
+        def callback(dynamodb, s3):
+            dynamodb.Table('report-request').put_item(Item=dict(commit_id='c1', request_id='r1', task_total=2, task_complete=2))
+            report.append_findings('r1', 1, dict(rule='rule1', content=[]))
+            results = iter([ dict(rule='rule1', content=[]), dict(rule='rule2', content=[], prompt_user='x') ])
+            with patch.object(report, 'iter_task_results', return_value=results):
+                return report.generate_report(None, dict(commit_id='c1', request_id='r1'), dict(project_name='demo'))
+
+        result = self.run_with_aws(callback)
+        assert [ data['rule'] for data in result['data'] ] == [ 'rule1', 'rule2' ]
+        assert 'prompt_user' not in result['data'][1]
+
+    def test_partial_report(self):
+        """
+        测试目的：验证评审进行中的报告包含已完成任务的发现，URL记录到Request
+
+        期望结果：partial.html写入报告目录，副标题显示进度，Request的partial_report_url被设置
+        """
+        def callback(dynamodb, s3):
+            record = dict(commit_id='c1', request_id='r1', project_name='demo', task_total=20, task_complete=2)
+            dynamodb.Table('report-request').put_item(Item=dict(record))
+            report.append_findings('r1', 1, dict(rule='rule1', content=[ dict(title='t1') ]))
+            report.append_findings('r1', 2, dict(rule='rule2', content=[]))
+            url = report.generate_partial_report(record)
+            content = s3_codec.get_object(s3, 'report-bucket', 'report/demo/c1/partial.html')
+            item = dynamodb.Table('report-request').get_item(Key=dict(commit_id='c1', request_id='r1'))['Item']
+            return url, content, item
+
+        url, content, item = self.run_with_aws(callback)
+        assert '2/20' in content and '"rule": "rule1"' in content and 'partial.data/0.json' in content
+        assert item['partial_report_url'] == url and 'partial.html' in url
+
+
+class TestReportPages:
+    """report.py 报告外壳页面与分页数据测试类"""
+
+    def test_findings_are_paginated_by_rule_and_file(self):
+        """
+        测试目的：验证发现按规则与文件分页，行号不参与分页，没有发现的结果不产生分页
+        """
+        data = [
+            dict(rule='sql', content=[ dict(title='a', filepath='a.py @line 1-2'), dict(title='b', filepath='b.py') ]),
+            dict(rule='sql', content=[ dict(title='c', filepath='a.py @line 9') ]),
+            dict(rule='xss', content=[ dict(title='d', filepath='a.py') ]),
+            dict(rule='none', content=[]),
+        ]
+        pages = report.paginate_findings(data)
+        assert [ (page['rule'], page['file']) for page in pages ] == [ ('sql', 'a.py'), ('sql', 'b.py'), ('xss', 'a.py') ]
+        assert [ item['title'] for item in pages[0]['data'][0]['content'] ] == [ 'a', 'c' ]
+
+    def test_report_shell_with_gzip_pages(self):
+        """
+        测试目的：验证报告写入外壳页面、gzip压缩的分页数据与共用的CSS/JS
+
+        测试过程：同一容器内为两个提交生成报告
+
+        期望结果：
+        - 外壳页面不包含发现内容，只引用分页数据的URL
+        - 分页数据设置Content-Encoding为gzip，解压后为报告数据
+        - 共用CSS/JS只上传一次，两个报告引用同一个对象
+        - 模板文件只读取一次
+        """
+        import gzip
+        import json
+        import boto3
+        from unittest.mock import patch
+        from moto import mock_aws
+
+        data = [ dict(rule='sql', content=[ dict(title='secret finding', filepath='a.py @line 1', content='</script> x') ]) ]
+        report.load_template.cache_clear()
+        with mock_aws():
+            s3 = boto3.resource('s3', region_name='us-east-1')
+            s3.create_bucket(Bucket='report-bucket')
+            with patch.object(report, 's3', s3), patch.object(report, 'uploaded_static_keys', set()), \
+                    patch.object(s3_codec, 'S3_COMPRESS_MIN_BYTES', 0), patch.dict(os.environ, { 'BUCKET_NAME': 'report-bucket' }), \
+                    patch('builtins.open', side_effect=open) as opened:
+                _, _, key, url, _ = report.write_report('demo', 'c1', 'index', data)
+                report.write_report('demo', 'c2', 'index', data)
+                assert opened.call_count == 3
+
+            shell = s3.Object('report-bucket', key).get()
+            assert shell['ContentEncoding'] == 'gzip' and shell['ContentType'].startswith('text/html')
+            content = s3_codec.get_object(s3, 'report-bucket', key)
+            assert key == 'report/demo/c1/index.html' and 'index.html' in url
+            assert 'secret finding' not in content and 'index.data/0.json' in content
+            page = s3.Object('report-bucket', 'report/demo/c1/index.data/0.json').get()
+            assert page['ContentEncoding'] == 'gzip' and page['ContentType'] == 'application/json'
+            assert json.loads(gzip.decompress(page['Body'].read())) == data
+            static = [ obj.key for obj in s3.Bucket('report-bucket').objects.filter(Prefix='report/static/') ]
+            assert len(static) == 2 and all(name in content for name in static)
+            assert '<style>' not in content and '<script id="report-script" src="https://' in content
+
+
+class TestReportNotify:
+    """report.py 通知测试类"""
+
+    def test_sns_message_has_only_location_and_counts(self):
+        """
+        测试目的：验证SNS消息不包含发现内容，避免超过256KB上限，预签名URL有效期不超过7天
+
+        期望结果：
+        - 消息包含报告位置、分页数与汇总计数，不包含data
+        - 30天的有效期被限制为604800秒
+        """
+        import json
+        from unittest.mock import patch, MagicMock
+
+        data = [ dict(rule='sql', content=[ dict(title='x' * 1024) ] * 300) ]
+        result = dict(title='t', subtitle='s', url='https://u', s3key='report/demo/c1/index.html', pages=1, summary=dict(results=1, findings=300), data=data)
+        sns = MagicMock()
+        sns.publish.return_value = dict(MessageId='m1')
+        with patch.object(report, 'generate_report', return_value=result), patch.object(report.datastore, 'update_item'), \
+                patch.object(report, 'sns', sns), patch.object(report, 'post_review_to_github_pr'):
+            report.generate_report_and_notify(None, dict(commit_id='c1', request_id='r1'), dict(project_name='demo'))
+        message = json.loads(sns.publish.call_args.kwargs['Message'])
+        assert 'data' not in message and len(sns.publish.call_args.kwargs['Message']) < 1024
+        assert (message['report_key'], message['pages'], message['summary']['findings']) == ('report/demo/c1/index.html', 1, 300)
+
+        client = MagicMock()
+        with patch.object(report, 's3', MagicMock(meta=MagicMock(client=client))):
+            report.get_presigned_url('report-bucket', 'k', 3600 * 24 * 30)
+        assert client.generate_presigned_url.call_args.kwargs['ExpiresIn'] == 604800
@@ -0,0 +1,122 @@
+"""
+report_receiver.py 单元测试
+
+测试目标：验证邮件报告的渲染
+- 问题内容中的代码块渲染为<pre>，其余文本转义
+- 问题数或正文大小超过上限时只显示前面的问题，并提示打开报告链接
+- 样式在同一容器内只读取一次
+- SNS消息不带问题时，从S3逐页读取报告数据，显示足够的问题后不再读取
+
+测试方法：直接调用generate_report，检查生成的HTML；使用moto模拟S3
+"""
+
+import sys
+import os
+import types
+from unittest.mock import patch
+
+# 在导入被测模块前，注入 awslambdaric 替身，避免本地缺少该依赖导致导入失败
+if 'awslambdaric.lambda_runtime_log_utils' not in sys.modules:
+    _parent = types.ModuleType('awslambdaric')
+    _sub = types.ModuleType('awslambdaric.lambda_runtime_log_utils')
+    class _JsonFormatter:
+        def __init__(self, *a, **k):
+            pass
+        def format(self, record):
+            return '{}'
+    _sub.JsonFormatter = _JsonFormatter
+    sys.modules['awslambdaric'] = _parent
+    sys.modules['awslambdaric.lambda_runtime_log_utils'] = _sub
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import report_receiver
+
+
+def build_data(count, size=10):
+    return [ dict(rule='sql', content=[ dict(title=f'issue{i}', filepath=f'a{i}.py', content='x' * size) for i in range(count) ]) ]
+
+
+class TestReportReceiver:
+    """report_receiver.py 测试类"""
+
+    def test_content_and_link(self):
+        """
+        测试目的：验证代码块、文本转义与报告链接
+
+        期望结果：代码块渲染为<pre>并转义代码，文本中的换行转为<br>，报告链接位于正文开头
+        """
+        data = [ dict(rule='sql', content=[ dict(title='<t>', filepath='a.py', content='line1\nline2\n```python\nif a < b:\n    pass\n```') ]) ]
+        content = report_receiver.generate_report('title', 'subtitle', data, report_url='https://example.com/r?a=1&b=2')
+        assert '<pre class="code-block"><code class="code-block-content python">if a &lt; b:\n    pass</code></pre>' in content
+        assert 'line1<br>line2<br>' in content and '&lt;t&gt;' in content
+        assert '<body><div style="border: 1px dashed gray; padding: 5px;">报告原始地址：<a href="https://example.com/r?a=1&amp;b=2"' in content
+        assert '<style>' in content and '.issue-item' in content
+
+    def test_top_findings(self):
+        """
+        测试目的：验证问题数超过上限时只显示前N个问题
+
+        期望结果：显示前3个问题，并提示共10个问题
+        """
+        content = report_receiver.generate_report('title', 'subtitle', build_data(10), max_findings=3)
+        assert content.count('class="issue-item"') == 3 and 'issue2' in content and 'issue3' not in content
+        assert '仅显示前3个问题，共10个问题' in content
+
+    def test_size_limit(self):
+        """
+        测试目的：验证正文超过大小上限时停止输出，第一个问题总是显示
+
+        期望结果：每个问题约1.5KB，上限3500字节时显示2个问题；上限很小时仍显示1个问题
+        """
+        content = report_receiver.generate_report('title', 'subtitle', build_data(10, 1000), max_findings=0, max_bytes=3500)
+        assert content.count('class="issue-item"') == 2 and '仅显示前2个问题' in content
+        content = report_receiver.generate_report('title', 'subtitle', build_data(10, 1000), max_findings=0, max_bytes=10)
+        assert content.count('class="issue-item"') == 1
+        content = report_receiver.generate_report('title', 'subtitle', build_data(10), max_findings=0, max_bytes=0)
+        assert content.count('class="issue-item"') == 10 and '仅显示前' not in content
+
+    def test_css_is_cached(self):
+        """
+        测试目的：验证样式在同一容器内只读取一次，不依赖当前工作目录
+
+        期望结果：两次渲染只打开一次模板和一次CSS文件
+        """
+        report_receiver.load_css.cache_clear()
+        cwd = os.getcwd()
+        try:
+            os.chdir('/')
+            with patch('builtins.open', side_effect=open) as opened:
+                report_receiver.generate_report('title', 'subtitle', build_data(1))
+                report_receiver.generate_report('title', 'subtitle', build_data(1))
+        finally:
+            os.chdir(cwd)
+        assert opened.call_count == 2
+
+    def test_mail_streams_pages_from_s3(self):
+        """
+        测试目的：验证邮件从S3的报告分页数据读取问题，达到上限后不再读取后面的分页
+
+        期望结果：3个分页只读取第1页，显示前2个问题，提示总数取自消息中的汇总计数
+        """
+        import json
+        import boto3
+        from moto import mock_aws
+
+        with mock_aws():
+            s3 = boto3.resource('s3', region_name='us-east-1')
+            s3.create_bucket(Bucket='report-bucket')
+            for index in range(3):
+                s3.Object('report-bucket', f'report/demo/c1/index.data/{index}.json').put(Body=json.dumps(build_data(3)))
+            message = json.dumps(dict(title='t', subtitle='s', report_url='https://u', report_key='report/demo/c1/index.html', pages=3, summary=dict(findings=9)))
+            get_object = report_receiver.s3_codec.get_object
+            with patch.object(report_receiver, 's3', s3), patch.dict(os.environ, { 'BUCKET_NAME': 'report-bucket' }), \
+                    patch.object(report_receiver, 'REPORT_MAIL_MAX_FINDINGS', 2), \
+                    patch.object(report_receiver.s3_codec, 'get_object', side_effect=get_object) as read, \
+                    patch.object(report_receiver.smtplib, 'SMTP_SSL') as smtp:
+                report_receiver.send_mail(message)
+        assert read.call_count == 1
+        sent = smtp.return_value.__enter__.return_value.send_message.call_args.args[0]
+        content = sent.get_payload()[0].get_payload(decode=True).decode('utf-8')
+        assert content.count('class="issue-item"') == 2 and '仅显示前2个问题，共9个问题' in content
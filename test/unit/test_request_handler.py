@@ -830,4 +830,44 @@ class TestRequestHandler:
                     'commit_id': actual_commit_id,
                     'request_id': actual_request_id
                 }
-            )
\ No newline at end of file
+            )
+
+class TestAttachRules:
+    """预检查规则随调用参数传递给Task Dispatcher"""
+
+    def test_attach_rules(self):
+        """
+        测试目的：验证预检查加载的规则集写入调用参数，超过大小上限时不传递
+
+        期望结果：未超限时参数包含rules与rules_hash；超限时两者均不存在，但仍返回哈希
+        """
+        rules = [ dict(name='r1', branch='main', event='push', mode='diff') ]
+        params = dict()
+        rules_hash = request_handler.attach_rules(params, rules)
+        assert params == dict(rules=rules, rules_hash=rules_hash)
+
+        params = dict()
+        with patch.object(request_handler, 'RULES_PAYLOAD_LIMIT', 10):
+            assert request_handler.attach_rules(params, rules) == rules_hash
+        assert params == dict()
+
+    def test_no_rule_push_records_head(self):
+        """
+        测试目的：验证没有适用规则而直接完成的请求同样记录最新提交，取代同一分支上进行中的旧请求
+
+        期望结果：record_head在预检查之前调用，请求直接完成，不调用Task Dispatcher
+        """
+        params = dict(request_id='r1', project_id='p1', project_name='demo', commit_id='c2', ref='main', repo_url='u', private_token='t', event_type='merge', target_branch='main')
+        calls = []
+        codelib = MagicMock()
+        codelib.parse_parameters.return_value = params
+        codelib.format_commit_id.side_effect = lambda repo_context, branch, commit_id: commit_id
+        with patch.object(request_handler, 'codelib', codelib), \
+                patch.object(request_handler.datastore, 'put_item') as put_item, \
+                patch.object(request_handler.supersession, 'record_head', side_effect=lambda *args: calls.append('head')), \
+                patch.object(request_handler, 'has_applicable_rules', side_effect=lambda *args: calls.append('precheck') and False), \
+                patch.object(request_handler, 'lambda_client') as lambda_client:
+            request_handler.process(dict(body='{}'), None)
+        assert calls == [ 'head', 'precheck' ]
+        assert put_item.call_args.args[1]['task_status'] == 'Complete'
+        assert not lambda_client.invoke.called
@@ -0,0 +1,103 @@
+"""
+rule_index.py 单元测试
+
+测试目标：验证规则索引按事件类型和分支（含glob通配符）路由规则的正确性
+- 精确分支与通配符分支的匹配
+- 匹配结果保持原始规则顺序，与线性扫描一致
+- 同一规则集只编译一次索引
+"""
+
+import sys
+import os
+from unittest.mock import patch
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import rule_index
+
+
+RULES = [
+    { 'name': 'main-push', 'branch': 'main', 'event': 'push' },
+    { 'name': 'release-push', 'branch': 'release/*', 'event': 'push' },
+    { 'name': 'main-merge', 'branch': 'main', 'event': 'merge' },
+    { 'name': 'any-feature-push', 'branch': 'feature/**', 'event': 'push' },
+    { 'name': 'main-or-dev-push', 'branch': 'main|dev', 'event': 'push' },
+]
+
+
+class TestRuleIndex:
+    """rule_index.py 测试类"""
+
+    def test_match_branch(self):
+        """
+        测试目的：验证单条分支模式的匹配语义
+
+        期望结果：
+        - 无通配符时精确匹配
+        - * 不跨越 /，** 可跨越多级
+        - | 分隔多个模式
+        - 目标分支为None时只匹配None
+        """
+        assert rule_index.match_branch('main', 'main') is True
+        assert rule_index.match_branch('main', 'main2') is False
+        assert rule_index.match_branch('release/*', 'release/1.0') is True
+        assert rule_index.match_branch('release/*', 'release/1.0/hotfix') is False
+        assert rule_index.match_branch('release/**', 'release/1.0/hotfix') is True
+        assert rule_index.match_branch('main|dev', 'dev') is True
+        assert rule_index.match_branch('release/*', None) is False
+        assert rule_index.match_branch(None, None) is True
+
+    def test_index_matches_linear_scan(self):
+        """
+        测试目的：验证索引结果与原有线性扫描逻辑一致（包括顺序）
+
+        测试过程：
+        1. 对多组(event, branch)组合分别使用索引和线性扫描
+        2. 比较两者返回的规则名称列表
+
+        期望结果：两者完全一致
+        """
+        index = rule_index.RuleIndex(RULES)
+        cases = [ ('push', 'main'), ('push', 'release/2.0'), ('merge', 'main'), ('push', 'feature/a/b'), ('push', 'dev'), ('tag', 'main'), ('push', None) ]
+        for event_type, branch in cases:
+            expected = [ rule['name'] for rule in RULES if rule_index.match_branch(rule['branch'], branch) and rule['event'] == event_type ]
+            actual = [ rule['name'] for rule in index.match(event_type, branch) ]
+            assert actual == expected, f'({event_type}, {branch}) 索引结果与线性扫描不一致'
+            assert index.has_match(event_type, branch) == bool(expected)
+
+    def test_index_cached_by_hash(self):
+        """
+        测试目的：验证同一规则集（内容相同）只编译一次索引
+
+        期望结果：内容相同的两个列表得到同一个索引对象，内容不同则重新编译
+        """
+        first = rule_index.get_rule_index([ dict(rule) for rule in RULES ])
+        second = rule_index.get_rule_index([ dict(rule) for rule in RULES ])
+        assert first is second
+
+        changed = rule_index.get_rule_index(RULES + [ { 'name': 'extra', 'branch': 'x', 'event': 'push' } ])
+        assert changed is not first
+        assert rule_index.find_rules(RULES, 'push', 'release/3') == [ RULES[1] ]
+
+    def test_index_lookup_skips_hashing(self):
+        """
+        测试目的：验证同一规则列表对象、或已传入规则集哈希时，不再序列化规则集计算哈希
+
+        期望结果：首次编译后，按对象身份或传入的哈希命中缓存，compute_rules_hash不被调用
+        """
+        rules = [ dict(rule) for rule in RULES ]
+        rules_hash = rule_index.compute_rules_hash(rules)
+        first = rule_index.get_rule_index(rules)
+        with patch.object(rule_index, 'compute_rules_hash', side_effect=AssertionError('rules are hashed again')):
+            assert rule_index.get_rule_index(rules) is first
+            assert rule_index.find_rules([ dict(rule) for rule in RULES ], 'push', 'release/3', rules_hash) == [ RULES[1] ]
+
+    def test_matched_rules_are_copies(self):
+        """
+        测试目的：验证匹配结果是缓存规则的副本，调用方修改后不影响之后的匹配结果
+        """
+        rules = [ dict(rule) for rule in RULES ]
+        matched = rule_index.find_rules(rules, 'push', 'release/3')
+        matched[0]['prompt_user'] = 'changed'
+        assert 'prompt_user' not in rule_index.find_rules(rules, 'push', 'release/3')[0]
@@ -0,0 +1,78 @@
+"""
+s3_codec.py 单元测试
+
+测试目标：验证S3对象的压缩编码
+- 写入时按S3_COMPRESSION压缩并设置Content-Encoding，小对象不压缩
+- 读取时按Content-Encoding或魔数解码，兼容未压缩的历史对象
+- 没有安装zstandard时zstd退回到gzip
+
+测试方法：使用moto模拟S3
+"""
+
+import sys
+import os
+import gzip
+import json
+import pytest
+import boto3
+from unittest.mock import patch
+from moto import mock_aws
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import s3_codec
+
+BUCKET_NAME = 'codec-bucket'
+TEXT = json.dumps(dict(rule='sql', prompt_user='代码' * 2000))
+
+
+@pytest.fixture
+def s3():
+    """创建S3存储桶"""
+    with mock_aws():
+        s3 = boto3.resource('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BUCKET_NAME)
+        yield s3
+
+
+class TestS3Codec:
+    """s3_codec.py 测试类"""
+
+    def test_gzip_round_trip(self, s3):
+        """
+        测试目的：验证默认以gzip压缩写入，设置Content-Encoding，读取时透明解压
+
+        期望结果：对象比原文小，Content-Encoding为gzip，读取结果与原文相同
+        """
+        s3_codec.put_object(s3, BUCKET_NAME, 'result/r1/1.json', TEXT, 'application/json', s3_codec.ENCODING_GZIP)
+        response = s3.Object(BUCKET_NAME, 'result/r1/1.json').get()
+        assert response['ContentEncoding'] == 'gzip' and response['ContentType'] == 'application/json'
+        assert response['ContentLength'] < len(TEXT.encode('utf-8'))
+        assert s3_codec.get_object(s3, BUCKET_NAME, 'result/r1/1.json') == TEXT
+
+    def test_plain_objects_are_compatible(self, s3):
+        """
+        测试目的：验证未压缩的历史对象、缺少Content-Encoding的压缩对象都能读取，小对象不压缩
+
+        期望结果：三种对象读取结果均与原文相同，小对象没有Content-Encoding
+        """
+        s3.Object(BUCKET_NAME, 'plain.json').put(Body=TEXT)
+        s3.Object(BUCKET_NAME, 'bare.json').put(Body=gzip.compress(TEXT.encode('utf-8')))
+        s3_codec.put_object(s3, BUCKET_NAME, 'small.json', '{}', 'application/json')
+        assert s3_codec.get_object(s3, BUCKET_NAME, 'plain.json') == TEXT
+        assert s3_codec.get_object(s3, BUCKET_NAME, 'bare.json') == TEXT
+        assert s3_codec.get_object(s3, BUCKET_NAME, 'small.json') == '{}'
+        assert 'ContentEncoding' not in s3.Object(BUCKET_NAME, 'small.json').get()
+
+    def test_encoding_selection(self):
+        """
+        测试目的：验证压缩方式的选择：none不压缩，未安装zstandard时zstd退回到gzip
+        """
+        body, encoding = s3_codec.encode(TEXT, 'none')
+        assert encoding is None and body == TEXT.encode('utf-8')
+        with patch.object(s3_codec, 'zstandard', None):
+            body, encoding = s3_codec.encode(TEXT, s3_codec.ENCODING_ZSTD)
+            assert encoding == s3_codec.ENCODING_GZIP and s3_codec.decode(body) == TEXT
+            with pytest.raises(Exception):
+                s3_codec.decode(s3_codec.ZSTD_MAGIC + b'\x00', s3_codec.ENCODING_ZSTD)
@@ -0,0 +1,96 @@
+"""
+supersession.py 单元测试
+
+测试目标：验证同一分支连续推送时，旧提交的评审被识别为已取代
+- 最新提交标记按create_time条件写入，乱序到达的旧请求不会覆盖新标记
+- Webtool请求与push事件不参与跟踪
+
+测试方法：使用moto模拟DynamoDB
+"""
+
+import sys
+import os
+import pytest
+import boto3
+from unittest.mock import patch
+from moto import mock_aws
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import datastore
+import supersession
+
+REQUEST_TABLE = 'supersession-test-request'
+
+
+@pytest.fixture
+def request_table():
+    """创建Request表，并清空标记缓存"""
+    with mock_aws():
+        dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+        dynamodb.create_table(
+            TableName=REQUEST_TABLE,
+            KeySchema=[{'AttributeName': 'commit_id', 'KeyType': 'HASH'}, {'AttributeName': 'request_id', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[{'AttributeName': 'commit_id', 'AttributeType': 'S'}, {'AttributeName': 'request_id', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST',
+        )
+        with patch.object(datastore, 'dynamodb', dynamodb), \
+                patch.dict(supersession._head_cache, clear=True), patch.dict(os.environ, { 'REQUEST_TABLE': REQUEST_TABLE }):
+            yield dynamodb
+
+
+def make_params(commit_id, **extra):
+    params = dict(project_id='42', event_type='merge', ref='feature/login', commit_id=commit_id, request_id=f'req-{commit_id}')
+    params.update(extra)
+    return params
+
+
+class TestSupersession:
+    """supersession.py 测试类"""
+
+    def test_newer_push_supersedes_older(self, request_table):
+        """
+        测试目的：验证推送新提交后，旧提交被判定为已取代，新提交不受影响
+
+        测试过程：
+        1. 依次记录c1、c2两个提交
+        2. 清空缓存后分别检查c1、c2
+
+        期望结果：c1已取代，c2未取代
+        """
+        assert supersession.record_head(make_params('c1'), '2026-01-01 10:00:00') is True
+        assert supersession.record_head(make_params('c2'), '2026-01-01 10:01:00') is True
+        supersession._head_cache.clear()
+
+        assert supersession.is_superseded(make_params('c1')) is True
+        assert supersession.is_superseded(make_params('c2')) is False
+
+    def test_out_of_order_webhook_does_not_overwrite(self, request_table):
+        """
+        测试目的：验证较晚到达但更旧的请求不会覆盖最新提交标记
+        """
+        supersession.record_head(make_params('c2'), '2026-01-01 10:01:00')
+        assert supersession.record_head(make_params('c1'), '2026-01-01 10:00:00') is False
+        supersession._head_cache.clear()
+
+        assert supersession.get_head_commit_id(make_params('c1')) == 'c2'
+
+    def test_webtool_and_unknown_ref_are_not_tracked(self, request_table):
+        """
+        测试目的：验证Webtool请求和缺少ref的请求不会被取消
+        """
+        supersession.record_head(make_params('c2'), '2026-01-01 10:01:00')
+
+        assert supersession.is_superseded(make_params('c1', invoker='webtool')) is False
+        assert supersession.is_superseded(dict(make_params('c1'), ref=None)) is False
+
+    def test_push_is_not_tracked(self, request_table):
+        """
+        测试目的：验证push事件不会被取消，每次push评审的差异不会被后续push覆盖
+
+        期望结果：push事件不记录最新提交，旧的push提交不会判定为已取代
+        """
+        assert supersession.record_head(make_params('c1', event_type='push'), '2026-01-01 10:00:00') is False
+        supersession.record_head(make_params('c2'), '2026-01-01 10:01:00')
+        assert supersession.is_superseded(make_params('c1', event_type='push')) is False
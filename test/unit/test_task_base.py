@@ -0,0 +1,175 @@
+"""
+task_base.py 单元测试
+
+测试目标：验证Request完成判断与报告认领
+- 根据计数器更新返回的记录判断完成，不再额外读取
+- 多个执行器同时看到完成时，只有一个能认领并生成报告
+- 报告生成中断后，认领超时可以重新认领
+- 计数器更新不会把Reporting/Complete改回Processing
+
+测试方法：使用moto模拟DynamoDB，mock报告生成
+"""
+
+import sys
+import os
+import types
+import datetime
+import logging
+import threading
+import pytest
+import boto3
+from unittest.mock import patch
+from moto import mock_aws
+
+# 在导入被测模块前，注入 awslambdaric 替身，避免本地缺少该依赖导致导入失败
+if 'awslambdaric.lambda_runtime_log_utils' not in sys.modules:
+    _parent = types.ModuleType('awslambdaric')
+    _sub = types.ModuleType('awslambdaric.lambda_runtime_log_utils')
+    class _JsonFormatter:
+        def __init__(self, *a, **k):
+            pass
+        def format(self, record):
+            return '{}'
+    _sub.JsonFormatter = _JsonFormatter
+    sys.modules['awslambdaric'] = _parent
+    sys.modules['awslambdaric.lambda_runtime_log_utils'] = _sub
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import base
+import datastore
+import task_base
+
+REQUEST_TABLE = 'task-base-test-request'
+KEY = dict(commit_id='c1', request_id='r1')
+log = logging.getLogger('test_task_base')
+
+
+@pytest.fixture
+def request_table():
+    """创建Request表并写入一条处理中的记录，mock报告生成"""
+    with mock_aws():
+        dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+        dynamodb.create_table(
+            TableName=REQUEST_TABLE,
+            KeySchema=[{'AttributeName': 'commit_id', 'KeyType': 'HASH'}, {'AttributeName': 'request_id', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[{'AttributeName': 'commit_id', 'AttributeType': 'S'}, {'AttributeName': 'request_id', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST',
+        )
+        dynamodb.Table(REQUEST_TABLE).put_item(Item=dict(
+            KEY, task_status=base.STATUS_PROCESSING, task_total=2, task_complete=1, task_failure=0, task_cancel=0,
+            create_time=str(datetime.datetime.now()),
+        ))
+        with patch.object(datastore, 'dynamodb', dynamodb), \
+                patch.dict(os.environ, { 'REQUEST_TABLE': REQUEST_TABLE }), \
+                patch.object(task_base.report, 'generate_report_and_notify') as generate:
+            yield dynamodb.Table(REQUEST_TABLE), generate
+
+
+def complete_one():
+    """模拟执行器完成一个子任务，返回计数器更新后的记录"""
+    return datastore.update_item(
+        REQUEST_TABLE, KEY,
+        'set task_complete = task_complete + :tc',
+        values={ ':tc': 1 },
+        return_values='ALL_NEW',
+    )
+
+
+class TestTaskBase:
+    """task_base.py 测试类"""
+
+    def test_incomplete_counters_do_not_report(self, request_table):
+        """
+        测试目的：验证子任务未全部结束时不认领报告
+        """
+        table, generate = request_table
+        record = table.get_item(Key=KEY)['Item']
+        assert not task_base.check_request_counters(record, log)
+        assert not task_base.check_request_counters(None, log)
+        assert not generate.called
+
+    def test_only_one_executor_reports(self, request_table):
+        """
+        测试目的：验证多个执行器同时看到完成时，只有一个生成报告
+
+        测试过程：最后一个子任务完成后，4个线程用同一份完成的记录同时检查
+
+        期望结果：只有一个线程返回True，报告只生成一次，Request状态为Reporting
+        """
+        table, generate = request_table
+        record = complete_one()
+        barrier = threading.Barrier(4)
+        results = []
+
+        def check():
+            barrier.wait()
+            results.append(task_base.check_request_counters(record, log))
+
+        threads = [ threading.Thread(target=check) for _ in range(4) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(results) == [ False, False, False, True ]
+        assert generate.call_count == 1
+        assert table.get_item(Key=KEY)['Item']['task_status'] == base.STATUS_REPORTING
+
+    def test_stale_claim_can_be_reclaimed(self, request_table):
+        """
+        测试目的：验证报告生成中断后，认领超过REPORT_CLAIM_TIMEOUT可以被cron重新认领
+
+        期望结果：未超时时认领失败，超时后认领成功
+        """
+        table, _ = request_table
+        record = complete_one()
+        assert task_base.claim_report(record, log)
+        assert not task_base.claim_report(record, log)
+
+        stale = str(datetime.datetime.now() - datetime.timedelta(seconds=task_base.REPORT_CLAIM_TIMEOUT + 1))
+        table.update_item(Key=KEY, UpdateExpression='set report_claim_time = :t', ExpressionAttributeValues={ ':t': stale })
+        assert task_base.claim_report(record, log)
+
+    def test_counters_do_not_revert_reporting(self, request_table):
+        """
+        测试目的：验证报告认领后到达的子任务结果不会把Request改回Processing
+
+        测试过程：
+        1. Request处于Start，子任务结果到达后切换为Processing
+        2. 认领报告后，迟到的子任务结果再次累加计数
+
+        期望结果：Start切换为Processing；Reporting保持不变
+        """
+        table, _ = request_table
+        table.update_item(Key=KEY, UpdateExpression='set task_status = :s', ExpressionAttributeValues={ ':s': base.STATUS_START })
+        record = table.get_item(Key=KEY)['Item']
+        assert task_base.mark_processing(record, log)['task_status'] == base.STATUS_PROCESSING
+
+        record = complete_one()
+        assert task_base.check_request_counters(record, log)
+        late = datastore.update_item(
+            REQUEST_TABLE, KEY, 'set task_complete = task_complete + :tc',
+            values={ ':tc': 1 }, return_values='ALL_NEW',
+        )
+        assert not task_base.check_request_counters(late, log)
+        assert table.get_item(Key=KEY)['Item']['task_status'] == base.STATUS_REPORTING
+
+    def test_partial_report_interval(self):
+        """
+        测试目的：验证评审进行中时按间隔更新进行中的报告，大Request的更新次数不超过PARTIAL_REPORT_MAX
+
+        测试过程：task_total为30与1000，依次完成全部任务
+
+        期望结果：30个任务每完成10个更新一次；1000个任务每完成100个更新一次
+        """
+        with patch.object(task_base.report, 'generate_partial_report') as generate, \
+                patch.object(task_base, 'PARTIAL_REPORT_EVERY', 10), patch.object(task_base, 'PARTIAL_REPORT_MAX', 10):
+            for total in (30, 1000):
+                generate.reset_mock()
+                for completes in range(1, total):
+                    record = dict(KEY, task_status=base.STATUS_PROCESSING, task_total=total, task_complete=completes, task_failure=0, task_cancel=0)
+                    assert not task_base.check_request_counters(record, log)
+                interval = 10 if total == 30 else 100
+                assert [ call.args[0]['task_complete'] for call in generate.call_args_list ] == list(range(interval, total, interval))
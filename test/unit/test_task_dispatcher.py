@@ -682,7 +682,9 @@ class TestTaskDispatcher:
         # 测试match_branch函数的直接调用
         assert task_dispatcher.match_branch('main', 'main') is True, "相同分支应该匹配"
         assert task_dispatcher.match_branch('main', 'develop') is False, "不同分支应该不匹配"
-        assert task_dispatcher.match_branch('feature/*', 'feature/login') is False, "当前实现不支持通配符匹配"
+        assert task_dispatcher.match_branch('feature/*', 'feature/login') is True, "通配符应该匹配单层分支"
+        assert task_dispatcher.match_branch('feature/*', 'feature/a/b') is False, "单个*不跨越/"
+        assert task_dispatcher.match_branch('main|release/*', 'release/1.0') is True, "|分隔的任一模式匹配即可"
 
     def test_get_code_contents(self):
         """
@@ -942,6 +944,123 @@ class TestTaskDispatcher:
         expected = '检查Java代码的{{issue}}问题，重点关注{{focus}}'  # 缺失的变量保持原样
         assert result == expected, "缺失的变量应该保持原样"
 
+    def test_cacheable_prompt_layout(self):
+        """
+        测试目的：验证缓存友好的提示词布局
+
+        测试流程：
+        1. 对同一条规则、两份不同代码生成提示词
+        2. Webtool提示词以{{code}}为界分离前缀
+
+        期望结果：
+        - 规则说明在前、代码在后，两份代码的前缀完全相同
+        - prompt_cache_point恰好等于前缀长度
+        - 没有{{code}}占位符的Webtool提示词不设置缓存点
+        """
+        rule = {
+            'name': '缓存规则',
+            'mode': 'single',
+            'model': 'claude4-sonnet',
+            'system': '你是一个专业的代码审查助手',
+            'quality': '请检查{{language}}代码质量问题',
+            'security': '请检查安全漏洞',
+            'order': ['quality', 'security'],
+        }
+        variables = { 'language': 'Python' }
+
+        system, first, point = task_dispatcher.get_cacheable_prompt_data('single', rule, 'a = 1', variables)
+        _, second, second_point = task_dispatcher.get_cacheable_prompt_data('single', rule, 'b = 2', variables)
+
+        assert system == '你是一个专业的代码审查助手'
+        assert first == '请检查Python代码质量问题\n\n请检查安全漏洞\n\n以下是我的代码:\na = 1'
+        assert point == second_point and first[:point] == second[:point]
+        assert first[point:] == 'a = 1'
+
+        webtool_rule = { 'mode': 'diff', 'model': 'claude4-sonnet', 'prompt_system': 's', 'prompt_user': '检查：\n{{code}}\n只输出JSON' }
+        _, prompt_user, point = task_dispatcher.get_cacheable_prompt_data('diff', webtool_rule, 'x = 1')
+        assert prompt_user == '检查：\nx = 1\n只输出JSON' and point == len('检查：\n')
+
+        no_code_rule = dict(webtool_rule, prompt_user='只有说明')
+        assert task_dispatcher.get_cacheable_prompt_data('diff', no_code_rule, 'x = 1')[2] is None
+
+    def test_fusion_grouping(self):
+        """
+        测试目的：验证开启fusion的兼容规则合并为一个任务
+
+        测试流程：
+        1. 同一文件上三条规则：两条开启fusion，一条未开启
+        2. 另一文件上一条开启fusion的规则
+        3. 把FUSION_MAX_TOKENS调小，验证超出上限时拆分
+
+        期望结果：
+        - 同一文件的两条fusion规则在同一组，其余各自成组
+        - 合并提示词只包含一次代码，并包含每条规则的章节
+        - 超出token上限时不再合并
+        """
+        def make_rule(name, fusion=True):
+            return { 'name': name, 'mode': 'diff', 'model': 'claude4-sonnet', 'system': 's', 'requirement': f'检查{name}', 'fusion': fusion }
+        contents = [
+            { 'mode': 'diff', 'rule': make_rule('bug'), 'filepath': 'a.py', 'content': 'code-a' },
+            { 'mode': 'diff', 'rule': make_rule('style', fusion=False), 'filepath': 'a.py', 'content': 'code-a' },
+            { 'mode': 'diff', 'rule': make_rule('security'), 'filepath': 'a.py', 'content': 'code-a' },
+            { 'mode': 'diff', 'rule': make_rule('bug'), 'filepath': 'b.py', 'content': 'code-b' },
+        ]
+
+        groups = task_dispatcher.group_fusion_contents(contents)
+        assert [ [ (c['rule']['name'], c['filepath']) for c in group ] for group in groups ] == [
+            [ ('bug', 'a.py'), ('security', 'a.py') ], [ ('style', 'a.py') ], [ ('bug', 'b.py') ],
+        ]
+
+        prompt_system, prompt_user, _ = task_dispatcher.get_fusion_prompt_data(groups[0])
+        assert prompt_system == 's'
+        assert prompt_user.count('code-a') == 1
+        assert '## 规则: bug\n检查bug' in prompt_user and '## 规则: security\n检查security' in prompt_user
+        assert 'fusion' not in task_dispatcher.join_diy_fields(make_rule('bug')), "fusion不应进入提示词"
+
+        with patch.object(task_dispatcher, 'FUSION_MAX_TOKENS', 10):
+            assert len(task_dispatcher.group_fusion_contents(contents)) == 4
+
+    def test_split_oversize_contents(self):
+        """
+        测试目的：验证超出上下文窗口的代码切分为有重叠的多个任务，并在SQS消息中标记代码位置
+
+        测试流程：
+        1. 把模型的上下文窗口调小，使600行的文件超出上限
+        2. 同时提供一个小文件
+        3. 把切分后的contents发送为任务
+
+        期望结果：
+        - 大文件切分为多段，每段都不超过上限，相邻两段有重叠的行，小文件保持不变
+        - 每个任务带有chunk与code_span，code_span指向prompt_user中的代码
+        """
+        rule = { 'name': 'bug', 'mode': 'diff', 'model': 'claude4-sonnet', 'system': 's', 'requirement': '检查bug' }
+        code = ''.join(f'line {i:04d} ' + 'x' * 90 + '\n' for i in range(600))
+        contents = [
+            { 'mode': 'diff', 'rule': rule, 'filepath': 'big.py', 'content': code },
+            { 'mode': 'diff', 'rule': rule, 'filepath': 'small.py', 'content': 'small' },
+        ]
+        window = dict(task_dispatcher.context_guard.model_config.MODEL_CONFIGS['claude4-sonnet'], context_window=20000)
+        with patch.dict(task_dispatcher.context_guard.model_config.MODEL_CONFIGS, { 'claude4-sonnet': window }):
+            result = task_dispatcher.split_oversize_contents({}, contents)
+            limit = task_dispatcher.context_guard.get_input_limit([ 'claude4-sonnet' ])
+
+        chunks = [ content for content in result if content['filepath'] == 'big.py' ]
+        assert len(chunks) > 1 and result[-1] is contents[1]
+        assert [ chunk['chunk']['index'] for chunk in chunks ] == list(range(1, len(chunks) + 1))
+        assert all(base.estimate_tokens(chunk['content']) <= limit for chunk in chunks)
+        for previous, current in zip(chunks, chunks[1:]):
+            assert current['content'].splitlines()[0] in previous['content']
+        assert code.splitlines()[-1] in chunks[-1]['content']
+
+        with patch.object(task_dispatcher.datastore, 'update_item'), \
+                patch.object(task_dispatcher, 'PROMPT_CACHE', False), \
+                patch.object(task_dispatcher, 'send_message', return_value=True) as send:
+            task_dispatcher.send_task_to_sqs({}, [ rule ], 'r1', 'c1', chunks)
+        for call, chunk in zip(send.call_args_list, chunks):
+            item = call.args[0]
+            start, end = item['code_span']
+            assert item['prompt_user'][start:end] == chunk['content'] and item['chunk'] == chunk['chunk']
+
     @patch('task_dispatcher.send_message')
     def test_task_distribution(self, mock_send_message):
         """
@@ -1956,3 +2075,46 @@ class Application:
             
             # 验证响应成功
             assert response['statusCode'] == 200, "无任务流程应该成功执行"
+
+
+class TestDispatchFailure:
+    """发送失败的任务计数"""
+
+    def test_all_sends_fail_completes_request(self):
+        """
+        测试目的：验证发送失败的任务立即计入task_failure，并在全部结束时生成报告
+
+        测试过程：两个任务发送到SQS均失败
+
+        期望结果：每次失败立即写入计数，最后一次失败后认领并生成一次报告，Request状态为Reporting
+        """
+        from moto import mock_aws
+        import boto3
+        import datastore
+        import task_base
+
+        table_name = 'dispatch-failure-request'
+        key = dict(commit_id='c1', request_id='r1')
+        with mock_aws():
+            dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+            dynamodb.create_table(
+                TableName=table_name,
+                KeySchema=[{'AttributeName': 'commit_id', 'KeyType': 'HASH'}, {'AttributeName': 'request_id', 'KeyType': 'RANGE'}],
+                AttributeDefinitions=[{'AttributeName': 'commit_id', 'AttributeType': 'S'}, {'AttributeName': 'request_id', 'AttributeType': 'S'}],
+                BillingMode='PAY_PER_REQUEST',
+            )
+            dynamodb.Table(table_name).put_item(Item=dict(key, task_status=base.STATUS_START, create_time=str(datetime.datetime.now())))
+            rule = dict(name='r', mode='diff', model='claude3.7-sonnet', prompt_system='system', prompt_user='{{content}}')
+            contents = [ dict(mode='diff', filepath=f'{i}.py', content=f'code {i}', rule=rule) for i in range(2) ]
+
+            with patch.object(datastore, 'dynamodb', dynamodb), \
+                    patch.dict(os.environ, { 'REQUEST_TABLE': table_name }), \
+                    patch.object(task_dispatcher, 'PROMPT_CACHE', False), \
+                    patch.object(task_dispatcher, 'send_message', return_value=False), \
+                    patch.object(task_base.report, 'generate_report_and_notify') as generate:
+                assert task_dispatcher.send_task_to_sqs(dict(key, invoker='webhook'), [ rule ], 'r1', 'c1', contents)
+
+            record = dynamodb.Table(table_name).get_item(Key=key)['Item']
+            assert record['task_total'] == 2 and record['task_failure'] == 2
+            assert record['task_status'] == base.STATUS_REPORTING
+            assert generate.call_count == 1
@@ -0,0 +1,649 @@
+"""
+task_executor.py 单元测试
+
+测试目标：验证Bedrock调用失败后通过SQS延迟消息重试，而不是在Lambda内sleep
+- 仍有重试次数时抛出RetryLaterException，并携带延迟与错误信息
+- 重试次数用尽时记录最终失败
+- 延迟消息保留原任务字段并携带重试计数
+
+测试方法：mock Bedrock调用、DynamoDB更新与SQS发送
+"""
+
+import sys
+import os
+import json
+import time
+import types
+import threading
+import pytest
+from unittest.mock import patch, MagicMock
+
+# 在导入被测模块前，注入 awslambdaric 替身，避免本地缺少该依赖导致导入失败
+if 'awslambdaric.lambda_runtime_log_utils' not in sys.modules:
+    _parent = types.ModuleType('awslambdaric')
+    _sub = types.ModuleType('awslambdaric.lambda_runtime_log_utils')
+    class _JsonFormatter:
+        def __init__(self, *a, **k):
+            pass
+        def format(self, record):
+            return '{}'
+    _sub.JsonFormatter = _JsonFormatter
+    sys.modules['awslambdaric'] = _parent
+    sys.modules['awslambdaric.lambda_runtime_log_utils'] = _sub
+
+# 添加lambda目录到路径，使测试能够导入被测试模块
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../lambda'))
+
+import base
+import task_executor
+
+
+@pytest.fixture(autouse=True)
+def disable_rate_control():
+    """关闭共享令牌桶，避免访问DynamoDB"""
+    with patch.object(task_executor.rate_control, 'RATE_CONTROL_ENABLED', False):
+        yield
+
+
+def make_prompt_data(current_retry=0, max_retry=3):
+    return dict(
+        model='claude3.5-sonnet',
+        messages=['hello'],
+        current_retry=current_retry,
+        max_retry=max_retry,
+        context=dict(commit_id='c1', request_id='r1', number=1, mode='all'),
+    )
+
+
+class TestTaskExecutorRetry:
+    """task_executor.py 重试调度测试类"""
+
+    def test_failure_with_retries_left_raises_retry_later(self):
+        """
+        测试目的：验证调用失败且仍有重试次数时不阻塞，直接抛出RetryLaterException
+
+        期望结果：
+        - 没有调用time.sleep
+        - 异常携带重试计数、延迟（不超过SQS上限）与错误信息
+        - Task记录被标记为等待重试
+        """
+        with patch.object(task_executor, 'invoke_claude', side_effect=Exception('ThrottlingException')), \
+                patch.object(task_executor, 'update_failure_task') as update_failure, \
+                patch.object(task_executor.time, 'sleep') as sleep:
+            with pytest.raises(task_executor.RetryLaterException) as info:
+                task_executor.invoke_bedrock('review', make_prompt_data())
+
+        assert not sleep.called
+        assert info.value.current_retry == 1
+        assert 0 <= info.value.delay <= task_executor.SQS_DELAY_LIMIT
+        assert info.value.error_messages == [ dict(err='ThrottlingException') ]
+        assert update_failure.call_args[0][-1] is True
+
+    def test_last_failure_is_final(self):
+        """
+        测试目的：验证最后一次重试失败时记录最终失败，而不再重新投递
+        """
+        with patch.object(task_executor, 'invoke_claude', side_effect=Exception('boom')), \
+                patch.object(task_executor, 'update_failure_task') as update_failure:
+            with pytest.raises(Exception) as info:
+                task_executor.invoke_bedrock('review', make_prompt_data(current_retry=2, max_retry=3))
+
+        assert not isinstance(info.value, task_executor.RetryLaterException)
+        assert update_failure.call_args[0][-1] is False
+
+    def test_schedule_retry_sends_delayed_message(self):
+        """
+        测试目的：验证延迟消息保留原任务字段并携带重试计数
+
+        期望结果：DelaySeconds等于异常中的延迟，消息体可解码回带current_retry的事件
+        """
+        event = dict(commit_id='c1', request_id='r1', number=1, mode='all', model='claude3.5-sonnet')
+        ex = task_executor.RetryLaterException('retry', 30, 2, [ dict(err='boom') ])
+        sqs = MagicMock()
+        with patch.object(task_executor, 'sqs', sqs):
+            assert task_executor.schedule_retry(event, ex) is True
+
+        kwargs = sqs.send_message.call_args.kwargs
+        assert kwargs['DelaySeconds'] == 30
+        body = json.loads(base.decode_base64(kwargs['MessageBody']))
+        assert body['current_retry'] == 2 and body['request_id'] == 'r1'
+        assert body['error_messages'] == [ dict(err='boom') ]
+        assert 'model_tier' not in body
+
+    def test_retry_keeps_escalated_tier(self):
+        """
+        测试目的：验证升级到更高级别模型后再失败时，重试消息携带当前级别，重试不再从第一级开始
+
+        期望结果：RetryLaterException与延迟消息中model_tier为1，handle_code_review按该级别选择模型
+        """
+        prompt_data = make_prompt_data()
+        prompt_data.update(model='claude4.5-haiku', model_tier=0, model_ladder=[
+            dict(model='claude4.5-haiku', max_input_tokens=1000), dict(model='claude4-sonnet', max_input_tokens=None),
+        ])
+
+        def fake_invoke(model, prompt_data, task_name, enable_reasoning):
+            if model == 'claude4.5-haiku':
+                raise Exception('ValidationException: Input is too long for requested model.')
+            raise Exception('ServiceUnavailableException')
+
+        with patch.object(task_executor, 'invoke_claude', side_effect=fake_invoke), \
+                patch.object(task_executor, 'update_failure_task'):
+            with pytest.raises(task_executor.RetryLaterException) as info:
+                task_executor.invoke_bedrock('review', prompt_data)
+        assert info.value.model_tier == 1
+
+        sqs = MagicMock()
+        with patch.object(task_executor, 'sqs', sqs):
+            task_executor.schedule_retry(dict(request_id='r1', number=1), info.value)
+        body = json.loads(base.decode_base64(sqs.send_message.call_args.kwargs['MessageBody']))
+        assert body['model_tier'] == 1
+
+        event = dict(
+            commit_id='c1', request_id='r1', number=1, mode='diff', model='claude4-sonnet', rule_name='r',
+            prompt_system='s', prompt_user='u', current_retry=1, model_tier=1,
+            model_ladder=[ dict(model='claude4.5-haiku', max_input_tokens=1000) ],
+        )
+        with patch.object(task_executor, 'validate_sqs_event'), \
+                patch.object(task_executor.supersession, 'is_superseded', return_value=False), \
+                patch.object(task_executor, 'invoke_and_extract_bedrock', side_effect=Exception('stop')) as invoke:
+            with pytest.raises(Exception):
+                task_executor.handle_code_review(None, event, dict())
+        assert invoke.call_args.args[1]['model'] == 'claude4-sonnet'
+
+
+class TestTaskExecutorBatch:
+    """task_executor.py 批次并发处理测试类"""
+
+    def test_records_processed_concurrently_with_partial_failures(self):
+        """
+        测试目的：验证同一批次的记录并发处理，且保留部分失败的返回约定
+
+        测试过程：
+        1. mock handle_code_review，阻塞直到所有记录都已开始处理，number为2的记录抛出异常
+        2. 调用lambda_handler处理3条记录
+
+        期望结果：
+        - 3条记录同时处于处理中（并发而非串行）
+        - 失败记录出现在batchItemFailures中，其余出现在成功列表中
+        """
+        started = threading.Barrier(3, timeout=5)
+
+        def fake_handle(record, event, context, deadline=None):
+            started.wait()
+            if event['number'] == 2:
+                raise Exception('boom')
+
+        records = [
+            dict(messageId=f'm{number}', body=base.encode_base64(json.dumps(dict(number=number))))
+            for number in [1, 2, 3]
+        ]
+        with patch.object(task_executor, 'handle_code_review', side_effect=fake_handle), \
+                patch.object(task_executor, 'RECORD_CONCURRENCY', 3):
+            response = task_executor.lambda_handler(dict(Records=records), None)
+
+        assert response['batchItemFailures'] == [ { 'itemIdentifier': 'm2' } ]
+        assert response['batchItemSeccesses'] == [ { 'itemIdentifier': 'm1' }, { 'itemIdentifier': 'm3' } ]
+
+
+class TestTaskExecutorPromptCache:
+    """task_executor.py 提示词缓存测试类"""
+
+    def test_cache_points_in_messages(self):
+        """
+        测试目的：验证缓存点放在首条消息的前缀之后，以及confirm轮次上一轮回复之后
+
+        期望结果：
+        - InvokeModel格式在前缀文本块上设置cache_control
+        - Converse格式在前缀之后插入cachePoint块
+        - 不设置cache_point时消息格式保持不变
+        """
+        messages = [ 'RULES' + 'CODE', 'REPLY', 'CONFIRM' ]
+
+        invoke = task_executor.build_messages(messages, cache_point=5)
+        assert invoke[0]['content'] == [
+            { 'type': 'text', 'text': 'RULES', 'cache_control': { 'type': 'ephemeral' } },
+            { 'type': 'text', 'text': 'CODE' },
+        ]
+        assert invoke[1]['content'][0]['cache_control'] == { 'type': 'ephemeral' }
+        assert 'cache_control' not in invoke[2]['content'][0]
+
+        converse = task_executor.build_messages(messages[:1], for_converse_api=True, cache_point=5)
+        assert converse[0]['content'] == [ { 'text': 'RULES' }, { 'cachePoint': { 'type': 'default' } }, { 'text': 'CODE' } ]
+
+        plain = task_executor.build_messages(messages)
+        assert [ len(message['content']) for message in plain ] == [ 1, 1, 1 ]
+        assert all('cache_control' not in message['content'][0] for message in plain)
+
+    def test_cache_usage_and_model_support(self):
+        """
+        测试目的：验证两种API的缓存token统计，以及不支持缓存的模型不设置缓存点
+        """
+        assert task_executor.get_cache_usage({ 'cache_read_input_tokens': 10, 'cache_creation_input_tokens': 2 }) == (10, 2)
+        assert task_executor.get_cache_usage({ 'cacheReadInputTokens': 7, 'cacheWriteInputTokens': 0 }) == (7, 0)
+        assert task_executor.get_cache_usage(None) == (0, 0)
+
+        prompt_data = dict(cache_point=5)
+        assert task_executor.get_cache_point(task_executor.model_config.get_model_config('claude4-sonnet'), prompt_data) == 5
+        assert task_executor.get_cache_point(task_executor.model_config.get_model_config('claude3-haiku'), prompt_data) is None
+
+
+class TestTaskExecutorFusion:
+    """task_executor.py 多规则合并测试类"""
+
+    def test_split_fused_findings(self):
+        """
+        测试目的：验证合并调用的发现按rule_name拆分回各条规则
+
+        期望结果：
+        - rule_name匹配时忽略大小写与首尾空白
+        - 无法匹配的发现归入第一条规则，不丢失
+        - 没有发现的规则得到空列表
+        """
+        fused_rules = [ dict(rule_name='Bug', number=3), dict(rule_name='Security', number=4), dict(rule_name='Style', number=5) ]
+        content = [
+            { 'title': 'npe', 'rule_name': 'bug' },
+            { 'title': 'sqli', 'rule_name': ' Security ' },
+            { 'title': 'unknown', 'rule_name': 'other' },
+        ]
+
+        findings = task_executor.split_fused_findings(content, fused_rules)
+
+        assert [ f['title'] for f in findings[3] ] == [ 'npe', 'unknown' ]
+        assert [ f['title'] for f in findings[4] ] == [ 'sqli' ]
+        assert findings[5] == []
+        assert task_executor.split_fused_findings('', fused_rules) == { 3: [], 4: [], 5: [] }
+
+
+class TestTaskExecutorRouting:
+    """task_executor.py 模型阶梯测试类"""
+
+    def test_context_overflow_escalates_without_retry(self):
+        """
+        测试目的：验证输入过长时升级到阶梯的下一级模型，且不消耗重试次数
+        """
+        prompt_data = make_prompt_data()
+        prompt_data.update(model='claude4.5-haiku', model_tier=0, model_ladder=[
+            dict(model='claude4.5-haiku', max_input_tokens=1000), dict(model='claude4-sonnet', max_input_tokens=None),
+        ])
+        models = []
+
+        def fake_invoke(model, prompt_data, task_name, enable_reasoning):
+            models.append(model)
+            if model == 'claude4.5-haiku':
+                raise Exception('ValidationException: Input is too long for requested model.')
+            return dict(text='<output>[]</output>', payload='{}', end_time='t1', start_time='t0', timecost=1)
+
+        with patch.object(task_executor, 'invoke_claude', side_effect=fake_invoke), \
+                patch.object(task_executor, 'update_failure_task') as update_failure:
+            result = task_executor.invoke_bedrock('review', prompt_data)
+
+        assert models == [ 'claude4.5-haiku', 'claude4-sonnet' ]
+        assert result['model'] == 'claude4-sonnet' and result['current_retry'] == 0
+        assert not update_failure.called
+
+
+    def test_client_error_releases_region(self):
+        """
+        测试目的：验证获取区域客户端失败时同样记录区域失败，半开探测不会一直占用
+        """
+        prompt_data = dict(make_prompt_data(), messages=[ dict(role='user', content=[ dict(text='hello') ]) ])
+        with patch.object(task_executor.region_pool, 'choose', return_value='us-west-2'), \
+                patch.object(task_executor.bedrock_client, 'get_client', side_effect=Exception('EndpointConnectionError')), \
+                patch.object(task_executor.region_pool, 'record_failure') as record_failure:
+            with pytest.raises(Exception):
+                task_executor.invoke_claude('claude3.5-sonnet', prompt_data, 'review')
+        assert record_failure.call_args.args[:2] == ('claude3.5-sonnet', 'us-west-2')
+
+
+class TestTaskExecutorMetrics:
+    """task_executor.py 分阶段耗时指标测试类"""
+
+    def test_queue_wait_and_invocation_metrics(self):
+        """
+        测试目的：验证处理SQS消息时记录排队时间，调用Bedrock后记录调用耗时与首字节时间，并带有模型、模式、项目维度
+        """
+        event = dict(model='claude3.5-sonnet', mode='diff', context=dict(project_name='demo'))
+        record = dict(body=base.encode_base64(json.dumps(event)), attributes=dict(SentTimestamp=str(int(time.time() * 1000) - 5000)))
+        with patch.object(task_executor, 'handle_code_review'), patch.object(task_executor.metrics, 'emit') as emit:
+            assert task_executor.process_record(record)
+        name, value, unit, dimensions = emit.call_args.args
+        assert name == 'SqsQueueWait' and value >= 5000 and unit == 'Milliseconds'
+        assert dimensions == dict(Model='claude3.5-sonnet', Mode='diff', Project='demo')
+
+        prompt_data = make_prompt_data()
+        prompt_data['context']['project_name'] = 'demo'
+        reply = dict(text='<output>[]</output>', payload='{}', end_time='t1', start_time='t0', timecost=1200, time_to_first_token=300)
+        with patch.object(task_executor, 'invoke_claude', return_value=reply), patch.object(task_executor.metrics, 'emit') as emit:
+            task_executor.invoke_bedrock('review', prompt_data)
+        emitted = { call.args[0]: call.args[1] for call in emit.call_args_list }
+        assert emitted['BedrockInvocationTime'] == 1200 and emitted['BedrockTimeToFirstByte'] == 300
+        assert emit.call_args_list[0].args[3] == dict(Model='claude3.5-sonnet', Mode='all', Project='demo')
+
+
+class TestTaskExecutorUsage:
+    """task_executor.py 用量与费用计量测试类"""
+
+    def test_usage_from_invoke_model_and_converse(self):
+        """
+        测试目的：验证InvokeModel与Converse两种用量格式都能归一化，推理token按推理文本估算
+        """
+        usage = task_executor.get_token_usage(dict(input_tokens=100, output_tokens=20, cache_read_input_tokens=5))
+        assert usage == dict(input_tokens=100, output_tokens=20, reasoning_tokens=0, cache_read_tokens=5, cache_write_tokens=0, estimated=False)
+        usage = task_executor.get_token_usage(dict(inputTokens=7, outputTokens=9, cacheWriteInputTokens=3), reasoning='a' * 40)
+        assert (usage['input_tokens'], usage['output_tokens'], usage['reasoning_tokens'], usage['cache_write_tokens']) == (7, 9, 10, 3)
+
+    def test_stream_cut_off_usage_is_estimated(self):
+        """
+        测试目的：验证流式读取在<output>结束后提前停止、没有收到最终用量时，输出token按已读取文本估算
+
+        期望结果：output_tokens不为0，用量标记为estimated
+        """
+        usage = task_executor.get_token_usage(dict(input_tokens=100), text='x' * 400, payload='{}')
+        assert usage['input_tokens'] == 100 and usage['output_tokens'] == 100 and usage['estimated']
+
+        usage = task_executor.get_token_usage({}, text='x' * 40, payload='y' * 80)
+        assert usage['input_tokens'] == 20 and usage['output_tokens'] == 10 and usage['estimated']
+
+    def test_usage_and_cost_accumulate_across_rounds(self):
+        """
+        测试目的：验证invoke_bedrock累计每一轮的用量与费用
+        """
+        prompt_data = make_prompt_data()
+        reply = dict(text='<output>[]</output>', payload='{}', end_time='t1', start_time='t0', timecost=1, usage=dict(input_tokens=1000, output_tokens=100))
+        with patch.object(task_executor, 'invoke_claude', return_value=reply):
+            task_executor.invoke_bedrock('review', prompt_data)
+            task_executor.invoke_bedrock('review', prompt_data)
+        assert prompt_data['usage']['input_tokens'] == 2000 and prompt_data['usage']['output_tokens'] == 200
+        assert prompt_data['cost'] == pytest.approx(2 * (1000 * 3.0 + 100 * 15.0) / 1000000)
+
+    def test_split_usage_between_fused_rules(self):
+        """
+        测试目的：验证合并调用的用量平均分摊，余数计入第一条规则，总量不变
+        """
+        usage = dict(input_tokens=10, output_tokens=5, reasoning_tokens=0, cache_read_tokens=0, cache_write_tokens=1)
+        shares = task_executor.split_usage(usage, 0.3, 3)
+        assert [ part['input_tokens'] for part, _ in shares ] == [ 4, 3, 3 ]
+        assert sum(part['cache_write_tokens'] for part, _ in shares) == 1
+        assert sum(cost for _, cost in shares) == pytest.approx(0.3)
+
+    def test_record_usage_aggregates_per_project_day_and_rule(self):
+        """
+        测试目的：验证按项目每日总计与按规则各累计一条记录，并输出用量指标
+        """
+        result = dict(rule='sql', usage=dict(input_tokens=10, output_tokens=2), cost=0.5, content=[ dict(title='a') ])
+        with patch.object(task_executor.datastore, 'add_counter') as add_counter, \
+                patch.object(task_executor.metrics, 'emit') as emit:
+            task_executor.record_usage('demo', result)
+        keys = { call.args[1]['request_id'] for call in add_counter.call_args_list }
+        assert len(keys) == 2 and any(key.endswith('#sql') for key in keys)
+        assert { call.args[1]['commit_id'] for call in add_counter.call_args_list } == { 'usage#demo' }
+        assert { call.args[0] for call in emit.call_args_list } == { 'BedrockInputTokens', 'BedrockOutputTokens', 'BedrockCost' }
+
+
+class TestTaskExecutorReasoning:
+    """task_executor.py 自适应推理预算测试类"""
+
+    def test_reasoning_budget_is_chosen_and_recorded(self):
+        """
+        测试目的：验证开启推理时按输入大小选择预算并传给Converse API，调用结果记录实际预算并更新历史
+
+        期望结果：
+        - 较大输入的budget_tokens大于最小预算
+        - prompt_data记录预算与来源
+        - 历史按模型与规则记录本次调用
+        """
+        task_executor.reasoning_budget.reset()
+        prompt_data = dict(make_prompt_data(), model='claude3.7-sonnet', messages=[ 'x' * 40000 ], enable_reasoning=True)
+        prompt_data['context']['rule_name'] = 'security'
+        client = MagicMock()
+        client.converse.return_value = dict(output=dict(message=dict(content=[ dict(text='<output>[]</output>') ])), stopReason='end_turn', usage=dict(inputTokens=10000, outputTokens=50))
+        with patch.object(task_executor, 'BEDROCK_STREAMING', False), \
+                patch.object(task_executor.bedrock_client, 'get_client', return_value=client), \
+                patch.object(task_executor.region_pool, 'choose', return_value='us-east-1'):
+            task_executor.invoke_bedrock('review', prompt_data)
+
+        budget = client.converse.call_args.kwargs['additionalModelRequestFields']['thinking']['budget_tokens']
+        assert budget > task_executor.reasoning_budget.REASONING_BUDGET_MIN
+        assert prompt_data['reasoning_budget'] == budget
+        assert prompt_data['reasoning_budget_source'] == task_executor.reasoning_budget.SOURCE_ADAPTIVE
+        assert task_executor.reasoning_budget.get_history('claude3.7-sonnet', 'security').utilization == 0
+        task_executor.reasoning_budget.reset()
+
+
+class TestTaskExecutorContextGuard:
+    """task_executor.py 上下文窗口检查测试类"""
+
+    def make_event(self, code):
+        prompt_user = f'以下是我的代码:\n{code}\n检查bug'
+        start = prompt_user.find(code)
+        return dict(
+            context=dict(), commit_id='c1', request_id='r1', number=3, mode='diff', model='claude4-sonnet', rule_name='bug',
+            prompt_system='s', prompt_user=prompt_user, code_span=[ start, start + len(code) ], identity='diff-3-bug',
+        )
+
+    def split(self, event, invoke=None, total=12):
+        """运行handle_code_review，返回发送的子任务与Request计数更新"""
+        sqs = MagicMock()
+        with patch.object(task_executor, 'create_task'), \
+                patch.object(task_executor.supersession, 'is_superseded', return_value=False), \
+                patch.object(task_executor.datastore, 'update_item', return_value=dict(task_total=total)) as update, \
+                patch.object(task_executor, 'invoke_claude', side_effect=invoke or Exception('not called')) as invoke_claude, \
+                patch.object(task_executor, 'update_failure_task') as update_failure, \
+                patch.object(task_executor, 'sqs', sqs):
+            task_executor.handle_code_review(None, event, dict())
+        children = [ json.loads(base.decode_base64(call.kwargs['MessageBody'])) for call in sqs.send_message.call_args_list ]
+        return children, update, invoke_claude, update_failure
+
+    def test_runtime_overflow_splits_task(self):
+        """
+        测试目的：验证模型以输入过长拒绝且没有更大的模型时，不消耗重试次数，直接拆分为子任务
+
+        期望结果：
+        - 第一个子任务沿用原编号，其余子任务使用task_total累加后的新编号
+        - 子任务的prompt_user只包含部分代码，code_span指向该部分，且不携带重试计数
+        - 没有记录失败
+        """
+        code = ''.join(f'{i:05d}' + 'v' * 95 + '\n' for i in range(400))
+        event = self.make_event(code)
+        event['current_retry'] = 0
+        children, update, invoke_claude, update_failure = self.split(event, Exception('ValidationException: Input is too long for requested model.'))
+
+        assert invoke_claude.call_count == 1 and not update_failure.called
+        assert update.call_args.kwargs['values'][':n'] == len(children) - 1
+        assert [ child['number'] for child in children ] == [ 3 ] + list(range(12 - len(children) + 2, 13))
+        for child in children:
+            start, end = child['code_span']
+            assert child['prompt_user'][start:end] in code and len(child['prompt_user']) < len(event['prompt_user'])
+            assert child['prompt_user'].endswith('检查bug') and 'current_retry' not in child
+        assert children[0]['chunk']['line'] == 1 and children[-1]['chunk']['line'] > 1
+
+    def test_preflight_splits_without_invoking(self):
+        """
+        测试目的：验证估算输入超出上下文窗口时不调用Bedrock，直接拆分
+        """
+        code = ''.join(f'{i:05d}' + 'v' * 95 + '\n' for i in range(400))
+        with patch.object(task_executor.context_guard, 'get_input_limit', return_value=1000):
+            children, _, invoke_claude, _ = self.split(self.make_event(code))
+        assert not invoke_claude.called and len(children) >= 2
+
+    def test_unsplittable_overflow_fails_without_retry(self):
+        """
+        测试目的：验证无法拆分的过长输入直接记录最终失败，不重新投递重试
+        """
+        event = self.make_event('short')
+        del event['code_span']
+        with patch.object(task_executor.task_base, 'check_request_counters'):
+            children, _, invoke_claude, update_failure = self.split(event, Exception('ValidationException: Input is too long for requested model.'))
+        assert children == [] and invoke_claude.call_count == 1
+        assert update_failure.call_args.args[-1] is False
+
+
+class TestTaskExecutorCheckpoint:
+    """task_executor.py 剩余时间检查点测试类"""
+
+    def test_checkpoint_and_resume_confirm_round(self):
+        """
+        测试目的：验证confirm轮次前剩余时间不足时保存检查点并发送继续消息，新的调用从confirm轮次继续
+
+        测试过程：
+        1. 第一轮调用完成后把剩余时间设为不足，处理SQS记录
+        2. 用继续消息再次处理，检查点从模拟的S3读取
+
+        期望结果：
+        - 第一次只调用一轮，检查点保存了第一轮的对话与confirm提示词，继续消息带有checkpoint
+        - 第二次只调用confirm轮次，对话包含第一轮，结果写入Task并删除检查点
+        """
+        event = dict(
+            context=dict(), commit_id='c1', request_id='r1', number=1, mode='diff', model='claude3.5-sonnet', rule_name='bug',
+            prompt_system='s', prompt_user='review', confirm_prompt='confirm',
+        )
+        objects = dict()
+        bedrock_messages = []
+
+        def fake_invoke(model, prompt_data, task_name, enable_reasoning):
+            bedrock_messages.append(list(prompt_data['messages']))
+            return dict(text='<output>[]</output>', payload='{}', end_time='t1', start_time='t0', timecost=20000)
+
+        s3 = MagicMock()
+        s3.meta.client.delete_object.side_effect = lambda **kwargs: objects.clear()
+        sqs = MagicMock()
+        with patch.object(task_executor, 'create_task'), \
+                patch.object(task_executor.supersession, 'is_superseded', return_value=False), \
+                patch.object(task_executor, 'invoke_claude', side_effect=fake_invoke), \
+                patch.object(task_executor, 'update_complete_task', return_value=None) as complete, \
+                patch.object(task_executor, 's3', s3), patch.object(task_executor, 'sqs', sqs), \
+                patch.object(task_executor.s3_codec, 'put_object', side_effect=lambda s3, bucket, key, text, content_type: objects.update({ key: text })), \
+                patch.object(task_executor.s3_codec, 'get_object', side_effect=lambda s3, bucket, key: objects[key]), \
+                patch.object(task_executor, 'CHECKPOINT_RESERVE_MS', 1000):
+            record = dict(body=base.encode_base64(json.dumps(event)))
+            assert task_executor.process_record(record, time.time() + 10)
+
+            assert bedrock_messages == [ [ 'review' ] ] and not complete.called
+            continuation = json.loads(base.decode_base64(sqs.send_message.call_args.kwargs['MessageBody']))
+            assert continuation['checkpoint'] == 'checkpoint/r1/1.json'
+            state = json.loads(objects[continuation['checkpoint']])
+            assert state['message'] == 'confirm' and state['prompt_data']['messages'] == [ 'review', '<output>[]</output>' ]
+
+            assert task_executor.process_record(dict(body=base.encode_base64(json.dumps(continuation))), time.time() + 900)
+
+        assert bedrock_messages[1] == [ 'review', '<output>[]</output>', 'confirm' ]
+        result = complete.call_args.args[4]
+        assert result['timecost'] == 40000 and result['content'] == []
+        assert objects == {}
+
+    def test_throttled_confirm_round_retries_from_checkpoint(self):
+        """
+        测试目的：confirm轮次被限流时，重试从检查点继续，不再调用第一轮
+
+        测试场景：
+        1. 第一轮成功，confirm轮次抛出RateLimitedException
+        2. 用重试消息再次处理
+
+        期望结果：
+        - 重试消息带有checkpoint，检查点保存了第一轮的对话与confirm提示词
+        - 重试只调用confirm轮次，结果写入Task并删除检查点
+        """
+        event = dict(
+            context=dict(), commit_id='c1', request_id='r1', number=1, mode='diff', model='claude3.5-sonnet', rule_name='bug',
+            prompt_system='s', prompt_user='review', confirm_prompt='confirm',
+        )
+        objects = dict()
+        bedrock_messages = []
+
+        def fake_invoke(model, prompt_data, task_name, enable_reasoning):
+            bedrock_messages.append(list(prompt_data['messages']))
+            if len(bedrock_messages) == 2:
+                raise task_executor.rate_control.RateLimitedException('m', 5)
+            return dict(text='<output>[]</output>', payload='{}', end_time='t1', start_time='t0', timecost=20000)
+
+        s3 = MagicMock()
+        s3.meta.client.delete_object.side_effect = lambda **kwargs: objects.clear()
+        sqs = MagicMock()
+        with patch.object(task_executor, 'create_task'), \
+                patch.object(task_executor.supersession, 'is_superseded', return_value=False), \
+                patch.object(task_executor.rate_control, 'acquire', return_value=0), \
+                patch.object(task_executor.rate_control, 'record_success'), \
+                patch.object(task_executor, 'invoke_claude', side_effect=fake_invoke), \
+                patch.object(task_executor, 'update_complete_task', return_value=None) as complete, \
+                patch.object(task_executor, 's3', s3), patch.object(task_executor, 'sqs', sqs), \
+                patch.object(task_executor.s3_codec, 'put_object', side_effect=lambda s3, bucket, key, text, content_type: objects.update({ key: text })), \
+                patch.object(task_executor.s3_codec, 'get_object', side_effect=lambda s3, bucket, key: objects[key]):
+            record = dict(body=base.encode_base64(json.dumps(event)))
+            assert task_executor.process_record(record, time.time() + 900)
+
+            assert len(bedrock_messages) == 2 and not complete.called
+            retry = json.loads(base.decode_base64(sqs.send_message.call_args.kwargs['MessageBody']))
+            assert retry['checkpoint'] == 'checkpoint/r1/1.json'
+            state = json.loads(objects[retry['checkpoint']])
+            assert state['message'] == 'confirm' and state['prompt_data']['messages'] == [ 'review', '<output>[]</output>' ]
+
+            assert task_executor.process_record(dict(body=base.encode_base64(json.dumps(retry))), time.time() + 900)
+
+        assert bedrock_messages[2:] == [ [ 'review', '<output>[]</output>', 'confirm' ] ]
+        assert complete.called and objects == {}
+
+
+class TestTaskExecutorCompletion:
+    """update_complete_task 完成计数测试类"""
+
+    def test_counter_failure_keeps_task_incomplete(self):
+        """
+        测试目的：完成计数写入失败时Task不被标记为完成，重试仍会计数
+
+        测试场景：
+        1. 第一次写入时事务失败（模拟Request计数写入被限流）
+        2. 重试写入，之后再重复写入一次
+
+        期望结果：
+        - 第一次抛出异常，Task未标记为完成，计数未累加
+        - 重试返回完成计数为1的Request记录，重复写入返回None且不再累加
+        """
+        import boto3
+        import datastore
+        from botocore.exceptions import ClientError
+        from moto import mock_aws
+
+        with mock_aws():
+            dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+            dynamodb.create_table(
+                TableName='complete-task',
+                KeySchema=[{'AttributeName': 'request_id', 'KeyType': 'HASH'}, {'AttributeName': 'number', 'KeyType': 'RANGE'}],
+                AttributeDefinitions=[{'AttributeName': 'request_id', 'AttributeType': 'S'}, {'AttributeName': 'number', 'AttributeType': 'N'}],
+                BillingMode='PAY_PER_REQUEST',
+            )
+            dynamodb.create_table(
+                TableName='complete-request',
+                KeySchema=[{'AttributeName': 'commit_id', 'KeyType': 'HASH'}, {'AttributeName': 'request_id', 'KeyType': 'RANGE'}],
+                AttributeDefinitions=[{'AttributeName': 'commit_id', 'AttributeType': 'S'}, {'AttributeName': 'request_id', 'AttributeType': 'S'}],
+                BillingMode='PAY_PER_REQUEST',
+            )
+            dynamodb.Table('complete-request').put_item(Item=dict(commit_id='c1', request_id='r1', task_total=2, task_complete=0, task_failure=0))
+            dynamodb.Table('complete-task').put_item(Item=dict(request_id='r1', number=1, succ=False, retry_times=0))
+
+            transact = dynamodb.meta.client.transact_write_items
+            calls = []
+            def flaky_transact(**kwargs):
+                calls.append(kwargs)
+                if len(calls) == 1:
+                    raise ClientError({ 'Error': { 'Code': 'TransactionCanceledException', 'Message': 'throttled' },
+                        'CancellationReasons': [ { 'Code': 'None' }, { 'Code': 'ThrottlingError' } ] }, 'TransactWriteItems')
+                return transact(**kwargs)
+
+            result = dict(model='claude3.5-sonnet', rule='bug', content=[], usage=dict(input_tokens=10, output_tokens=5), cost=0.01)
+            with patch.object(datastore, 'dynamodb', dynamodb), \
+                    patch.object(dynamodb.meta.client, 'transact_write_items', side_effect=flaky_transact), \
+                    patch.object(task_executor, 'REQUEST_TABLE', 'complete-request'), \
+                    patch.object(task_executor.s3_codec, 'put_object'), \
+                    patch.object(task_executor.report, 'append_findings'), \
+                    patch.dict(os.environ, { 'TASK_TABLE': 'complete-task', 'BUCKET_NAME': 'bucket' }):
+                with pytest.raises(Exception):
+                    task_executor.update_complete_task('c1', 'r1', 1, 'diff', result)
+                assert dynamodb.Table('complete-task').get_item(Key=dict(request_id='r1', number=1))['Item']['succ'] is False
+                assert dynamodb.Table('complete-request').get_item(Key=dict(commit_id='c1', request_id='r1'))['Item']['task_complete'] == 0
+
+                record = task_executor.update_complete_task('c1', 'r1', 1, 'diff', result)
+                assert record['task_complete'] == 1 and record['usage_input_tokens'] == 10
+                assert task_executor.update_complete_task('c1', 'r1', 1, 'diff', result) is None
+
+            assert dynamodb.Table('complete-task').get_item(Key=dict(request_id='r1', number=1))['Item']['succ'] is True
+            assert dynamodb.Table('complete-request').get_item(Key=dict(commit_id='c1', request_id='r1'))['Item']['task_complete'] == 1